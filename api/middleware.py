@@ -0,0 +1,340 @@
+"""
+中间件定义
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import Optional
+
+from core.access_log import KeyValues, reset_fields, start_fields
+from core.compression import DEFAULT_LEVELS, ENCODINGS, StreamCompressor, available_encodings, compress, negotiate
+from core.drain import DrainController
+from core.timing import current_timer, reset_timer, start_timer
+from core.tracing import TraceBuffer, normalize_request_id, reset_trace, start_trace
+
+logger = logging.getLogger(__name__)
+
+# 访问日志单独使用一个 logger，便于按类别设置采样率（LOG_SAMPLING）
+access_logger = logging.getLogger("megallm.access")
+
+
+class ServerTimingMiddleware:
+    """
+    Server-Timing 中间件（纯 ASGI 实现，不缓冲响应体）
+
+    为每个请求创建阶段计时器，发送响应头时附加 Server-Timing；流式响应的响应头在
+    上游首字节后即发出，完整的阶段耗时（含 stream 传输时间）在流结束时写入 DEBUG 日志。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timer, token = start_timer()
+        state = {"stream": False, "headers_sent_at": 0.0}
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                for name, value in headers:
+                    if name.lower() == b"content-type" and value.startswith(b"text/event-stream"):
+                        state["stream"] = True
+                state["headers_sent_at"] = timer.elapsed()
+                headers.append((b"server-timing", timer.header(total=state["headers_sent_at"]).encode("latin-1")))
+                message = {**message, "headers": headers}
+
+            elif message["type"] == "http.response.body" and state["stream"] and not message.get("more_body", False):
+                elapsed = timer.elapsed()
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(
+                        "Server-Timing %s %s: %s", scope["method"], scope["path"],
+                        timer.header(stream=elapsed - state["headers_sent_at"], total=elapsed)
+                    )
+
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            reset_timer(token)
+
+
+class AccessLogMiddleware:
+    """
+    访问日志中间件（纯 ASGI 实现）
+
+    每个请求结束时（流式响应在流结束后）输出一行 key=value 访问日志：方法、路径、状态码、耗时，
+    以及路由和代理服务通过 core.access_log.annotate() 补充的字段（模型、客户端、密钥、重试次数、
+    token 用量），启用 Server-Timing 时附带各阶段耗时。结构化字段同时传给日志系统，JSON 输出时为独立字段。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not access_logger.isEnabledFor(logging.INFO):
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        fields, token = start_fields()
+        state = {"status": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            reset_fields(token)
+            line = {
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": state["status"],
+                "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+                **fields
+            }
+            timer = current_timer()
+            if timer is not None and timer.phases:
+                line["phases_ms"] = {name: round(seconds * 1000, 2) for name, seconds in timer.phases.items()}
+            access_logger.info("%s", KeyValues(line), extra={"fields": line})
+
+
+class TracingMiddleware:
+    """
+    请求追踪中间件（纯 ASGI 实现）
+
+    使用客户端传入的 X-Request-ID（不合法时生成新的）作为请求ID，在响应头中返回；
+    为请求创建根 span 并绑定到上下文（日志中带上请求ID），请求结束（流式响应在流结束后）时保存到环形缓冲区。
+    """
+
+    def __init__(self, app, buffer: TraceBuffer):
+        self.app = app
+        self.buffer = buffer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")
+                break
+        request_id = normalize_request_id(request_id)
+
+        trace, tokens = start_trace(request_id, "http.request", **{
+            "http.method": scope["method"], "http.path": scope["path"]
+        })
+        header = (b"x-request-id", request_id.encode("latin-1"))
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                trace.root.set(**{"http.status_code": message["status"]})
+                message = {**message, "headers": [*message.get("headers", []), header]}
+            await send(message)
+
+        error = None
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            reset_trace(tokens)
+            trace.root.finish(error)
+            if trace.root.attributes.get("http.status_code", 500) >= 500 and trace.root.status == "ok":
+                trace.root.status = "error"
+            self.buffer.add(trace)
+
+
+class DrainMiddleware:
+    """
+    优雅排空中间件（纯 ASGI 实现）
+
+    登记进行中的请求；排空期间拒绝新请求（503 + Retry-After + Connection: close，健康检查、就绪检查和指标除外），
+    宽限期结束后被中止且尚未发送响应头的请求返回 503。
+    """
+
+    EXEMPT_PATHS = ("/health", "/ready", "/metrics")
+
+    def __init__(self, app, controller: DrainController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        if self.controller.draining:
+            self.controller.reject()
+            await self._send_unavailable(send, "服务正在关闭，请重试")
+            return
+
+        inflight, token = self.controller.enter()
+
+        async def send_tracking(message):
+            if message["type"] == "http.response.start":
+                inflight.response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_tracking)
+        except asyncio.CancelledError:
+            if not inflight.aborted or inflight.response_started:
+                raise
+            if hasattr(inflight.task, "uncancel"):
+                inflight.task.uncancel()
+            await self._send_unavailable(send, "服务正在关闭，请求已中止，请重试")
+        finally:
+            self.controller.exit(inflight, token)
+
+    async def _send_unavailable(self, send, message: str) -> None:
+        body = json.dumps(
+            {"error": {"message": message, "type": "server_shutdown", "code": 503}}, ensure_ascii=False
+        ).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin-1")),
+                (b"retry-after", str(self.controller.retry_after).encode("latin-1")),
+                (b"connection", b"close"),
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+class CompressionMiddleware:
+    """
+    响应压缩中间件（纯 ASGI 实现）
+
+    按 Accept-Encoding 协商 zstd / br / gzip。单块发送的非流式响应（JSON 补全结果、模型列表）超过 min_size 时
+    压缩，超过 offload_threshold 时在线程池中压缩以免阻塞事件循环；启用 sse 时 SSE 响应逐块压缩并 flush。
+    已带 Content-Encoding 的响应、不可压缩的类型以及分多块发送的其他响应（如文件下载）原样转发。
+    """
+
+    COMPRESSIBLE_TYPES = (b"application/json", b"text/", b"application/x-ndjson")
+
+    def __init__(
+        self,
+        app,
+        encodings=ENCODINGS,
+        min_size: int = 1024,
+        offload_threshold: int = 65536,
+        levels: Optional[dict] = None,
+        sse: bool = False
+    ):
+        """
+        Args:
+            app: ASGI 应用
+            encodings: 按偏好排序的编码，未安装依赖的编码自动忽略
+            min_size: 最小压缩字节数，更小的响应压缩收益低于开销
+            offload_threshold: 超过该字节数时在线程池中压缩
+            levels: 按编码覆盖的压缩级别
+            sse: 是否压缩 SSE 流式响应
+        """
+        self.app = app
+        self.encodings = available_encodings(encodings)
+        self.min_size = min_size
+        self.offload_threshold = offload_threshold
+        self.levels = {**DEFAULT_LEVELS, **(levels or {})}
+        self.sse = sse
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = b""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value
+                break
+        encoding = negotiate(accept_encoding.decode("latin-1"), self.encodings) if accept_encoding else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        level = self.levels[encoding]
+        state = {"mode": "pass", "start": None, "compressor": None}
+
+        def encoded_headers(headers: list) -> list:
+            headers = [(name, value) for name, value in headers if name.lower() != b"content-length"]
+            headers.append((b"content-encoding", encoding.encode("latin-1")))
+            headers.append((b"vary", b"Accept-Encoding"))
+            return headers
+
+        async def send_compressed(message):
+            if message["type"] == "http.response.start":
+                content_type = b""
+                encoded = False
+                for name, value in message.get("headers", []):
+                    name = name.lower()
+                    if name == b"content-type":
+                        content_type = value.lower()
+                    elif name == b"content-encoding":
+                        encoded = True
+
+                if encoded:
+                    state["mode"] = "pass"
+                elif content_type.startswith(b"text/event-stream"):
+                    if self.sse:
+                        state["mode"] = "stream"
+                        state["compressor"] = StreamCompressor(encoding, level)
+                        message = {**message, "headers": encoded_headers(message.get("headers", []))}
+                elif content_type.startswith(self.COMPRESSIBLE_TYPES):
+                    # 等到响应体再决定是否压缩
+                    state["mode"] = "buffer"
+                    state["start"] = message
+                    return
+                await send(message)
+                return
+
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            if state["mode"] == "stream":
+                body = message.get("body", b"")
+                more_body = message.get("more_body", False)
+                compressor = state["compressor"]
+                data = compressor.compress(body) if body else b""
+                if not more_body:
+                    data += compressor.finish()
+                if data or not more_body:
+                    await send({"type": "http.response.body", "body": data, "more_body": more_body})
+                return
+
+            if state["mode"] == "buffer":
+                start, state["start"] = state["start"], None
+                state["mode"] = "pass"
+                body = message.get("body", b"")
+                if message.get("more_body", False) or len(body) < self.min_size:
+                    await send(start)
+                    await send(message)
+                    return
+
+                if len(body) >= self.offload_threshold:
+                    compressed = await asyncio.to_thread(compress, body, encoding, level)
+                else:
+                    compressed = compress(body, encoding, level)
+                headers = encoded_headers(start.get("headers", []))
+                headers.append((b"content-length", str(len(compressed)).encode("latin-1")))
+                await send({**start, "headers": headers})
+                await send({"type": "http.response.body", "body": compressed})
+                return
+
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
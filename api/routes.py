@@ -1,10 +1,18 @@
 """
 API路由定义
 """
+import asyncio
+import json
 import logging
-from fastapi import APIRouter, HTTPException, Request
-from fastapi.responses import JSONResponse, StreamingResponse
-from typing import Dict, Any
+import os
+import time
+import uuid
+from fastapi import APIRouter, File, HTTPException, Request, Response, UploadFile, WebSocket
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from pydantic import ValidationError
+from starlette.background import BackgroundTask
+from starlette.requests import HTTPConnection
+from typing import Dict, Any, List, Optional
 
 from models.schemas import (
     ChatCompletionRequest,
@@ -12,10 +20,25 @@ from models.schemas import (
     ErrorResponse,
     HealthResponse
 )
+from config.settings import settings
+from core.access_log import annotate
+from core.admission import AdmissionRejected
+from core.chat_session import ChatSession, DeltaCollector, SessionUnavailable
+from core.drain import current_request, guard_stream
+from core.fanout import fanout_chat_completion
+from core.metrics import REQUEST_DURATION, REQUESTS, TIME_TO_FIRST_TOKEN, record_tokens, registry
+from core.http_client import PhaseTimeout
+from core.rate_limiter import ClientAuthError, ClientState, RateLimitExceeded
+from core.sse import UsageTail, format_sse_data
+from core.timing import current_timer, phase
+from core.tracing import TraceBuffer, current_request_id, span, to_otlp
 from config.model_config import (
-    check_context_limit,
+    TRIM_POLICIES,
+    check_max_tokens_limit,
     get_context_exceeded_error,
-    get_all_models_info
+    get_max_tokens_exceeded_error,
+    get_all_models_info,
+    get_model_trim_policy
 )
 
 logger = logging.getLogger(__name__)
@@ -23,20 +46,347 @@ logger = logging.getLogger(__name__)
 router = APIRouter()
 
 
+def identify_client(request: HTTPConnection, token: Optional[str] = None) -> ClientState:
+    """
+    根据 Authorization: Bearer 或 X-API-Key 请求头识别客户端
+
+    浏览器 WebSocket 无法设置请求头，WebSocket 连接也接受 Sec-WebSocket-Protocol 中的 bearer.<凭证>
+    （见 websocket_credential）。凭证不接受查询参数：查询字符串会出现在 uvicorn 的握手日志和代理的访问日志中。
+
+    Args:
+        request: FastAPI请求或 WebSocket 连接
+        token: 已从其他途径取得的凭证（WebSocket 的 auth 帧），优先于请求头
+
+    Returns:
+        客户端状态
+
+    Raises:
+        HTTPException: 要求认证但凭证缺失或无效时返回 401
+    """
+    if not token:
+        token = request.headers.get("X-API-Key")
+    authorization = request.headers.get("Authorization", "")
+    if not token and authorization[:7].lower() == "bearer ":
+        token = authorization[7:].strip()
+    if not token and request.scope["type"] == "websocket":
+        token = websocket_credential(request.scope.get("subprotocols") or [])
+
+    remote_addr = request.client.host if request.client else None
+    if settings.client_trust_forwarded_for:
+        forwarded_for = request.headers.get("X-Forwarded-For")
+        if forwarded_for:
+            remote_addr = forwarded_for.split(",")[0].strip()
+
+    try:
+        return request.app.state.rate_limiter.identify(token, remote_addr)
+    except ClientAuthError as e:
+        raise HTTPException(
+            status_code=401,
+            detail={
+                "error": {
+                    "message": str(e),
+                    "type": "authentication_error",
+                    "code": 401
+                }
+            }
+        )
+
+
+def format_sse_error(message: str, error_type: str, code: Any) -> bytes:
+    """
+    生成流式响应中的 SSE 错误事件
+
+    Args:
+        message: 错误信息
+        error_type: 错误类型
+        code: 错误码
+
+    Returns:
+        SSE 事件字节串
+    """
+    payload = json.dumps(
+        {"error": {"message": message, "type": error_type, "code": code}},
+        ensure_ascii=False
+    )
+    return format_sse_data(payload)
+
+
+def record_request(model: str, status_code: int, started: float, stream: bool) -> None:
+    """
+    记录请求数和请求耗时指标
+
+    Args:
+        model: 模型名称
+        status_code: 响应状态码
+        started: 请求开始时的单调时钟时间
+        stream: 是否为流式请求
+    """
+    REQUESTS.inc(model, str(status_code))
+    REQUEST_DURATION.observe(time.monotonic() - started, model, "true" if stream else "false")
+
+
+def build_audit_record(
+    request: Request,
+    request_data: ChatCompletionRequest,
+    model: str,
+    status_code: int,
+    started: float,
+    stream: bool
+) -> Dict[str, Any]:
+    """
+    生成审计记录（请求模型和响应在写入线程中序列化，这里只收集引用）
+
+    Args:
+        request: FastAPI请求对象
+        request_data: 聊天补全请求
+        model: 模型名称
+        status_code: 响应状态码
+        started: 请求开始时的单调时钟时间
+        stream: 是否为流式请求
+
+    Returns:
+        审计记录，调用方补充 response 或 _stream_chunks（id 由服务端生成；request_id 可能来自客户端的
+        X-Request-ID，只用于关联日志和追踪，不能作为审计记录的唯一标识）
+    """
+    return {
+        "id": uuid.uuid4().hex,
+        "request_id": current_request_id(),
+        "time": time.time(),
+        "client": getattr(request.state, "client_id", None),
+        "model": model,
+        "status": status_code,
+        "stream": stream,
+        "duration_ms": round((time.monotonic() - started) * 1000, 1),
+        "request": request_data,
+        "response": None
+    }
+
+
+def admission_error(e: AdmissionRejected) -> HTTPException:
+    """
+    将准入拒绝转换为 HTTP 错误
+
+    Args:
+        e: 准入拒绝异常
+
+    Returns:
+        HTTPException（400 / 429 / 503，后两者带 Retry-After）
+    """
+    error_types = {400: "invalid_request_error", 429: "rate_limit_exceeded", 503: "service_unavailable"}
+    return HTTPException(
+        status_code=e.status_code,
+        detail={
+            "error": {
+                "message": str(e),
+                "type": error_types.get(e.status_code, "service_unavailable"),
+                "code": e.reason
+            }
+        },
+        headers={"Retry-After": str(e.retry_after)} if e.status_code != 400 else None
+    )
+
+
+def service_error(e: Exception) -> HTTPException:
+    """
+    将转发过程中的其他异常转换为 HTTP 错误（在 except 块中调用，记录异常堆栈）
+
+    Args:
+        e: 异常（所有密钥都失败时 ProxyService 抛出 RuntimeError）
+
+    Returns:
+        HTTPException（所有密钥失败时 503，其他 500）
+    """
+    if isinstance(e, RuntimeError):
+        logger.error("所有密钥失败: %s", e)
+        return HTTPException(
+            status_code=503,
+            detail={
+                "error": {
+                    "message": "所有API密钥都不可用，请稍后重试",
+                    "type": "service_unavailable",
+                    "code": 503
+                }
+            }
+        )
+    logger.error("处理请求时发生错误: %s", e, exc_info=True)
+    return HTTPException(
+        status_code=500,
+        detail={
+            "error": {
+                "message": str(e),
+                "type": "internal_error",
+                "code": 500
+            }
+        }
+    )
+
+
+def check_client_limit(check, client: ClientState, *args) -> None:
+    """
+    执行客户端限流检查，超限时转换为 429 响应
+
+    Args:
+        check: 限流检查方法
+        client: 客户端状态
+        *args: 检查方法的其他参数
+
+    Raises:
+        HTTPException: 超出限流配额时返回 429
+    """
+    try:
+        check(client, *args)
+    except RateLimitExceeded as e:
+        logger.warning("客户端限流: client=%s, type=%s, retry_after=%ss", client.client_id, e.limit_type, e.retry_after)
+        raise HTTPException(
+            status_code=429,
+            detail={
+                "error": {
+                    "message": str(e),
+                    "type": "rate_limit_exceeded",
+                    "code": f"client_{e.limit_type}_limit"
+                }
+            },
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+
+async def admit_chat_request(
+    state,
+    client: ClientState,
+    model: str,
+    messages: List[Dict[str, Any]],
+    max_tokens: Optional[int],
+    trim_policy: str,
+    request_class: Optional[str]
+) -> tuple:
+    """
+    转发到上游之前的公共步骤（/v1/chat/completions 与 WebSocket 对话共用）：
+    客户端请求数配额、max_tokens 上限、上下文检查与裁剪、客户端 token 配额、准入控制
+
+    Args:
+        state: 应用状态（rate_limiter / context_checker / admission_controller）
+        client: 客户端状态
+        model: 模型名称
+        messages: 消息列表
+        max_tokens: 请求的最大输出 token 数
+        trim_policy: 上下文超限时的裁剪策略
+        request_class: 客户端请求的优先级分类，为空时使用客户端配置的默认分类；不超过客户端配置的最高分类
+
+    Returns:
+        (发送给上游的消息列表, 裁剪信息响应头（未裁剪时为空字典）, 准入凭证（调用方负责 release）)
+
+    Raises:
+        HTTPException: 超出客户端配额（429）、超出模型限制或裁剪策略无效（400）、准入被拒绝（429 / 503）
+    """
+    # 请求数配额在任何 token 估算之前检查
+    rate_limiter = state.rate_limiter
+    with phase("client"):
+        check_client_limit(rate_limiter.check_request, client)
+
+    # 检查 max_tokens 是否超出模型最大输出长度（无需估算 token，直接快速失败）
+    max_tokens_exceeded, max_output = check_max_tokens_limit(model, max_tokens)
+    if max_tokens_exceeded:
+        logger.warning("max_tokens 超限: model=%s, max_tokens=%s, limit=%s", model, max_tokens, max_output)
+        raise HTTPException(status_code=400, detail=get_max_tokens_exceeded_error(model, max_tokens, max_output))
+
+    # 检查上下文长度限制：输入估算 + 请求输出（大请求卸载到线程/进程池，避免阻塞事件循环）
+    context_checker = state.context_checker
+    with phase("tokens"):
+        is_exceeded, current_tokens, context_limit = await context_checker.check(model, messages, max_tokens)
+
+    # 超限时按策略自动裁剪最早的消息
+    trim_headers = {}
+    if is_exceeded:
+        if trim_policy not in TRIM_POLICIES:
+            raise HTTPException(
+                status_code=400,
+                detail={
+                    "error": {
+                        "message": f"不支持的裁剪策略: {trim_policy}，可选值: {', '.join(TRIM_POLICIES)}",
+                        "type": "invalid_request_error",
+                        "code": 400
+                    }
+                }
+            )
+
+        if trim_policy != "none":
+            with phase("trim"):
+                trimmed_messages, trim_info = await context_checker.trim(model, messages, max_tokens, trim_policy)
+            if trim_info["fits"]:
+                logger.info(
+                    "上下文已自动裁剪: model=%s, policy=%s, dropped=%d, truncated=%d, tokens=%d->%d",
+                    model, trim_policy, trim_info["dropped_messages"], trim_info["truncated_messages"],
+                    current_tokens, trim_info["tokens"]
+                )
+                annotate(trimmed=trim_policy)
+                messages = trimmed_messages
+                current_tokens = trim_info["tokens"]
+                is_exceeded = False
+                trim_headers = {
+                    "X-Context-Trimmed": trim_policy,
+                    "X-Context-Trimmed-Messages": str(trim_info["dropped_messages"]),
+                    "X-Context-Truncated-Messages": str(trim_info["truncated_messages"]),
+                    "X-Context-Trimmed-Tokens": str(trim_info["trimmed_tokens"])
+                }
+
+    if is_exceeded:
+        logger.warning(
+            "上下文超限: model=%s, current_tokens=%d, limit=%d, usage=%.2f%%",
+            model, current_tokens, context_limit, current_tokens / context_limit * 100
+        )
+        raise HTTPException(
+            status_code=400,
+            detail=get_context_exceeded_error(model, current_tokens, context_limit, max_tokens)
+        )
+
+    logger.debug(
+        "上下文检查通过: model=%s, messages=%d, tokens=%d/%d (%.1f%%)",
+        model, len(messages), current_tokens, context_limit, current_tokens / context_limit * 100
+    )
+    annotate(estimated_tokens=current_tokens)
+
+    # 检查客户端 token 配额（输入估算 + 请求输出）
+    check_client_limit(rate_limiter.check_tokens, client, current_tokens + (max_tokens or 0))
+
+    # 优先级分类由客户端自报，按客户端配置的上限截断，避免任意客户端以最高优先级插队
+    admission_controller = state.admission_controller
+    request_class = admission_controller.cap_class(
+        request_class or client.default_class or settings.scheduler_default_class, client.max_class
+    )
+
+    # 准入控制：并发已满时排队，队列满或排队超时立即返回 429/503，
+    # 排队请求按 优先级分类 + 客户端 加权公平出队
+    try:
+        with phase("admission"), span("admission"):
+            ticket = await admission_controller.acquire(
+                model,
+                request_class=request_class,
+                tenant=client.client_id,
+                tenant_weight=client.weight
+            )
+    except AdmissionRejected as e:
+        raise admission_error(e)
+
+    return messages, trim_headers, ticket
+
+
 @router.post(
     "/v1/chat/completions",
     response_model=ChatCompletionResponse,
     responses={
         400: {"model": ErrorResponse},
         401: {"model": ErrorResponse},
-        500: {"model": ErrorResponse}
+        429: {"model": ErrorResponse},
+        500: {"model": ErrorResponse},
+        503: {"model": ErrorResponse}
     },
     summary="创建聊天补全",
     description="发送聊天消息并获取AI响应，兼容OpenAI API格式"
 )
 async def chat_completions(
     request_data: ChatCompletionRequest,
-    request: Request
+    request: Request,
+    response: Response
 ):
     """
     聊天补全API端点
@@ -44,6 +394,7 @@ async def chat_completions(
     Args:
         request_data: 聊天补全请求
         request: FastAPI请求对象
+        response: FastAPI响应对象（用于附加响应头）
 
     Returns:
         聊天补全响应（非流式）或 StreamingResponse（流式）
@@ -51,32 +402,36 @@ async def chat_completions(
     Raises:
         HTTPException: 请求失败时
     """
+    started = time.monotonic()
+
+    # 进入路由前的耗时（路由匹配、读取请求体、参数校验）
+    timer = current_timer()
+    if timer is not None:
+        timer.add("validation", timer.elapsed())
+
+    # 使用默认模型（如果未指定）
+    model = request_data.model or "openai-gpt-oss-120b"
+    annotate(model=model, messages=len(request_data.messages), stream=bool(request_data.stream))
+
+    # 流式请求在流结束时记录指标和审计日志
+    status_code = 500
+    streaming = False
+    result = None
+    audit_sink = getattr(request.app.state, "audit_sink", None)
+
     try:
         # 从应用状态获取代理服务
         proxy_service = request.app.state.proxy_service
 
+        # 识别客户端（在任何上游请求和 token 估算之前）
+        with phase("client"):
+            client = identify_client(request)
+        request.state.client_id = client.client_id
+        annotate(client=client.client_id)
+
         # 转换消息格式
         messages = [msg.dict() for msg in request_data.messages]
 
-        # 使用默认模型（如果未指定）
-        model = request_data.model or "openai-gpt-oss-120b"
-
-        # 检查上下文长度限制
-        is_exceeded, current_tokens, context_limit = check_context_limit(model, messages)
-
-        if is_exceeded:
-            logger.warning(
-                f"上下文超限: model={model}, current_tokens={current_tokens}, "
-                f"limit={context_limit}, usage={current_tokens/context_limit*100:.2f}%"
-            )
-            error_response = get_context_exceeded_error(model, current_tokens, context_limit)
-            raise HTTPException(status_code=400, detail=error_response)
-
-        logger.info(
-            f"上下文检查通过: model={model}, messages={len(messages)}, "
-            f"tokens={current_tokens}/{context_limit} ({current_tokens/context_limit*100:.1f}%)"
-        )
-
         # 准备额外参数 - 如果前端传递了就使用前端的值,否则使用默认值
         extra_params = {
             "temperature": request_data.temperature if request_data.temperature is not None else 1.0,
@@ -93,20 +448,103 @@ async def chat_completions(
 
         is_stream = extra_params["stream"]
 
-        logger.info(f"收到聊天补全请求: model={model}, messages={len(messages)}, params={extra_params}")
+        logger.debug("收到聊天补全请求: model=%s, messages=%d, params=%s", model, len(messages), extra_params)
 
-        # 调用代理服务
-        result = await proxy_service.chat_completion(
-            model=model,
-            messages=messages,
-            **extra_params
+        # 配额、上下文检查与裁剪（请求头 X-Context-Trim 或模型配置的策略）、准入控制（X-Priority 优先级分类）
+        messages, trim_headers, ticket = await admit_chat_request(
+            request.app.state,
+            client,
+            model,
+            messages,
+            request_data.max_tokens,
+            request.headers.get("X-Context-Trim") or get_model_trim_policy(model, settings.context_trim_default),
+            request.headers.get("X-Priority")
         )
 
-        # 如果是流式响应，返回 StreamingResponse
+        # n>1 时可拆分为 n 个并行的 n=1 请求（请求头 X-Fanout 覆盖默认配置）
+        fanout_header = request.headers.get("X-Fanout")
+        fanout = (
+            fanout_header.lower() in ("1", "true", "on", "yes")
+            if fanout_header is not None else settings.fanout_enabled
+        )
+
+        try:
+            with phase("upstream"):
+                if fanout and extra_params["n"] > 1:
+                    annotate(fanout=extra_params["n"])
+                    result = await fanout_chat_completion(
+                        proxy_service,
+                        model=model,
+                        messages=messages,
+                        **extra_params
+                    )
+                else:
+                    # 调用代理服务
+                    result = await proxy_service.chat_completion(
+                        model=model,
+                        messages=messages,
+                        **extra_params
+                    )
+        except BaseException:
+            ticket.release()
+            raise
+
+        # 如果是流式响应，返回 StreamingResponse（流结束后关闭上游连接并释放并发槽位）
         if is_stream:
+            streaming = True
+            stream_state = {"recorded": False}
+            # 审计时保留转发的原始分块，在写入线程中重组为完整响应
+            audit_chunks = [] if audit_sink is not None else None
+            usage_tail = UsageTail()
+            # 流式转发跨越生成器的多次迭代，span 不绑定到上下文，结束时手动 finish
+            stream_span = span("stream")
+
+            async def cleanup():
+                await result.aclose()
+                ticket.release()
+                stream_span.finish()
+                if not stream_state["recorded"]:
+                    stream_state["recorded"] = True
+                    record_request(model, 200, started, stream=True)
+                    record_tokens(model, usage_tail.usage())
+                    if audit_sink is not None:
+                        record = build_audit_record(request, request_data, model, 200, started, stream=True)
+                        record["_stream_chunks"] = audit_chunks
+                        await audit_sink.submit(record)
+
             async def generate():
-                async for chunk in result.aiter_bytes():
-                    yield chunk
+                first_chunk = True
+                chunks = 0
+                try:
+                    async for chunk in guard_stream(result.aiter_bytes()):
+                        chunks += 1
+                        if first_chunk:
+                            first_chunk = False
+                            TIME_TO_FIRST_TOKEN.observe(time.monotonic() - started, model)
+                            stream_span.event("first_chunk")
+                        if audit_chunks is not None:
+                            audit_chunks.append(chunk)
+                        usage_tail.feed(chunk)
+                        yield chunk
+
+                    # 排空宽限期结束被中止，以 SSE 错误事件结束流
+                    inflight = current_request()
+                    if inflight is not None and inflight.aborted:
+                        stream_span.event("aborted")
+                        error_event = format_sse_error("服务正在关闭，响应已中止，请重试", "server_shutdown", 503)
+                        if audit_chunks is not None:
+                            audit_chunks.append(error_event)
+                        yield error_event
+                except PhaseTimeout as e:
+                    # 响应头已发送，只能以 SSE 错误事件结束流
+                    stream_span.finish(e)
+                    error_event = format_sse_error(str(e), "upstream_timeout", e.kind)
+                    if audit_chunks is not None:
+                        audit_chunks.append(error_event)
+                    yield error_event
+                finally:
+                    stream_span.set(chunks=chunks)
+                    await cleanup()
 
             return StreamingResponse(
                 generate(),
@@ -114,38 +552,649 @@ async def chat_completions(
                 headers={
                     "Cache-Control": "no-cache",
                     "Connection": "keep-alive",
-                }
+                    **trim_headers
+                },
+                background=BackgroundTask(cleanup)
             )
 
         # 非流式响应直接返回
+        ticket.release()
+        usage = result.get("usage") or {}
+        annotate(prompt_tokens=usage.get("prompt_tokens"), completion_tokens=usage.get("completion_tokens"))
+        response.headers.update(trim_headers)
+        status_code = 200
         return result
 
-    except HTTPException:
+    except HTTPException as e:
+        status_code = e.status_code
         raise
-    except RuntimeError as e:
-        logger.error(f"所有密钥失败: {e}")
-        raise HTTPException(
-            status_code=503,
-            detail={
-                "error": {
-                    "message": "所有API密钥都不可用，请稍后重试",
-                    "type": "service_unavailable",
-                    "code": 503
-                }
-            }
+    except Exception as e:
+        error = service_error(e)
+        status_code = error.status_code
+        raise error
+    finally:
+        if not streaming:
+            record_request(model, status_code, started, stream=False)
+            if audit_sink is not None:
+                record = build_audit_record(
+                    request, request_data, model, status_code, started, stream=bool(request_data.stream)
+                )
+                record["response"] = result if status_code == 200 else None
+                await audit_sink.submit(record)
+
+
+# WebSocket 会话中客户端可以设置的上游参数（取值范围与 ChatCompletionRequest 相同）
+WS_REQUEST_PARAMS = ("temperature", "top_p", "max_tokens", "presence_penalty", "frequency_penalty")
+
+# WebSocket 子协议：浏览器客户端以 new WebSocket(url, ["megallm.v1", "bearer.<凭证>"]) 传递凭证，
+# 服务端只回应 megallm.v1（浏览器要求服务端从客户端提供的子协议中选择一个），凭证不会出现在响应中
+WS_SUBPROTOCOL = "megallm.v1"
+WS_CREDENTIAL_PREFIX = "bearer."
+
+# 握手时没有凭证且要求认证时，等待第一帧 {"t": "auth", "key": ...} 的超时（秒）
+WS_AUTH_TIMEOUT = 10.0
+
+# WebSocket 关闭码
+WS_CLOSE_NORMAL = 1000
+WS_CLOSE_POLICY_VIOLATION = 1008
+WS_CLOSE_SERVICE_RESTART = 1012
+WS_CLOSE_TRY_AGAIN_LATER = 1013
+
+
+def websocket_credential(subprotocols: List[str]) -> Optional[str]:
+    """
+    从客户端提供的子协议中取出凭证
+
+    Args:
+        subprotocols: Sec-WebSocket-Protocol 中的子协议列表
+
+    Returns:
+        bearer.<凭证> 中的凭证，没有时返回 None
+    """
+    for protocol in subprotocols:
+        if protocol.startswith(WS_CREDENTIAL_PREFIX) and len(protocol) > len(WS_CREDENTIAL_PREFIX):
+            return protocol[len(WS_CREDENTIAL_PREFIX):]
+    return None
+
+
+async def authenticate_websocket(websocket: WebSocket) -> Optional[ClientState]:
+    """
+    识别 WebSocket 客户端：先使用握手中的请求头或子协议凭证；握手中没有凭证且要求认证时，
+    等待第一帧 {"t": "auth", "key": ...}（不要求认证时匿名连接也可以随后发送 auth 帧，见 chat_websocket）
+
+    Args:
+        websocket: 已接受的 WebSocket 连接
+
+    Returns:
+        客户端状态，等待 auth 帧期间连接断开时返回 None
+
+    Raises:
+        HTTPException: 凭证缺失或无效时返回 401
+    """
+    try:
+        return identify_client(websocket)
+    except HTTPException:
+        handshake_credential = (
+            websocket.headers.get("X-API-Key")
+            or websocket.headers.get("Authorization")
+            or websocket_credential(websocket.scope.get("subprotocols") or [])
+        )
+        if handshake_credential:
+            raise
+
+    try:
+        message = await asyncio.wait_for(websocket.receive(), timeout=WS_AUTH_TIMEOUT)
+    except asyncio.TimeoutError:
+        message = {"type": "websocket.receive", "text": None}
+    if message["type"] == "websocket.disconnect":
+        return None
+
+    try:
+        frame = json.loads(message.get("text") or "")
+    except ValueError:
+        frame = None
+    token = frame.get("key") if isinstance(frame, dict) and frame.get("t") == "auth" else None
+    return identify_client(websocket, token if isinstance(token, str) else None)
+
+
+def encode_frame(frame: Dict[str, Any]) -> str:
+    """生成紧凑的 JSON 文本帧"""
+    return json.dumps(frame, ensure_ascii=False, separators=(",", ":"))
+
+
+def error_frame(message: str, error_type: str, code: Any) -> Dict[str, Any]:
+    """生成错误帧（字段与 HTTP 错误响应的 error 对象相同）"""
+    return {"t": "error", "message": message, "type": error_type, "code": code}
+
+
+def http_error_frame(e: HTTPException) -> Dict[str, Any]:
+    """将 HTTPException 转换为错误帧"""
+    if isinstance(e.detail, dict) and isinstance(e.detail.get("error"), dict):
+        return {"t": "error", **e.detail["error"]}
+    return error_frame(str(e.detail), "invalid_request_error", e.status_code)
+
+
+def session_frame(session: ChatSession, resumed: bool = False) -> Dict[str, Any]:
+    """生成会话状态帧"""
+    return {
+        "t": "session",
+        "id": session.id,
+        "resumed": resumed,
+        "model": session.model,
+        "system": session.system,
+        "params": session.params,
+        "messages": len(session.messages)
+    }
+
+
+def apply_session_config(session: ChatSession, frame: Dict[str, Any]) -> None:
+    """
+    更新会话配置（值为 null 表示恢复默认）
+
+    Args:
+        session: 会话
+        frame: cfg 帧
+
+    Raises:
+        ValueError: 参数名或取值无效时
+    """
+    unknown = set(frame) - {"t", "model", "system", "trim", "priority", *WS_REQUEST_PARAMS}
+    if unknown:
+        raise ValueError(f"不支持的参数: {', '.join(sorted(unknown))}")
+
+    params = {**session.params}
+    for name in (*WS_REQUEST_PARAMS, "trim", "priority"):
+        if name in frame:
+            if frame[name] is None:
+                params.pop(name, None)
+            else:
+                params[name] = frame[name]
+
+    # 数值参数复用 HTTP 接口的请求模型校验
+    try:
+        ChatCompletionRequest(
+            messages=[{"role": "user", "content": ""}],
+            **{name: params[name] for name in WS_REQUEST_PARAMS if name in params}
         )
+    except ValidationError as e:
+        raise ValueError("; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors()))
+    if params.get("trim", "none") not in TRIM_POLICIES:
+        raise ValueError(f"不支持的裁剪策略: {params['trim']}，可选值: {', '.join(TRIM_POLICIES)}")
+    for name in ("model", "system", "priority"):
+        if frame.get(name) is not None and not isinstance(frame[name], str):
+            raise ValueError(f"{name} 必须是字符串")
+
+    session.params = params
+    if frame.get("model"):
+        session.model = frame["model"]
+    if "system" in frame:
+        session.system = frame["system"] or None
+
+
+async def run_chat_turn(
+    websocket: WebSocket,
+    session: ChatSession,
+    client: ClientState,
+    content: str,
+    send,
+    cancelled: asyncio.Event
+) -> None:
+    """
+    执行一轮对话：与 HTTP 接口相同的限流、上下文检查与裁剪、准入控制（admit_chat_request）和密钥故障转移，
+    以增量帧转发回复，结束时发送 done 帧；用户消息和回复追加到会话历史（没有回复时撤销用户消息）
+
+    Args:
+        websocket: WebSocket 连接
+        session: 会话
+        client: 客户端状态
+        content: 用户消息
+        send: 发送帧的协程函数
+        cancelled: 客户端取消本轮时设置（随后取消本任务）
+    """
+    state = websocket.app.state
+    session_store = state.session_store
+    model = session.model
+    max_tokens = session.params.get("max_tokens")
+    started = time.monotonic()
+    status_code = 500
+    finish_reason = None
+    result = None
+    ticket = None
+    messages = None
+    collector = DeltaCollector()
+    audit_sink = getattr(state, "audit_sink", None)
+    audit_chunks = [] if audit_sink is not None else None
+
+    # 每一轮登记为进行中的请求，排空时等待本轮完成（超过宽限期则中止）
+    drain_controller = getattr(state, "drain_controller", None)
+    inflight = token = None
+    if drain_controller is not None:
+        inflight, token = drain_controller.enter()
+
+    session_store.append(session, "user", content)
+    try:
+        # 历史保存在服务端，客户端无法自行裁剪，超限时默认丢弃最早的消息，裁剪结果写回会话
+        messages = session.history()
+        messages, trim_headers, ticket = await admit_chat_request(
+            state,
+            client,
+            model,
+            messages,
+            max_tokens,
+            session.params.get("trim") or settings.ws_context_trim,
+            session.params.get("priority")
+        )
+        if trim_headers:
+            session_store.replace(session, messages)
+
+        params = {name: session.params[name] for name in WS_REQUEST_PARAMS if name in session.params}
+        result = await state.proxy_service.chat_completion(model=model, messages=messages, stream=True, **params)
+
+        first_chunk = True
+        async for chunk in guard_stream(result.aiter_bytes()):
+            if first_chunk:
+                first_chunk = False
+                TIME_TO_FIRST_TOKEN.observe(time.monotonic() - started, model)
+            if audit_chunks is not None:
+                audit_chunks.append(chunk)
+            delta = collector.feed(chunk)
+            if delta:
+                await send({"t": "d", "c": delta})
+
+        status_code = 200
+        if collector.error is not None:
+            error = collector.error
+            await send(error_frame(error.get("message", ""), error.get("type", "upstream_error"), error.get("code")))
+        if inflight is not None and inflight.aborted:
+            finish_reason = "aborted"
+            await send(error_frame("服务正在关闭，响应已中止，请重试", "server_shutdown", 503))
+        else:
+            finish_reason = collector.finish_reason
+    except asyncio.CancelledError:
+        aborted = inflight is not None and inflight.aborted
+        if not (cancelled.is_set() or aborted):
+            raise
+        task = asyncio.current_task()
+        if hasattr(task, "uncancel"):
+            task.uncancel()
+        status_code = 200
+        finish_reason = "aborted" if aborted else "cancelled"
+        if aborted:
+            await send(error_frame("服务正在关闭，响应已中止，请重试", "server_shutdown", 503))
+    except PhaseTimeout as e:
+        status_code = 504
+        await send(error_frame(str(e), "upstream_timeout", e.kind))
+    except HTTPException as e:
+        status_code = e.status_code
+        await send(http_error_frame(e))
     except Exception as e:
-        logger.error(f"处理请求时发生错误: {e}", exc_info=True)
-        raise HTTPException(
-            status_code=500,
-            detail={
-                "error": {
-                    "message": str(e),
-                    "type": "internal_error",
-                    "code": 500
-                }
+        error = service_error(e)
+        status_code = error.status_code
+        await send(http_error_frame(error))
+    finally:
+        if result is not None:
+            await result.aclose()
+        if ticket is not None:
+            ticket.release()
+        if drain_controller is not None:
+            drain_controller.exit(inflight, token)
+
+        reply = collector.content
+        if reply:
+            session_store.append(session, "assistant", reply)
+        else:
+            session_store.pop_last(session)
+
+        record_request(model, status_code, started, stream=True)
+        record_tokens(model, collector.usage)
+        if audit_sink is not None and messages is not None:
+            request_data = ChatCompletionRequest(
+                model=model, messages=messages, stream=True,
+                **{name: session.params[name] for name in WS_REQUEST_PARAMS if name in session.params}
+            )
+            record = build_audit_record(websocket, request_data, model, status_code, started, stream=True)
+            record["_stream_chunks"] = audit_chunks
+            await audit_sink.submit(record)
+
+    await send({
+        "t": "done",
+        "finish": finish_reason,
+        "usage": collector.usage,
+        "ms": round((time.monotonic() - started) * 1000)
+    })
+
+
+@router.websocket("/v1/chat/ws")
+async def chat_websocket(websocket: WebSocket, model: Optional[str] = None, session_id: Optional[str] = None):
+    """
+    WebSocket 多轮对话端点
+
+    对话历史保存在服务端，客户端每轮只发送新消息；帧均为 JSON 文本，以 t 字段区分类型。
+    凭证通过请求头或子协议 bearer.<凭证> 在握手时传递，也可以作为第一帧发送（见 authenticate_websocket）。
+    客户端 -> 服务端:
+        {"t": "auth", "key": "..."}         握手中没有凭证时作为第一帧发送
+        {"t": "msg", "c": "..."}            发送一条用户消息，开始一轮对话
+        {"t": "cfg", "model": ..., "system": ..., "temperature": ..., "max_tokens": ..., "trim": ..., "priority": ...}
+        {"t": "cancel"}                     取消进行中的一轮（已生成的部分回复保留在历史中）
+        {"t": "reset"}                      清空历史
+        {"t": "ping"}
+    服务端 -> 客户端:
+        {"t": "session", "id": ..., "resumed": ..., "model": ..., "messages": ...}
+        {"t": "d", "c": "..."}              回复增量
+        {"t": "done", "finish": ..., "usage": ..., "ms": ...}   每轮结束（出错时先发送 error 帧）
+        {"t": "error", "message": ..., "type": ..., "code": ...}
+        {"t": "pong"}
+
+    Args:
+        websocket: WebSocket 连接
+        model: 新会话使用的模型
+        session_id: 断开后重新连接时恢复的会话 ID（会话只保存在处理连接的 worker 进程内；不存在时以
+            session_not_found 错误关闭连接，客户端应不带 session_id 重新连接）
+    """
+    subprotocols = websocket.scope.get("subprotocols") or []
+    await websocket.accept(subprotocol=WS_SUBPROTOCOL if WS_SUBPROTOCOL in subprotocols else None)
+    send_lock = asyncio.Lock()
+
+    async def send(frame: Dict[str, Any]) -> None:
+        async with send_lock:
+            await websocket.send_text(encode_frame(frame))
+
+    async def close(code: int, frame: Optional[Dict[str, Any]] = None) -> None:
+        if frame is not None:
+            await send(frame)
+        await websocket.close(code=code)
+
+    state = websocket.app.state
+    session_store = getattr(state, "session_store", None)
+    drain_controller = getattr(state, "drain_controller", None)
+    if session_store is None:
+        await close(WS_CLOSE_POLICY_VIOLATION, error_frame("WebSocket 对话未启用", "invalid_request_error", 404))
+        return
+    if drain_controller is not None and drain_controller.draining:
+        await close(WS_CLOSE_TRY_AGAIN_LATER, error_frame("服务正在关闭，请重新连接", "server_shutdown", 503))
+        return
+
+    try:
+        client = await authenticate_websocket(websocket)
+        if client is None:
+            return
+        session, resumed = session_store.open(client.client_id, model or "openai-gpt-oss-120b", session_id)
+    except HTTPException as e:
+        await close(WS_CLOSE_POLICY_VIOLATION, http_error_frame(e))
+        return
+    except SessionUnavailable as e:
+        close_code = WS_CLOSE_TRY_AGAIN_LATER if e.reason == "too_many_sessions" else WS_CLOSE_POLICY_VIOLATION
+        error_type = "invalid_request_error" if e.reason == "session_not_found" else "service_unavailable"
+        await close(close_code, error_frame(str(e), error_type, e.reason))
+        return
+    websocket.state.client_id = client.client_id
+
+    receiver = None
+    turn = None
+    cancelled = None
+    drain_wait = asyncio.create_task(drain_controller.wait_draining()) if drain_controller is not None else None
+    try:
+        await send(session_frame(session, resumed))
+        while True:
+            if receiver is None:
+                receiver = asyncio.create_task(websocket.receive())
+            waiters = {receiver}
+            if turn is not None:
+                waiters.add(turn)
+            elif drain_wait is not None:
+                waiters.add(drain_wait)
+
+            # 没有进行中的一轮时，超过空闲超时没有收到消息则关闭连接（会话保留到淘汰）
+            done, _ = await asyncio.wait(
+                waiters,
+                timeout=None if turn is not None else session_store.idle_timeout,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                await close(WS_CLOSE_NORMAL)
+                break
+
+            if turn is not None and turn in done:
+                if not turn.cancelled() and turn.exception() is not None:
+                    logger.debug("WebSocket 对话轮次异常结束: %s", turn.exception())
+                turn = None
+                if drain_controller is not None and drain_controller.draining:
+                    await close(WS_CLOSE_SERVICE_RESTART)
+                    break
+            if drain_wait is not None and drain_wait in done and turn is None:
+                await close(WS_CLOSE_SERVICE_RESTART)
+                break
+            if receiver not in done:
+                continue
+
+            message = receiver.result()
+            receiver = None
+            if message["type"] == "websocket.disconnect":
+                break
+
+            text = message.get("text")
+            if text is None:
+                text = (message.get("bytes") or b"").decode("utf-8", "replace")
+            if len(text) > settings.ws_max_frame_chars:
+                await send(error_frame(f"消息过长，上限 {settings.ws_max_frame_chars} 个字符", "invalid_request_error", 413))
+                continue
+            try:
+                frame = json.loads(text)
+            except ValueError:
+                frame = None
+            if not isinstance(frame, dict):
+                await send(error_frame("无效的帧，应为 JSON 对象", "invalid_request_error", 400))
+                continue
+
+            kind = frame.get("t")
+            session_store.touch(session)
+            if kind == "ping":
+                await send({"t": "pong"})
+            elif kind == "cancel":
+                if turn is not None:
+                    cancelled.set()
+                    turn.cancel()
+            elif kind == "auth":
+                # 不要求认证时，握手中没有凭证的连接先以匿名身份创建会话，第一帧 auth 帧再将会话转给认证后的客户端
+                if not client.anonymous or resumed or turn is not None or session.messages:
+                    await send(error_frame("auth 帧只能作为匿名连接的第一帧发送", "invalid_request_error", 400))
+                    continue
+                key = frame.get("key")
+                try:
+                    client = identify_client(websocket, key if isinstance(key, str) else None)
+                except HTTPException as e:
+                    await close(WS_CLOSE_POLICY_VIOLATION, http_error_frame(e))
+                    break
+                session.client_id = client.client_id
+                websocket.state.client_id = client.client_id
+                await send(session_frame(session, resumed))
+            elif turn is not None and kind in ("msg", "cfg", "reset"):
+                await send(error_frame("上一轮对话尚未结束", "invalid_request_error", "busy"))
+            elif kind == "msg":
+                content = frame.get("c")
+                if not isinstance(content, str) or not content:
+                    await send(error_frame("c 必须是非空字符串", "invalid_request_error", 400))
+                    continue
+                cancelled = asyncio.Event()
+                turn = asyncio.create_task(run_chat_turn(websocket, session, client, content, send, cancelled))
+            elif kind == "cfg":
+                try:
+                    apply_session_config(session, frame)
+                except ValueError as e:
+                    await send(error_frame(str(e), "invalid_request_error", 400))
+                    continue
+                await send(session_frame(session, resumed))
+            elif kind == "reset":
+                session_store.reset(session)
+                await send(session_frame(session, resumed))
+            else:
+                await send(error_frame(f"不支持的帧类型: {kind}", "invalid_request_error", 400))
+    except Exception as e:
+        # 客户端已断开时发送失败，直接结束
+        logger.debug("WebSocket 连接结束: %s", e)
+    finally:
+        for task in (receiver, drain_wait):
+            if task is not None:
+                task.cancel()
+        if turn is not None:
+            turn.cancel()
+            await asyncio.gather(turn, return_exceptions=True)
+        session_store.release(session)
+
+
+def identify_batch_client(request: Request) -> ClientState:
+    """
+    识别批处理接口的客户端（与聊天补全相同的认证要求），任务只对提交它的客户端可见
+
+    Args:
+        request: FastAPI请求对象
+
+    Returns:
+        客户端状态
+
+    Raises:
+        HTTPException: 要求认证但凭证缺失或无效时返回 401
+    """
+    client = identify_client(request)
+    request.state.client_id = client.client_id
+    annotate(client=client.client_id)
+    return client
+
+
+def batch_not_found(batch_id: str) -> HTTPException:
+    """生成批处理任务不存在的错误"""
+    return HTTPException(
+        status_code=404,
+        detail={
+            "error": {
+                "message": f"批处理任务不存在: {batch_id}",
+                "type": "not_found",
+                "code": 404
             }
-        )
+        }
+    )
+
+
+@router.post(
+    "/v1/batches",
+    summary="创建批处理任务",
+    description="上传 JSONL 请求文件（每行一个 OpenAI Batch 格式请求或聊天补全请求体），后台有界并发执行"
+)
+async def create_batch(request: Request, file: UploadFile = File(..., description="JSONL 请求文件")) -> Dict[str, Any]:
+    """
+    创建批处理任务
+
+    Args:
+        request: FastAPI请求对象
+        file: 上传的 JSONL 文件
+
+    Returns:
+        任务状态
+
+    Raises:
+        HTTPException: 认证失败（401）、超出客户端请求数配额（429）或创建失败（500）
+    """
+    batch_manager = request.app.state.batch_manager
+    try:
+        client = identify_batch_client(request)
+        check_client_limit(request.app.state.rate_limiter.check_request, client)
+        return await batch_manager.create(file, client_id=client.client_id, client_weight=client.weight)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"创建批处理任务失败: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        await file.close()
+
+
+@router.get(
+    "/v1/batches",
+    summary="列出批处理任务",
+    description="返回最近创建的批处理任务"
+)
+async def list_batches(request: Request, limit: int = 20) -> Dict[str, Any]:
+    """
+    列出批处理任务
+
+    Args:
+        request: FastAPI请求对象
+        limit: 返回数量
+
+    Returns:
+        任务列表
+    """
+    client = identify_batch_client(request)
+    return {"object": "list", "data": request.app.state.batch_manager.list(limit, client.client_id)}
+
+
+@router.get(
+    "/v1/batches/{batch_id}",
+    summary="获取批处理任务状态",
+    description="返回任务状态和完成进度"
+)
+async def get_batch(batch_id: str, request: Request) -> Dict[str, Any]:
+    """
+    获取批处理任务状态
+
+    Args:
+        batch_id: 任务ID
+        request: FastAPI请求对象
+
+    Returns:
+        任务状态
+    """
+    client = identify_batch_client(request)
+    state = request.app.state.batch_manager.get(batch_id, client.client_id)
+    if state is None:
+        raise batch_not_found(batch_id)
+    return state
+
+
+@router.get(
+    "/v1/batches/{batch_id}/output",
+    summary="下载批处理结果",
+    description="下载 JSONL 结果文件（任务运行中时返回已完成部分）"
+)
+async def get_batch_output(batch_id: str, request: Request):
+    """
+    下载批处理结果
+
+    Args:
+        batch_id: 任务ID
+        request: FastAPI请求对象
+
+    Returns:
+        JSONL 结果文件
+    """
+    client = identify_batch_client(request)
+    output_path = request.app.state.batch_manager.output_path(batch_id, client.client_id)
+    if output_path is None:
+        raise batch_not_found(batch_id)
+    return FileResponse(output_path, media_type="application/jsonl", filename=f"{batch_id}_output.jsonl")
+
+
+@router.post(
+    "/v1/batches/{batch_id}/cancel",
+    summary="取消批处理任务",
+    description="停止执行批处理任务，已完成的结果保留"
+)
+async def cancel_batch(batch_id: str, request: Request) -> Dict[str, Any]:
+    """
+    取消批处理任务
+
+    Args:
+        batch_id: 任务ID
+        request: FastAPI请求对象
+
+    Returns:
+        任务状态
+    """
+    client = identify_batch_client(request)
+    state = await request.app.state.batch_manager.cancel(batch_id, client.client_id)
+    if state is None:
+        raise batch_not_found(batch_id)
+    return state
 
 
 @router.get(
@@ -177,6 +1226,7 @@ async def list_models(request: Request) -> Dict[str, Any]:
             if model_id in context_map:
                 model["context_length"] = context_map[model_id]["context_length"]
                 model["context_length_formatted"] = context_map[model_id]["context_length_formatted"]
+                model["max_output_tokens"] = context_map[model_id]["max_output_tokens"]
 
         return models
     except Exception as e:
@@ -200,7 +1250,12 @@ async def get_model_info(model_id: str) -> Dict[str, Any]:
         模型信息
     """
     try:
-        from config.model_config import get_model_context_limit, MODEL_CONTEXT_LIMITS
+        from config.model_config import (
+            get_model_context_limit,
+            get_model_max_output_tokens,
+            get_prompt_budget,
+            MODEL_CONTEXT_LIMITS
+        )
 
         if model_id not in MODEL_CONTEXT_LIMITS:
             # 返回默认信息
@@ -208,16 +1263,19 @@ async def get_model_info(model_id: str) -> Dict[str, Any]:
                 "id": model_id,
                 "context_length": get_model_context_limit(model_id),
                 "context_length_formatted": f"{get_model_context_limit(model_id):,} tokens",
+                "max_output_tokens": get_model_max_output_tokens(model_id),
                 "note": "使用默认上下文长度"
             }
 
         context_limit = get_model_context_limit(model_id)
+        usable_limit = get_prompt_budget(model_id)
         return {
             "id": model_id,
             "context_length": context_limit,
             "context_length_formatted": f"{context_limit:,} tokens",
-            "usable_limit": int(context_limit * 0.9),
-            "usable_limit_formatted": f"{int(context_limit * 0.9):,} tokens (90%)"
+            "max_output_tokens": get_model_max_output_tokens(model_id),
+            "usable_limit": usable_limit,
+            "usable_limit_formatted": f"{usable_limit:,} tokens (预留 {context_limit - usable_limit:,} tokens 输出，未指定 max_tokens 时)"
         }
     except Exception as e:
         logger.error(f"获取模型信息失败: {e}")
@@ -247,6 +1305,8 @@ async def health_check(request: Request) -> Dict[str, Any]:
         return {
             "status": "healthy" if stats["key_stats"]["available"] > 0 else "degraded",
             "key_stats": stats["key_stats"],
+            "admission": request.app.state.admission_controller.get_stats(),
+            "timeouts": stats["timeouts"],
             "version": "1.0.0"
         }
     except Exception as e:
@@ -261,6 +1321,53 @@ async def health_check(request: Request) -> Dict[str, Any]:
         )
 
 
+@router.get(
+    "/ready",
+    summary="就绪检查",
+    description="启动预热完成后返回 200，之前和排空期间返回 503；用于负载均衡器/编排系统的就绪探针"
+)
+async def readiness_check(request: Request) -> JSONResponse:
+    """
+    就绪检查端点（与 /health 区分：/health 表示进程存活，/ready 表示可以接收流量）
+
+    Args:
+        request: FastAPI请求对象
+
+    Returns:
+        就绪状态和启动耗时报告
+    """
+    drain_controller = getattr(request.app.state, "drain_controller", None)
+    if drain_controller is not None and drain_controller.draining:
+        return JSONResponse(status_code=503, content={"status": "draining", **drain_controller.get_stats()})
+
+    startup = getattr(request.app.state, "startup", None)
+    if startup is None or not startup.ready:
+        report = startup.report() if startup is not None else {}
+        return JSONResponse(status_code=503, content={"status": "starting", **report})
+    return JSONResponse(content={"status": "ready", **startup.report()})
+
+
+@router.get(
+    "/metrics",
+    summary="Prometheus 指标",
+    description="以 Prometheus 文本格式导出请求数、延迟直方图、token 用量、密钥和连接池状态（多 worker 时合并所有 worker）",
+    response_class=Response
+)
+async def metrics() -> Response:
+    """
+    Prometheus 指标端点
+
+    Returns:
+        Prometheus 文本格式（0.0.4）的指标
+    """
+    if not settings.metrics_enabled:
+        raise HTTPException(status_code=404, detail="指标端点未启用")
+    return Response(
+        content=await registry.render(),
+        media_type="text/plain; version=0.0.4"
+    )
+
+
 @router.post(
     "/admin/reload-keys",
     summary="重新加载密钥",
@@ -286,6 +1393,30 @@ async def reload_keys(request: Request) -> Dict[str, str]:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post(
+    "/admin/reload-clients",
+    summary="重新加载客户端配置",
+    description="从文件重新加载客户端凭证和限流配置（需要管理员权限）"
+)
+async def reload_clients(request: Request) -> Dict[str, str]:
+    """
+    重新加载客户端配置
+
+    Args:
+        request: FastAPI请求对象
+
+    Returns:
+        操作结果
+    """
+    try:
+        request.app.state.rate_limiter.reload_clients()
+
+        return {"message": "客户端配置已成功重新加载"}
+    except Exception as e:
+        logger.error(f"重新加载客户端配置失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.post(
     "/admin/reset-failed-keys",
     summary="重置失败密钥",
@@ -309,3 +1440,168 @@ async def reset_failed_keys(request: Request) -> Dict[str, str]:
     except Exception as e:
         logger.error(f"重置失败密钥失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+def require_profiler() -> None:
+    """采样分析与任务快照会暴露调用栈和请求内容，需显式开启，未启用时返回 404"""
+    if not settings.profiler_enabled:
+        raise HTTPException(status_code=404, detail="采样分析未启用（PROFILER_ENABLED=false）")
+
+
+def get_profiler(request: Request):
+    """获取（首次使用时创建）采样分析器，诊断模块按需导入"""
+    profiler = getattr(request.app.state, "profiler", None)
+    if profiler is None:
+        from core.profiler import Profiler
+
+        profiler = Profiler(
+            max_duration=settings.profiler_max_duration,
+            lag_monitor=getattr(request.app.state, "loop_lag_monitor", None)
+        )
+        request.app.state.profiler = profiler
+    return profiler
+
+
+@router.post(
+    "/admin/profile",
+    summary="采样分析",
+    description="对接收请求的 worker 的事件循环线程做限时栈采样，返回 collapsed stack（可用 flamegraph.pl / speedscope 打开）或包含任务快照与事件循环延迟的 JSON"
+)
+async def profile(request: Request, duration: float = 10.0, interval_ms: float = 5.0, format: str = "collapsed"):
+    """
+    采样分析当前 worker
+
+    Args:
+        request: FastAPI请求对象
+        duration: 采样时长（秒），不超过 PROFILER_MAX_DURATION
+        interval_ms: 采样间隔（毫秒）
+        format: collapsed（火焰图输入文件）或 json
+
+    Returns:
+        collapsed stack 文本或 JSON 结果
+    """
+    require_profiler()
+    if format not in ("collapsed", "json"):
+        raise HTTPException(status_code=400, detail="format 可选值: collapsed, json")
+
+    profiler = get_profiler(request)
+    try:
+        result = await profiler.profile(duration, interval_ms / 1000)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    if format == "json":
+        return result
+
+    return Response(
+        content=result["collapsed"],
+        media_type="text/plain",
+        headers={
+            "Content-Disposition": f'attachment; filename="profile_{result["pid"]}.collapsed"',
+            "X-Worker-PID": str(result["pid"]),
+            "X-Profile-Samples": str(result["samples"])
+        }
+    )
+
+
+@router.get(
+    "/admin/tasks",
+    summary="asyncio 任务快照",
+    description="返回接收请求的 worker 中所有 asyncio 任务及其挂起位置，以及事件循环延迟统计"
+)
+async def list_tasks(request: Request) -> Dict[str, Any]:
+    """
+    获取 asyncio 任务快照
+
+    Args:
+        request: FastAPI请求对象
+
+    Returns:
+        任务列表和事件循环延迟统计
+    """
+    require_profiler()
+    from core.profiler import dump_tasks
+
+    tasks = dump_tasks()
+    lag_monitor = getattr(request.app.state, "loop_lag_monitor", None)
+    return {
+        "pid": os.getpid(),
+        "count": len(tasks),
+        "loop_lag": lag_monitor.get_stats() if lag_monitor is not None else None,
+        "tasks": tasks
+    }
+
+
+def get_trace_buffer(request: Request) -> TraceBuffer:
+    """获取追踪缓冲区，未启用时返回 404"""
+    buffer = getattr(request.app.state, "trace_buffer", None)
+    if buffer is None:
+        raise HTTPException(status_code=404, detail="请求追踪未启用（TRACING_ENABLED=false）")
+    return buffer
+
+
+@router.get(
+    "/admin/traces",
+    summary="最近请求追踪",
+    description="列出接收请求的 worker 环形缓冲区中最近的请求，可按耗时、状态和路径过滤；format=otlp 返回 OTLP JSON"
+)
+async def list_traces(
+    request: Request,
+    limit: int = 50,
+    min_duration_ms: float = 0.0,
+    status: Optional[str] = None,
+    path: Optional[str] = None,
+    format: str = "json"
+):
+    """
+    查询最近的请求追踪
+
+    Args:
+        request: FastAPI请求对象
+        limit: 最多返回条数
+        min_duration_ms: 只返回耗时不小于该值（毫秒）的请求
+        status: 只返回该状态（ok / error / cancelled）的请求
+        path: 只返回该路径的请求
+        format: json（摘要列表）或 otlp（完整 span）
+
+    Returns:
+        追踪列表
+    """
+    buffer = get_trace_buffer(request)
+    traces = buffer.recent(limit=limit, min_duration_ms=min_duration_ms, status=status, path=path)
+    if format == "otlp":
+        return to_otlp(traces)
+    return {
+        "pid": os.getpid(),
+        "buffered": len(buffer),
+        "count": len(traces),
+        "traces": [trace.summary() for trace in traces]
+    }
+
+
+@router.get(
+    "/admin/traces/{request_id}",
+    summary="单个请求追踪",
+    description="按请求ID（X-Request-ID）查询完整的 span 列表：选择密钥、每次上游调用及其重试、流式转发"
+)
+async def get_trace(request: Request, request_id: str, format: str = "json"):
+    """
+    查询单个请求的追踪
+
+    Args:
+        request: FastAPI请求对象
+        request_id: 请求ID
+        format: json 或 otlp
+
+    Returns:
+        追踪详情
+    """
+    trace = get_trace_buffer(request).get(request_id)
+    if trace is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"请求 {request_id} 不在 worker {os.getpid()} 的追踪缓冲区中（可能已被淘汰或由其他 worker 处理）"
+        )
+    if format == "otlp":
+        return to_otlp([trace])
+    return trace.to_dict()
@@ -0,0 +1,184 @@
+"""
+响应压缩基准测试
+
+对代表性的响应体测量各编码和级别的 CPU 开销与节省的字节数，用于选择 COMPRESSION_ENCODINGS /
+COMPRESSION_LEVELS / COMPRESSION_MIN_SIZE:
+
+    completion-<大小>   非流式聊天补全响应（中英文混合的随机文本，不会因重复而过度压缩）
+    models              /v1/models 响应（模型列表 + 上下文长度信息）
+    sse                 流式响应：逐块压缩并 flush（COMPRESSION_SSE）与不压缩对比，按分块计算开销
+
+未安装 brotli / zstandard 时只测 gzip。每个组合重复多次取中位数，单线程测量，不含网络传输。
+
+运行方式:
+    python -m benchmarks.bench_compression
+    python -m benchmarks.bench_compression --sizes 1,16,256 --levels gzip:1,6,9 --levels zstd:1,3,9
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+from typing import Callable, Dict, List
+
+from config.model_config import get_all_models_info
+from core.compression import DEFAULT_LEVELS, ENCODINGS, StreamCompressor, available_encodings, compress, decompress
+
+WORDS = (
+    "the model returns a response with tokens and context 上下文 模型 响应 请求 代理 密钥 "
+    "function value result data stream chunk latency throughput 吞吐 延迟 分块 数据 结果"
+).split()
+
+
+def random_text(size: int, rng: random.Random) -> str:
+    """生成约 size 字节的中英文混合文本"""
+    parts = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        parts.append(word)
+        length += len(word.encode("utf-8")) + 1
+    return " ".join(parts)
+
+
+def completion_body(size: int, rng: random.Random) -> bytes:
+    """非流式聊天补全响应"""
+    return json.dumps({
+        "id": "chatcmpl-bench",
+        "object": "chat.completion",
+        "created": 1700000000,
+        "model": "openai-gpt-oss-120b",
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": random_text(size, rng)},
+            "finish_reason": "stop"
+        }],
+        "usage": {"prompt_tokens": 120, "completion_tokens": size // 4, "total_tokens": 120 + size // 4}
+    }, ensure_ascii=False).encode("utf-8")
+
+
+def models_body() -> bytes:
+    """/v1/models 响应"""
+    data = [{"object": "model", "owned_by": "megallm", **info} for info in get_all_models_info()]
+    return json.dumps({"object": "list", "data": data}, ensure_ascii=False).encode("utf-8")
+
+
+def sse_chunks(tokens: int, rng: random.Random) -> List[bytes]:
+    """流式响应分块（每块一个 token 的 delta 事件）"""
+    chunks = []
+    for i in range(tokens):
+        event = {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion.chunk",
+            "created": 1700000000,
+            "model": "openai-gpt-oss-120b",
+            "choices": [{"index": 0, "delta": {"content": rng.choice(WORDS) + " "}, "finish_reason": None}]
+        }
+        chunks.append(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+    chunks.append(b"data: [DONE]\n\n")
+    return chunks
+
+
+def measure(func: Callable[[], object], repeat: int) -> float:
+    """多次运行取中位数（微秒）"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1e6)
+    return statistics.median(timings)
+
+
+def bench_body(name: str, body: bytes, encoding: str, level: int, repeat: int) -> Dict[str, object]:
+    """一次性压缩完整响应体"""
+    compressed = compress(body, encoding, level)
+    assert decompress(compressed, encoding) == body
+    cpu_us = measure(lambda: compress(body, encoding, level), repeat)
+    saved = len(body) - len(compressed)
+    return {
+        "payload": name, "encoding": encoding, "level": level,
+        "bytes": len(body), "compressed": len(compressed), "saved": saved,
+        "cpu_us": round(cpu_us, 1),
+        "mb_per_s": round(len(body) / cpu_us, 1) if cpu_us else None,
+        "us_per_kb_saved": round(cpu_us / (saved / 1024), 2) if saved > 0 else None
+    }
+
+
+def bench_sse(chunks: List[bytes], encoding: str, level: int, repeat: int) -> Dict[str, object]:
+    """逐块压缩并 flush 整个流"""
+    def run() -> int:
+        compressor = StreamCompressor(encoding, level)
+        return sum(len(compressor.compress(chunk)) for chunk in chunks) + len(compressor.finish())
+
+    raw = sum(len(chunk) for chunk in chunks)
+    compressed = run()
+    cpu_us = measure(run, repeat)
+    saved = raw - compressed
+    return {
+        "payload": f"sse-{len(chunks)}", "encoding": encoding, "level": level,
+        "bytes": raw, "compressed": compressed, "saved": saved,
+        "cpu_us": round(cpu_us, 1),
+        "mb_per_s": round(raw / cpu_us, 1) if cpu_us else None,
+        "us_per_kb_saved": round(cpu_us / (saved / 1024), 2) if saved > 0 else None,
+        "us_per_chunk": round(cpu_us / len(chunks), 2)
+    }
+
+
+def parse_levels(values: List[str], encodings: tuple) -> Dict[str, List[int]]:
+    """--levels gzip:1,6 -> {"gzip": [1, 6]}；未指定的编码测最快级别和默认级别"""
+    levels = {encoding: sorted({1, DEFAULT_LEVELS[encoding]}) for encoding in encodings}
+    for value in values:
+        encoding, _, numbers = value.partition(":")
+        if encoding in levels:
+            levels[encoding] = [int(number) for number in numbers.split(",") if number]
+    return levels
+
+
+def main():
+    parser = argparse.ArgumentParser(description="响应压缩基准测试")
+    parser.add_argument("--sizes", default="1,4,16,64,256", help="非流式响应内容大小列表（KB），逗号分隔")
+    parser.add_argument("--sse-tokens", type=int, default=500, help="流式响应的分块数")
+    parser.add_argument("--levels", action="append", default=[], metavar="ENC:L1,L2", help="各编码测试的级别，可重复")
+    parser.add_argument("--repeat", type=int, default=20, help="每个组合的重复次数")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    encodings = available_encodings(ENCODINGS)
+    skipped = [encoding for encoding in ENCODINGS if encoding not in encodings]
+    if skipped:
+        print(f"未安装依赖，跳过: {', '.join(skipped)}")
+    levels = parse_levels(args.levels, encodings)
+
+    payloads = [(f"completion-{size}k", completion_body(int(size) * 1024, rng)) for size in args.sizes.split(",") if size]
+    payloads.append(("models", models_body()))
+    chunks = sse_chunks(args.sse_tokens, rng)
+
+    results = []
+    print(f"{'响应体':<18}{'编码':<6}{'级别':>4}{'原始':>10}{'压缩后':>10}{'压缩率':>8}{'CPU µs':>10}{'MB/s':>8}{'µs/KB节省':>11}")
+    for encoding in encodings:
+        for level in levels[encoding]:
+            rows = [bench_body(name, body, encoding, level, args.repeat) for name, body in payloads]
+            rows.append(bench_sse(chunks, encoding, level, args.repeat))
+            for row in rows:
+                results.append(row)
+                ratio = row["compressed"] / row["bytes"]
+                print(
+                    f"{row['payload']:<18}{encoding:<6}{level:>4}{row['bytes']:>10}{row['compressed']:>10}{ratio:>8.1%}"
+                    f"{row['cpu_us']:>10.1f}{row['mb_per_s'] or 0:>8.1f}{row['us_per_kb_saved'] or 0:>11.2f}"
+                )
+
+    print("\nSSE 逐块压缩: 每个分块的 CPU 开销")
+    for row in results:
+        if "us_per_chunk" in row:
+            print(f"  {row['encoding']:<6}level={row['level']:<3}{row['us_per_chunk']:>8.2f} µs/分块，节省 {row['saved'] / row['bytes']:.0%}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
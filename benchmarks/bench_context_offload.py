@@ -0,0 +1,109 @@
+"""
+上下文检查卸载基准测试
+
+模拟若干并发流式转发协程（每 10ms 转发一个分块），同时对大体积 prompt 执行上下文检查，
+对比内联 / 线程池 / 进程池三种模式下流式分块的调度延迟。
+
+运行方式:
+    python -m benchmarks.bench_context_offload
+    python -m benchmarks.bench_context_offload --prompt-mb 5 --large-requests 8 --streams 50
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from core.context_checker import ContextChecker
+
+
+def percentile(values: list, pct: float) -> float:
+    """计算百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(len(ordered) * pct / 100), len(ordered) - 1)
+    return ordered[index]
+
+
+async def stream_worker(stop: asyncio.Event, interval: float, lags: list) -> None:
+    """模拟流式转发：每个间隔转发一个分块，记录实际调度延迟"""
+    while not stop.is_set():
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        lags.append((time.perf_counter() - expected) * 1000)
+
+
+async def run_mode(mode: str, args, messages: list) -> dict:
+    """运行单个模式"""
+    if mode == "inline":
+        checker = ContextChecker(offload_threshold=0)
+    else:
+        checker = ContextChecker(
+            offload_threshold=1,
+            pool_size=args.pool_size,
+            executor_type=mode
+        )
+
+    # 预热执行器，避免首次创建进程/线程的开销计入结果
+    await checker.check("openai-gpt-oss-120b", [{"role": "user", "content": "warmup"}])
+
+    stop = asyncio.Event()
+    lags: list = []
+    streams = [
+        asyncio.create_task(stream_worker(stop, args.interval_ms / 1000, lags))
+        for _ in range(args.streams)
+    ]
+
+    await asyncio.sleep(0.2)
+    lags.clear()
+
+    started = time.perf_counter()
+    for _ in range(args.large_requests):
+        await asyncio.gather(*[
+            checker.check("openai-gpt-oss-120b", messages)
+            for _ in range(args.concurrency)
+        ])
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await asyncio.gather(*streams)
+    checker.shutdown()
+
+    return {
+        "mode": mode,
+        "check_seconds": round(elapsed, 3),
+        "lag_p50_ms": round(statistics.median(lags), 2) if lags else 0.0,
+        "lag_p99_ms": round(percentile(lags, 99), 2),
+        "lag_max_ms": round(max(lags), 2) if lags else 0.0,
+        "samples": len(lags)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="上下文检查卸载基准测试")
+    parser.add_argument("--prompt-mb", type=float, default=5.0, help="单个 prompt 大小（MB）")
+    parser.add_argument("--large-requests", type=int, default=4, help="大请求批次数")
+    parser.add_argument("--concurrency", type=int, default=2, help="每批并发的大请求数")
+    parser.add_argument("--streams", type=int, default=50, help="并发流数量")
+    parser.add_argument("--interval-ms", type=float, default=10.0, help="流式分块间隔（毫秒）")
+    parser.add_argument("--pool-size", type=int, default=2, help="线程/进程池大小")
+    parser.add_argument("--modes", default="inline,thread,process", help="要对比的模式，逗号分隔")
+    args = parser.parse_args()
+
+    content = ("The quick brown fox jumps over the lazy dog. 敏捷的狐狸跳过了懒狗。"
+               * int(args.prompt_mb * 1024 * 1024 / 60))
+    messages = [{"role": "user", "content": content}]
+
+    print(f"prompt 大小: {len(content):,} 字符, 并发流: {args.streams}, 分块间隔: {args.interval_ms}ms\n")
+    print(f"{'模式':<10}{'检查耗时(s)':>14}{'p50延迟(ms)':>14}{'p99延迟(ms)':>14}{'最大延迟(ms)':>14}")
+
+    for mode in args.modes.split(","):
+        result = asyncio.run(run_mode(mode.strip(), args, messages))
+        print(
+            f"{result['mode']:<10}{result['check_seconds']:>14}{result['lag_p50_ms']:>14}"
+            f"{result['lag_p99_ms']:>14}{result['lag_max_ms']:>14}"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+"""
+故障转移基准测试
+
+启动带故障注入的模拟上游（benchmarks.mock_upstream）和真实的代理服务进程，以固定速率发起开环负载
+（到达时间不受响应快慢影响，故障期间的排队和尾延迟能真实体现），负载分为三个阶段:
+
+    before   无故障
+    during   按场景注入故障
+    after    故障结束后（如 401 禁用的密钥不会自动恢复，可观察容量损失）
+
+每个阶段统计: 请求成功率（流式请求必须完整收到 [DONE] 且没有错误事件）、成功请求的延迟 p50/p95/p99/max、
+流式首 token 延迟、错误分类、上游调用次数（来自模拟上游的统计）、浪费的上游调用数（未产生成功响应的调用）
+和每个请求平均的上游调用数。阶段按请求发出时间划分，上游调用按调用发生时间划分，跨越阶段边界的重试会计入后一个阶段。
+
+内置场景（--scenarios 选择，默认全部）:
+    auth       2 个密钥返回 401
+    ratelimit  一半密钥返回 429（Retry-After: 5）
+    5xx        所有密钥 30% 的请求返回 503
+    reset      1 个密钥在返回响应前重置连接
+    drop       1 个密钥响应中途断开
+    slow       1 个密钥慢速发送响应（slow-loris，500 B/s）
+
+也可用 --faults 指定自定义故障计划文件（规则格式见 benchmarks/mock_upstream.py，时间相对负载开始）。
+每个场景使用新的代理和模拟上游进程，密钥状态互不影响；代理日志写入 benchmarks/results/failover-<场景>.log。
+结果写入 JSON 文件，--compare 与之前的结果对比。
+
+运行方式:
+    python -m benchmarks.bench_failover
+    python -m benchmarks.bench_failover --scenarios 5xx,reset --mode nonstream --rate 50
+    python -m benchmarks.bench_failover --proxy-env MEGALLM_IDLE_TIMEOUT=2 --scenarios slow
+    python -m benchmarks.bench_failover --compare benchmarks/results/failover-abc1234.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import httpx
+
+from benchmarks.bench_proxy import (
+    RESULTS_DIR, free_port, git_revision, start_mock, start_proxy, summarize, wait_ready
+)
+
+PHASES = ("before", "during", "after")
+
+SCENARIOS = {
+    "auth": "2 个密钥返回 401",
+    "ratelimit": "一半密钥返回 429（Retry-After: 5）",
+    "5xx": "所有密钥 30% 的请求返回 503",
+    "reset": "1 个密钥在返回响应前重置连接",
+    "drop": "1 个密钥响应中途断开",
+    "slow": "1 个密钥慢速发送响应（500 B/s）",
+}
+
+
+def scenario_faults(name: str, keys: List[str], start: float, end: float) -> List[Dict[str, Any]]:
+    """内置场景的故障规则"""
+    window = {"start": start, "end": end}
+    rules = {
+        "auth": {"fault": 401, "keys": keys[:2]},
+        "ratelimit": {"fault": 429, "keys": keys[:len(keys) // 2], "retry_after": 5},
+        "5xx": {"fault": 503, "rate": 0.3},
+        "reset": {"fault": "reset", "keys": keys[:1]},
+        "drop": {"fault": "drop", "keys": keys[:1]},
+        "slow": {"fault": "slow", "keys": keys[:1], "bytes_per_second": 500},
+    }
+    return [{**rules[name], **window}]
+
+
+async def one_request(client: httpx.AsyncClient, payload: dict, stream: bool) -> tuple:
+    """
+    发送一个请求
+
+    Returns:
+        (是否成功, 总耗时 ms, 首 token 耗时 ms 或 None, 错误分类或 None)
+    """
+    started = time.perf_counter()
+
+    def elapsed() -> float:
+        return (time.perf_counter() - started) * 1000
+
+    try:
+        if not stream:
+            response = await client.post("/v1/chat/completions", json=payload)
+            error = None if response.status_code == 200 else f"http_{response.status_code}"
+            return error is None, elapsed(), None, error
+
+        first_token = None
+        error = None
+        tail = b""
+        async with client.stream("POST", "/v1/chat/completions", json=payload) as response:
+            if response.status_code != 200:
+                await response.aread()
+                return False, elapsed(), None, f"http_{response.status_code}"
+            async for chunk in response.aiter_bytes():
+                if first_token is None and b'"content":"' in chunk and b'"content":""' not in chunk:
+                    first_token = elapsed()
+                if b'"error"' in chunk:
+                    error = "sse_error"
+                tail = (tail + chunk)[-32:]
+        if error is None and b"[DONE]" not in tail:
+            error = "truncated"
+        return error is None, elapsed(), first_token, error
+    except httpx.HTTPError as e:
+        return False, elapsed(), None, type(e).__name__
+
+
+def phase_of(offset: float, args) -> str:
+    """按相对负载开始的时间确定阶段"""
+    if offset < args.before:
+        return "before"
+    if offset < args.before + args.during:
+        return "during"
+    return "after"
+
+
+def summarize_phase(phase: str, records: List[tuple], calls: int, outcomes: Dict[str, int], duration: float) -> dict:
+    """汇总一个阶段的结果"""
+    successes = [r for r in records if r[0]]
+    errors: Dict[str, int] = {}
+    for record in records:
+        if record[3] is not None:
+            errors[record[3]] = errors.get(record[3], 0) + 1
+    result = {
+        "phase": phase,
+        "requests": len(records),
+        "success": len(successes),
+        "success_rate": round(len(successes) / len(records), 4) if records else None,
+        "goodput_rps": round(len(successes) / duration, 2) if duration > 0 else 0.0,
+        "errors": errors,
+        "latency_ms": summarize([r[1] for r in successes]),
+        "failed_latency_ms": summarize([r[1] for r in records if not r[0]]),
+        "upstream_calls": calls,
+        "wasted_calls": max(calls - len(successes), 0),
+        "calls_per_request": round(calls / len(records), 3) if records else None,
+        "upstream_outcomes": outcomes
+    }
+    ttfts = [r[2] for r in successes if r[2] is not None]
+    if ttfts:
+        result["ttft_ms"] = summarize(ttfts)
+    return result
+
+
+def diff_outcomes(after: Dict[str, int], before: Dict[str, int]) -> Dict[str, int]:
+    return {key: count - before.get(key, 0) for key, count in after.items() if count - before.get(key, 0)}
+
+
+async def run_scenario(name: str, faults: List[Dict[str, Any]], args, key_file: str) -> List[dict]:
+    """启动新的模拟上游和代理，运行一个场景的三个阶段"""
+    mock_port, proxy_port = free_port(), free_port()
+    mock = start_mock(args, mock_port)
+    proxy = None
+    mock_url = f"http://127.0.0.1:{mock_port}"
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    log = open(RESULTS_DIR / f"failover-{name}.log", "w", encoding="utf-8")
+    try:
+        await wait_ready(f"{mock_url}/v1/models", mock)
+        proxy = start_proxy(args, proxy_port, mock_port, key_file, args.proxy_env, output=log)
+        await wait_ready(f"http://127.0.0.1:{proxy_port}/health", proxy)
+
+        stream = args.mode == "stream"
+        payload = {
+            "model": args.model,
+            "messages": [{"role": "user", "content": "Write a short poem about failover."}],
+            "stream": stream
+        }
+        total = args.before + args.during + args.after
+        records: Dict[str, List[tuple]] = {phase: [] for phase in PHASES}
+        snapshots: List[Dict[str, Any]] = []
+
+        async with httpx.AsyncClient(base_url=mock_url) as control, httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{proxy_port}",
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=100),
+            timeout=args.timeout
+        ) as client:
+            # 故障计划的时钟从这里开始，与负载开始时间对齐
+            plan = await control.put("/mock/faults", json={"faults": faults, "seed": args.seed})
+            plan.raise_for_status()
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+
+            async def fire(phase: str):
+                records[phase].append(await one_request(client, payload, stream))
+
+            async def snapshot_at(offset: float):
+                await asyncio.sleep(max(started + offset - loop.time(), 0))
+                snapshots.append((await control.get("/mock/stats")).json())
+
+            boundaries = asyncio.gather(snapshot_at(args.before), snapshot_at(args.before + args.during))
+            tasks = []
+            for i in range(int(total * args.rate)):
+                offset = i / args.rate
+                delay = started + offset - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(fire(phase_of(offset, args))))
+
+            await boundaries
+            done, pending = await asyncio.wait(tasks, timeout=args.timeout) if tasks else (set(), set())
+            for task in pending:
+                task.cancel()
+            snapshots.append((await control.get("/mock/stats")).json())
+    finally:
+        for process in (proxy, mock):
+            if process is not None:
+                process.terminate()
+        for process in (proxy, mock):
+            if process is not None:
+                process.wait(timeout=10)
+        log.close()
+
+    results = []
+    durations = {"before": args.before, "during": args.during, "after": args.after}
+    previous = {"calls": 0, "by_outcome": {}}
+    for phase, snapshot in zip(PHASES, snapshots):
+        results.append({
+            "scenario": name,
+            **summarize_phase(
+                phase, records[phase], snapshot["calls"] - previous["calls"],
+                diff_outcomes(snapshot["by_outcome"], previous["by_outcome"]), durations[phase]
+            )
+        })
+        previous = snapshot
+    return results
+
+
+def print_results(results: List[dict]) -> None:
+    for result in results:
+        latency = result["latency_ms"]
+        rate = result["success_rate"]
+        print(
+            f"{result['scenario']:<11}{result['phase']:<8}{result['requests']:>6}"
+            f"{(rate or 0) * 100:>8.1f}%{latency.get('p50', 0):>9.0f}{latency.get('p99', 0):>9.0f}"
+            f"{latency.get('max', 0):>9.0f}{result['calls_per_request'] or 0:>8.2f}{result['wasted_calls']:>8}"
+            f"  {json.dumps(result['errors'], ensure_ascii=False) if result['errors'] else ''}",
+            flush=True
+        )
+
+
+def compare(current: dict, baseline_path: str) -> None:
+    """对比之前的结果: 成功率差值（百分点）、p99 变化、浪费调用数差值"""
+    baseline = json.loads(Path(baseline_path).read_text(encoding="utf-8"))
+    previous = {(r["scenario"], r["phase"]): r for r in baseline["results"]}
+    print(f"\n对比 {baseline_path}（提交 {baseline['meta'].get('commit')}）:")
+    print(f"{'场景':<9}{'阶段':<6}{'成功率':>10}{'p99':>10}{'浪费调用':>10}")
+    for result in current["results"]:
+        old = previous.get((result["scenario"], result["phase"]))
+        if old is None:
+            continue
+        rate = ((result["success_rate"] or 0) - (old["success_rate"] or 0)) * 100
+        p99, old_p99 = result["latency_ms"].get("p99"), old["latency_ms"].get("p99")
+        p99_delta = f"{(p99 - old_p99) / old_p99 * 100:+.1f}%" if p99 and old_p99 else "n/a"
+        print(
+            f"{result['scenario']:<11}{result['phase']:<8}{rate:>+9.1f}pp{p99_delta:>10}"
+            f"{result['wasted_calls'] - old['wasted_calls']:>+12}"
+        )
+
+
+async def run(args) -> dict:
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        key_file = os.path.join(tmp, "keys.txt")
+        keys = [f"sk-bench-{i:04d}" for i in range(args.keys)]
+        with open(key_file, "w", encoding="utf-8") as f:
+            f.write("".join(key + "\n" for key in keys))
+
+        start, end = args.before, args.before + args.during
+        if args.faults:
+            plan = json.loads(Path(args.faults).read_text(encoding="utf-8"))
+            scenarios = {Path(args.faults).stem: plan["faults"] if isinstance(plan, dict) else plan}
+        else:
+            scenarios = {name: scenario_faults(name, keys, start, end) for name in args.scenarios}
+
+        for name, faults in scenarios.items():
+            print(f"# {name}: {SCENARIOS.get(name, args.faults)}", flush=True)
+            scenario_results = await run_scenario(name, faults, args, key_file)
+            print_results(scenario_results)
+            results.extend(scenario_results)
+
+    return {
+        "meta": {
+            **git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "args": {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+        },
+        "results": results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="故障转移基准测试")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"场景列表，逗号分隔: {', '.join(SCENARIOS)}")
+    parser.add_argument("--faults", help="自定义故障计划文件（替代内置场景）")
+    parser.add_argument("--mode", choices=("nonstream", "stream"), default="stream")
+    parser.add_argument("--rate", type=float, default=20.0, help="请求到达速率（每秒）")
+    parser.add_argument("--before", type=float, default=5.0, help="故障前阶段时长（秒）")
+    parser.add_argument("--during", type=float, default=10.0, help="故障阶段时长（秒）")
+    parser.add_argument("--after", type=float, default=5.0, help="故障后阶段时长（秒）")
+    parser.add_argument("--timeout", type=float, default=120.0, help="单个请求超时，也是负载结束后等待未完成请求的时间（秒）")
+    parser.add_argument("--seed", type=int, default=42, help="故障命中的随机数种子")
+    parser.add_argument("--keys", type=int, default=8, help="密钥数量")
+    parser.add_argument("--workers", type=int, default=1, help="代理 worker 进程数")
+    parser.add_argument("--model", default="openai-gpt-oss-120b")
+    parser.add_argument("--log-level", default="WARNING", help="代理日志级别")
+    parser.add_argument("--proxy-env", action="append", default=[], metavar="KEY=VALUE", help="覆盖代理配置，可重复")
+    parser.add_argument("--latency", type=float, default=0.0, help="模拟上游响应头延迟（秒）")
+    parser.add_argument("--ttft", type=float, default=0.05, help="模拟上游首 token 延迟（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="模拟上游生成速度")
+    parser.add_argument("--chunk-tokens", type=int, default=1, help="模拟上游每个分块的 token 数")
+    parser.add_argument("--completion-tokens", type=int, default=32, help="模拟上游响应 token 数")
+    parser.add_argument("--output", help="结果文件路径（默认 benchmarks/results/failover-<提交>.json）")
+    parser.add_argument("--compare", help="与之前的结果文件对比")
+    args = parser.parse_args()
+
+    args.scenarios = [name for name in args.scenarios.split(",") if name]
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"未知场景: {name}")
+    try:
+        args.proxy_env = dict(item.split("=", 1) for item in args.proxy_env)
+    except ValueError:
+        parser.error("--proxy-env 格式应为 KEY=VALUE")
+
+    print(f"{'场景':<9}{'阶段':<6}{'请求':>6}{'成功率':>7}{'p50':>9}{'p99':>9}{'max':>9}{'调用/请求':>5}{'浪费':>6}  错误")
+    report = asyncio.run(run(args))
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"failover-{report['meta']['commit'] or 'unknown'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"\n结果已写入 {output}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+加权公平调度模拟基准测试
+
+使用模拟上游（httpx.MockTransport，固定服务时间）驱动真实的 AdmissionController 和 ProxyService：
+批处理客户端在开始时一次性提交大量请求（洪峰），交互式客户端按固定速率持续到达，
+对比 FIFO（所有请求同一个流）与 WFQ（interactive:batch 权重 8:1）下交互式请求的端到端延迟。
+
+运行方式:
+    python -m benchmarks.bench_fair_scheduler
+    python -m benchmarks.bench_fair_scheduler --capacity 16 --batch-requests 2000 --interactive-rps 20
+"""
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import time
+
+import httpx
+
+from core.admission import AdmissionController
+from core.http_client import MegaLLMClient
+from core.key_manager import KeyManager
+from core.proxy import ProxyService
+
+
+def percentile(values: list, pct: float) -> float:
+    """计算百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(len(ordered) * pct / 100), len(ordered) - 1)
+    return ordered[index]
+
+
+def build_proxy(key_file: str, service_ms: float) -> tuple:
+    """构建使用模拟上游的代理服务"""
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(service_ms / 1000)
+        body = json.loads(request.content)
+        return httpx.Response(200, json={
+            "id": "mock", "object": "chat.completion", "created": 0, "model": body["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}
+        })
+
+    client = MegaLLMClient(base_url="http://mock-upstream/v1")
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client, ProxyService(KeyManager(key_file), client)
+
+
+async def run_mode(mode: str, args) -> dict:
+    """运行单个调度模式"""
+    http_client, proxy = build_proxy(args.key_file, args.service_ms)
+    class_weights = {"interactive": 8, "batch": 1} if mode == "wfq" else {"fifo": 1}
+    controller = AdmissionController(
+        max_concurrency=args.capacity,
+        max_queue_size=args.batch_requests + 10_000,
+        max_queue_time=600,
+        class_weights=class_weights
+    )
+
+    async def one_request(request_class: str, tenant: str, latencies: list) -> None:
+        started = time.perf_counter()
+        ticket = await controller.acquire(
+            "mock-model",
+            request_class=request_class if mode == "wfq" else "fifo",
+            tenant=tenant if mode == "wfq" else "all"
+        )
+        try:
+            await proxy.chat_completion(model="mock-model", messages=[{"role": "user", "content": "hi"}])
+        finally:
+            ticket.release()
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    batch_latencies: list = []
+    interactive_latencies: list = []
+
+    # 批处理洪峰：开始时一次性提交
+    batch_tasks = [
+        asyncio.create_task(one_request("batch", "nightly-batch", batch_latencies))
+        for _ in range(args.batch_requests)
+    ]
+    await asyncio.sleep(0)
+
+    # 交互式请求：固定速率到达（开环）
+    interactive_tasks = []
+    interval = 1 / args.interactive_rps
+    started = time.perf_counter()
+    for i in range(int(args.interactive_rps * args.duration)):
+        delay = started + i * interval - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        interactive_tasks.append(
+            asyncio.create_task(one_request("interactive", f"chat-user-{i % 10}", interactive_latencies))
+        )
+
+    await asyncio.gather(*interactive_tasks)
+    await asyncio.gather(*batch_tasks)
+    batch_elapsed = time.perf_counter() - started
+    await http_client._client.aclose()
+
+    return {
+        "mode": mode,
+        "interactive_p50_ms": round(statistics.median(interactive_latencies), 1),
+        "interactive_p99_ms": round(percentile(interactive_latencies, 99), 1),
+        "batch_p50_ms": round(statistics.median(batch_latencies), 1),
+        "batch_done_s": round(batch_elapsed, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="加权公平调度模拟基准测试")
+    parser.add_argument("--key-file", default="data/keys.txt", help="密钥文件（仅用于轮询，不会发出真实请求）")
+    parser.add_argument("--capacity", type=int, default=16, help="并发容量（可用密钥数 x 单密钥并发）")
+    parser.add_argument("--service-ms", type=float, default=50.0, help="模拟上游服务时间（毫秒）")
+    parser.add_argument("--batch-requests", type=int, default=1000, help="批处理洪峰请求数")
+    parser.add_argument("--interactive-rps", type=float, default=20.0, help="交互式请求到达速率")
+    parser.add_argument("--duration", type=float, default=2.0, help="交互式请求持续时间（秒）")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    print(f"容量: {args.capacity}, 上游服务时间: {args.service_ms}ms, 批处理洪峰: {args.batch_requests}, "
+          f"交互式到达: {args.interactive_rps}/s x {args.duration}s\n")
+    print(f"{'模式':<8}{'交互p50(ms)':>14}{'交互p99(ms)':>14}{'批处理p50(ms)':>16}{'批处理完成(s)':>16}")
+
+    for mode in ("fifo", "wfq"):
+        result = asyncio.run(run_mode(mode, args))
+        print(
+            f"{result['mode']:<8}{result['interactive_p50_ms']:>14}{result['interactive_p99_ms']:>14}"
+            f"{result['batch_p50_ms']:>16}{result['batch_done_s']:>16}"
+        )
+
+
+if __name__ == '__main__':
+    main()
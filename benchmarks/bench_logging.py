@@ -0,0 +1,153 @@
+"""
+日志开销基准测试
+
+在进程内通过 ASGI 调用完整的聊天补全路由（客户端识别、上下文检查、准入控制、代理服务、HTTP 客户端），
+上游替换为立即返回的模拟传输层，对比不同日志配置下的单请求耗时:
+
+    off        LOG_LEVEL=WARNING（访问日志和请求路径上的日志全部跳过）
+    info       LOG_LEVEL=INFO，文本格式
+    json       LOG_LEVEL=INFO，JSON 格式
+    sampled    LOG_LEVEL=INFO，访问日志按 10% 采样
+
+日志写入 os.devnull，只测量格式化和转发开销，不含磁盘 I/O。
+
+运行方式:
+    python -m benchmarks.bench_logging
+    python -m benchmarks.bench_logging --rounds 50 --stream
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from api.middleware import AccessLogMiddleware, ServerTimingMiddleware
+from api.routes import router
+from config.settings import settings
+from core.admission import AdmissionController
+from core.context_checker import ContextChecker
+from core.http_client import MegaLLMClient
+from core.key_manager import KeyManager
+from core.proxy import ProxyService
+from core.rate_limiter import ClientRateLimiter
+from utils.logger import setup_logging
+
+MODES = {
+    "off": {"log_level": "WARNING", "log_format": "text", "log_sampling": {}},
+    "info": {"log_level": "INFO", "log_format": "text", "log_sampling": {}},
+    "json": {"log_level": "INFO", "log_format": "json", "log_sampling": {}},
+    "sampled": {"log_level": "INFO", "log_format": "text", "log_sampling": {"megallm.access": 0.1}},
+}
+
+COMPLETION = {
+    "id": "chatcmpl-bench", "object": "chat.completion", "created": 0, "model": "openai-gpt-oss-120b",
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"}, "finish_reason": "stop"}],
+    "usage": {"prompt_tokens": 12, "completion_tokens": 1, "total_tokens": 13}
+}
+STREAM_BODY = (
+    "".join(
+        "data: " + json.dumps({"id": "chatcmpl-bench", "object": "chat.completion.chunk",
+                               "choices": [{"index": 0, "delta": {"content": word}}]}) + "\n\n"
+        for word in ("o", "k")
+    ) + "data: [DONE]\n\n"
+).encode()
+
+
+def upstream(request: httpx.Request) -> httpx.Response:
+    """模拟上游：立即返回固定响应"""
+    if b'"stream": true' in request.content or b'"stream":true' in request.content:
+        return httpx.Response(200, content=STREAM_BODY, headers={"content-type": "text/event-stream"})
+    return httpx.Response(200, json=COMPLETION)
+
+
+def build_app(http_client: MegaLLMClient, key_file: str) -> FastAPI:
+    """构建与 main.py 相同中间件和路由的测试应用"""
+    app = FastAPI()
+    app.include_router(router)
+    app.add_middleware(AccessLogMiddleware)
+    app.add_middleware(ServerTimingMiddleware)
+    app.state.proxy_service = ProxyService(KeyManager(key_file), http_client)
+    app.state.context_checker = ContextChecker()
+    app.state.admission_controller = AdmissionController(class_weights=settings.scheduler_class_weights)
+    app.state.rate_limiter = ClientRateLimiter()
+    return app
+
+
+def apply_mode(mode: str) -> None:
+    """切换日志配置"""
+    for name, value in MODES[mode].items():
+        setattr(settings, name, value)
+    setup_logging()
+
+
+async def run(args, key_file: str) -> dict:
+    """
+    各模式交替运行若干批请求（减少机器负载变化对单个模式的影响）
+
+    Returns:
+        模式 -> 每批的单请求平均耗时列表（微秒）
+    """
+    payload = {
+        "model": "openai-gpt-oss-120b",
+        "messages": [{"role": "user", "content": "hello"}],
+        "stream": args.stream
+    }
+    results = {mode: [] for mode in MODES}
+
+    async with MegaLLMClient(transport=httpx.MockTransport(upstream)) as http_client:
+        transport = httpx.ASGITransport(app=build_app(http_client, key_file))
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for _ in range(args.warmup):
+                await client.post("/v1/chat/completions", json=payload)
+
+            for _ in range(args.rounds):
+                for mode in MODES:
+                    apply_mode(mode)
+                    started = time.perf_counter()
+                    for _ in range(args.batch):
+                        response = await client.post("/v1/chat/completions", json=payload)
+                        assert response.status_code == 200, response.text
+                    results[mode].append((time.perf_counter() - started) / args.batch * 1e6)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="日志开销基准测试")
+    parser.add_argument("--rounds", type=int, default=20, help="交替运行轮数")
+    parser.add_argument("--batch", type=int, default=200, help="每轮每种模式的请求数")
+    parser.add_argument("--warmup", type=int, default=500, help="预热请求数")
+    parser.add_argument("--stream", action="store_true", help="使用流式请求")
+    args = parser.parse_args()
+
+    settings.log_file = None
+    settings.access_log_enabled = True
+
+    # 日志输出到 os.devnull（loguru 在 add 时记录 sys.stdout 对象）
+    stdout = sys.stdout
+    with tempfile.TemporaryDirectory() as tmp, open(os.devnull, "w") as devnull:
+        key_file = os.path.join(tmp, "keys.txt")
+        with open(key_file, "w", encoding="utf-8") as f:
+            f.write("sk-bench-0001\nsk-bench-0002\n")
+
+        sys.stdout = devnull
+        try:
+            results = asyncio.run(run(args, key_file))
+        finally:
+            sys.stdout = stdout
+
+    baseline = statistics.median(results["off"])
+    print(f"{'模式':<10}{'中位数(µs)':>12}{'最好(µs)':>12}{'相对 off':>12}")
+    for mode, runs in results.items():
+        median = statistics.median(runs)
+        print(f"{mode:<10}{median:>12.1f}{min(runs):>12.1f}{median - baseline:>+12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,353 @@
+"""
+代理开销基准测试
+
+启动模拟上游（benchmarks.mock_upstream）和真实的代理服务进程（python main.py，上游指向模拟服务），
+以不同并发度发起闭环负载（每个并发连接收到响应后立即发下一个请求），分别测量非流式和流式请求的
+吞吐量、延迟 p50/p95/p99，流式另测首 token 延迟（TTFT）。加 --direct 时对模拟上游直接施加同样的负载
+作为基线，两者之差即代理本身的开销。--profiles 依次以各服务器引擎档位（server.engine.PROFILES）启动代理，
+用于对比事件循环、HTTP 解析器、worker 数和 SO_REUSEPORT 的影响，结果中的目标记为 proxy:<档位>。
+
+结果写入 JSON 文件（含 git 提交、机器信息和全部参数），--compare 与之前的结果逐项对比，用于提交之间的回归比较。
+负载发生器与被测服务运行在同一台机器上，高并发时负载发生器本身可能成为瓶颈，对比结果时保持并发度和机器一致。
+
+运行方式:
+    python -m benchmarks.bench_proxy
+    python -m benchmarks.bench_proxy --concurrency 1,16,64 --duration 10 --direct
+    python -m benchmarks.bench_proxy --ttft 0.2 --tokens-per-second 50 --compare benchmarks/results/proxy-abc1234.json
+    python -m benchmarks.bench_proxy --profiles default,performance --workers 0
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = ROOT / "benchmarks" / "results"
+MODES = ("nonstream", "stream")
+
+
+def percentile(values: list, pct: float) -> float:
+    """计算百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(len(ordered) * pct / 100), len(ordered) - 1)
+    return ordered[index]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """延迟统计（毫秒）"""
+    if not values:
+        return {}
+    return {
+        "mean": round(statistics.fmean(values), 2),
+        "p50": round(percentile(values, 50), 2),
+        "p95": round(percentile(values, 95), 2),
+        "p99": round(percentile(values, 99), 2),
+        "max": round(max(values), 2)
+    }
+
+
+def free_port() -> int:
+    """获取一个空闲端口"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def git_revision() -> Dict[str, Optional[str]]:
+    """当前 git 提交及工作区是否有未提交修改"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, capture_output=True, text=True
+        ).stdout.strip())
+        return {"commit": commit, "dirty": dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+
+async def wait_ready(url: str, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    """等待服务可以响应请求"""
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"服务进程已退出: {' '.join(process.args)}")
+            try:
+                if (await client.get(url, timeout=1.0)).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"等待服务就绪超时: {url}")
+
+
+def start_mock(args, port: int) -> subprocess.Popen:
+    """启动模拟上游进程"""
+    return subprocess.Popen([
+        sys.executable, "-m", "benchmarks.mock_upstream", "--port", str(port),
+        "--latency", str(args.latency), "--ttft", str(args.ttft),
+        "--tokens-per-second", str(args.tokens_per_second),
+        "--chunk-tokens", str(args.chunk_tokens), "--completion-tokens", str(args.completion_tokens)
+    ], cwd=ROOT)
+
+
+def start_proxy(
+    args,
+    port: int,
+    upstream_port: int,
+    key_file: str,
+    extra_env: Optional[Dict[str, str]] = None,
+    output=None,
+    profile: str = "default"
+) -> subprocess.Popen:
+    """
+    启动代理服务进程（准入和客户端限流放宽到不影响测量）
+
+    Args:
+        extra_env: 覆盖其他配置的环境变量
+        output: 代理日志输出的文件对象，省略时输出到控制台
+        profile: 服务器引擎档位；args.workers 为 None 时 worker 数由档位决定
+    """
+    env = {
+        **os.environ,
+        "HOST": "127.0.0.1",
+        "PORT": str(port),
+        "SERVER_PROFILE": profile,
+        "MEGALLM_BASE_URL": f"http://127.0.0.1:{upstream_port}/v1",
+        "KEY_FILE_PATH": key_file,
+        "LOG_LEVEL": args.log_level,
+        "LOG_FILE": "",
+        "ADMISSION_MAX_CONCURRENCY": "100000",
+        "ADMISSION_MAX_QUEUE_SIZE": "100000",
+        "CLIENT_AUTH_REQUIRED": "false",
+        "CLIENT_DEFAULT_RPM": "0",
+        "CLIENT_DEFAULT_TPM": "0",
+        **(extra_env or {})
+    }
+    if args.workers is not None:
+        env["WORKERS"] = str(args.workers)
+    return subprocess.Popen(
+        [sys.executable, "main.py"],
+        cwd=ROOT, env=env, stdout=output, stderr=subprocess.STDOUT if output is not None else None
+    )
+
+
+def stop_process(process: subprocess.Popen, timeout: float = 30.0) -> None:
+    """终止进程并等待退出（代理会先排空进行中的请求），超时后强制结束"""
+    process.terminate()
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+async def one_request(client: httpx.AsyncClient, payload: dict, stream: bool) -> tuple:
+    """
+    发送一个请求
+
+    Returns:
+        (总耗时 ms, 首 token 耗时 ms 或 None)；失败时抛出异常
+    """
+    started = time.perf_counter()
+    if not stream:
+        response = await client.post("/v1/chat/completions", json=payload)
+        response.raise_for_status()
+        return (time.perf_counter() - started) * 1000, None
+
+    first_token = None
+    async with client.stream("POST", "/v1/chat/completions", json=payload) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes():
+            if first_token is None and b'"content":"' in chunk and b'"content":""' not in chunk:
+                first_token = (time.perf_counter() - started) * 1000
+    return (time.perf_counter() - started) * 1000, first_token
+
+
+async def run_level(base_url: str, mode: str, concurrency: int, args) -> dict:
+    """以固定并发度运行闭环负载（先预热，再测量 duration 秒）"""
+    stream = mode == "stream"
+    payload = {
+        "model": args.model,
+        "messages": [{"role": "user", "content": "Write a short poem about benchmarks."}],
+        "stream": stream
+    }
+    latencies: List[float] = []
+    ttfts: List[float] = []
+    errors: Dict[str, int] = {}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+        loop = asyncio.get_running_loop()
+        measure_from = loop.time() + args.warmup
+        stop_at = measure_from + args.duration
+
+        async def worker():
+            while loop.time() < stop_at:
+                issued = loop.time()
+                try:
+                    total, first_token = await one_request(client, payload, stream)
+                except Exception as e:
+                    if issued >= measure_from:
+                        name = type(e).__name__
+                        errors[name] = errors.get(name, 0) + 1
+                    continue
+                if issued >= measure_from:
+                    latencies.append(total)
+                    if first_token is not None:
+                        ttfts.append(first_token)
+
+        started = loop.time()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = loop.time() - max(started, measure_from)
+
+    result = {
+        "mode": mode,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        "latency_ms": summarize(latencies)
+    }
+    if stream:
+        result["ttft_ms"] = summarize(ttfts)
+    return result
+
+
+def compare(current: dict, baseline_path: str) -> None:
+    """逐项对比当前结果与之前的结果（吞吐量越高越好，延迟越低越好）"""
+    baseline = json.loads(Path(baseline_path).read_text(encoding="utf-8"))
+    previous = {(r["target"], r["mode"], r["concurrency"]): r for r in baseline["results"]}
+    print(f"\n对比 {baseline_path}（提交 {baseline['meta'].get('commit')}）:")
+    print(f"{'目标':<22}{'模式':<11}{'并发':>6}{'吞吐':>10}{'p50':>10}{'p99':>10}")
+
+    def delta(now: float, before: float) -> str:
+        return f"{(now - before) / before * 100:+.1f}%" if before else "n/a"
+
+    for result in current["results"]:
+        old = previous.get((result["target"], result["mode"], result["concurrency"]))
+        if old is None or not result["latency_ms"] or not old["latency_ms"]:
+            continue
+        print(
+            f"{result['target']:<22}{result['mode']:<11}{result['concurrency']:>6}"
+            f"{delta(result['throughput_rps'], old['throughput_rps']):>10}"
+            f"{delta(result['latency_ms']['p50'], old['latency_ms']['p50']):>10}"
+            f"{delta(result['latency_ms']['p99'], old['latency_ms']['p99']):>10}"
+        )
+
+
+async def run(args) -> dict:
+    """启动服务并依次运行各场景"""
+    mock_port = free_port()
+    results = []
+
+    async def run_target(target: str, base_url: str) -> None:
+        for mode in args.modes:
+            for concurrency in args.concurrency:
+                result = {"target": target, **await run_level(base_url, mode, concurrency, args)}
+                results.append(result)
+                latency = result["latency_ms"]
+                print(
+                    f"{target:<22}{mode:<11}{concurrency:>6}{result['throughput_rps']:>10.1f}"
+                    f"{latency.get('p50', 0):>10.1f}{latency.get('p95', 0):>10.1f}{latency.get('p99', 0):>10.1f}"
+                    f"{result.get('ttft_ms', {}).get('p50', 0):>10.1f}{sum(result['errors'].values()):>8}",
+                    flush=True
+                )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        key_file = os.path.join(tmp, "keys.txt")
+        with open(key_file, "w", encoding="utf-8") as f:
+            f.write("".join(f"sk-bench-{i:04d}\n" for i in range(args.keys)))
+
+        mock = start_mock(args, mock_port)
+        try:
+            await wait_ready(f"http://127.0.0.1:{mock_port}/v1/models", mock)
+            if args.direct:
+                await run_target("direct", f"http://127.0.0.1:{mock_port}")
+
+            # 各档位依次单独运行，避免多个代理争用 CPU
+            for profile in args.profiles:
+                proxy_port = free_port()
+                proxy = start_proxy(args, proxy_port, mock_port, key_file, profile=profile)
+                try:
+                    await wait_ready(f"http://127.0.0.1:{proxy_port}/health", proxy)
+                    target = "proxy" if len(args.profiles) == 1 else f"proxy:{profile}"
+                    await run_target(target, f"http://127.0.0.1:{proxy_port}")
+                finally:
+                    stop_process(proxy)
+        finally:
+            stop_process(mock)
+
+    return {
+        "meta": {
+            **git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+        },
+        "results": results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="代理开销基准测试")
+    parser.add_argument("--concurrency", default="1,8,32,128", help="并发度列表，逗号分隔")
+    parser.add_argument("--modes", default=",".join(MODES), help="nonstream / stream，逗号分隔")
+    parser.add_argument("--duration", type=float, default=10.0, help="每个场景的测量时长（秒）")
+    parser.add_argument("--warmup", type=float, default=2.0, help="每个场景的预热时长（秒，不计入结果）")
+    parser.add_argument("--timeout", type=float, default=60.0, help="单个请求超时（秒）")
+    parser.add_argument("--direct", action="store_true", help="同时直接压测模拟上游作为基线")
+    parser.add_argument("--profiles", default="default", help="服务器引擎档位列表，逗号分隔: default / performance")
+    parser.add_argument("--workers", type=int, help="代理 worker 进程数（默认由档位决定，0 表示按 CPU 配额）")
+    parser.add_argument("--keys", type=int, default=8, help="密钥数量")
+    parser.add_argument("--model", default="openai-gpt-oss-120b")
+    parser.add_argument("--log-level", default="WARNING", help="代理日志级别")
+    parser.add_argument("--latency", type=float, default=0.0, help="模拟上游响应头延迟（秒）")
+    parser.add_argument("--ttft", type=float, default=0.05, help="模拟上游首 token 延迟（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="模拟上游生成速度，0 表示不限速")
+    parser.add_argument("--chunk-tokens", type=int, default=1, help="模拟上游每个分块的 token 数")
+    parser.add_argument("--completion-tokens", type=int, default=64, help="模拟上游响应 token 数")
+    parser.add_argument("--output", help="结果文件路径（默认 benchmarks/results/proxy-<提交>.json）")
+    parser.add_argument("--compare", help="与之前的结果文件对比")
+    args = parser.parse_args()
+    args.concurrency = [int(value) for value in args.concurrency.split(",") if value]
+    args.modes = [value for value in args.modes.split(",") if value]
+    for mode in args.modes:
+        if mode not in MODES:
+            parser.error(f"不支持的模式: {mode}")
+    args.profiles = [value for value in args.profiles.split(",") if value]
+    if not args.profiles:
+        parser.error("至少需要一个服务器档位")
+
+    print(f"{'目标':<8}{'模式':<11}{'并发':>6}{'吞吐/s':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'TTFT50':>10}{'错误':>8}")
+    report = asyncio.run(run(args))
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"proxy-{report['meta']['commit'] or 'unknown'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"\n结果已写入 {output}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Server-Timing 计时开销基准测试
+
+1. 单次 phase() 调用在 未启用 / 启用 时的耗时
+2. 一个记录与聊天补全路由相同数量阶段的 FastAPI 路由，在 启用 / 未启用 中间件时的单请求耗时差
+
+运行方式:
+    python -m benchmarks.bench_server_timing
+    python -m benchmarks.bench_server_timing --requests 20000
+"""
+import argparse
+import asyncio
+import time
+import timeit
+
+import httpx
+from fastapi import FastAPI
+
+from api.middleware import ServerTimingMiddleware
+from core.timing import phase, reset_timer, start_timer
+
+# 聊天补全路由中记录的阶段
+PHASES = ("client", "tokens", "admission", "key", "upstream", "body")
+
+
+def bench_phase_call(number: int) -> dict:
+    """单次 phase() 调用耗时（纳秒）"""
+    def run():
+        with phase("tokens"):
+            pass
+
+    disabled = timeit.timeit(run, number=number) / number * 1e9
+
+    _, token = start_timer()
+    try:
+        enabled = timeit.timeit(run, number=number) / number * 1e9
+    finally:
+        reset_timer(token)
+
+    return {"disabled_ns": round(disabled, 1), "enabled_ns": round(enabled, 1)}
+
+
+def build_app(enabled: bool) -> FastAPI:
+    """构建测试应用"""
+    app = FastAPI()
+
+    @app.get("/ping")
+    async def ping():
+        for name in PHASES:
+            with phase(name):
+                pass
+        return {"ok": True}
+
+    if enabled:
+        app.add_middleware(ServerTimingMiddleware)
+    return app
+
+
+async def bench_requests(enabled: bool, requests: int) -> float:
+    """单请求平均耗时（微秒）"""
+    transport = httpx.ASGITransport(app=build_app(enabled))
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for _ in range(200):
+            await client.get("/ping")
+
+        started = time.perf_counter()
+        for _ in range(requests):
+            await client.get("/ping")
+        return (time.perf_counter() - started) / requests * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server-Timing 计时开销基准测试")
+    parser.add_argument("--requests", type=int, default=5000, help="每种模式的请求数")
+    parser.add_argument("--rounds", type=int, default=3, help="交替运行轮数")
+    parser.add_argument("--calls", type=int, default=1_000_000, help="phase() 微基准调用次数")
+    args = parser.parse_args()
+
+    calls = bench_phase_call(args.calls)
+    print(f"phase() 单次调用: 未启用 {calls['disabled_ns']}ns, 启用 {calls['enabled_ns']}ns\n")
+
+    # 交替运行多轮取最好成绩，减少预热和机器噪声的影响
+    disabled_runs, enabled_runs = [], []
+    for _ in range(args.rounds):
+        disabled_runs.append(asyncio.run(bench_requests(False, args.requests)))
+        enabled_runs.append(asyncio.run(bench_requests(True, args.requests)))
+    disabled, enabled = min(disabled_runs), min(enabled_runs)
+    print(f"{'模式':<10}{'单请求耗时(µs)':>16}")
+    print(f"{'未启用':<10}{disabled:>16.1f}")
+    print(f"{'启用':<10}{enabled:>16.1f}")
+    print(f"\n中间件 + {len(PHASES)} 个阶段的额外开销: {enabled - disabled:.1f}µs/请求")
+
+
+if __name__ == '__main__':
+    main()
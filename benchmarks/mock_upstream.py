@@ -0,0 +1,403 @@
+"""
+模拟 MegaLLM 上游服务 - 用于代理基准测试和本地联调（不消耗真实额度）
+
+实现 OpenAI 兼容的 POST /v1/chat/completions（流式/非流式）和 GET /v1/models，响应时间按以下参数模拟:
+
+    latency            收到请求到返回响应头的延迟（秒，模拟网络往返和排队）
+    ttft               首 token 延迟（秒；流式在响应头之后等待，非流式计入总耗时）
+    tokens_per_second  生成速度，0 表示不限速
+    chunk_tokens       流式响应每个 SSE 分块包含的 token 数
+    completion_tokens  响应 token 数（请求的 max_tokens 更小时以其为准）
+
+每个 token 为一个单词加空格，流式分块按相对请求开始的绝对时间发送，不会因调度误差累积漂移。
+只使用 Starlette 路由，序列化尽量简单，降低模拟服务本身占用的 CPU 对被测代理的影响。
+
+故障注入: 按故障计划（JSON 规则列表）对匹配的请求注入故障，每条规则的字段:
+
+    fault              HTTP 状态码（如 401 / 429 / 503），或 reset（不返回响应直接重置连接）、
+                       drop（响应中途断开）、slow（按 bytes_per_second 慢速发送响应，slow-loris）
+    keys               只对这些密钥生效（Authorization 中的完整密钥），省略表示全部密钥
+    start / end        生效时间窗口（相对计划开始的秒数），end 省略表示一直生效
+    rate               命中比例（0-1），默认 1
+    retry_after        429 响应的 Retry-After 头（秒）
+    after_chunks       drop: 断开前发送的响应分块数（最后一个分块只发送一半），默认 2
+    bytes_per_second   slow: 发送速度，默认 100
+
+多条规则按顺序匹配，第一条命中的生效。计划可在启动时用 --faults 从文件加载，或运行时通过
+PUT /mock/faults 替换（同时重新计时并清空统计）；GET /mock/stats 返回按密钥和结果统计的上游调用次数。
+
+运行方式:
+    python -m benchmarks.mock_upstream --port 9000 --ttft 0.2 --tokens-per-second 50
+    python -m benchmarks.mock_upstream --port 9000 --faults faults.json
+    MEGALLM_BASE_URL=http://127.0.0.1:9000/v1 python main.py
+"""
+import argparse
+import asyncio
+import json
+import random
+import socket
+import struct
+import time
+from typing import Any, Dict, List, Optional
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+DEFAULT_MODELS = ("openai-gpt-oss-120b", "gpt-4o", "claude-sonnet-4")
+
+# 非 HTTP 状态码的故障类型
+CONNECTION_FAULTS = ("reset", "drop", "slow")
+
+
+def _usage(body: Dict[str, Any], completion_tokens: int) -> Dict[str, int]:
+    """按消息字符数粗略估算 prompt token 数"""
+    chars = sum(len(str(message.get("content") or "")) for message in body.get("messages") or [])
+    prompt_tokens = max(chars // 4, 1)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens
+    }
+
+
+class FaultSchedule:
+    """故障计划: 按时间窗口、密钥和比例匹配请求，并统计每个密钥的调用结果"""
+
+    def __init__(self, rules: Optional[List[Dict[str, Any]]] = None, seed: Optional[int] = None):
+        """
+        Args:
+            rules: 故障规则列表（字段见模块说明）
+            seed: 随机数种子（rate < 1 时决定哪些请求命中）
+
+        Raises:
+            ValueError: 规则不合法时
+        """
+        self.rules = [self._validate(rule) for rule in rules or []]
+        self._random = random.Random(seed)
+        self.started = time.monotonic()
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    @staticmethod
+    def _validate(rule: Dict[str, Any]) -> Dict[str, Any]:
+        fault = rule.get("fault")
+        if not (fault in CONNECTION_FAULTS or (isinstance(fault, int) and 400 <= fault <= 599)):
+            raise ValueError(f"不支持的故障类型: {fault}，可选值: HTTP 状态码 400-599、{', '.join(CONNECTION_FAULTS)}")
+        if not 0 <= rule.get("rate", 1) <= 1:
+            raise ValueError(f"故障命中比例必须在 0-1 之间: {rule.get('rate')}")
+        keys = rule.get("keys")
+        return {**rule, "keys": frozenset(keys) if keys else None}
+
+    def match(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        查找当前请求命中的故障规则
+
+        Args:
+            key: 请求使用的密钥
+
+        Returns:
+            命中的规则，未命中时返回 None
+        """
+        elapsed = time.monotonic() - self.started
+        for rule in self.rules:
+            if rule["keys"] is not None and key not in rule["keys"]:
+                continue
+            if elapsed < rule.get("start", 0) or (rule.get("end") is not None and elapsed >= rule["end"]):
+                continue
+            if self._random.random() < rule.get("rate", 1):
+                return rule
+        return None
+
+    def record(self, key: str, outcome: str) -> None:
+        """记录一次上游调用的结果（ok 或故障类型）"""
+        by_key = self.stats.setdefault(key, {})
+        by_key[outcome] = by_key.get(outcome, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """统计快照: 总调用数、按结果和按密钥的调用数"""
+        by_outcome: Dict[str, int] = {}
+        for counts in self.stats.values():
+            for outcome, count in counts.items():
+                by_outcome[outcome] = by_outcome.get(outcome, 0) + count
+        return {
+            "elapsed": round(time.monotonic() - self.started, 3),
+            "calls": sum(by_outcome.values()),
+            "by_outcome": by_outcome,
+            "by_key": {key: dict(counts) for key, counts in self.stats.items()}
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "elapsed": round(time.monotonic() - self.started, 3),
+            "faults": [{**rule, "keys": sorted(rule["keys"]) if rule["keys"] else None} for rule in self.rules]
+        }
+
+
+async def _abort_connection(send) -> None:
+    """
+    立即重置客户端连接（SO_LINGER=0 后 abort，对端收到 RST）
+
+    uvicorn 传给应用的 send 是绑定到连接的方法，可从中取得 transport；在其他服务器或测试传输层中
+    拿不到 transport 时抛出 ConnectionResetError。
+    """
+    transport = getattr(getattr(send, "__self__", None), "transport", None)
+    if transport is None:
+        raise ConnectionResetError("模拟上游重置连接")
+    sock = transport.get_extra_info("socket")
+    if sock is not None:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+    transport.abort()
+    # 让 uvicorn 处理连接断开（标记 disconnected 后不再尝试发送 500 响应）
+    await asyncio.sleep(0)
+
+
+class FaultInjector:
+    """
+    故障注入中间件（纯 ASGI，放在最外层以便拿到服务器原始的 send）
+
+    只作用于 POST /v1/chat/completions；HTTP 错误直接返回错误响应，reset / drop / slow 改写响应的发送过程。
+    """
+
+    def __init__(self, app, schedule: FaultSchedule):
+        self.app = app
+        self.schedule = schedule
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != "/v1/chat/completions":
+            await self.app(scope, receive, send)
+            return
+
+        key = ""
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                key = value.decode("latin-1").removeprefix("Bearer ").strip()
+                break
+
+        rule = self.schedule.match(key)
+        fault = rule["fault"] if rule is not None else None
+        self.schedule.record(key, "ok" if fault is None else str(fault))
+
+        if fault is None:
+            await self.app(scope, receive, send)
+        elif isinstance(fault, int):
+            await self._error(fault, rule, send)
+        elif fault == "reset":
+            await _abort_connection(send)
+        elif fault == "drop":
+            await self._drop(scope, receive, send, rule.get("after_chunks", 2))
+        else:
+            await self._slow(scope, receive, send, rule.get("bytes_per_second", 100))
+
+    @staticmethod
+    async def _error(status: int, rule: Dict[str, Any], send) -> None:
+        error_types = {401: "authentication_error", 429: "rate_limit_exceeded"}
+        body = json.dumps({"error": {
+            "message": f"mock upstream injected {status}",
+            "type": error_types.get(status, "server_error" if status >= 500 else "invalid_request_error"),
+            "code": status
+        }}).encode()
+        headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        if status == 429 and rule.get("retry_after") is not None:
+            headers.append((b"retry-after", str(rule["retry_after"]).encode()))
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+    async def _drop(self, scope, receive, send, after_chunks: int) -> None:
+        state = {"chunks": 0, "dropped": False}
+
+        async def dropping_send(message):
+            if state["dropped"]:
+                return
+            if message["type"] == "http.response.body":
+                body = message.get("body", b"")
+                if not body and message.get("more_body", False):
+                    return
+                if state["chunks"] >= after_chunks or not message.get("more_body", False):
+                    state["dropped"] = True
+                    await send({"type": "http.response.body", "body": body[:len(body) // 2], "more_body": True})
+                    await _abort_connection(send)
+                    return
+                state["chunks"] += 1
+            await send(message)
+
+        async def dropping_receive():
+            if state["dropped"]:
+                return {"type": "http.disconnect"}
+            return await receive()
+
+        await self.app(scope, dropping_receive, dropping_send)
+
+    async def _slow(self, scope, receive, send, bytes_per_second: float) -> None:
+        interval = 0.1
+        piece = max(int(bytes_per_second * interval), 1)
+
+        async def slow_send(message):
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            for offset in range(0, len(body), piece):
+                await asyncio.sleep(interval)
+                last = offset + piece >= len(body)
+                await send({
+                    "type": "http.response.body",
+                    "body": body[offset:offset + piece],
+                    "more_body": more_body or not last
+                })
+            if not body:
+                await send(message)
+
+        await self.app(scope, receive, slow_send)
+
+
+def create_app(
+    latency: float = 0.0,
+    ttft: float = 0.05,
+    tokens_per_second: float = 100.0,
+    chunk_tokens: int = 1,
+    completion_tokens: int = 64,
+    schedule: Optional[FaultSchedule] = None
+):
+    """
+    创建模拟上游应用
+
+    Args:
+        latency: 响应头延迟（秒）
+        ttft: 首 token 延迟（秒）
+        tokens_per_second: 生成速度（token/秒），0 表示不限速
+        chunk_tokens: 流式每个分块的 token 数
+        completion_tokens: 默认响应 token 数
+        schedule: 故障计划，省略表示不注入故障
+
+    Returns:
+        ASGI 应用（外层为故障注入中间件）
+    """
+    injector = None
+    chunk_tokens = max(chunk_tokens, 1)
+    token_interval = 1 / tokens_per_second if tokens_per_second > 0 else 0.0
+
+    def token_count(body: Dict[str, Any]) -> int:
+        max_tokens = body.get("max_tokens")
+        return min(completion_tokens, max_tokens) if max_tokens else completion_tokens
+
+    async def chat_completions(request: Request) -> Response:
+        started = time.perf_counter()
+        body = json.loads(await request.body())
+        model = body.get("model", DEFAULT_MODELS[0])
+        tokens = token_count(body)
+        completion_id = f"chatcmpl-mock-{time.time_ns():x}"
+        created = int(time.time())
+
+        if latency > 0:
+            await asyncio.sleep(latency)
+
+        if not body.get("stream"):
+            remaining = started + latency + ttft + tokens * token_interval - time.perf_counter()
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+            return JSONResponse({
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "token " * tokens},
+                    "finish_reason": "stop"
+                }],
+                "usage": _usage(body, tokens)
+            })
+
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+        prefix = (
+            f'{{"id":"{completion_id}","object":"chat.completion.chunk","created":{created},'
+            f'"model":{json.dumps(model)},"choices":[{{"index":0,"delta":'
+        )
+
+        async def events():
+            first_token_at = started + latency + ttft
+            yield f'data: {prefix}{{"role":"assistant","content":""}},"finish_reason":null}}]}}\n\n'.encode()
+            sent = 0
+            while sent < tokens:
+                count = min(chunk_tokens, tokens - sent)
+                delay = first_token_at + (sent + count - 1) * token_interval - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                sent += count
+                yield f'data: {prefix}{{"content":"{"token " * count}"}},"finish_reason":null}}]}}\n\n'.encode()
+            yield f'data: {prefix}{{}},"finish_reason":"stop"}}]}}\n\n'.encode()
+            if include_usage:
+                usage = json.dumps({
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created,
+                    "model": model, "choices": [], "usage": _usage(body, tokens)
+                })
+                yield f"data: {usage}\n\n".encode()
+            yield b"data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    async def list_models(request: Request) -> Response:
+        return JSONResponse({
+            "object": "list",
+            "data": [{"id": model, "object": "model", "created": 0, "owned_by": "mock"} for model in DEFAULT_MODELS]
+        })
+
+    async def get_faults(request: Request) -> Response:
+        return JSONResponse(injector.schedule.to_dict())
+
+    async def put_faults(request: Request) -> Response:
+        body = json.loads(await request.body() or b"{}")
+        try:
+            injector.schedule = FaultSchedule(body.get("faults"), seed=body.get("seed"))
+        except ValueError as e:
+            return JSONResponse({"error": {"message": str(e), "type": "invalid_request_error"}}, status_code=400)
+        return JSONResponse(injector.schedule.to_dict())
+
+    async def get_stats(request: Request) -> Response:
+        return JSONResponse(injector.schedule.snapshot())
+
+    app = Starlette(routes=[
+        Route("/v1/chat/completions", chat_completions, methods=["POST"]),
+        Route("/v1/models", list_models, methods=["GET"]),
+        Route("/mock/faults", get_faults, methods=["GET"]),
+        Route("/mock/faults", put_faults, methods=["PUT"]),
+        Route("/mock/stats", get_stats, methods=["GET"]),
+    ])
+    injector = FaultInjector(app, schedule or FaultSchedule())
+    return injector
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟 MegaLLM 上游服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=0.0, help="响应头延迟（秒）")
+    parser.add_argument("--ttft", type=float, default=0.05, help="首 token 延迟（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=100.0, help="生成速度，0 表示不限速")
+    parser.add_argument("--chunk-tokens", type=int, default=1, help="流式每个分块的 token 数")
+    parser.add_argument("--completion-tokens", type=int, default=64, help="响应 token 数")
+    parser.add_argument("--faults", help="故障计划 JSON 文件（规则列表，或含 faults / seed 字段的对象）")
+    parser.add_argument("--seed", type=int, help="故障命中的随机数种子")
+    args = parser.parse_args()
+
+    schedule = None
+    if args.faults:
+        with open(args.faults, encoding="utf-8") as f:
+            plan = json.load(f)
+        if isinstance(plan, list):
+            plan = {"faults": plan}
+        schedule = FaultSchedule(plan.get("faults"), seed=args.seed if args.seed is not None else plan.get("seed"))
+
+    app = create_app(
+        latency=args.latency,
+        ttft=args.ttft,
+        tokens_per_second=args.tokens_per_second,
+        chunk_tokens=args.chunk_tokens,
+        completion_tokens=args.completion_tokens,
+        schedule=schedule
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == '__main__':
+    main()
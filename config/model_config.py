@@ -35,6 +35,60 @@ MODEL_CONTEXT_LIMITS: Dict[str, int] = {
 # 默认上下文长度（用于未知模型）
 DEFAULT_CONTEXT_LIMIT = 128_000
 
+# 模型单次最大输出长度配置（单位：tokens）
+MODEL_MAX_OUTPUT_TOKENS: Dict[str, int] = {
+    # OpenAI GPT 系列
+    "openai-gpt-oss-20b": 32_768,
+    "openai-gpt-oss-120b": 32_768,
+
+    # Llama 系列
+    "llama3.3-70b-instruct": 8_192,
+    "llama3-8b-instruct": 4_096,
+
+    # DeepSeek 系列
+    "deepseek-r1-distill-llama-70b": 32_768,
+    "deepseek-ai/deepseek-v3.1-terminus": 65_536,
+    "deepseek-ai/deepseek-v3.1": 32_768,
+
+    # Qwen 系列
+    "alibaba-qwen3-32b": 32_768,
+    "qwen/qwen3-next-80b-a3b-instruct": 32_768,
+
+    # Moonshot 系列
+    "moonshotai/kimi-k2-instruct-0905": 16_384,
+
+    # Mistral 系列
+    "mistralai/mistral-nemotron": 32_768,
+
+    # MiniMax 系列
+    "minimaxai/minimax-m2": 32_768,
+}
+
+# 默认最大输出长度（用于未知模型）
+DEFAULT_MAX_OUTPUT_TOKENS = 32_768
+
+# 未指定 max_tokens 时为响应预留的 token 数（不超过模型最大输出长度）
+DEFAULT_RESPONSE_RESERVE_TOKENS = 1_024
+
+# 按模型覆盖的分阶段超时（单位：秒），未配置的阶段使用全局默认值
+#   connect / pool / first_byte / idle / total
+MODEL_TIMEOUT_OVERRIDES: Dict[str, Dict[str, float]] = {
+    # 推理模型首个 token 前可能长时间思考
+    "deepseek-r1-distill-llama-70b": {"first_byte": 180.0, "total": 600.0},
+    "deepseek-ai/deepseek-v3.1-terminus": {"total": 300.0},
+}
+
+# 上下文超限时的自动裁剪策略（按模型配置，未配置的模型使用全局默认值）
+#   none: 不裁剪，直接返回 context_length_exceeded
+#   drop_oldest: 丢弃最早的非 system 消息
+#   truncate_oldest: 截断最早的非 system 消息内容，不足时再整条丢弃
+TRIM_POLICIES = ("none", "drop_oldest", "truncate_oldest")
+
+MODEL_TRIM_POLICIES: Dict[str, str] = {}
+
+# 截断消息时追加的标记
+TRUNCATION_MARKER = "…[已截断]"
+
 
 def get_model_context_limit(model: str) -> int:
     """
@@ -49,6 +103,67 @@ def get_model_context_limit(model: str) -> int:
     return MODEL_CONTEXT_LIMITS.get(model, DEFAULT_CONTEXT_LIMIT)
 
 
+def get_model_max_output_tokens(model: str) -> int:
+    """
+    获取指定模型的单次最大输出长度
+
+    Args:
+        model: 模型名称
+
+    Returns:
+        最大输出长度（tokens）
+    """
+    return MODEL_MAX_OUTPUT_TOKENS.get(model, DEFAULT_MAX_OUTPUT_TOKENS)
+
+
+def get_prompt_budget(model: str, max_tokens: Optional[int] = None) -> int:
+    """
+    计算留给输入消息的 token 预算：上下文长度 - 输出预留
+
+    Args:
+        model: 模型名称
+        max_tokens: 请求的最大输出 token 数，未指定时预留 DEFAULT_RESPONSE_RESERVE_TOKENS
+
+    Returns:
+        输入 token 预算
+    """
+    if max_tokens is None:
+        max_tokens = min(DEFAULT_RESPONSE_RESERVE_TOKENS, get_model_max_output_tokens(model))
+
+    return get_model_context_limit(model) - max_tokens
+
+
+def get_model_timeouts(model: str, defaults: Dict[str, float]) -> Dict[str, float]:
+    """
+    获取指定模型的分阶段超时
+
+    Args:
+        model: 模型名称
+        defaults: 全局默认超时
+
+    Returns:
+        合并后的超时配置
+    """
+    overrides = MODEL_TIMEOUT_OVERRIDES.get(model)
+    if not overrides:
+        return defaults
+    return {**defaults, **overrides}
+
+
+def get_model_trim_policy(model: str, default: str = "none") -> str:
+    """
+    获取指定模型的上下文裁剪策略
+
+    Args:
+        model: 模型名称
+        default: 模型未配置时使用的策略
+
+    Returns:
+        裁剪策略
+    """
+    return MODEL_TRIM_POLICIES.get(model, default)
+
+
 def estimate_tokens(text: str) -> int:
     """
     估算文本的 token 数量
@@ -96,13 +211,18 @@ def calculate_messages_tokens(messages: list) -> int:
     return total_tokens
 
 
-def check_context_limit(model: str, messages: list) -> tuple[bool, int, int]:
+def check_context_limit(
+    model: str,
+    messages: list,
+    max_tokens: Optional[int] = None
+) -> tuple[bool, int, int]:
     """
-    检查消息是否超出模型上下文限制
+    检查 输入估算 + 请求输出 是否超出模型上下文限制
 
     Args:
         model: 模型名称
         messages: 消息列表
+        max_tokens: 请求的最大输出 token 数
 
     Returns:
         (是否超限, 当前tokens数, 上限tokens数)
@@ -110,15 +230,108 @@ def check_context_limit(model: str, messages: list) -> tuple[bool, int, int]:
     context_limit = get_model_context_limit(model)
     current_tokens = calculate_messages_tokens(messages)
 
-    # 预留 10% 空间给响应和系统提示
-    usable_limit = int(context_limit * 0.9)
-
-    is_exceeded = current_tokens > usable_limit
+    is_exceeded = current_tokens > get_prompt_budget(model, max_tokens)
 
     return is_exceeded, current_tokens, context_limit
 
 
-def get_context_exceeded_error(model: str, current_tokens: int, limit: int) -> dict:
+def check_max_tokens_limit(model: str, max_tokens: Optional[int]) -> tuple[bool, int]:
+    """
+    检查请求的 max_tokens 是否超出模型单次最大输出长度
+
+    Args:
+        model: 模型名称
+        max_tokens: 请求的最大输出 token 数
+
+    Returns:
+        (是否超限, 最大输出长度)
+    """
+    max_output = get_model_max_output_tokens(model)
+    return max_tokens is not None and max_tokens > max_output, max_output
+
+
+def trim_messages_to_fit(
+    model: str,
+    messages: list,
+    max_tokens: Optional[int] = None,
+    policy: str = "drop_oldest"
+) -> tuple[list, dict]:
+    """
+    从最早的非 system 消息开始裁剪，直到估算 token 数不超过 (上下文长度 - 输出预留)
+
+    system 消息和最后一条消息不会被丢弃；truncate_oldest 策略下最后一条消息仍可被截断。
+
+    Args:
+        model: 模型名称
+        messages: 消息列表
+        max_tokens: 请求的最大输出 token 数
+        policy: 裁剪策略，drop_oldest 或 truncate_oldest
+
+    Returns:
+        (裁剪后的消息列表, 裁剪信息)
+    """
+    if policy not in TRIM_POLICIES or policy == "none":
+        raise ValueError(f"不支持的裁剪策略: {policy}")
+
+    budget = get_prompt_budget(model, max_tokens)
+
+    token_counts = [estimate_tokens(message.get("content", "")) + 4 for message in messages]
+    total_tokens = sum(token_counts)
+    original_tokens = total_tokens
+
+    trimmed = list(messages)
+    dropped = 0
+    truncated = 0
+    last_index = len(messages) - 1
+
+    for index, message in enumerate(messages):
+        if total_tokens <= budget:
+            break
+        if message.get("role") == "system":
+            continue
+
+        overflow = total_tokens - budget
+        content = message.get("content", "")
+        content_tokens = token_counts[index] - 4
+
+        if policy == "truncate_oldest" and content_tokens > overflow:
+            # 按字符/token 比例估算保留长度，保留开头部分
+            keep_tokens = content_tokens - overflow - estimate_tokens(TRUNCATION_MARKER)
+            keep_chars = int(len(content) * keep_tokens / content_tokens) if keep_tokens > 0 else 0
+            if keep_chars > 0:
+                new_content = content[:keep_chars] + TRUNCATION_MARKER
+                new_tokens = estimate_tokens(new_content) + 4
+                trimmed[index] = {**message, "content": new_content}
+                total_tokens += new_tokens - token_counts[index]
+                truncated += 1
+                continue
+
+        if index == last_index:
+            break
+
+        trimmed[index] = None
+        total_tokens -= token_counts[index]
+        dropped += 1
+
+    trimmed = [message for message in trimmed if message is not None]
+
+    return trimmed, {
+        "policy": policy,
+        "dropped_messages": dropped,
+        "truncated_messages": truncated,
+        "trimmed_tokens": original_tokens - total_tokens,
+        "tokens": total_tokens,
+        "budget": budget,
+        "fits": total_tokens <= budget
+    }
+
+
+def get_context_exceeded_error(
+    model: str,
+    current_tokens: int,
+    limit: int,
+    max_tokens: Optional[int] = None
+) -> dict:
     """
     生成上下文超限错误响应
 
@@ -126,20 +339,56 @@ def get_context_exceeded_error(model: str, current_tokens: int, limit: int) -> d
         model: 模型名称
         current_tokens: 当前 token 数
         limit: 上下文限制
+        max_tokens: 请求的最大输出 token 数
 
     Returns:
         错误响应字典
     """
+    prompt_budget = get_prompt_budget(model, max_tokens)
+    reserved_tokens = limit - prompt_budget
+
     return {
         "error": {
-            "message": f"对话上下文已超出模型 '{model}' 的限制。当前: {current_tokens:,} tokens，限制: {limit:,} tokens。请开始新的对话。",
+            "message": (
+                f"对话上下文已超出模型 '{model}' 的限制。当前: {current_tokens:,} tokens，"
+                f"输出预留: {reserved_tokens:,} tokens，限制: {limit:,} tokens。请开始新的对话或减小 max_tokens。"
+            ),
             "type": "context_length_exceeded",
             "code": "context_length_exceeded",
             "param": {
                 "model": model,
                 "current_tokens": current_tokens,
+                "max_tokens": max_tokens,
+                "reserved_tokens": reserved_tokens,
+                "prompt_budget": prompt_budget,
                 "limit": limit,
-                "usage_percentage": round((current_tokens / limit) * 100, 2)
+                "usage_percentage": round(((current_tokens + reserved_tokens) / limit) * 100, 2)
+            }
+        }
+    }
+
+
+def get_max_tokens_exceeded_error(model: str, max_tokens: int, max_output: int) -> dict:
+    """
+    生成 max_tokens 超出模型最大输出长度的错误响应
+
+    Args:
+        model: 模型名称
+        max_tokens: 请求的最大输出 token 数
+        max_output: 模型最大输出长度
+
+    Returns:
+        错误响应字典
+    """
+    return {
+        "error": {
+            "message": f"max_tokens 超出模型 '{model}' 的最大输出长度。请求: {max_tokens:,} tokens，限制: {max_output:,} tokens。",
+            "type": "invalid_request_error",
+            "code": "max_tokens_exceeded",
+            "param": {
+                "model": model,
+                "max_tokens": max_tokens,
+                "max_output_tokens": max_output
             }
         }
     }
@@ -158,7 +407,8 @@ def get_all_models_info() -> list[dict]:
         models_info.append({
             "id": model_id,
             "context_length": context_limit,
-            "context_length_formatted": f"{context_limit:,} tokens"
+            "context_length_formatted": f"{context_limit:,} tokens",
+            "max_output_tokens": get_model_max_output_tokens(model_id)
         })
 
     # 按上下文长度降序排序
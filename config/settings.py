@@ -13,23 +13,134 @@ class Settings(BaseSettings):
     app_version: str = "1.0.0"
     host: str = "0.0.0.0"
     port: int = 8000
-    workers: int = 1
+    workers: Optional[int] = None
     reload: bool = False
 
+    # 服务器引擎配置（python main.py 启动时生效）：SERVER_PROFILE 选择档位（default / performance），
+    # 以下各项及 WORKERS 未设置时使用档位的值，WORKERS=0 表示按 CPU 配额自动确定
+    server_profile: str = "default"
+    server_loop: Optional[str] = None
+    server_http: Optional[str] = None
+    server_reuse_port: Optional[bool] = None
+    server_backlog: Optional[int] = None
+    server_keepalive_timeout: Optional[int] = None
+
     # MegaLLM API配置
     megallm_base_url: str = "https://ai.megallm.io/v1"
     megallm_timeout: float = 120.0
     megallm_max_retries: int = 3
+    megallm_connect_timeout: float = 10.0
+    megallm_pool_timeout: float = 10.0
+    megallm_first_byte_timeout: float = 60.0
+    megallm_idle_timeout: float = 30.0
 
     # 密钥配置
     key_file_path: str = "data/keys.txt"
     max_key_retries: int = 3
 
+    # 上下文检查配置
+    context_check_offload_threshold: int = 262_144
+    context_check_pool_size: int = 2
+    context_check_executor: str = "thread"
+    context_trim_default: str = "none"
+
+    # 准入控制配置
+    admission_max_concurrency: int = 100
+    admission_model_concurrency: int = 0
+    admission_model_limits: dict = {}
+    admission_max_queue_size: int = 500
+    admission_max_queue_time: float = 10.0
+    admission_retry_after: int = 1
+
+    # 调度配置（加权公平队列）
+    scheduler_class_weights: dict = {"interactive": 8, "batch": 1}
+    scheduler_default_class: str = "interactive"
+    scheduler_per_key_concurrency: int = 0
+
+    # WebSocket 对话配置（/v1/chat/ws：历史保存在服务端，客户端每轮只发送新消息）
+    ws_enabled: bool = True
+    ws_max_sessions: int = 2000
+    ws_max_sessions_per_client: int = 20
+    ws_session_max_messages: int = 200
+    ws_session_max_chars: int = 200_000
+    ws_session_idle_timeout: float = 900.0
+    ws_max_frame_chars: int = 100_000
+    ws_context_trim: str = "drop_oldest"
+
+    # 扇出配置（n>1 拆分为 n 个并行的 n=1 上游请求）
+    fanout_enabled: bool = False
+
+    # 批处理任务配置
+    batch_storage_dir: str = "data/batches"
+    batch_concurrency_per_key: int = 4
+    batch_max_concurrency: int = 64
+    batch_checkpoint_interval: int = 100
+
+    # 客户端限流配置
+    client_config_path: str = "data/clients.json"
+    client_auth_required: bool = False
+    client_default_rpm: int = 0
+    client_default_tpm: int = 0
+    client_max_tracked: int = 10_000
+    client_trust_forwarded_for: bool = False
+
+    # Server-Timing 配置（响应头中输出各阶段耗时）
+    server_timing_enabled: bool = True
+
+    # 请求追踪配置（X-Request-ID、span 环形缓冲区、可选 OTLP JSON 导出）
+    tracing_enabled: bool = True
+    tracing_buffer_size: int = 1000
+    tracing_export_dir: str = ""
+    tracing_export_interval: float = 5.0
+
+    # 诊断配置（事件循环延迟监控、按需采样分析）
+    loop_lag_monitor_enabled: bool = True
+    loop_lag_interval: float = 0.1
+    loop_lag_threshold: float = 0.25
+    profiler_enabled: bool = False
+    profiler_max_duration: float = 60.0
+
+    # 启动预热配置（预建立上游连接、同步密钥状态、启动上下文检查池，完成后 /ready 返回 200）
+    warmup_enabled: bool = True
+    warmup_timeout: float = 15.0
+
+    # 优雅排空配置（SIGTERM 时停止接收新请求，等待进行中的请求完成后再退出）
+    drain_enabled: bool = True
+    drain_grace_period: float = 20.0
+    drain_retry_after: int = 5
+
+    # 指标配置
+    metrics_enabled: bool = True
+    metrics_multiprocess_dir: str = ""
+    metrics_flush_interval: float = 5.0
+
+    # 审计日志配置（请求/响应记录异步写入压缩的 JSONL 文件）
+    audit_enabled: bool = False
+    audit_dir: str = "data/audit"
+    audit_compression: str = "gzip"
+    audit_queue_size: int = 10_000
+    audit_queue_policy: str = "drop"
+    audit_batch_size: int = 256
+    audit_flush_interval: float = 1.0
+    audit_rotate_mb: int = 100
+    audit_rotate_interval: float = 3600.0
+
+    # 响应压缩配置（按 Accept-Encoding 协商；br / zstd 分别需要安装 brotli / zstandard，未安装时不参与协商）
+    compression_enabled: bool = True
+    compression_encodings: list = ["zstd", "br", "gzip"]
+    compression_min_size: int = 1024
+    compression_offload_threshold: int = 65536
+    compression_levels: dict = {}
+    compression_sse: bool = False
+
     # 日志配置
     log_level: str = "INFO"
     log_file: Optional[str] = "logs/app.log"
     log_rotation: str = "100 MB"
     log_retention: str = "30 days"
+    log_format: str = "text"
+    log_sampling: dict = {}
+    access_log_enabled: bool = True
 
     # CORS配置
     cors_origins: list = ["*"]
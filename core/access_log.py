@@ -0,0 +1,63 @@
+"""
+访问日志模块 - 基于 contextvar 的请求级访问日志字段
+
+中间件为每个请求创建字段字典并绑定到当前上下文，路由和代理服务通过 annotate() 补充模型、客户端、
+密钥、token 用量等字段，请求结束时由中间件合并为一行访问日志；未启用时 annotate() 直接返回。
+"""
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+_current: ContextVar[Optional[Dict[str, Any]]] = ContextVar("access_fields", default=None)
+
+
+def start_fields() -> tuple:
+    """
+    为当前上下文创建访问日志字段字典
+
+    Returns:
+        (字段字典, contextvar token)，请求结束后用 token 调用 reset_fields
+    """
+    fields: Dict[str, Any] = {}
+    return fields, _current.set(fields)
+
+
+def reset_fields(token) -> None:
+    """解除当前上下文的字段字典"""
+    _current.reset(token)
+
+
+def annotate(**fields: Any) -> None:
+    """补充当前请求的访问日志字段（未启用访问日志时为空操作）"""
+    current = _current.get()
+    if current is not None:
+        current.update(fields)
+
+
+class KeyValues:
+    """
+    key=value 形式的惰性日志参数
+
+    作为 %s 参数传给 logging，只有日志实际输出（未被级别或采样过滤）时才格式化；
+    值为 None 的字段省略，含空格的值加引号，字典值展开为 a:1,b:2。
+    """
+
+    __slots__ = ("fields",)
+
+    def __init__(self, fields: Dict[str, Any]):
+        self.fields = fields
+
+    @staticmethod
+    def _format(value: Any) -> str:
+        if isinstance(value, dict):
+            return ",".join(f"{key}:{item}" for key, item in value.items())
+        if isinstance(value, bool):
+            return "true" if value else "false"
+        text = str(value)
+        if " " in text or '"' in text:
+            return '"' + text.replace('"', '\\"') + '"'
+        return text
+
+    def __str__(self) -> str:
+        return " ".join(
+            f"{key}={self._format(value)}" for key, value in self.fields.items() if value is not None
+        )
@@ -0,0 +1,300 @@
+"""
+准入控制模块 - 全局/单模型/密钥容量并发限制、加权公平等待队列与过载保护
+"""
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, Optional
+
+from .scheduler import FairQueue
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """请求被准入控制拒绝"""
+
+    def __init__(self, message: str, status_code: int, retry_after: int, reason: str):
+        """
+        Args:
+            message: 错误信息
+            status_code: 返回给客户端的HTTP状态码（429 或 503）
+            retry_after: 建议客户端重试等待秒数
+            reason: 拒绝原因（queue_full / queue_timeout / invalid_class）
+        """
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionTicket:
+    """准入凭证，释放操作幂等，可安全地在多个清理路径上调用"""
+
+    __slots__ = ("_controller", "model", "_released")
+
+    def __init__(self, controller: "AdmissionController", model: str):
+        self._controller = controller
+        self.model = model
+        self._released = False
+
+    def release(self) -> None:
+        """释放并发槽位"""
+        if not self._released:
+            self._released = True
+            self._controller._release(self.model)
+
+
+class AdmissionController:
+    """
+    准入控制器，在请求进入代理服务前限制并发并对过载请求快速失败
+
+    无空闲槽位时请求按 优先级分类 + 租户 进入加权公平队列，槽位释放时按 WFQ 顺序出队，
+    使交互式请求在批处理洪峰下仍保持低延迟，批处理请求使用剩余容量。
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 100,
+        model_concurrency: int = 0,
+        model_limits: Optional[Dict[str, int]] = None,
+        max_queue_size: int = 500,
+        max_queue_time: float = 10.0,
+        retry_after: int = 1,
+        class_weights: Optional[Dict[str, float]] = None,
+        capacity_provider: Optional[Callable[[], int]] = None
+    ):
+        """
+        初始化准入控制器
+
+        Args:
+            max_concurrency: 全局并发上限，<=0 表示不限制
+            model_concurrency: 单模型默认并发上限，<=0 表示不限制
+            model_limits: 按模型覆盖的并发上限
+            max_queue_size: 等待队列最大长度，队列满时立即返回 429
+            max_queue_time: 最长排队时间（秒），超时返回 503
+            retry_after: Retry-After 响应头建议的重试秒数
+            class_weights: 优先级分类权重，如 {"interactive": 8, "batch": 1}
+            capacity_provider: 动态容量（如 可用密钥数 x 单密钥并发），返回 <=0 表示不限制
+        """
+        self.max_concurrency = max_concurrency
+        self.model_concurrency = model_concurrency
+        self.model_limits = dict(model_limits or {})
+        self.max_queue_size = max_queue_size
+        self.max_queue_time = max_queue_time
+        self.retry_after = retry_after
+        self.class_weights = dict(class_weights or {"default": 1.0})
+        self.capacity_provider = capacity_provider
+
+        self._active = 0
+        self._active_by_model: Dict[str, int] = {}
+        self._queue = FairQueue()
+        self._queued_by_class: Dict[str, int] = {}
+
+        # 统计信息
+        self._admitted = 0
+        self._queued = 0
+        self._rejected: Dict[str, int] = {"queue_full": 0, "queue_timeout": 0}
+        self._wait_by_class: Dict[str, list] = {}
+
+    def _model_limit(self, model: str) -> int:
+        """获取模型并发上限"""
+        return self.model_limits.get(model, self.model_concurrency)
+
+    def _has_capacity(self) -> bool:
+        """判断全局/密钥容量是否还有空闲"""
+        if 0 < self.max_concurrency <= self._active:
+            return False
+        if self.capacity_provider is not None:
+            capacity = self.capacity_provider()
+            if 0 < capacity <= self._active:
+                return False
+        return True
+
+    def _model_has_capacity(self, model: str) -> bool:
+        """判断模型并发是否还有空闲"""
+        model_limit = self._model_limit(model)
+        return not (0 < model_limit <= self._active_by_model.get(model, 0))
+
+    def _can_run(self, model: str) -> bool:
+        """判断当前是否有空闲槽位"""
+        return self._has_capacity() and self._model_has_capacity(model)
+
+    def _occupy(self, model: str) -> None:
+        """占用槽位"""
+        self._active += 1
+        self._active_by_model[model] = self._active_by_model.get(model, 0) + 1
+        self._admitted += 1
+
+    def _grant(self, waiter: tuple) -> None:
+        """为出队的等待者占用槽位并唤醒"""
+        model, future, request_class = waiter
+        self._queued_by_class[request_class] -= 1
+        self._occupy(model)
+        future.set_result(None)
+
+    def _release(self, model: str) -> None:
+        """释放槽位并按 WFQ 顺序唤醒可以运行的等待者"""
+        self._active -= 1
+        remaining = self._active_by_model.get(model, 1) - 1
+        if remaining > 0:
+            self._active_by_model[model] = remaining
+        else:
+            self._active_by_model.pop(model, None)
+
+        if len(self._queue):
+            self._queue.dispatch(
+                can_run=lambda waiter: self._model_has_capacity(waiter[0]),
+                has_capacity=self._has_capacity,
+                on_dispatch=self._grant
+            )
+
+    def _reject(self, reason: str, status_code: int, message: str) -> AdmissionRejected:
+        """记录并生成拒绝异常"""
+        self._rejected[reason] = self._rejected.get(reason, 0) + 1
+        return AdmissionRejected(message, status_code, self.retry_after, reason)
+
+    def cap_class(self, request_class: str, max_class: Optional[str]) -> str:
+        """
+        将优先级分类限制在上限以内（分类按权重排序，权重越高优先级越高）
+
+        Args:
+            request_class: 请求的分类
+            max_class: 允许的最高分类，为空或不是已配置的分类时不限制
+
+        Returns:
+            实际使用的分类（请求的分类未配置时原样返回，由 acquire 拒绝）
+        """
+        weights = self.class_weights
+        if max_class in weights and request_class in weights and weights[request_class] > weights[max_class]:
+            return max_class
+        return request_class
+
+    async def acquire(
+        self,
+        model: str,
+        request_class: Optional[str] = None,
+        tenant: str = "default",
+        tenant_weight: float = 1.0
+    ) -> AdmissionTicket:
+        """
+        获取并发槽位，无空闲槽位时进入有界加权公平队列
+
+        Args:
+            model: 模型名称
+            request_class: 优先级分类，默认使用第一个配置的分类
+            tenant: 租户（客户端）标识
+            tenant_weight: 租户权重
+
+        Returns:
+            准入凭证，使用完毕后需调用 release()
+
+        Raises:
+            AdmissionRejected: 分类无效、队列已满或排队超时
+        """
+        if request_class is None:
+            request_class = next(iter(self.class_weights))
+        if request_class not in self.class_weights:
+            raise self._reject(
+                "invalid_class", 400,
+                f"不支持的优先级分类: {request_class}，可选值: {', '.join(self.class_weights)}"
+            )
+
+        flow = f"{request_class}:{tenant}"
+        weight = self.class_weights[request_class] * tenant_weight
+
+        if not len(self._queue) and self._can_run(model):
+            self._queue.bypass(flow, weight)
+            self._occupy(model)
+            return AdmissionTicket(self, model)
+
+        if len(self._queue) >= self.max_queue_size:
+            logger.warning(f"准入队列已满，拒绝请求: model={model}, class={request_class}, queue={len(self._queue)}")
+            raise self._reject("queue_full", 429, "服务繁忙，请求队列已满，请稍后重试")
+
+        future = asyncio.get_running_loop().create_future()
+        entry = self._queue.push((model, future, request_class), flow, weight)
+        self._queued_by_class[request_class] = self._queued_by_class.get(request_class, 0) + 1
+        self._queued += 1
+        started = time.monotonic()
+
+        # 队列中可能有因单模型上限阻塞的请求，新请求若可直接运行则立即调度
+        if self._can_run(model):
+            self._queue.dispatch(
+                can_run=lambda waiter: self._model_has_capacity(waiter[0]),
+                has_capacity=self._has_capacity,
+                on_dispatch=self._grant
+            )
+
+        try:
+            # 使用 wait 而非 wait_for，超时时不取消 future，避免与释放唤醒产生竞争
+            await asyncio.wait((future,), timeout=self.max_queue_time)
+        except asyncio.CancelledError:
+            # 客户端断开：若已获得槽位则归还，否则退出队列
+            if future.done() and not future.cancelled():
+                self._release(model)
+            else:
+                self._leave_queue(entry, future, request_class)
+            raise
+        finally:
+            self._record_wait(request_class, time.monotonic() - started)
+
+        if not future.done():
+            self._leave_queue(entry, future, request_class)
+            logger.warning(f"准入排队超时: model={model}, class={request_class}, waited={self.max_queue_time}s")
+            raise self._reject("queue_timeout", 503, "服务繁忙，排队超时，请稍后重试")
+
+        return AdmissionTicket(self, model)
+
+    def _leave_queue(self, entry: list, future: asyncio.Future, request_class: str) -> None:
+        """从等待队列中移除"""
+        future.cancel()
+        if entry[3]:
+            self._queued_by_class[request_class] -= 1
+        self._queue.discard(entry)
+
+    def _record_wait(self, request_class: str, waited: float) -> None:
+        """记录排队时间"""
+        stats = self._wait_by_class.setdefault(request_class, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += waited
+        stats[2] = max(stats[2], waited)
+
+    @property
+    def queue_depth(self) -> int:
+        """当前排队数"""
+        return len(self._queue)
+
+    @property
+    def active(self) -> int:
+        """当前并发数"""
+        return self._active
+
+    def get_stats(self) -> dict:
+        """获取统计信息"""
+        total_count = sum(stats[0] for stats in self._wait_by_class.values())
+        total_wait = sum(stats[1] for stats in self._wait_by_class.values())
+        max_wait = max((stats[2] for stats in self._wait_by_class.values()), default=0.0)
+
+        return {
+            "active": self._active,
+            "active_by_model": dict(self._active_by_model),
+            "max_concurrency": self.max_concurrency,
+            "capacity": self.capacity_provider() if self.capacity_provider else None,
+            "queue_depth": len(self._queue),
+            "queue_depth_by_class": dict(self._queued_by_class),
+            "max_queue_size": self.max_queue_size,
+            "admitted": self._admitted,
+            "queued": self._queued,
+            "rejected": dict(self._rejected),
+            "avg_wait_ms": round(total_wait / total_count * 1000, 2) if total_count else 0.0,
+            "max_wait_ms": round(max_wait * 1000, 2),
+            "wait_by_class": {
+                name: {
+                    "queued": stats[0],
+                    "avg_wait_ms": round(stats[1] / stats[0] * 1000, 2) if stats[0] else 0.0,
+                    "max_wait_ms": round(stats[2] * 1000, 2)
+                }
+                for name, stats in self._wait_by_class.items()
+            }
+        }
@@ -0,0 +1,310 @@
+"""
+审计日志模块 - 请求/响应记录异步批量写入压缩的 JSONL 文件
+
+请求路径只把记录放入有界队列（队列满时按策略丢弃或等待），不做序列化和磁盘 I/O；
+后台写入任务攒批后在线程中序列化（流式响应在这里重组为完整响应）、压缩并追加到当前文件。
+每批写为一个独立的 gzip member / zstd frame，拼接后仍是合法的压缩文件，
+进程异常退出时已写入的批次仍可用 zcat / zstdcat 读取。
+"""
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .metrics import registry
+from .sse import DONE, SSEParser
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖，仅 AUDIT_COMPRESSION=zstd 时需要
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+
+# 压缩方式 -> 文件扩展名
+COMPRESSIONS = {"none": ".jsonl", "gzip": ".jsonl.gz", "zstd": ".jsonl.zst"}
+
+# 队列满时的策略: drop 丢弃新记录（请求路径从不等待），block 等待写入任务腾出空间
+QUEUE_POLICIES = ("drop", "block")
+
+AUDIT_RECORDS = registry.counter(
+    "megallm_audit_records_total", "审计记录数（written 已写入 / dropped 队列满丢弃 / failed 写入失败）", ("outcome",)
+)
+
+
+def reassemble_stream(chunks: List[bytes]) -> Dict[str, Any]:
+    """
+    将转发给客户端的 SSE 分块重组为 chat.completion 格式的完整响应
+
+    Args:
+        chunks: 流式响应的原始分块
+
+    Returns:
+        完整响应（各 choice 的 delta 按顺序拼接，tool_calls 按 index 合并；流中的错误事件放在 error 字段）
+    """
+    parser = SSEParser()
+    events = [data for chunk in chunks for data in parser.feed(chunk)]
+    last = parser.flush()
+    if last is not None:
+        events.append(last)
+
+    result: Dict[str, Any] = {"object": "chat.completion"}
+    choices: Dict[int, Dict[str, Any]] = {}
+
+    for data in events:
+        if data == DONE:
+            continue
+        try:
+            event = json.loads(data)
+        except ValueError:
+            continue
+        if "error" in event:
+            result["error"] = event["error"]
+            continue
+
+        for field in ("id", "created", "model", "system_fingerprint"):
+            if field in event:
+                result.setdefault(field, event[field])
+        if event.get("usage"):
+            result["usage"] = event["usage"]
+
+        for choice in event.get("choices") or []:
+            index = choice.get("index", 0)
+            state = choices.setdefault(index, {"message": {"role": "assistant"}, "finish_reason": None, "tool_calls": {}})
+            message = state["message"]
+            for key, value in (choice.get("delta") or {}).items():
+                if key == "tool_calls":
+                    for call in value or []:
+                        merged = state["tool_calls"].setdefault(
+                            call.get("index", 0), {"id": None, "type": "function", "function": {"name": "", "arguments": ""}}
+                        )
+                        if call.get("id"):
+                            merged["id"] = call["id"]
+                        function = call.get("function") or {}
+                        merged["function"]["name"] += function.get("name") or ""
+                        merged["function"]["arguments"] += function.get("arguments") or ""
+                elif key == "role":
+                    message["role"] = value
+                elif isinstance(value, str):
+                    message[key] = message.get(key, "") + value
+            if choice.get("finish_reason"):
+                state["finish_reason"] = choice["finish_reason"]
+
+    result["choices"] = []
+    for index in sorted(choices):
+        state = choices[index]
+        if state["tool_calls"]:
+            state["message"]["tool_calls"] = [state["tool_calls"][i] for i in sorted(state["tool_calls"])]
+        result["choices"].append({"index": index, "message": state["message"], "finish_reason": state["finish_reason"]})
+    return result
+
+
+def _json_default(value: Any) -> Any:
+    """序列化请求模型等非 JSON 类型"""
+    if hasattr(value, "dict"):
+        return value.dict(exclude_none=True)
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    return str(value)
+
+
+class AuditSink:
+    """
+    审计日志写入器
+
+    submit() 在事件循环中调用；写入任务在单独线程中执行序列化、压缩和写文件，同一时刻只有一个批次在写。
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        compression: str = "gzip",
+        queue_size: int = 10_000,
+        policy: str = "drop",
+        batch_size: int = 256,
+        flush_interval: float = 1.0,
+        rotate_bytes: int = 100 * 1024 * 1024,
+        rotate_interval: float = 3600.0
+    ):
+        """
+        初始化审计日志写入器
+
+        Args:
+            directory: 审计文件目录
+            compression: 压缩方式 none / gzip / zstd
+            queue_size: 队列最大记录数
+            policy: 队列满时的策略 drop / block
+            batch_size: 每批最多写入的记录数
+            flush_interval: 攒批最长等待时间（秒）
+            rotate_bytes: 单个文件超过该大小（压缩后字节数）时轮转
+            rotate_interval: 单个文件打开超过该时长（秒）时轮转
+
+        Raises:
+            ValueError: 压缩方式或队列策略不支持，或 zstd 未安装时
+        """
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"不支持的审计压缩方式: {compression}，可选值: {', '.join(COMPRESSIONS)}")
+        if compression == "zstd" and zstandard is None:
+            raise ValueError("AUDIT_COMPRESSION=zstd 需要安装 zstandard: pip install zstandard")
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"不支持的审计队列策略: {policy}，可选值: {', '.join(QUEUE_POLICIES)}")
+
+        self.directory = Path(directory)
+        self.compression = compression
+        self.policy = policy
+        self.batch_size = max(batch_size, 1)
+        self.flush_interval = flush_interval
+        self.rotate_bytes = rotate_bytes
+        self.rotate_interval = rotate_interval
+
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._task: Optional[asyncio.Task] = None
+        self._compressor = zstandard.ZstdCompressor() if compression == "zstd" else None
+
+        # 当前文件（仅在写入线程中访问）
+        self._file = None
+        self._path: Optional[Path] = None
+        self._opened_at = 0.0
+        self._size = 0
+        self._sequence = 0
+
+        self._stats = {"submitted": 0, "written": 0, "dropped": 0, "failed": 0, "batches": 0, "files": 0, "bytes": 0}
+
+    def start(self) -> None:
+        """启动后台写入任务（需在事件循环中调用）"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._task = asyncio.create_task(self._run(), name="audit-writer")
+        logger.info(
+            f"审计日志已启用: dir={self.directory}, compression={self.compression}, "
+            f"queue={self._queue.maxsize}, policy={self.policy}"
+        )
+
+    async def close(self) -> None:
+        """写完队列中的剩余记录并关闭文件"""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        await asyncio.to_thread(self._close_file)
+
+    async def submit(self, record: Dict[str, Any]) -> bool:
+        """
+        提交一条审计记录
+
+        Args:
+            record: 审计记录（在写入线程中序列化；含 _stream_chunks 时先重组流式响应）
+
+        Returns:
+            是否进入队列（drop 策略下队列已满时返回 False）
+        """
+        self._stats["submitted"] += 1
+        if self.policy == "block":
+            await self._queue.put(record)
+            return True
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except asyncio.QueueFull:
+            self._stats["dropped"] += 1
+            AUDIT_RECORDS.inc("dropped")
+            if self._stats["dropped"] == 1 or self._stats["dropped"] % 1000 == 0:
+                logger.warning(f"审计队列已满，已丢弃 {self._stats['dropped']} 条记录")
+            return False
+
+    async def _run(self) -> None:
+        """写入任务：攒批后交给线程写入"""
+        loop = asyncio.get_running_loop()
+        closing = False
+        while not closing:
+            record = await self._queue.get()
+            if record is None:
+                break
+            batch = [record]
+            deadline = loop.time() + self.flush_interval
+
+            while len(batch) < self.batch_size:
+                try:
+                    record = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        record = await asyncio.wait_for(self._queue.get(), timeout=remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if record is None:
+                    closing = True
+                    break
+                batch.append(record)
+
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+                self._stats["written"] += len(batch)
+                AUDIT_RECORDS.inc("written", amount=len(batch))
+            except Exception as e:
+                self._stats["failed"] += len(batch)
+                AUDIT_RECORDS.inc("failed", amount=len(batch))
+                logger.error(f"写入审计日志失败，丢失 {len(batch)} 条记录: {e}")
+
+    def _serialize(self, record: Dict[str, Any]) -> str:
+        """序列化一条记录（流式响应在这里重组）"""
+        chunks = record.pop("_stream_chunks", None)
+        if chunks is not None:
+            record["response"] = reassemble_stream(chunks)
+        return json.dumps(record, ensure_ascii=False, default=_json_default)
+
+    def _write_batch(self, batch: List[Dict[str, Any]]) -> None:
+        """序列化、压缩并写入一批记录（在线程中执行）"""
+        data = "".join(self._serialize(record) + "\n" for record in batch).encode("utf-8")
+        if self.compression == "gzip":
+            data = gzip.compress(data)
+        elif self.compression == "zstd":
+            data = self._compressor.compress(data)
+
+        if (
+            self._file is None
+            or self._size >= self.rotate_bytes
+            or time.time() - self._opened_at >= self.rotate_interval
+        ):
+            self._rotate()
+
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data)
+        self._stats["bytes"] += len(data)
+        self._stats["batches"] += 1
+
+    def _rotate(self) -> None:
+        """关闭当前文件并打开新文件（文件名含时间、进程号和序号，多 worker 不会冲突）"""
+        self._close_file()
+        self._sequence += 1
+        name = f"audit-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self._sequence:04d}{COMPRESSIONS[self.compression]}"
+        self._path = self.directory / name
+        self._file = open(self._path, "ab")
+        self._opened_at = time.time()
+        self._size = 0
+        self._stats["files"] += 1
+        logger.info(f"审计日志文件: {self._path}")
+
+    def _close_file(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取统计信息"""
+        return {
+            **self._stats,
+            "queue_depth": self._queue.qsize(),
+            "queue_size": self._queue.maxsize,
+            "policy": self.policy,
+            "compression": self.compression,
+            "current_file": str(self._path) if self._path else None
+        }
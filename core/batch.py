@@ -0,0 +1,649 @@
+"""
+批处理任务模块 - 从磁盘流式读取 JSONL 请求文件，有界并发转发并增量写入结果，支持断点续跑
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from pydantic import ValidationError
+
+from config.model_config import check_max_tokens_limit
+from models.schemas import ChatCompletionRequest
+from .admission import AdmissionController, AdmissionRejected
+from .context_checker import ContextChecker
+from .proxy import ProxyService
+
+try:
+    import fcntl
+except ImportError:  # Windows 下不支持跨进程文件锁
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class BatchCancelled(Exception):
+    """任务已在其他 worker 中被取消"""
+
+
+# 任务状态
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+# 断点续跑时从结果文件末尾向前查找完整行的块大小
+CHECKPOINT_TAIL_BLOCK = 64 * 1024
+
+# 默认模型（与 /v1/chat/completions 一致）
+DEFAULT_MODEL = "openai-gpt-oss-120b"
+
+
+def parse_batch_line(line: str) -> Dict[str, Any]:
+    """
+    解析批处理输入行
+
+    支持 OpenAI Batch 格式 {"custom_id", "method", "url", "body"}，也支持直接传入请求体。
+
+    Args:
+        line: JSONL 中的一行
+
+    Returns:
+        {"custom_id": ..., "model": ..., "messages": [...], "params": {...}}
+
+    Raises:
+        ValueError: 格式错误时
+    """
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError("每行必须是 JSON 对象")
+
+    body = record.get("body", record)
+    url = record.get("url", "/v1/chat/completions")
+    if url != "/v1/chat/completions":
+        raise ValueError(f"不支持的 url: {url}")
+
+    try:
+        request = ChatCompletionRequest(**body)
+    except ValidationError as e:
+        raise ValueError(f"请求体校验失败: {e.errors()}") from e
+
+    params = request.model_dump(exclude_none=True, exclude={"model", "messages", "stream"})
+    params["stream"] = False
+
+    return {
+        "custom_id": record.get("custom_id"),
+        "model": request.model or DEFAULT_MODEL,
+        "messages": [message.model_dump(exclude_none=True) for message in request.messages],
+        "params": params
+    }
+
+
+def read_lines(input_file, count: int) -> List[str]:
+    """读取若干行（阻塞 IO，在线程中执行）"""
+    lines = []
+    for _ in range(count):
+        line = input_file.readline()
+        if not line:
+            break
+        lines.append(line)
+    return lines
+
+
+async def process_batch_line(
+    proxy_service: ProxyService,
+    context_checker: ContextChecker,
+    record_id: str,
+    index: int,
+    line: str,
+    admit: Optional[Callable[[str], Awaitable[Any]]] = None
+) -> Dict[str, Any]:
+    """
+    执行一行批处理请求，错误记录到结果中而不是抛出
+
+    Args:
+        proxy_service: 代理服务
+        context_checker: 上下文检查器（大请求的 token 估算卸载到池中，不阻塞事件循环）
+        record_id: 结果记录ID
+        index: 行号（从 0 开始）
+        line: JSONL 中的一行
+        admit: 获取准入凭证的协程函数，参数为模型名称，返回带 release() 的凭证或 None
+
+    Returns:
+        {"id", "custom_id", "line", "response": {"status_code", "body"}, "error"}
+    """
+    record: Dict[str, Any] = {
+        "id": record_id,
+        "custom_id": None,
+        "line": index,
+        "response": None,
+        "error": None
+    }
+
+    try:
+        request = parse_batch_line(line)
+    except ValueError as e:
+        record["error"] = {"message": str(e), "type": "invalid_request_error"}
+        return record
+
+    record["custom_id"] = request["custom_id"]
+    model = request["model"]
+    max_tokens = request["params"].get("max_tokens")
+
+    if check_max_tokens_limit(model, max_tokens)[0] or \
+            (await context_checker.check(model, request["messages"], max_tokens))[0]:
+        record["error"] = {"message": "超出模型上下文或最大输出限制", "type": "context_length_exceeded"}
+        return record
+
+    try:
+        ticket = await admit(model) if admit is not None else None
+        try:
+            result = await proxy_service.chat_completion(
+                model=model,
+                messages=request["messages"],
+                **request["params"]
+            )
+        finally:
+            if ticket is not None:
+                ticket.release()
+        record["response"] = {"status_code": 200, "body": result}
+    except Exception as e:
+        status_code = getattr(getattr(e, "response", None), "status_code", None)
+        record["error"] = {"message": str(e), "type": type(e).__name__, "status_code": status_code}
+
+    return record
+
+
+class BatchJob:
+    """批处理任务状态（持久化为 state.json）"""
+
+    def __init__(self, job_dir: Path, state: Dict[str, Any]):
+        self.job_dir = job_dir
+        self.state = state
+
+    @property
+    def id(self) -> str:
+        return self.state["id"]
+
+    @property
+    def input_path(self) -> Path:
+        return self.job_dir / "input.jsonl"
+
+    @property
+    def output_path(self) -> Path:
+        return self.job_dir / "output.jsonl"
+
+    @property
+    def state_path(self) -> Path:
+        return self.job_dir / "state.json"
+
+    @property
+    def lock_path(self) -> Path:
+        return self.job_dir / "job.lock"
+
+    @property
+    def state_lock_path(self) -> Path:
+        return self.job_dir / "state.lock"
+
+    @contextmanager
+    def state_lock(self):
+        """
+        状态文件锁（跨 worker 的读-改-写互斥）
+
+        job.lock 由执行任务的 worker 在整个运行期间持有，状态读写使用单独的短期锁
+        """
+        if fcntl is None:
+            yield
+            return
+        with open(self.state_lock_path, 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def save_unless_cancelled(self) -> bool:
+        """
+        在状态锁内检查磁盘状态后保存
+
+        Returns:
+            任务已被其他 worker 取消时返回 False（同步取消状态，不覆盖磁盘），否则保存并返回 True
+        """
+        with self.state_lock():
+            disk_state = BatchJob.load(self.job_dir).state
+            if disk_state["status"] == "cancelled":
+                self.state["status"] = "cancelled"
+                self.state["completed_at"] = disk_state["completed_at"]
+                return False
+            self.save()
+            return True
+
+    def mark_cancelled(self) -> None:
+        """在状态锁内将任务标记为已取消（磁盘上已是终态时以磁盘状态为准）"""
+        with self.state_lock():
+            disk_state = BatchJob.load(self.job_dir).state
+            if disk_state["status"] in TERMINAL_STATUSES:
+                self.state = disk_state
+                return
+            self.state["status"] = "cancelled"
+            self.state["completed_at"] = int(time.time())
+            self.save()
+
+    def save(self) -> None:
+        """原子写入状态文件"""
+        tmp_path = self.state_path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.state_path)
+
+    @classmethod
+    def load(cls, job_dir: Path) -> "BatchJob":
+        """从状态文件加载"""
+        with open(job_dir / "state.json", 'r', encoding='utf-8') as f:
+            return cls(job_dir, json.load(f))
+
+
+class BatchManager:
+    """批处理任务管理器"""
+
+    def __init__(
+        self,
+        proxy_service: ProxyService,
+        storage_dir: str = "data/batches",
+        concurrency_per_key: int = 4,
+        max_concurrency: int = 64,
+        checkpoint_interval: int = 100,
+        admission_controller: Optional[AdmissionController] = None,
+        request_class: str = "batch",
+        context_checker: Optional[ContextChecker] = None
+    ):
+        """
+        初始化批处理任务管理器
+
+        Args:
+            proxy_service: 代理服务
+            storage_dir: 任务文件存储目录
+            concurrency_per_key: 每个可用密钥的并发窗口，总窗口随可用密钥数变化
+            max_concurrency: 单个任务的最大并发窗口
+            checkpoint_interval: 每完成多少个请求保存一次状态
+            admission_controller: 准入控制器，批处理请求与在线请求共享容量
+            request_class: 批处理请求在准入控制中的优先级分类
+            context_checker: 上下文检查器，与在线请求共享，省略时创建默认检查器
+        """
+        self.proxy_service = proxy_service
+        self.storage_dir = Path(storage_dir)
+        self.concurrency_per_key = max(concurrency_per_key, 1)
+        self.max_concurrency = max(max_concurrency, 1)
+        self.checkpoint_interval = max(checkpoint_interval, 1)
+        self.admission_controller = admission_controller
+        self.request_class = request_class
+        self.context_checker = context_checker or ContextChecker()
+
+        self._jobs: Dict[str, BatchJob] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._locks: Dict[str, Any] = {}
+
+        self.storage_dir.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def concurrency(self) -> int:
+        """当前并发窗口：可用密钥数 x 单密钥并发，不超过上限"""
+        available = max(self.proxy_service.key_manager.available_keys, 1)
+        return min(available * self.concurrency_per_key, self.max_concurrency)
+
+    async def create(self, upload, client_id: Optional[str] = None, client_weight: float = 1.0) -> Dict[str, Any]:
+        """
+        创建任务：将上传的 JSONL 文件分块写入磁盘后开始执行
+
+        Args:
+            upload: 上传文件（提供 async read(size) 方法）
+            client_id: 提交任务的客户端ID（任务只对该客户端可见，准入控制中作为租户）
+            client_weight: 客户端在加权公平调度中的权重
+
+        Returns:
+            任务状态
+        """
+        job_id = f"batch_{uuid.uuid4().hex}"
+        job_dir = self.storage_dir / job_id
+        job_dir.mkdir(parents=True)
+
+        job = BatchJob(job_dir, {
+            "id": job_id,
+            "object": "batch",
+            "status": "validating",
+            "created_at": int(time.time()),
+            "completed_at": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            "error": None,
+            "client_id": client_id,
+            "client_weight": client_weight
+        })
+
+        # 只统计非空行（与执行时跳过空行一致），行可能跨越分块
+        total = 0
+        line_has_content = False
+        with open(job.input_path, 'wb') as f:
+            while True:
+                chunk = await upload.read(1024 * 1024)
+                if not chunk:
+                    break
+                await asyncio.to_thread(f.write, chunk)
+                parts = chunk.split(b"\n")
+                for part in parts[:-1]:
+                    if line_has_content or part.strip():
+                        total += 1
+                    line_has_content = False
+                line_has_content = line_has_content or bool(parts[-1].strip())
+        if line_has_content:
+            total += 1
+
+        job.state["request_counts"]["total"] = total
+        job.state["status"] = "in_progress"
+        await asyncio.to_thread(job.save)
+
+        self._jobs[job_id] = job
+        self._start(job)
+
+        logger.info(f"批处理任务已创建: id={job_id}, requests={total}")
+        return job.state
+
+    @staticmethod
+    def _owned(state: Dict[str, Any], client_id: Optional[str]) -> bool:
+        """client_id 为 None 时不检查归属（内部调用），否则只匹配该客户端提交的任务"""
+        return client_id is None or state.get("client_id") == client_id
+
+    def get(self, job_id: str, client_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        获取任务状态（运行在其他 worker 中的任务从状态文件读取）
+
+        Args:
+            job_id: 任务ID
+            client_id: 请求方客户端ID，任务属于其他客户端时视为不存在
+
+        Returns:
+            任务状态，不存在时返回 None
+        """
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.state if self._owned(job.state, client_id) else None
+
+        job_dir = self._job_dir(job_id)
+        if job_dir is None or not (job_dir / "state.json").exists():
+            return None
+        state = BatchJob.load(job_dir).state
+        return state if self._owned(state, client_id) else None
+
+    def list(self, limit: int = 20, client_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """列出最近的任务（指定 client_id 时只列出该客户端的任务）"""
+        states = []
+        for job_dir in self.storage_dir.iterdir():
+            state = self.get(job_dir.name, client_id)
+            if state is not None:
+                states.append(state)
+        states.sort(key=lambda state: state["created_at"], reverse=True)
+        return states[:limit]
+
+    def output_path(self, job_id: str, client_id: Optional[str] = None) -> Optional[Path]:
+        """获取结果文件路径（任务属于其他客户端时返回 None）"""
+        if self.get(job_id, client_id) is None:
+            return None
+        path = self.storage_dir / job_id / "output.jsonl"
+        return path if path.exists() else None
+
+    async def cancel(self, job_id: str, client_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        取消任务
+
+        Args:
+            job_id: 任务ID
+            client_id: 请求方客户端ID，任务属于其他客户端时视为不存在
+
+        Returns:
+            任务状态，不存在时返回 None
+        """
+        job = self._jobs.get(job_id)
+        if job is None:
+            job_dir = self._job_dir(job_id)
+            if job_dir is None or not (job_dir / "state.json").exists():
+                return None
+            job = BatchJob.load(job_dir)
+        if not self._owned(job.state, client_id):
+            return None
+
+        if job.state["status"] in TERMINAL_STATUSES:
+            return job.state
+
+        task = self._tasks.get(job_id)
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+        await asyncio.to_thread(job.mark_cancelled)
+        logger.info(f"批处理任务已取消: id={job_id}, status={job.state['status']}")
+        return job.state
+
+    def resume_all(self) -> int:
+        """
+        恢复未完成的任务（服务重启后调用）
+
+        Returns:
+            恢复的任务数
+        """
+        resumed = 0
+        for job_dir in self.storage_dir.iterdir():
+            if not (job_dir / "state.json").exists():
+                continue
+            job = BatchJob.load(job_dir)
+            if job.state["status"] != "in_progress" or job.id in self._tasks:
+                continue
+            if self._start(job):
+                self._jobs[job.id] = job
+                resumed += 1
+
+        if resumed:
+            logger.info(f"已恢复 {resumed} 个未完成的批处理任务")
+        return resumed
+
+    async def shutdown(self) -> None:
+        """停止所有运行中的任务（保留进度，重启后续跑）"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _job_dir(self, job_id: str) -> Optional[Path]:
+        """校验任务ID并返回目录"""
+        if not job_id.startswith("batch_") or not job_id[6:].isalnum():
+            return None
+        return self.storage_dir / job_id
+
+    def _start(self, job: BatchJob) -> bool:
+        """获取任务文件锁并启动执行（多 worker 下只有一个 worker 执行同一任务）"""
+        if fcntl is not None:
+            lock_file = open(job.lock_path, 'w')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+            self._locks[job.id] = lock_file
+
+        task = asyncio.create_task(self._run(job))
+        self._tasks[job.id] = task
+        task.add_done_callback(lambda _: self._finish(job.id))
+        return True
+
+    def _finish(self, job_id: str) -> None:
+        """释放任务资源"""
+        self._tasks.pop(job_id, None)
+        lock_file = self._locks.pop(job_id, None)
+        if lock_file is not None:
+            lock_file.close()
+
+    @staticmethod
+    def _load_checkpoint(job: BatchJob) -> Tuple[Set[int], Dict[str, int]]:
+        """
+        逐行扫描结果文件获取已完成的行号和成功/失败数
+
+        进程崩溃可能留下不完整的最后一行，先从文件末尾向前查找最后一个换行符并截断，不把整个文件读入内存。
+        计数以结果文件为准：上次保存状态之后写入的结果同样计入。
+
+        Returns:
+            (已完成的行号集合, {"completed": 成功数, "failed": 失败数})
+        """
+        done: Set[int] = set()
+        counts = {"completed": 0, "failed": 0}
+        if not job.output_path.exists():
+            return done, counts
+
+        with open(job.output_path, 'rb+') as f:
+            end = f.seek(0, os.SEEK_END)
+            position = end
+            while position > 0:
+                start = max(position - CHECKPOINT_TAIL_BLOCK, 0)
+                f.seek(start)
+                block = f.read(position - start)
+                if position == end and block.endswith(b"\n"):
+                    break
+                newline = block.rfind(b"\n")
+                if newline >= 0:
+                    f.truncate(start + newline + 1)
+                    break
+                position = start
+            else:
+                f.truncate(0)
+
+            f.seek(0)
+            for line in f:
+                record = json.loads(line)
+                if record["line"] in done:
+                    continue
+                done.add(record["line"])
+                counts["completed" if record["error"] is None else "failed"] += 1
+        return done, counts
+
+    async def _run(self, job: BatchJob) -> None:
+        """执行任务：有界窗口内并发转发，完成一个写入一个"""
+        pending: Set[asyncio.Task] = set()
+        try:
+            done, recovered = await asyncio.to_thread(self._load_checkpoint, job)
+            counts = job.state["request_counts"]
+            counts.update(recovered)
+            if done:
+                logger.info(f"批处理任务从断点恢复: id={job.id}, 已完成={len(done)}")
+
+            since_checkpoint = 0
+
+            with open(job.input_path, 'r', encoding='utf-8') as input_file, \
+                    open(job.output_path, 'a', encoding='utf-8') as output_file:
+                line_number = 0
+                while True:
+                    lines = await asyncio.to_thread(read_lines, input_file, 256)
+                    if not lines:
+                        break
+
+                    for line in lines:
+                        index = line_number
+                        line_number += 1
+                        if index in done or not line.strip():
+                            continue
+
+                        while len(pending) >= self.concurrency:
+                            finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                            since_checkpoint += await self._collect(job, finished, output_file)
+
+                        pending.add(asyncio.create_task(self._process(job, index, line)))
+
+                        if since_checkpoint >= self.checkpoint_interval:
+                            await self._checkpoint(job, output_file)
+                            since_checkpoint = 0
+
+                while pending:
+                    finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    await self._collect(job, finished, output_file)
+
+                await self._checkpoint(job, output_file)
+
+            job.state["status"] = "completed"
+            job.state["completed_at"] = int(time.time())
+            if not await asyncio.to_thread(job.save_unless_cancelled):
+                raise BatchCancelled(job.id)
+            logger.info(
+                f"批处理任务完成: id={job.id}, completed={counts['completed']}, failed={counts['failed']}"
+            )
+
+        except asyncio.CancelledError:
+            for task in pending:
+                task.cancel()
+            raise
+        except BatchCancelled:
+            for task in pending:
+                task.cancel()
+            logger.info(f"批处理任务已在其他 worker 中取消，停止执行: id={job.id}")
+        except Exception as e:
+            logger.error(f"批处理任务失败: id={job.id}, error={e}", exc_info=True)
+            job.state["status"] = "failed"
+            job.state["error"] = str(e)
+            job.state["completed_at"] = int(time.time())
+            await asyncio.to_thread(job.save_unless_cancelled)
+
+    async def _collect(self, job: BatchJob, finished: Set[asyncio.Task], output_file) -> int:
+        """写入已完成请求的结果"""
+        counts = job.state["request_counts"]
+        for task in finished:
+            record = task.result()
+            output_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            if record["error"] is None:
+                counts["completed"] += 1
+            else:
+                counts["failed"] += 1
+        return len(finished)
+
+    async def _checkpoint(self, job: BatchJob, output_file) -> None:
+        """刷新结果文件并保存状态；若任务已被其他 worker 取消则停止（读取与保存在同一把状态锁内）"""
+        output_file.flush()
+        if not await asyncio.to_thread(job.save_unless_cancelled):
+            raise BatchCancelled(job.id)
+
+    async def _process(self, job: BatchJob, index: int, line: str) -> Dict[str, Any]:
+        """处理单个请求，错误记录到结果中而不是中断任务"""
+        return await process_batch_line(
+            self.proxy_service, self.context_checker, f"{job.id}_{index}", index, line,
+            admit=lambda model: self._admit(model, job)
+        )
+
+    async def _admit(self, model: str, job: BatchJob):
+        """
+        通过准入控制获取槽位；被拒绝时等待后重试，批处理请求不丢弃
+
+        以提交任务的客户端作为租户（权重取客户端配置），不同客户端的批处理任务在加权公平队列中互不挤占
+        """
+        if self.admission_controller is None:
+            return None
+
+        request_class = self.request_class
+        if request_class not in self.admission_controller.class_weights:
+            request_class = None
+
+        while True:
+            try:
+                return await self.admission_controller.acquire(
+                    model,
+                    request_class=request_class,
+                    tenant=job.state.get("client_id") or "batch",
+                    tenant_weight=job.state.get("client_weight") or 1.0
+                )
+            except AdmissionRejected as e:
+                await asyncio.sleep(e.retry_after)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取统计信息"""
+        return {
+            "running": len(self._tasks),
+            "concurrency": self.concurrency
+        }
@@ -0,0 +1,342 @@
+"""
+离线批量执行模块 - 不经过 HTTP 服务，直接复用代理核心执行 JSONL 请求文件
+
+用法:
+    python -m core.bulk_runner prompts.jsonl -o results.jsonl
+    python -m core.bulk_runner prompts.jsonl -o results.jsonl --order completed --rpm-per-key 60
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from typing import Any, Dict, Optional, Set
+
+from .batch import process_batch_line, read_lines
+from .context_checker import ContextChecker
+from .key_manager import KeyManager
+from .proxy import ProxyService
+from .rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+# 结果写入顺序
+OUTPUT_ORDERS = ("input", "completed")
+
+
+class KeyAwareRateLimiter:
+    """
+    按可用密钥数伸缩的请求/ token 限流器
+
+    总配额 = 单密钥配额 x 当前可用密钥数，密钥失效后自动收紧，避免剩余密钥被打满触发上游 429。
+    """
+
+    def __init__(
+        self,
+        key_manager: KeyManager,
+        requests_per_minute_per_key: int = 0,
+        tokens_per_minute_per_key: int = 0
+    ):
+        """
+        Args:
+            key_manager: 密钥管理器
+            requests_per_minute_per_key: 单密钥每分钟请求数上限，<=0 表示不限制
+            tokens_per_minute_per_key: 单密钥每分钟 token 数上限，<=0 表示不限制
+        """
+        self.key_manager = key_manager
+        self.requests_per_minute_per_key = requests_per_minute_per_key
+        self.tokens_per_minute_per_key = tokens_per_minute_per_key
+
+        now = time.monotonic()
+        keys = self._keys()
+        self._requests = (
+            TokenBucket(requests_per_minute_per_key * keys, now) if requests_per_minute_per_key > 0 else None
+        )
+        self._tokens = (
+            TokenBucket(tokens_per_minute_per_key * keys, now) if tokens_per_minute_per_key > 0 else None
+        )
+        self._keys_seen = keys
+        self.waited = 0.0
+
+    def _keys(self) -> int:
+        """当前可用密钥数（至少为 1）"""
+        return max(self.key_manager.available_keys, 1)
+
+    def _sync_capacity(self, now: float) -> None:
+        """可用密钥数变化时调整桶容量"""
+        keys = self._keys()
+        if keys == self._keys_seen:
+            return
+        self._keys_seen = keys
+        if self._requests is not None:
+            self._requests.resize(self.requests_per_minute_per_key * keys, now)
+        if self._tokens is not None:
+            self._tokens.resize(self.tokens_per_minute_per_key * keys, now)
+
+    async def acquire(self) -> None:
+        """等待直到可以发送下一个请求"""
+        while True:
+            now = time.monotonic()
+            self._sync_capacity(now)
+
+            wait = 0.0
+            if self._tokens is not None:
+                # 事后计费产生的欠额还清前不再发送
+                wait = self._tokens.consume(0, now)
+            if not wait and self._requests is not None:
+                wait = self._requests.consume(1, now)
+            if not wait:
+                return
+
+            self.waited += wait
+            await asyncio.sleep(wait)
+
+    def record_tokens(self, tokens: int) -> None:
+        """按响应中的实际 token 用量计费"""
+        if self._tokens is not None and tokens:
+            self._tokens.charge(tokens, time.monotonic())
+
+
+class BulkRunner:
+    """离线批量执行器：流式读取输入，有界并发执行，按输入顺序或完成顺序写出结果"""
+
+    def __init__(
+        self,
+        proxy_service: ProxyService,
+        concurrency_per_key: int = 4,
+        max_concurrency: int = 64,
+        requests_per_minute_per_key: int = 0,
+        tokens_per_minute_per_key: int = 0,
+        order: str = "input",
+        reorder_window: int = 4,
+        context_checker: Optional[ContextChecker] = None
+    ):
+        """
+        初始化批量执行器
+
+        Args:
+            proxy_service: 代理服务
+            concurrency_per_key: 每个可用密钥的并发数，总并发随可用密钥数变化
+            max_concurrency: 最大并发数
+            requests_per_minute_per_key: 单密钥每分钟请求数上限，<=0 表示不限制
+            tokens_per_minute_per_key: 单密钥每分钟 token 数上限，<=0 表示不限制
+            order: 结果写入顺序，input（与输入一致）或 completed（完成即写）
+            reorder_window: 按输入顺序写出时，已完成未写出的结果最多为并发数的多少倍
+            context_checker: 上下文检查器，省略时创建默认检查器
+        """
+        if order not in OUTPUT_ORDERS:
+            raise ValueError(f"不支持的输出顺序: {order}，可选值: {', '.join(OUTPUT_ORDERS)}")
+
+        self.proxy_service = proxy_service
+        self.concurrency_per_key = max(concurrency_per_key, 1)
+        self.max_concurrency = max(max_concurrency, 1)
+        self.order = order
+        self.reorder_window = max(reorder_window, 1)
+        self.context_checker = context_checker or ContextChecker()
+        self.rate_limiter = KeyAwareRateLimiter(
+            proxy_service.key_manager,
+            requests_per_minute_per_key=requests_per_minute_per_key,
+            tokens_per_minute_per_key=tokens_per_minute_per_key
+        )
+
+        self._buffer: Dict[int, Dict[str, Any]] = {}
+        self._next_seq = 0
+        self._stats = {
+            "total": 0,
+            "completed": 0,
+            "failed": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "total_tokens": 0
+        }
+
+    @property
+    def concurrency(self) -> int:
+        """当前并发数：可用密钥数 x 单密钥并发，不超过上限"""
+        available = max(self.proxy_service.key_manager.available_keys, 1)
+        return min(available * self.concurrency_per_key, self.max_concurrency)
+
+    async def run(self, input_path: str, output_path: str) -> Dict[str, Any]:
+        """
+        执行请求文件
+
+        Args:
+            input_path: 输入 JSONL 文件路径（OpenAI Batch 格式或直接为请求体）
+            output_path: 输出 JSONL 文件路径
+
+        Returns:
+            执行统计（含 requests/s 与 tokens/s）
+        """
+        started = time.monotonic()
+        pending: Set[asyncio.Task] = set()
+        seq = 0
+
+        try:
+            with open(input_path, 'r', encoding='utf-8') as input_file, \
+                    open(output_path, 'w', encoding='utf-8') as output_file:
+                line_number = 0
+                while True:
+                    lines = await asyncio.to_thread(read_lines, input_file, 256)
+                    if not lines:
+                        break
+
+                    for line in lines:
+                        index = line_number
+                        line_number += 1
+                        if not line.strip():
+                            continue
+
+                        # 按输入顺序写出时，队首慢请求会使已完成结果堆积，同样计入窗口
+                        while len(pending) >= self.concurrency or \
+                                len(pending) + len(self._buffer) >= self.concurrency * self.reorder_window:
+                            finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                            self._collect(finished, output_file)
+
+                        await self.rate_limiter.acquire()
+                        pending.add(asyncio.create_task(self._process(seq, index, line)))
+                        seq += 1
+
+                while pending:
+                    finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    self._collect(finished, output_file)
+        finally:
+            for task in pending:
+                task.cancel()
+
+        return self._report(time.monotonic() - started)
+
+    async def _process(self, seq: int, index: int, line: str) -> tuple:
+        """执行单行请求"""
+        record = await process_batch_line(self.proxy_service, self.context_checker, f"bulk_{index}", index, line)
+
+        usage = {}
+        if record["response"] is not None:
+            usage = record["response"]["body"].get("usage") or {}
+            self.rate_limiter.record_tokens(usage.get("total_tokens", 0))
+        return seq, record, usage
+
+    def _collect(self, finished: Set[asyncio.Task], output_file) -> None:
+        """统计已完成请求并写出结果"""
+        for task in finished:
+            seq, record, usage = task.result()
+
+            self._stats["total"] += 1
+            self._stats["completed" if record["error"] is None else "failed"] += 1
+            for field in ("prompt_tokens", "completion_tokens", "total_tokens"):
+                self._stats[field] += usage.get(field, 0) or 0
+
+            if self.order == "completed":
+                output_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            else:
+                self._buffer[seq] = record
+
+        # 重排序缓冲：写出从下一个序号开始的连续结果
+        while self._next_seq in self._buffer:
+            record = self._buffer.pop(self._next_seq)
+            output_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._next_seq += 1
+
+    def _report(self, elapsed: float) -> Dict[str, Any]:
+        """生成执行统计"""
+        elapsed = max(elapsed, 1e-9)
+        return {
+            **self._stats,
+            "elapsed_seconds": round(elapsed, 3),
+            "requests_per_second": round(self._stats["total"] / elapsed, 2),
+            "tokens_per_second": round(self._stats["total_tokens"] / elapsed, 2),
+            "completion_tokens_per_second": round(self._stats["completion_tokens"] / elapsed, 2),
+            "rate_limit_wait_seconds": round(self.rate_limiter.waited, 3)
+        }
+
+
+def parse_args(argv: Optional[list] = None) -> argparse.Namespace:
+    """解析命令行参数"""
+    from config.settings import settings
+
+    parser = argparse.ArgumentParser(
+        prog="python -m core.bulk_runner",
+        description="离线批量执行 JSONL 请求文件（直接调用代理核心，不经过 HTTP 服务）"
+    )
+    parser.add_argument("input", help="输入 JSONL 文件（OpenAI Batch 格式或直接为请求体）")
+    parser.add_argument("-o", "--output", required=True, help="输出 JSONL 文件")
+    parser.add_argument("--order", choices=OUTPUT_ORDERS, default="input",
+                        help="结果写入顺序：input 与输入一致，completed 完成即写（默认: input）")
+    parser.add_argument("--key-file", default=settings.key_file_path, help="密钥文件路径")
+    parser.add_argument("--concurrency-per-key", type=int, default=settings.batch_concurrency_per_key,
+                        help="每个可用密钥的并发数")
+    parser.add_argument("--max-concurrency", type=int, default=settings.batch_max_concurrency,
+                        help="最大并发数")
+    parser.add_argument("--rpm-per-key", type=int, default=0, help="单密钥每分钟请求数上限，0 表示不限制")
+    parser.add_argument("--tpm-per-key", type=int, default=0, help="单密钥每分钟 token 数上限，0 表示不限制")
+    parser.add_argument("--log-level", default="WARNING", help="日志级别（默认: WARNING）")
+    return parser.parse_args(argv)
+
+
+async def run_from_args(args: argparse.Namespace) -> Dict[str, Any]:
+    """按命令行参数构建代理核心并执行"""
+    from config.settings import settings
+    from .http_client import MegaLLMClient
+
+    key_manager = KeyManager(args.key_file)
+    http_client = MegaLLMClient(
+        base_url=settings.megallm_base_url,
+        timeout=settings.megallm_timeout,
+        max_retries=settings.megallm_max_retries,
+        connect_timeout=settings.megallm_connect_timeout,
+        pool_timeout=settings.megallm_pool_timeout,
+        first_byte_timeout=settings.megallm_first_byte_timeout,
+        idle_timeout=settings.megallm_idle_timeout
+    )
+
+    async with http_client:
+        proxy_service = ProxyService(
+            key_manager=key_manager,
+            http_client=http_client,
+            max_key_retries=settings.max_key_retries
+        )
+        context_checker = ContextChecker(
+            offload_threshold=settings.context_check_offload_threshold,
+            pool_size=settings.context_check_pool_size,
+            executor_type=settings.context_check_executor
+        )
+        runner = BulkRunner(
+            proxy_service,
+            concurrency_per_key=args.concurrency_per_key,
+            max_concurrency=args.max_concurrency,
+            requests_per_minute_per_key=args.rpm_per_key,
+            tokens_per_minute_per_key=args.tpm_per_key,
+            order=args.order,
+            context_checker=context_checker
+        )
+        try:
+            return await runner.run(args.input, args.output)
+        finally:
+            context_checker.shutdown()
+
+
+def main(argv: Optional[list] = None) -> int:
+    """命令行入口"""
+    from config.settings import settings
+    from utils.logger import setup_logging
+
+    args = parse_args(argv)
+    settings.log_level = args.log_level.upper()
+    setup_logging()
+
+    report = asyncio.run(run_from_args(args))
+
+    print("=" * 60)
+    print(f"请求总数: {report['total']}  成功: {report['completed']}  失败: {report['failed']}")
+    print(f"耗时: {report['elapsed_seconds']}s  限流等待: {report['rate_limit_wait_seconds']}s")
+    print(f"吞吐: {report['requests_per_second']} requests/s, "
+          f"{report['tokens_per_second']} tokens/s "
+          f"(输出 {report['completion_tokens_per_second']} tokens/s)")
+    print(f"结果文件: {args.output}")
+    print("=" * 60)
+    return 0 if report["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,297 @@
+"""
+会话模块 - WebSocket 多轮对话的服务端历史（内存有界、空闲淘汰）与流式增量提取
+
+客户端每轮只发送新消息，完整历史保存在服务端：单个会话按消息数和字符数限制，超出时丢弃最早的消息；
+会话总数和单个客户端的会话数都有上限，已断开且长时间无活动的会话被淘汰。断开后在空闲超时之前可以凭会话 ID 重新连接继续对话。
+"""
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from .sse import DONE, SSEParser
+
+logger = logging.getLogger(__name__)
+
+
+class SessionUnavailable(Exception):
+    """无法创建或恢复会话"""
+
+    def __init__(self, message: str, reason: str):
+        """
+        Args:
+            message: 错误信息
+            reason: 原因（too_many_sessions / too_many_client_sessions / session_in_use / session_not_found）
+        """
+        super().__init__(message)
+        self.reason = reason
+
+
+class ChatSession:
+    """一个 WebSocket 对话会话"""
+
+    __slots__ = ("id", "client_id", "model", "system", "params", "messages", "chars", "connected", "last_active")
+
+    def __init__(self, session_id: str, client_id: str, model: str):
+        self.id = session_id
+        self.client_id = client_id
+        self.model = model
+        self.system: Optional[str] = None
+        # 上游请求参数（temperature / max_tokens 等，只包含客户端设置过的项）及 trim / priority
+        self.params: Dict[str, Any] = {}
+        self.messages: List[Dict[str, str]] = []
+        self.chars = 0
+        self.connected = False
+        self.last_active = time.monotonic()
+
+    def history(self) -> List[Dict[str, str]]:
+        """发送给上游的完整消息列表（system 消息在最前）"""
+        if self.system:
+            return [{"role": "system", "content": self.system}, *self.messages]
+        return list(self.messages)
+
+
+class SessionStore:
+    """WebSocket 会话存储（按最近活动时间排序，最久未活动的在前）"""
+
+    def __init__(
+        self,
+        max_sessions: int = 2000,
+        max_sessions_per_client: int = 20,
+        max_messages: int = 200,
+        max_chars: int = 200_000,
+        idle_timeout: float = 900.0
+    ):
+        """
+        初始化会话存储
+
+        Args:
+            max_sessions: 会话总数上限，满时淘汰最久未活动的已断开会话（优先淘汰请求方自己的会话）
+            max_sessions_per_client: 单个客户端的会话数上限，满时淘汰该客户端最久未活动的已断开会话，
+                避免一个客户端占满会话总数并挤掉其他客户端断开后待恢复的会话
+            max_messages: 单个会话保留的最大消息数
+            max_chars: 单个会话保留的最大字符数
+            idle_timeout: 空闲超时（秒），连接超过该时间无消息时关闭，断开的会话超过该时间后淘汰
+        """
+        self.max_sessions = max_sessions
+        self.max_sessions_per_client = max_sessions_per_client
+        self.max_messages = max_messages
+        self.max_chars = max_chars
+        self.idle_timeout = idle_timeout
+
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._stats: Dict[str, int] = {
+            "created": 0, "resumed": 0, "evicted_idle": 0, "evicted_capacity": 0, "evicted_client_limit": 0,
+            "not_found": 0, "dropped_messages": 0
+        }
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def open(self, client_id: str, model: str, session_id: Optional[str] = None) -> tuple:
+        """
+        恢复已有会话或创建新会话，并标记为已连接
+
+        Args:
+            client_id: 客户端 ID（只能恢复同一客户端的会话）
+            model: 新会话使用的模型
+            session_id: 要恢复的会话 ID，为空时创建新会话
+
+        Returns:
+            (会话, 是否为恢复的会话)
+
+        Raises:
+            SessionUnavailable: 要恢复的会话不存在（已淘汰、属于其他客户端，或保存在其他 worker 进程中），
+                会话正在被其他连接使用，或客户端会话数 / 会话总数已满且都处于连接状态
+        """
+        self.evict_idle()
+
+        if session_id:
+            session = self._sessions.get(session_id)
+            # 会话只保存在当前进程内，多 worker 时恢复请求可能落到其他 worker；明确报错而不是静默开始新对话
+            if session is None or session.client_id != client_id:
+                self._stats["not_found"] += 1
+                raise SessionUnavailable("会话不存在或已过期，请不带 session_id 重新连接开始新会话", "session_not_found")
+            if session.connected:
+                raise SessionUnavailable("会话正在被其他连接使用", "session_in_use")
+            session.connected = True
+            self.touch(session)
+            self._stats["resumed"] += 1
+            return session, True
+
+        # 按最近活动时间从旧到新，请求方自己的已断开会话
+        own = [s for s in self._sessions.values() if s.client_id == client_id]
+        own_detached = (s for s in own if not s.connected)
+        if len(own) >= self.max_sessions_per_client:
+            victim = next(own_detached, None)
+            if victim is None:
+                raise SessionUnavailable(
+                    f"客户端会话数已达上限 {self.max_sessions_per_client}，请关闭不用的连接", "too_many_client_sessions"
+                )
+            del self._sessions[victim.id]
+            self._stats["evicted_client_limit"] += 1
+        elif len(self._sessions) >= self.max_sessions:
+            victim = next(own_detached, None) or next((s for s in self._sessions.values() if not s.connected), None)
+            if victim is None:
+                raise SessionUnavailable("会话数已达上限，请稍后重试", "too_many_sessions")
+            del self._sessions[victim.id]
+            self._stats["evicted_capacity"] += 1
+
+        session = ChatSession(uuid.uuid4().hex, client_id, model)
+        session.connected = True
+        self._sessions[session.id] = session
+        self._stats["created"] += 1
+        return session, False
+
+    def release(self, session: ChatSession) -> None:
+        """连接断开，会话保留到空闲超时"""
+        session.connected = False
+        self.touch(session)
+
+    def touch(self, session: ChatSession) -> None:
+        """更新最近活动时间"""
+        session.last_active = time.monotonic()
+        if session.id in self._sessions:
+            self._sessions.move_to_end(session.id)
+
+    def append(self, session: ChatSession, role: str, content: str) -> None:
+        """
+        追加一条消息，超出消息数或字符数上限时丢弃最早的消息（最后一条始终保留）
+
+        Args:
+            session: 会话
+            role: 消息角色
+            content: 消息内容
+        """
+        session.messages.append({"role": role, "content": content})
+        session.chars += len(content)
+        self._enforce_limits(session)
+        self.touch(session)
+
+    def replace(self, session: ChatSession, messages: List[Dict[str, str]]) -> None:
+        """
+        用裁剪后的消息列表替换会话历史
+
+        Args:
+            session: 会话
+            messages: history() 经上下文裁剪后的结果（system 消息由会话单独保存）
+        """
+        session.messages = [
+            {"role": message["role"], "content": message["content"]}
+            for message in messages if message.get("role") != "system"
+        ]
+        session.chars = sum(len(message["content"]) for message in session.messages)
+
+    def pop_last(self, session: ChatSession) -> None:
+        """撤销最后一条消息（本轮失败时撤销用户消息）"""
+        if session.messages:
+            session.chars -= len(session.messages.pop()["content"])
+
+    def reset(self, session: ChatSession) -> None:
+        """清空会话历史"""
+        session.messages = []
+        session.chars = 0
+
+    def _enforce_limits(self, session: ChatSession) -> None:
+        dropped = 0
+        while len(session.messages) > 1 and (
+            len(session.messages) > self.max_messages or session.chars > self.max_chars
+        ):
+            session.chars -= len(session.messages.pop(0)["content"])
+            dropped += 1
+        if dropped:
+            self._stats["dropped_messages"] += dropped
+
+    def evict_idle(self) -> int:
+        """
+        淘汰已断开且超过空闲超时的会话
+
+        Returns:
+            淘汰的会话数
+        """
+        deadline = time.monotonic() - self.idle_timeout
+        expired = [
+            session.id for session in self._sessions.values()
+            if not session.connected and session.last_active < deadline
+        ]
+        for session_id in expired:
+            del self._sessions[session_id]
+        self._stats["evicted_idle"] += len(expired)
+        return len(expired)
+
+    async def run_evictor(self, interval: float = 30.0) -> None:
+        """定期淘汰空闲会话（后台任务）"""
+        while True:
+            await asyncio.sleep(interval)
+            evicted = self.evict_idle()
+            if evicted:
+                logger.debug(f"已淘汰 {evicted} 个空闲会话")
+
+    def get_stats(self) -> dict:
+        """获取会话统计"""
+        connected = sum(1 for session in self._sessions.values() if session.connected)
+        return {
+            "sessions": len(self._sessions),
+            "connected": connected,
+            "chars": sum(session.chars for session in self._sessions.values()),
+            **self._stats
+        }
+
+
+class DeltaCollector:
+    """
+    从上游 SSE 流中提取助手回复的文本增量
+
+    一个上游分块中到达的多个事件合并为一次增量，减少发给客户端的帧数。
+    """
+
+    def __init__(self):
+        self._parser = SSEParser()
+        self.parts: List[str] = []
+        self.finish_reason: Optional[str] = None
+        self.usage: Optional[Dict[str, Any]] = None
+        self.error: Optional[Dict[str, Any]] = None
+
+    def feed(self, chunk: bytes) -> str:
+        """
+        输入一个上游分块
+
+        Args:
+            chunk: 上游响应分块
+
+        Returns:
+            本分块中新增的回复文本（可能为空）
+        """
+        delta = []
+        for data in self._parser.feed(chunk):
+            if data == DONE:
+                continue
+            try:
+                event = json.loads(data)
+            except ValueError:
+                continue
+            if not isinstance(event, dict):
+                continue
+            if event.get("error"):
+                self.error = event["error"]
+            if event.get("usage"):
+                self.usage = event["usage"]
+            for choice in event.get("choices") or []:
+                content = (choice.get("delta") or {}).get("content")
+                if content:
+                    delta.append(content)
+                if choice.get("finish_reason"):
+                    self.finish_reason = choice["finish_reason"]
+
+        text = "".join(delta)
+        if text:
+            self.parts.append(text)
+        return text
+
+    @property
+    def content(self) -> str:
+        """目前为止的完整回复"""
+        return "".join(self.parts)
@@ -0,0 +1,163 @@
+"""
+压缩模块 - Accept-Encoding 协商与 gzip / br / zstd 压缩
+
+br 和 zstd 为可选依赖（brotli / zstandard），未安装时不参与协商。SSE 使用 StreamCompressor 逐块压缩并
+flush，每个输出分块都能立即解压出完整事件，同时保留跨事件的压缩上下文（后续事件中重复的 JSON 键几乎不占字节）。
+"""
+import gzip
+import zlib
+from typing import Dict, Iterable, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # 可选依赖，未安装时不协商 br
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖，未安装时不协商 zstd
+    zstandard = None
+
+
+# 按服务端偏好排序（q 值相同时优先选择靠前的编码）
+ENCODINGS = ("zstd", "br", "gzip")
+
+# 默认压缩级别：偏向速度，代理响应体大多是一次性的 JSON（gzip 6 比 5 的 CPU 开销高数倍，压缩率只提高约 2%，
+# 见 benchmarks/bench_compression.py）
+DEFAULT_LEVELS: Dict[str, int] = {"zstd": 3, "br": 4, "gzip": 5}
+
+
+def available_encodings(preferred: Iterable[str] = ENCODINGS) -> Tuple[str, ...]:
+    """
+    过滤出已安装依赖的编码
+
+    Args:
+        preferred: 按偏好排序的编码列表
+
+    Returns:
+        可用编码（保持原顺序）
+
+    Raises:
+        ValueError: 编码名称不支持时
+    """
+    installed = {"zstd": zstandard is not None, "br": brotli is not None, "gzip": True}
+    result = []
+    for encoding in preferred:
+        if encoding not in installed:
+            raise ValueError(f"不支持的压缩编码: {encoding}，可选: {', '.join(ENCODINGS)}")
+        if installed[encoding]:
+            result.append(encoding)
+    return tuple(result)
+
+
+def negotiate(accept_encoding: str, encodings: Iterable[str]) -> Optional[str]:
+    """
+    根据 Accept-Encoding 选择编码
+
+    Args:
+        accept_encoding: 请求头的值，如 "gzip, br;q=0.9, *;q=0"
+        encodings: 服务端可用编码，按偏好排序
+
+    Returns:
+        q 值最高的编码（相同时按服务端偏好），都不可接受时返回 None
+    """
+    qualities: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities["gzip" if name == "x-gzip" else name] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in encodings:
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    """
+    一次性压缩完整响应体（各实现在压缩时释放 GIL，可在线程池中并行执行）
+
+    Args:
+        data: 响应体
+        encoding: zstd / br / gzip
+        level: 压缩级别，省略时使用 DEFAULT_LEVELS
+
+    Returns:
+        压缩后的字节串
+    """
+    if level is None:
+        level = DEFAULT_LEVELS[encoding]
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    raise ValueError(f"不支持的压缩编码: {encoding}")
+
+
+def decompress(data: bytes, encoding: str) -> bytes:
+    """解压（用于测试和基准测试校验）"""
+    if encoding == "gzip":
+        return gzip.decompress(data)
+    if encoding == "br":
+        return brotli.decompress(data)
+    if encoding == "zstd":
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    raise ValueError(f"不支持的压缩编码: {encoding}")
+
+
+class StreamCompressor:
+    """流式压缩器：每次 compress() 的输出都已 flush，可独立发送"""
+
+    def __init__(self, encoding: str, level: Optional[int] = None):
+        """
+        Args:
+            encoding: zstd / br / gzip
+            level: 压缩级别，省略时使用 DEFAULT_LEVELS
+        """
+        if level is None:
+            level = DEFAULT_LEVELS[encoding]
+        self.encoding = encoding
+        if encoding == "gzip":
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        elif encoding == "br":
+            self._compressor = brotli.Compressor(quality=level)
+        elif encoding == "zstd":
+            self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        else:
+            raise ValueError(f"不支持的压缩编码: {encoding}")
+
+    def compress(self, data: bytes) -> bytes:
+        """
+        压缩一个分块并 flush
+
+        Args:
+            data: 分块（如一个或多个 SSE 事件）
+
+        Returns:
+            可立即发送的压缩数据
+        """
+        if self.encoding == "gzip":
+            return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        if self.encoding == "br":
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        """结束压缩流"""
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush()
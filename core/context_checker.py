@@ -0,0 +1,166 @@
+"""
+上下文检查模块 - 小请求内联估算，大请求卸载到线程/进程池执行
+"""
+import asyncio
+import logging
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+from config.model_config import check_context_limit, trim_messages_to_fit
+
+logger = logging.getLogger(__name__)
+
+
+class ContextChecker:
+    """上下文长度检查器，避免大体积 token 估算阻塞事件循环"""
+
+    def __init__(
+        self,
+        offload_threshold: int = 262_144,
+        pool_size: int = 2,
+        executor_type: str = "thread"
+    ):
+        """
+        初始化上下文检查器
+
+        Args:
+            offload_threshold: 消息总字符数达到该值时卸载到池中执行，<=0 表示始终内联
+            pool_size: 线程/进程池大小
+            executor_type: 池类型，thread 或 process
+        """
+        if executor_type not in ("thread", "process"):
+            raise ValueError(f"不支持的执行器类型: {executor_type}")
+
+        self.offload_threshold = offload_threshold
+        self.pool_size = max(pool_size, 1)
+        self.executor_type = executor_type
+
+        self._executor: Optional[Executor] = None
+        self._inline_checks = 0
+        self._offloaded_checks = 0
+
+    def _get_executor(self) -> Executor:
+        """延迟创建执行器"""
+        if self._executor is None:
+            if self.executor_type == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.pool_size)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.pool_size,
+                    thread_name_prefix="context-check"
+                )
+            logger.info(f"上下文检查池已创建: type={self.executor_type}, size={self.pool_size}")
+        return self._executor
+
+    @staticmethod
+    def payload_size(messages: list) -> int:
+        """
+        计算消息内容总字符数（O(消息数)，不遍历字符）
+
+        Args:
+            messages: 消息列表
+
+        Returns:
+            字符数
+        """
+        return sum(len(message.get("content") or "") for message in messages)
+
+    def should_offload(self, messages: list) -> bool:
+        """判断是否需要卸载到池中执行"""
+        return self.offload_threshold > 0 and self.payload_size(messages) >= self.offload_threshold
+
+    async def run(self, func, model: str, messages: list, *args):
+        """
+        按负载大小选择内联或卸载执行 CPU 密集的上下文计算
+
+        Args:
+            func: 模块级函数（进程池需要可序列化），签名为 func(model, messages, *args)
+            model: 模型名称
+            messages: 消息列表
+            *args: 其他位置参数
+
+        Returns:
+            函数返回值
+        """
+        if not self.should_offload(messages):
+            self._inline_checks += 1
+            return func(model, messages, *args)
+
+        self._offloaded_checks += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), func, model, messages, *args)
+
+    async def check(
+        self,
+        model: str,
+        messages: list,
+        max_tokens: Optional[int] = None
+    ) -> tuple[bool, int, int]:
+        """
+        检查 输入估算 + 请求输出 是否超出模型上下文限制
+
+        Args:
+            model: 模型名称
+            messages: 消息列表
+            max_tokens: 请求的最大输出 token 数
+
+        Returns:
+            (是否超限, 当前tokens数, 上限tokens数)
+        """
+        return await self.run(check_context_limit, model, messages, max_tokens)
+
+    async def trim(
+        self,
+        model: str,
+        messages: list,
+        max_tokens: Optional[int] = None,
+        policy: str = "drop_oldest"
+    ) -> tuple[list, dict]:
+        """
+        裁剪消息直到满足上下文限制
+
+        Args:
+            model: 模型名称
+            messages: 消息列表
+            max_tokens: 请求的最大输出 token 数
+            policy: 裁剪策略
+
+        Returns:
+            (裁剪后的消息列表, 裁剪信息)
+        """
+        return await self.run(trim_messages_to_fit, model, messages, max_tokens, policy)
+
+    async def warmup(self) -> Optional[dict]:
+        """
+        提前启动池中的全部工作线程/进程（进程池首次提交任务时才创建进程并导入模块，耗时较长）
+
+        Returns:
+            池信息；始终内联执行时不创建池，返回 None
+        """
+        if self.offload_threshold <= 0:
+            return None
+
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        probe = [{"role": "user", "content": "warmup"}]
+        await asyncio.gather(*(
+            loop.run_in_executor(executor, check_context_limit, "", probe, None)
+            for _ in range(self.pool_size)
+        ))
+        return {"executor": self.executor_type, "pool_size": self.pool_size}
+
+    def shutdown(self) -> None:
+        """关闭执行器"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def get_stats(self) -> dict:
+        """获取统计信息"""
+        return {
+            "executor": self.executor_type,
+            "pool_size": self.pool_size,
+            "offload_threshold": self.offload_threshold,
+            "inline_checks": self._inline_checks,
+            "offloaded_checks": self._offloaded_checks
+        }
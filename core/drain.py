@@ -0,0 +1,187 @@
+"""
+优雅排空模块 - 关闭或重载时等待进行中的请求完成，超过宽限期后干净地中止剩余请求
+
+排空开始后就绪检查返回 503、新请求被拒绝（503 + Retry-After + Connection: close），
+进行中的非流式和流式请求在宽限期内继续处理；宽限期结束时仍未完成的请求被中止：
+尚未发送响应头的请求返回 503，流式响应以一个 SSE 错误事件结束。
+"""
+import asyncio
+import logging
+import time
+from contextvars import ContextVar
+from typing import AsyncIterator, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+_current: ContextVar[Optional["InflightRequest"]] = ContextVar("inflight_request", default=None)
+
+
+class InflightRequest:
+    """一个进行中的请求（由中间件创建并绑定到上下文）"""
+
+    __slots__ = ("task", "response_started", "aborted", "_stream_task", "_reading")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.response_started = False
+        self.aborted = False
+        self._stream_task: Optional[asyncio.Task] = None
+        self._reading = False
+
+    def abort(self) -> None:
+        """
+        中止请求
+
+        流式转发正在等待上游分块时取消转发任务，分块之间只设置标记（下一次读取前检查）；
+        尚未发送响应头的请求取消处理任务，由中间件返回 503；其他已开始发送的响应不打断。
+        """
+        self.aborted = True
+        if self._stream_task is not None:
+            if self._reading:
+                self._stream_task.cancel()
+        elif not self.response_started:
+            self.task.cancel()
+
+    async def guard(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """逐块转发，中止时停止迭代（调用方检查 aborted 后发送结束事件）"""
+        self._stream_task = asyncio.current_task()
+        iterator = chunks.__aiter__()
+        try:
+            while not self.aborted:
+                self._reading = True
+                try:
+                    chunk = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return
+                except asyncio.CancelledError:
+                    if not self.aborted:
+                        raise
+                    if hasattr(self._stream_task, "uncancel"):
+                        self._stream_task.uncancel()
+                    return
+                finally:
+                    self._reading = False
+                yield chunk
+        finally:
+            self._stream_task = None
+
+
+def current_request() -> Optional[InflightRequest]:
+    """获取当前请求的排空句柄，未启用排空时返回 None"""
+    return _current.get()
+
+
+def guard_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    使流式转发可在排空宽限期结束时中止
+
+    Args:
+        chunks: 上游分块迭代器
+
+    Returns:
+        未启用排空时原样返回，否则返回可中止的迭代器
+    """
+    inflight = _current.get()
+    return chunks if inflight is None else inflight.guard(chunks)
+
+
+class DrainController:
+    """进行中请求的登记与排空"""
+
+    def __init__(self, grace_period: float = 20.0, retry_after: int = 5, abort_timeout: float = 5.0):
+        """
+        初始化排空控制器
+
+        Args:
+            grace_period: 等待进行中请求完成的最长时间（秒）
+            retry_after: 排空期间拒绝新请求时的 Retry-After（秒）
+            abort_timeout: 中止剩余请求后等待其结束的最长时间（秒）
+        """
+        self.grace_period = grace_period
+        self.retry_after = retry_after
+        self.abort_timeout = abort_timeout
+
+        self.draining = False
+        self._draining = asyncio.Event()
+        self._inflight: set = set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._stats: Dict[str, int] = {"drained": 0, "aborted": 0, "rejected": 0}
+        self._started_at: Optional[float] = None
+        self._finished_at: Optional[float] = None
+
+    @property
+    def inflight(self) -> int:
+        """进行中的请求数"""
+        return len(self._inflight)
+
+    def enter(self) -> tuple:
+        """
+        登记当前请求并绑定到上下文
+
+        Returns:
+            (InflightRequest, contextvar token)
+        """
+        inflight = InflightRequest(asyncio.current_task())
+        self._inflight.add(inflight)
+        self._idle.clear()
+        return inflight, _current.set(inflight)
+
+    def exit(self, inflight: InflightRequest, token) -> None:
+        """注销请求"""
+        _current.reset(token)
+        self._inflight.discard(inflight)
+        if self.draining:
+            self._stats["aborted" if inflight.aborted else "drained"] += 1
+        if not self._inflight:
+            self._idle.set()
+
+    async def wait_draining(self) -> None:
+        """等待排空开始（长连接在空闲时据此主动关闭）"""
+        await self._draining.wait()
+
+    def reject(self) -> None:
+        """记录一次排空期间被拒绝的请求"""
+        self._stats["rejected"] += 1
+
+    async def drain(self) -> Dict[str, int]:
+        """
+        开始排空并等待进行中的请求完成，超过宽限期后中止剩余请求
+
+        Returns:
+            统计（drained 在宽限期内完成、aborted 被中止、rejected 被拒绝的新请求）
+        """
+        if self.draining:
+            await self._idle.wait()
+            return self.get_stats()
+
+        self.draining = True
+        self._draining.set()
+        self._started_at = time.monotonic()
+        logger.info(f"开始排空: 进行中请求 {self.inflight} 个，宽限期 {self.grace_period}s")
+
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=self.grace_period)
+        except asyncio.TimeoutError:
+            logger.warning(f"排空宽限期已到，中止剩余 {self.inflight} 个请求")
+            for inflight in list(self._inflight):
+                inflight.abort()
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout=self.abort_timeout)
+            except asyncio.TimeoutError:
+                logger.error(f"中止后仍有 {self.inflight} 个请求未结束")
+
+        self._finished_at = time.monotonic()
+        stats = self.get_stats()
+        logger.info(
+            f"排空完成: 完成 {stats['drained']} 个，中止 {stats['aborted']} 个，"
+            f"拒绝新请求 {stats['rejected']} 个，耗时 {stats['duration_s']}s"
+        )
+        return stats
+
+    def get_stats(self) -> dict:
+        """获取排空状态"""
+        duration = None
+        if self._started_at is not None:
+            duration = round((self._finished_at or time.monotonic()) - self._started_at, 2)
+        return {"draining": self.draining, "inflight": self.inflight, **self._stats, "duration_s": duration}
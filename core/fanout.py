@@ -0,0 +1,214 @@
+"""
+扇出模块 - 将 n>1 的请求拆分为 n 个并行的 n=1 上游请求（轮询到不同密钥），再合并为一个响应
+"""
+import asyncio
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+from .proxy import ProxyService
+from .sse import DONE, format_sse_data, iter_sse_data
+
+logger = logging.getLogger(__name__)
+
+
+USAGE_FIELDS = ("prompt_tokens", "completion_tokens", "total_tokens")
+
+
+def merge_completions(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    合并多个 n=1 的非流式响应
+
+    Args:
+        results: 上游响应列表，顺序即合并后的 choice 索引
+
+    Returns:
+        合并后的响应：choices 重新编号，usage 求和（上游按 n 次请求计费）
+    """
+    merged = dict(results[0])
+    choices = []
+    usage: Dict[str, int] = {}
+
+    for index, result in enumerate(results):
+        for choice in result.get("choices") or []:
+            choices.append({**choice, "index": index})
+        for field in USAGE_FIELDS:
+            value = (result.get("usage") or {}).get(field)
+            if value is not None:
+                usage[field] = usage.get(field, 0) + value
+
+    merged["choices"] = choices
+    if usage:
+        merged["usage"] = usage
+    return merged
+
+
+async def _gather_or_cancel(coroutines: list) -> list:
+    """并发执行，任一失败时取消其余请求并抛出第一个异常"""
+    tasks = [asyncio.create_task(coroutine) for coroutine in coroutines]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+class FanoutStream:
+    """
+    合并多个 n=1 的上游流
+
+    各上游流的 delta 按到达顺序交错转发，choice 索引改写为上游流的序号，响应 ID 统一为
+    第一个到达分块的 ID，usage 分块（如有）求和后在结束前发送一次，最后发送一个 [DONE]。
+    接口与 UpstreamStream 一致（aiter_bytes / aclose / status_code / headers）。
+    """
+
+    def __init__(self, streams: list):
+        self._streams = streams
+        self.status_code = streams[0].status_code
+        self.headers = streams[0].headers
+        self._response_id: Optional[str] = None
+        self._usage: Dict[str, int] = {}
+        self._last_chunk: Optional[Dict[str, Any]] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def _rewrite(self, index: int, data: str) -> Optional[bytes]:
+        """改写单个事件，usage-only 分块暂存不转发"""
+        chunk = json.loads(data)
+        if not isinstance(chunk, dict):
+            return format_sse_data(data)
+
+        if self._response_id is None:
+            self._response_id = chunk.get("id")
+        if self._response_id is not None:
+            chunk["id"] = self._response_id
+
+        usage = chunk.pop("usage", None)
+        if usage:
+            for field in USAGE_FIELDS:
+                if usage.get(field) is not None:
+                    self._usage[field] = self._usage.get(field, 0) + usage[field]
+
+        choices = chunk.get("choices")
+        if not choices:
+            self._last_chunk = chunk
+            return None
+
+        chunk["choices"] = [{**choice, "index": index} for choice in choices]
+        self._last_chunk = chunk
+        return format_sse_data(json.dumps(chunk, ensure_ascii=False))
+
+    async def _pump(self, index: int, stream, queue: asyncio.Queue) -> None:
+        """读取单个上游流并写入合并队列"""
+        try:
+            async for data in iter_sse_data(stream.aiter_bytes()):
+                if data == DONE:
+                    continue
+                event = self._rewrite(index, data)
+                if event is not None:
+                    await queue.put(event)
+        except Exception as e:
+            # 消费方收到异常后立即结束，无需再发送结束标记
+            await queue.put(e)
+            return
+        await queue.put(None)
+
+    async def aiter_bytes(self):
+        """交错读取所有上游流"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=len(self._streams) * 4)
+        self._tasks = [
+            asyncio.create_task(self._pump(index, stream, queue))
+            for index, stream in enumerate(self._streams)
+        ]
+
+        try:
+            remaining = len(self._tasks)
+            while remaining:
+                item = await queue.get()
+                if item is None:
+                    remaining -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item
+
+            if self._usage and self._last_chunk is not None:
+                usage_chunk = {**self._last_chunk, "choices": [], "usage": self._usage}
+                yield format_sse_data(json.dumps(usage_chunk, ensure_ascii=False))
+            yield format_sse_data(DONE)
+        finally:
+            await self.aclose()
+
+    async def aclose(self) -> None:
+        """停止读取并关闭所有上游连接"""
+        for task in self._tasks:
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        for stream in self._streams:
+            await stream.aclose()
+
+
+async def fanout_chat_completion(
+    proxy_service: ProxyService,
+    model: str,
+    messages: list,
+    n: int,
+    **kwargs
+):
+    """
+    将 n>1 的请求拆分为 n 个并行的 n=1 请求
+
+    代理服务按轮询分配密钥，并行请求会落在不同密钥上，延迟接近单次请求而不随 n 线性增长。
+
+    Args:
+        proxy_service: 代理服务
+        model: 模型名称
+        messages: 消息列表
+        n: 结果数量
+        **kwargs: 其他参数（stream 决定返回类型）
+
+    Returns:
+        非流式返回合并后的响应，流式返回 FanoutStream
+
+    Raises:
+        任一子请求失败时抛出其异常（其余子请求会被取消）
+    """
+    kwargs["n"] = 1
+    logger.info(f"扇出请求: model={model}, n={n}, stream={kwargs.get('stream', False)}")
+
+    if not kwargs.get("stream"):
+        results = await _gather_or_cancel([
+            proxy_service.chat_completion(model=model, messages=messages, **kwargs)
+            for _ in range(n)
+        ])
+        return merge_completions(results)
+
+    # 流式：任一上游未能建立连接（或请求被取消）时关闭已建立的连接
+    tasks = [
+        asyncio.create_task(proxy_service.chat_completion(model=model, messages=messages, **kwargs))
+        for _ in range(n)
+    ]
+    try:
+        await asyncio.wait(tasks)
+    except asyncio.CancelledError:
+        for task in tasks:
+            task.cancel()
+        await asyncio.wait(tasks)
+        await _close_opened(tasks)
+        raise
+
+    errors = [task.exception() for task in tasks if task.exception() is not None]
+    if errors:
+        await _close_opened(tasks)
+        raise errors[0]
+
+    return FanoutStream([task.result() for task in tasks])
+
+
+async def _close_opened(tasks: List[asyncio.Task]) -> None:
+    """关闭已成功建立的上游流"""
+    for task in tasks:
+        if not task.cancelled() and task.exception() is None:
+            await task.result().aclose()
@@ -2,7 +2,9 @@
 HTTP客户端模块 - 支持自动重试和超时控制
 """
 import asyncio
+import json
 import logging
+import math
 from typing import Optional, Dict, Any
 import httpx
 from tenacity import (
@@ -13,42 +15,192 @@ from tenacity import (
     before_sleep_log
 )
 
+from config.model_config import get_model_timeouts
+from .metrics import UPSTREAM_RETRIES
+from .timing import UpstreamTrace, current_timer, record
+from .tracing import add_event, set_attributes
+
 logger = logging.getLogger(__name__)
 
+_log_before_sleep = before_sleep_log(logger, logging.WARNING)
+
+_retry_wait = wait_exponential(multiplier=1, min=1, max=10)
+
+
+def _before_retry_sleep(retry_state) -> None:
+    """重试前记录日志、重试次数指标和追踪事件"""
+    error = retry_state.outcome.exception()
+    UPSTREAM_RETRIES.inc(type(error).__name__)
+    add_event(
+        "retry", reason=type(error).__name__, error=str(error), attempt=retry_state.attempt_number,
+        sleep_seconds=retry_state.next_action.sleep if retry_state.next_action else None
+    )
+    _log_before_sleep(retry_state)
+
+
+def _stop_at_deadline(retry_state) -> bool:
+    """重试等待结束时已超过总截止时间则停止重试（截止时间在首次尝试前计算，所有重试共享）"""
+    deadline = retry_state.kwargs["deadline"]
+    return asyncio.get_running_loop().time() + _retry_wait(retry_state) >= deadline
+
+
+class PhaseTimeout(httpx.TimeoutException):
+    """分阶段超时（connect / pool / first_byte / idle / write / total）"""
+
+    def __init__(self, kind: str, message: str, request: Optional[httpx.Request] = None):
+        super().__init__(message, request=request)
+        self.kind = kind
+
+
+class UpstreamStream:
+    """
+    上游流式响应包装，按分块检查空闲超时和总截止时间
+
+    httpx 的 read 超时需要容纳首字节超时，不能用来限制分块间隔，因此空闲超时由一个定时器单独检查：
+    定时器只在到期时检查是否仍在等待同一个分块，未超时则按剩余时间重新设置，每个分块只需记录开始等待的时间，
+    不必为每次读取创建和取消超时（流式转发的热路径，见 tests/test_microbench.py）。
+    等待中超时时取消读取并抛出 PhaseTimeout（idle / total）；总截止时间另外在每个分块到达时检查。
+    """
+
+    def __init__(
+        self,
+        client: "MegaLLMClient",
+        response: httpx.Response,
+        deadline: float,
+        model: str,
+        idle_timeout: float = math.inf
+    ):
+        self._client = client
+        self.response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self._deadline = deadline
+        self._model = model
+        self._idle_timeout = idle_timeout
+
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wait_started: Optional[float] = None
+        self._expired: Optional[str] = None
+
+    def _arm(self, loop: asyncio.AbstractEventLoop, now: float) -> asyncio.TimerHandle:
+        """设置下一次检查的定时器"""
+        started = self._wait_started if self._wait_started is not None else now
+        return loop.call_at(min(started + self._idle_timeout, self._deadline), self._check, loop)
+
+    def _check(self, loop: asyncio.AbstractEventLoop) -> None:
+        """定时器回调：等待分块超时则取消读取，否则重新设置定时器"""
+        now = loop.time()
+        if self._wait_started is not None and self._task is not None:
+            if now >= self._deadline:
+                self._expired = "total"
+            elif now - self._wait_started >= self._idle_timeout:
+                self._expired = "idle"
+            if self._expired is not None:
+                self._task.cancel()
+                return
+        self._timer = self._arm(loop, now)
+
+    async def aiter_bytes(self):
+        """逐块读取上游响应"""
+        loop = asyncio.get_running_loop()
+        chunks = self.response.aiter_bytes()
+        if self._idle_timeout != math.inf or self._deadline != math.inf:
+            self._timer = self._arm(loop, loop.time())
+        try:
+            while True:
+                self._task = asyncio.current_task()
+                self._wait_started = loop.time()
+                try:
+                    chunk = await chunks.__anext__()
+                except StopAsyncIteration:
+                    break
+                except asyncio.CancelledError as e:
+                    if self._expired is None:
+                        raise
+                    if hasattr(self._task, "uncancel"):
+                        self._task.uncancel()
+                    if self._expired == "idle":
+                        raise self._client._timeout("idle", f"响应体分块空闲超时: model={self._model}") from e
+                    raise self._client._timeout("total", f"响应体超过总截止时间: model={self._model}") from e
+                except httpx.ReadTimeout as e:
+                    raise self._client._timeout("idle", f"响应体分块空闲超时: model={self._model}") from e
+                finally:
+                    self._wait_started = None
+                yield chunk
+                if loop.time() > self._deadline:
+                    raise self._client._timeout("total", f"响应体超过总截止时间: model={self._model}")
+        finally:
+            if self._timer is not None:
+                self._timer.cancel()
+            await self.response.aclose()
+
+    async def aread(self) -> bytes:
+        """读取完整响应体（同样按分块检查空闲超时和总截止时间）"""
+        return b"".join([chunk async for chunk in self.aiter_bytes()])
+
+    async def aclose(self) -> None:
+        """关闭上游连接"""
+        await self.response.aclose()
+
 
 class MegaLLMClient:
     """MegaLLM API客户端，支持自动重试和故障转移"""
 
+    TIMEOUT_KINDS = ("connect", "pool", "first_byte", "idle", "write", "total")
+
     def __init__(
         self,
         base_url: str = "https://ai.megallm.io/v1",
         timeout: float = 120.0,
         max_retries: int = 3,
-        retry_multiplier: float = 1.5
+        retry_multiplier: float = 1.5,
+        connect_timeout: float = 10.0,
+        pool_timeout: float = 10.0,
+        first_byte_timeout: float = 60.0,
+        idle_timeout: float = 30.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None
     ):
         """
         初始化HTTP客户端
 
         Args:
             base_url: API基础URL
-            timeout: 请求超时时间（秒）
+            timeout: 单次请求总截止时间（秒）
             max_retries: 最大重试次数
             retry_multiplier: 重试等待时间倍数
+            connect_timeout: 建立连接（含TLS握手）超时（秒）
+            pool_timeout: 等待连接池空闲连接超时（秒）
+            first_byte_timeout: 发出请求到收到响应头的超时（秒）
+            idle_timeout: 响应体相邻两个分块之间的空闲超时（秒）
+            transport: 自定义 httpx 传输层（基准测试中替换为模拟上游），默认为 HTTP/2 连接池
         """
         self.base_url = base_url.rstrip('/')
         self.timeout = timeout
         self.max_retries = max_retries
         self.retry_multiplier = retry_multiplier
+        self.default_timeouts = {
+            "connect": connect_timeout,
+            "pool": pool_timeout,
+            "first_byte": first_byte_timeout,
+            "idle": idle_timeout,
+            "total": timeout
+        }
 
         # 使用httpx异步客户端
         self._client: Optional[httpx.AsyncClient] = None
+        self._transport = transport
+
+        # 按超时类型计数，用于根据数据调整超时配置
+        self._timeout_counts: Dict[str, int] = {kind: 0 for kind in self.TIMEOUT_KINDS}
 
     async def __aenter__(self):
         """异步上下文管理器入口"""
         self._client = httpx.AsyncClient(
-            timeout=httpx.Timeout(self.timeout),
+            timeout=self._httpx_timeout(self.default_timeouts),
             limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
-            http2=True  # 启用HTTP/2支持
+            http2=True,  # 启用HTTP/2支持
+            transport=self._transport
         )
         return self
 
@@ -57,13 +209,47 @@ class MegaLLMClient:
         if self._client:
             await self._client.aclose()
 
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=1, max=10),
-        retry=retry_if_exception_type((httpx.TimeoutException, httpx.NetworkError)),
-        before_sleep=before_sleep_log(logger, logging.WARNING),
-        reraise=True
-    )
+    @staticmethod
+    def _httpx_timeout(timeouts: Dict[str, float]) -> httpx.Timeout:
+        """
+        将分阶段超时转换为 httpx 超时
+
+        httpx 的 read 超时同时限制等待响应头和读取响应体，因此取首字节超时和空闲超时中较大者，
+        否则空闲超时会截断首字节超时；分块之间的空闲超时由 UpstreamStream 单独检查。
+        """
+        return httpx.Timeout(
+            connect=timeouts["connect"],
+            read=max(timeouts["first_byte"], timeouts["idle"]),
+            write=timeouts["idle"],
+            pool=timeouts["pool"]
+        )
+
+    def _timeout(self, kind: str, message: str, request: Optional[httpx.Request] = None) -> PhaseTimeout:
+        """记录并生成分阶段超时异常"""
+        self._timeout_counts[kind] += 1
+        logger.warning("请求超时 [%s]: %s", kind, message)
+        return PhaseTimeout(kind, message, request=request)
+
+    def get_timeout_stats(self) -> Dict[str, int]:
+        """获取各类超时次数"""
+        return dict(self._timeout_counts)
+
+    def get_pool_stats(self) -> Dict[str, int]:
+        """获取连接池使用情况（依赖 httpcore 连接池内部属性，不可用时返回空字典）"""
+        pool = getattr(getattr(self._client, "_transport", None), "_pool", None)
+        if pool is None:
+            return {}
+        connections = list(getattr(pool, "connections", []))
+        requests = list(getattr(pool, "_requests", []))
+        idle = sum(1 for connection in connections if connection.is_idle())
+        waiting = sum(1 for pool_request in requests if pool_request.is_queued())
+        return {
+            "connections_active": len(connections) - idle,
+            "connections_idle": idle,
+            "requests_in_flight": len(requests) - waiting,
+            "requests_waiting": waiting
+        }
+
     async def chat_completion(
         self,
         api_key: str,
@@ -72,7 +258,7 @@ class MegaLLMClient:
         **kwargs
     ):
         """
-        调用聊天补全API
+        调用聊天补全API（超时和网络错误自动重试，总超时覆盖全部重试）
 
         Args:
             api_key: API密钥
@@ -81,13 +267,50 @@ class MegaLLMClient:
             **kwargs: 其他参数（temperature, max_tokens等）
 
         Returns:
-            API响应字典（非流式）或 httpx.Response（流式）
+            API响应字典（非流式）或 UpstreamStream（流式）
 
         Raises:
             httpx.HTTPStatusError: HTTP错误
-            httpx.TimeoutException: 超时错误
+            httpx.TimeoutException: 超时错误（PhaseTimeout 标明超时阶段）
             httpx.NetworkError: 网络错误
         """
+        # 按模型覆盖超时配置
+        timeouts = get_model_timeouts(model, self.default_timeouts)
+        deadline = asyncio.get_running_loop().time() + timeouts["total"]
+        return await self._send_chat_completion(
+            api_key, model, messages, timeouts=timeouts, deadline=deadline, **kwargs
+        )
+
+    @retry(
+        stop=stop_after_attempt(3) | _stop_at_deadline,
+        wait=_retry_wait,
+        retry=retry_if_exception_type((httpx.TimeoutException, httpx.NetworkError)),
+        before_sleep=_before_retry_sleep,
+        reraise=True
+    )
+    async def _send_chat_completion(
+        self,
+        api_key: str,
+        model: str,
+        messages: list,
+        timeouts: Dict[str, float],
+        deadline: float,
+        **kwargs
+    ):
+        """
+        发送一次聊天补全请求（由 chat_completion 调用并重试）
+
+        Args:
+            api_key: API密钥
+            model: 模型名称
+            messages: 消息列表
+            timeouts: 分阶段超时配置
+            deadline: 总截止时间（事件循环时钟）
+            **kwargs: 其他参数
+
+        Returns:
+            API响应字典（非流式）或 UpstreamStream（流式）
+        """
         if not self._client:
             raise RuntimeError("客户端未初始化，请使用async with语句")
 
@@ -106,42 +329,109 @@ class MegaLLMClient:
         # 判断是否为流式请求
         is_stream = kwargs.get("stream", False)
 
-        logger.info(f"发送请求到MegaLLM API: model={model}, messages_count={len(messages)}, stream={is_stream}")
+        loop = asyncio.get_running_loop()
+
+        logger.debug("发送请求到MegaLLM API: model=%s, messages_count=%d, stream=%s", model, len(messages), is_stream)
+
+        request = self._client.build_request(
+            "POST", url, json=payload, headers=headers,
+            timeout=self._httpx_timeout(timeouts)
+        )
+
+        # 启用 Server-Timing 时通过 httpx trace 扩展拆分 连接池等待 / 建立连接 / 首字节 耗时
+        timer = current_timer()
+        trace = UpstreamTrace(timer) if timer is not None else None
+        if trace is not None:
+            request.extensions["trace"] = trace
 
         try:
-            response = await self._client.post(url, json=payload, headers=headers)
-            response.raise_for_status()
+            # 首字节超时：从发出请求到收到响应头（不超过剩余的总时间）
+            remaining = deadline - loop.time()
+            try:
+                response = await asyncio.wait_for(
+                    self._client.send(request, stream=True),
+                    timeout=min(timeouts["first_byte"], remaining)
+                )
+            except asyncio.TimeoutError as e:
+                kind = "first_byte" if timeouts["first_byte"] <= remaining else "total"
+                raise self._timeout(kind, f"等待响应头超时: model={model}", request) from e
+            except httpx.ReadTimeout as e:
+                raise self._timeout("first_byte", f"等待响应头超时: model={model}", request) from e
+
+            if trace is not None:
+                trace.finish()
+            set_attributes(**{"http.status_code": response.status_code})
+
+            if response.status_code >= 400:
+                await response.aread()
+                await response.aclose()
+                response.raise_for_status()
+
+            upstream = UpstreamStream(self, response, deadline, model, timeouts["idle"])
 
-            # 流式响应直接返回 response 对象
+            # 流式响应返回包装对象，由调用方逐块读取
             if is_stream:
-                logger.info(f"流式请求成功: model={model}")
-                return response
+                logger.debug("流式请求成功: model=%s", model)
+                return upstream
 
-            # 非流式响应解析 JSON
-            result = response.json()
-            logger.info(f"请求成功: model={model}, usage={result.get('usage', {})}")
+            # 非流式响应逐块读取完整响应体（检查空闲超时和总截止时间）
+            body_started = loop.time()
+            try:
+                body = await upstream.aread()
+            finally:
+                record("body", loop.time() - body_started)
+
+            result = json.loads(body)
+            logger.debug("请求成功: model=%s, usage=%s", model, result.get("usage"))
             return result
 
         except httpx.HTTPStatusError as e:
-            logger.error(f"HTTP错误 [{e.response.status_code}]: {e.response.text}")
+            logger.error("HTTP错误 [%d]: %s", e.response.status_code, e.response.text)
             # 对于4xx错误不重试
             if 400 <= e.response.status_code < 500:
                 raise
             # 5xx错误会被重试
             raise
 
-        except httpx.TimeoutException as e:
-            logger.warning(f"请求超时: {e}")
+        except PhaseTimeout:
             raise
 
+        except httpx.TimeoutException as e:
+            kind = {
+                httpx.ConnectTimeout: "connect",
+                httpx.PoolTimeout: "pool",
+                httpx.WriteTimeout: "write"
+            }.get(type(e), "idle")
+            raise self._timeout(kind, f"{e}: model={model}", request) from e
+
         except httpx.NetworkError as e:
-            logger.warning(f"网络错误: {e}")
+            logger.warning("网络错误: %s", e)
             raise
 
         except Exception as e:
             logger.error(f"未知错误: {e}")
             raise
 
+    async def warmup(self, api_key: str) -> int:
+        """
+        预建立上游连接（含 TLS 握手和 HTTP/2 协商），连接保留在连接池中供后续请求复用
+
+        Args:
+            api_key: API密钥
+
+        Returns:
+            上游 GET /models 的状态码
+        """
+        if not self._client:
+            raise RuntimeError("客户端未初始化，请使用async with语句")
+
+        response = await self._client.get(
+            f"{self.base_url}/models",
+            headers={"Authorization": f"Bearer {api_key}"},
+            timeout=httpx.Timeout(self.default_timeouts["first_byte"], connect=self.default_timeouts["connect"])
+        )
+        return response.status_code
+
     async def health_check(self, api_key: str) -> bool:
         """
         健康检查
@@ -168,15 +458,17 @@ class MegaLLMClient:
 async def create_client(
     base_url: str = "https://ai.megallm.io/v1",
     timeout: float = 120.0,
-    max_retries: int = 3
+    max_retries: int = 3,
+    **timeouts
 ) -> MegaLLMClient:
     """
     创建HTTP客户端（工厂函数）
 
     Args:
         base_url: API基础URL
-        timeout: 请求超时时间
+        timeout: 单次请求总截止时间
         max_retries: 最大重试次数
+        **timeouts: 分阶段超时（connect_timeout, pool_timeout, first_byte_timeout, idle_timeout）
 
     Returns:
         MegaLLMClient实例
@@ -184,5 +476,6 @@ async def create_client(
     return MegaLLMClient(
         base_url=base_url,
         timeout=timeout,
-        max_retries=max_retries
+        max_retries=max_retries,
+        **timeouts
     )
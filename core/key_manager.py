@@ -6,9 +6,24 @@ from pathlib import Path
 from typing import List, Optional
 import logging
 
+from .metrics import KEY_FAILURES
+
 logger = logging.getLogger(__name__)
 
 
+def mask_key(key: str) -> str:
+    """
+    生成密钥的脱敏标识（用于指标标签，前缀相同的密钥也能区分）
+
+    Args:
+        key: API密钥
+
+    Returns:
+        形如 sk-...abcd 的标识
+    """
+    return f"{key[:3]}...{key[-4:]}"
+
+
 class KeyManager:
     """API密钥管理器，支持轮询和故障转移"""
 
@@ -62,7 +77,7 @@ class KeyManager:
 
                 # 跳过已失败的key
                 if key not in self._failed_keys:
-                    logger.debug(f"使用密钥: {key[:8]}***")
+                    logger.debug("使用密钥: %s", mask_key(key))
                     return key
 
                 attempts += 1
@@ -76,6 +91,7 @@ class KeyManager:
         Args:
             key: 失败的API密钥
         """
+        KEY_FAILURES.inc(mask_key(key))
         with self._lock:
             self._failed_keys.add(key)
             logger.warning(f"密钥已标记为失败: {key[:8]}***，剩余可用密钥: {len(self._keys) - len(self._failed_keys)}")
@@ -0,0 +1,379 @@
+"""
+指标模块 - 进程内计数器/直方图，Prometheus 文本格式导出，多 worker 通过快照文件聚合
+
+热路径只做一次字典查找和整数加法：所有指标都在事件循环线程中更新，无需加锁。
+多 worker 部署时每个 worker 定期把自己的指标快照写入共享目录，/metrics 读取全部快照后合并。
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from bisect import bisect_left
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+# 默认延迟分桶（秒），覆盖从本地处理到长推理请求的范围
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class Counter:
+    """单调递增计数器"""
+
+    __slots__ = ("name", "help", "labelnames", "values")
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values: Dict[tuple, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        """
+        增加计数
+
+        Args:
+            *labels: 标签值，顺序与 labelnames 一致
+            amount: 增加量
+        """
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Histogram:
+    """分桶直方图（各桶内部存储非累计计数，导出时累加）"""
+
+    __slots__ = ("name", "help", "labelnames", "buckets", "values")
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # 每个标签组合: [桶0计数, ..., +Inf桶计数, 总和, 总数]
+        self.values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        """
+        记录观测值
+
+        Args:
+            value: 观测值
+            *labels: 标签值，顺序与 labelnames 一致
+        """
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        entry[bisect_left(self.buckets, value)] += 1
+        entry[-2] += value
+        entry[-1] += 1
+
+
+class MetricsRegistry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._collectors: List[Callable[[], List[dict]]] = []
+        self.multiprocess_dir: Optional[Path] = None
+        self.flush_interval = 5.0
+
+    def counter(self, name: str, help: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        """注册计数器（重复注册返回已有实例）"""
+        if name not in self._metrics:
+            self._metrics[name] = Counter(name, help, labelnames)
+        return self._metrics[name]
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        """注册直方图（重复注册返回已有实例）"""
+        if name not in self._metrics:
+            self._metrics[name] = Histogram(name, help, labelnames, buckets)
+        return self._metrics[name]
+
+    def register_collector(self, collector: Callable[[], List[dict]]) -> None:
+        """
+        注册采集函数，抓取时调用，用于导出其他组件的当前状态
+
+        Args:
+            collector: 返回指标族列表，每项为
+                {"name", "type": "gauge"|"counter", "help", "labelnames", "values": [[labels, value]], "mode"}
+                mode 为多进程模式下仪表盘的聚合方式（sum / max / min，默认 sum）
+        """
+        self._collectors.append(collector)
+
+    def clear_collectors(self) -> None:
+        """移除所有采集函数（应用关闭时调用）"""
+        self._collectors = []
+
+    def snapshot(self) -> Dict[str, dict]:
+        """
+        生成当前进程的指标快照（可 JSON 序列化）
+
+        Returns:
+            {指标名: {"type", "help", "labelnames", "values": [[labels, value]], ...}}
+        """
+        families: Dict[str, dict] = {}
+        for metric in self._metrics.values():
+            family = {
+                "type": "histogram" if isinstance(metric, Histogram) else "counter",
+                "help": metric.help,
+                "labelnames": list(metric.labelnames),
+                "values": [[list(labels), value if isinstance(value, (int, float)) else list(value)]
+                           for labels, value in metric.values.items()]
+            }
+            if isinstance(metric, Histogram):
+                family["buckets"] = list(metric.buckets)
+            families[metric.name] = family
+
+        for collector in self._collectors:
+            try:
+                for family in collector():
+                    families[family["name"]] = {
+                        "type": family["type"],
+                        "help": family["help"],
+                        "labelnames": list(family.get("labelnames", ())),
+                        "values": [[list(labels), value] for labels, value in family["values"]],
+                        "mode": family.get("mode", "sum")
+                    }
+            except Exception as e:
+                logger.warning(f"指标采集失败: {e}")
+
+        return families
+
+    def enable_multiprocess(self, directory: str, flush_interval: float = 5.0) -> None:
+        """
+        启用多进程模式
+
+        Args:
+            directory: 各 worker 快照文件所在的共享目录
+            flush_interval: 快照写入间隔（秒）
+        """
+        self.multiprocess_dir = Path(directory)
+        self.multiprocess_dir.mkdir(parents=True, exist_ok=True)
+        self.flush_interval = flush_interval
+
+    @property
+    def snapshot_path(self) -> Path:
+        """当前 worker 的快照文件路径"""
+        return self.multiprocess_dir / f"metrics_{os.getpid()}.json"
+
+    def write_snapshot(self, families: Dict[str, dict]) -> None:
+        """原子写入快照文件（阻塞 IO，在线程中执行）"""
+        path = self.snapshot_path
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"pid": os.getpid(), "time": time.time(), "metrics": families}, f)
+        os.replace(tmp_path, path)
+
+    async def run_flusher(self) -> None:
+        """后台任务：定期写入快照，退出时写入最后一次"""
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                await asyncio.to_thread(self.write_snapshot, self.snapshot())
+        finally:
+            self.write_snapshot(self.snapshot())
+
+    def _read_other_snapshots(self) -> List[Tuple[float, Dict[str, dict]]]:
+        """读取其他 worker 的快照（阻塞 IO，在线程中执行）"""
+        snapshots = []
+        own_path = self.snapshot_path
+        for path in self.multiprocess_dir.glob("metrics_*.json"):
+            if path == own_path:
+                continue
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                snapshots.append((data["time"], data["metrics"]))
+            except (OSError, ValueError, KeyError) as e:
+                logger.debug(f"读取指标快照失败: {path}, {e}")
+        return snapshots
+
+    async def collect(self) -> Dict[str, dict]:
+        """
+        采集指标：单进程模式直接返回本进程快照，多进程模式合并所有 worker 的快照
+
+        计数器和直方图跨 worker 求和（已退出 worker 的累计值保留）；仪表盘只取最近
+        3 个写入间隔内有更新的 worker，按 mode 聚合。
+        """
+        own = self.snapshot()
+        if self.multiprocess_dir is None:
+            return own
+
+        others = await asyncio.to_thread(self._read_other_snapshots)
+        fresh_after = time.time() - 3 * self.flush_interval
+        return merge_snapshots([own] + [
+            metrics if written >= fresh_after else {
+                name: family for name, family in metrics.items() if family["type"] != "gauge"
+            }
+            for written, metrics in others
+        ])
+
+    async def render(self) -> str:
+        """生成 Prometheus 文本格式"""
+        return render_text(await self.collect())
+
+
+def merge_snapshots(snapshots: List[Dict[str, dict]]) -> Dict[str, dict]:
+    """
+    合并多个 worker 的指标快照
+
+    Args:
+        snapshots: 快照列表
+
+    Returns:
+        合并后的快照
+    """
+    merged: Dict[str, dict] = {}
+    for families in snapshots:
+        for name, family in families.items():
+            target = merged.get(name)
+            if target is None:
+                target = merged[name] = {**family, "values": {}}
+            values = target["values"]
+            mode = family.get("mode", "sum")
+
+            for labels, value in family["values"]:
+                key = tuple(labels)
+                current = values.get(key)
+                if current is None:
+                    values[key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    values[key] = [a + b for a, b in zip(current, value)]
+                elif family["type"] == "gauge" and mode == "max":
+                    values[key] = max(current, value)
+                elif family["type"] == "gauge" and mode == "min":
+                    values[key] = min(current, value)
+                else:
+                    values[key] = current + value
+
+    for family in merged.values():
+        family["values"] = [[list(labels), value] for labels, value in family["values"].items()]
+    return merged
+
+
+def _escape(value: str) -> str:
+    """转义标签值"""
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: List[str], values: List[str], extra: str = "") -> str:
+    """生成标签字符串"""
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    """格式化数值"""
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def render_text(families: Dict[str, dict]) -> str:
+    """
+    按 Prometheus 文本格式（0.0.4）输出
+
+    Args:
+        families: 指标快照
+
+    Returns:
+        文本内容
+    """
+    lines = []
+    for name in sorted(families):
+        family = families[name]
+        labelnames = family["labelnames"]
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['type']}")
+
+        for labels, value in family["values"]:
+            if family["type"] != "histogram":
+                lines.append(f"{name}{_format_labels(labelnames, labels)} {_format_value(value)}")
+                continue
+
+            cumulative = 0
+            for bound, count in zip(family["buckets"] + ["+Inf"], value[:-2]):
+                cumulative += count
+                le = "+Inf" if bound == "+Inf" else _format_value(float(bound))
+                bucket_labels = _format_labels(labelnames, labels, 'le="' + le + '"')
+                lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labelnames, labels)} {_format_value(value[-2])}")
+            lines.append(f"{name}_count{_format_labels(labelnames, labels)} {value[-1]}")
+
+    return "\n".join(lines) + "\n"
+
+
+def clear_multiprocess_dir(directory: str) -> None:
+    """清理上次运行遗留的快照文件（在启动 worker 之前调用）"""
+    path = Path(directory)
+    if path.exists():
+        for snapshot in path.glob("metrics_*.json"):
+            snapshot.unlink(missing_ok=True)
+
+
+# 全局注册表
+registry = MetricsRegistry()
+
+# 请求级指标
+REQUESTS = registry.counter(
+    "megallm_requests_total", "聊天补全请求数", ("model", "status")
+)
+REQUEST_DURATION = registry.histogram(
+    "megallm_request_duration_seconds", "聊天补全请求总耗时（流式到最后一个分块）", ("model", "stream")
+)
+TIME_TO_FIRST_TOKEN = registry.histogram(
+    "megallm_time_to_first_token_seconds", "流式请求从收到请求到发送第一个分块的耗时", ("model",)
+)
+TOKENS = registry.counter(
+    "megallm_tokens_total", "上游返回的 token 用量（流式响应取末尾的 usage 事件）", ("model", "type")
+)
+
+# 上游级指标
+UPSTREAM_DURATION = registry.histogram(
+    "megallm_upstream_duration_seconds", "单次上游调用耗时（流式到收到响应头）", ("model", "key")
+)
+UPSTREAM_ATTEMPTS = registry.counter(
+    "megallm_upstream_attempts_total", "按密钥统计的上游调用次数", ("key", "outcome")
+)
+UPSTREAM_RETRIES = registry.counter(
+    "megallm_upstream_retries_total", "同一密钥上的网络/超时重试次数", ("reason",)
+)
+KEY_FAILOVERS = registry.counter(
+    "megallm_key_failovers_total", "切换到下一个密钥重试的次数", ("model",)
+)
+KEY_FAILURES = registry.counter(
+    "megallm_key_failures_total", "密钥被标记为失败的次数", ("key",)
+)
+KEY_COOLDOWNS = registry.counter(
+    "megallm_key_cooldowns_total", "密钥触发上游速率限制（429）的次数", ("key",)
+)
+
+
+def record_tokens(model: str, usage: Optional[Dict[str, Any]]) -> None:
+    """
+    记录上游返回的 token 用量
+
+    Args:
+        model: 模型名称
+        usage: 上游响应中的 usage 字段（可能为空）
+    """
+    if usage:
+        TOKENS.inc(model, "prompt", amount=usage.get("prompt_tokens") or 0)
+        TOKENS.inc(model, "completion", amount=usage.get("completion_tokens") or 0)
@@ -0,0 +1,294 @@
+"""
+诊断模块 - 事件循环线程栈采样、asyncio 任务快照和事件循环延迟监控
+
+采样在独立线程中通过 sys._current_frames() 读取事件循环线程的当前栈，不需要在被测代码中插桩，
+输出 flamegraph.pl / speedscope 可直接读取的 collapsed stack 格式。
+"""
+import asyncio
+import logging
+import os
+import sys
+import sysconfig
+import threading
+import time
+import traceback
+from bisect import bisect_left
+from collections import Counter as StackCounter
+from typing import Dict, List, Optional
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+_STDLIB = sysconfig.get_paths()["stdlib"]
+
+
+# 事件循环延迟分桶（秒）
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+LOOP_LAG = registry.histogram(
+    "megallm_event_loop_lag_seconds", "事件循环调度延迟（心跳实际唤醒时间 - 预期唤醒时间）", buckets=LAG_BUCKETS
+)
+
+
+def _frame_label(frame) -> str:
+    """栈帧标签：模块路径:函数名"""
+    filename = frame.f_code.co_filename
+    cwd = os.getcwd()
+    if filename.startswith(cwd):
+        filename = filename[len(cwd) + 1:]
+    elif "site-packages" in filename:
+        filename = filename.split("site-packages" + os.sep, 1)[1]
+    elif filename.startswith(_STDLIB):
+        filename = filename[len(_STDLIB) + 1:]
+    return f"{filename}:{frame.f_code.co_name}".replace(";", ":").replace(" ", "_")
+
+
+def collapse_stack(frame) -> str:
+    """将栈帧转换为 collapsed 格式（根在前，以分号分隔）"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+def format_stack(frame, limit: int = 30) -> str:
+    """格式化栈帧用于日志"""
+    return "".join(traceback.format_stack(frame, limit=limit))
+
+
+class StackSampler:
+    """事件循环线程栈采样器"""
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        """
+        Args:
+            thread_id: 被采样线程ID（事件循环线程）
+            interval: 采样间隔（秒）
+        """
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: StackCounter = StackCounter()
+        self.sample_count = 0
+
+    def run(self, duration: float) -> None:
+        """
+        采样指定时长（阻塞，在独立线程中执行）
+
+        Args:
+            duration: 采样时长（秒）
+        """
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[collapse_stack(frame)] += 1
+                self.sample_count += 1
+            del frame
+            time.sleep(self.interval)
+
+    def collapsed(self) -> str:
+        """collapsed stack 文本（每行: 栈 计数）"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+def dump_tasks(limit: int = 20) -> List[Dict[str, object]]:
+    """
+    获取当前事件循环中所有 asyncio 任务的快照（需在事件循环线程中调用）
+
+    Args:
+        limit: 每个任务最多输出的栈帧数
+
+    Returns:
+        任务列表（名称、协程、状态、挂起位置的栈）
+    """
+    tasks = []
+    for task in asyncio.all_tasks():
+        coro = task.get_coro()
+        stack = [
+            f"{frame.f_code.co_filename}:{frame.f_lineno} {frame.f_code.co_name}"
+            for frame in task.get_stack(limit=limit)
+        ]
+        tasks.append({
+            "name": task.get_name(),
+            "coro": getattr(coro, "__qualname__", repr(coro)),
+            "done": task.done(),
+            "cancelling": task.cancelling() if hasattr(task, "cancelling") else None,
+            "stack": stack
+        })
+    tasks.sort(key=lambda item: item["coro"])
+    return tasks
+
+
+class LoopLagMonitor:
+    """
+    事件循环延迟监控
+
+    心跳协程按固定间隔唤醒并记录调度延迟；看门狗线程检查心跳是否超过阈值未更新，
+    若事件循环被阻塞，在阻塞期间抓取事件循环线程的栈写入日志，便于定位阻塞代码。
+    """
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.25):
+        """
+        Args:
+            interval: 心跳间隔（秒）
+            threshold: 阻塞告警阈值（秒）
+        """
+        self.interval = interval
+        self.threshold = threshold
+
+        self.thread_id: Optional[int] = None
+        self._last_beat = time.perf_counter()
+        self._beat = 0
+        self._reported_beat = -1
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+        self.blocked_count = 0
+        self.max_lag = 0.0
+        # 非累计分桶计数，最后一个为 +Inf
+        self._buckets = [0] * (len(LAG_BUCKETS) + 1)
+
+    def start(self) -> None:
+        """启动监控（需在事件循环线程中调用）"""
+        self.thread_id = threading.get_ident()
+        self._last_beat = time.perf_counter()
+        self._task = asyncio.create_task(self._heartbeat(), name="loop-lag-monitor")
+        self._stop.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info(f"事件循环延迟监控已启动: interval={self.interval}s, threshold={self.threshold}s")
+
+    async def stop(self) -> None:
+        """停止监控"""
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _heartbeat(self) -> None:
+        """心跳协程"""
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            lag = max(now - expected, 0.0)
+
+            self._last_beat = now
+            self._beat += 1
+            self._buckets[bisect_left(LAG_BUCKETS, lag)] += 1
+            self.max_lag = max(self.max_lag, lag)
+            LOOP_LAG.observe(lag)
+
+            if lag >= self.threshold:
+                self.blocked_count += 1
+                logger.warning(f"事件循环被阻塞 {lag * 1000:.0f}ms（阈值 {self.threshold * 1000:.0f}ms）")
+
+    def _watch(self) -> None:
+        """看门狗线程：心跳超时时抓取事件循环线程的栈"""
+        while not self._stop.wait(self.interval):
+            stalled = time.perf_counter() - self._last_beat - self.interval
+            if stalled < self.threshold or self._reported_beat == self._beat:
+                continue
+            self._reported_beat = self._beat
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                logger.warning(
+                    f"事件循环已阻塞 {stalled * 1000:.0f}ms，当前栈:\n{format_stack(frame)}"
+                )
+            del frame
+
+    def histogram(self) -> Dict[str, int]:
+        """延迟直方图（各桶非累计计数）"""
+        labels = [f"<={bound * 1000:g}ms" for bound in LAG_BUCKETS] + [f">{LAG_BUCKETS[-1] * 1000:g}ms"]
+        return dict(zip(labels, self._buckets))
+
+    def get_stats(self) -> Dict[str, object]:
+        """获取统计信息"""
+        return {
+            "interval_ms": self.interval * 1000,
+            "threshold_ms": self.threshold * 1000,
+            "beats": self._beat,
+            "blocked": self.blocked_count,
+            "max_lag_ms": round(self.max_lag * 1000, 2),
+            "histogram": self.histogram()
+        }
+
+
+class Profiler:
+    """按需采样分析器（同一 worker 同时只运行一个采样）"""
+
+    def __init__(self, max_duration: float = 60.0, lag_monitor: Optional[LoopLagMonitor] = None):
+        """
+        Args:
+            max_duration: 单次采样最长时长（秒）
+            lag_monitor: 事件循环延迟监控，用于在结果中附带采样期间的延迟直方图
+        """
+        self.max_duration = max_duration
+        self.lag_monitor = lag_monitor
+        self._running = False
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    async def profile(self, duration: float, interval: float = 0.005) -> Dict[str, object]:
+        """
+        对事件循环线程采样
+
+        Args:
+            duration: 采样时长（秒），不超过 max_duration
+            interval: 采样间隔（秒）
+
+        Returns:
+            {"pid", "duration", "samples", "collapsed", "tasks", "loop_lag"}
+
+        Raises:
+            RuntimeError: 已有采样在运行时
+        """
+        if self._running:
+            raise RuntimeError("已有采样正在运行")
+
+        duration = min(max(duration, 0.1), self.max_duration)
+        sampler = StackSampler(threading.get_ident(), max(interval, 0.001))
+        lag_before = list(self.lag_monitor._buckets) if self.lag_monitor else None
+
+        self._running = True
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+
+        def finished() -> None:
+            # 请求被取消时采样线程仍会运行到结束，结束后才允许下一次采样
+            self._running = False
+            if not done.done():
+                done.set_result(None)
+
+        def run() -> None:
+            try:
+                sampler.run(duration)
+            finally:
+                loop.call_soon_threadsafe(finished)
+
+        logger.info(f"开始采样: pid={os.getpid()}, duration={duration}s, interval={sampler.interval}s")
+        # 采样线程独立于默认线程池，避免线程池繁忙时采样无法开始
+        threading.Thread(target=run, name="stack-sampler", daemon=True).start()
+        await done
+
+        loop_lag = None
+        if self.lag_monitor is not None:
+            labels = list(self.lag_monitor.histogram())
+            loop_lag = {
+                label: after - before
+                for label, before, after in zip(labels, lag_before, self.lag_monitor._buckets)
+            }
+
+        return {
+            "pid": os.getpid(),
+            "duration": duration,
+            "samples": sampler.sample_count,
+            "collapsed": sampler.collapsed(),
+            "tasks": dump_tasks(),
+            "loop_lag": loop_lag
+        }
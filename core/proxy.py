@@ -2,9 +2,14 @@
 代理核心模块 - 整合密钥管理和HTTP客户端
 """
 import logging
+import time
 from typing import Dict, Any, Optional
-from .key_manager import KeyManager
+from .key_manager import KeyManager, mask_key
 from .http_client import MegaLLMClient
+from .access_log import annotate
+from .metrics import KEY_COOLDOWNS, KEY_FAILOVERS, UPSTREAM_ATTEMPTS, UPSTREAM_DURATION, record_tokens
+from .timing import phase
+from .tracing import span
 
 logger = logging.getLogger(__name__)
 
@@ -57,38 +62,52 @@ class ProxyService:
         for attempt in range(self.max_key_retries):
             try:
                 # 获取下一个可用密钥
-                api_key = self.key_manager.get_next_key()
+                with phase("key"), span("key.select"):
+                    api_key = self.key_manager.get_next_key()
                 attempted_keys.append(api_key[:8])
-
-                logger.info(f"尝试使用密钥 {api_key[:8]}*** (第{attempt + 1}次)")
-
-                # 发送请求
-                result = await self.http_client.chat_completion(
-                    api_key=api_key,
-                    model=model,
-                    messages=messages,
-                    **kwargs
-                )
+                if attempt:
+                    KEY_FAILOVERS.inc(model)
+
+                logger.debug("尝试使用密钥 %s (第%d次)", mask_key(api_key), attempt + 1)
+
+                # 发送请求（流式请求计时到收到响应头）
+                started = time.monotonic()
+                with span("upstream.attempt", key=mask_key(api_key), attempt=attempt + 1, model=model):
+                    result = await self.http_client.chat_completion(
+                        api_key=api_key,
+                        model=model,
+                        messages=messages,
+                        **kwargs
+                    )
+                UPSTREAM_DURATION.observe(time.monotonic() - started, model, mask_key(api_key))
+                UPSTREAM_ATTEMPTS.inc(mask_key(api_key), "success")
+
+                # 流式响应的用量在流结束时由调用方从末尾的 usage 事件记录
+                if isinstance(result, dict):
+                    record_tokens(model, result.get("usage"))
 
                 # 请求成功，标记密钥为可用
                 self.key_manager.mark_key_success(api_key)
 
-                logger.info(f"请求成功: model={model}, key={api_key[:8]}***")
+                annotate(key=mask_key(api_key), attempts=attempt + 1)
+                logger.debug("请求成功: model=%s, key=%s", model, mask_key(api_key))
                 return result
 
             except Exception as e:
                 last_exception = e
-                logger.warning(f"密钥 {api_key[:8]}*** 请求失败: {e}")
+                UPSTREAM_ATTEMPTS.inc(mask_key(api_key), "failure")
+                logger.warning("密钥 %s 请求失败: %s", mask_key(api_key), e)
 
                 # 对于客户端错误（4xx），标记密钥失败
                 if hasattr(e, 'response') and e.response and 400 <= e.response.status_code < 500:
                     if e.response.status_code == 401:
                         # 认证失败，标记密钥为失败
                         self.key_manager.mark_key_failed(api_key)
-                        logger.error(f"密钥认证失败，已禁用: {api_key[:8]}***")
+                        logger.error("密钥认证失败，已禁用: %s", mask_key(api_key))
                     elif e.response.status_code == 429:
                         # 速率限制，暂时标记失败，但会在下次重置时恢复
-                        logger.warning(f"密钥达到速率限制: {api_key[:8]}***")
+                        KEY_COOLDOWNS.inc(mask_key(api_key))
+                        logger.warning("密钥达到速率限制: %s", mask_key(api_key))
                     else:
                         # 其他4xx错误，直接抛出，不重试
                         raise
@@ -98,9 +117,10 @@ class ProxyService:
                     logger.error("所有密钥都已失败，无法继续重试")
                     break
 
-                logger.info(f"切换到下一个密钥重试...")
+                logger.info("切换到下一个密钥重试...")
 
         # 所有重试都失败
+        annotate(attempts=len(attempted_keys))
         error_msg = f"请求失败，已尝试 {len(attempted_keys)} 个密钥: {attempted_keys}"
         logger.error(error_msg)
         raise RuntimeError(error_msg) from last_exception
@@ -138,6 +158,28 @@ class ProxyService:
             ]
         }
 
+    async def warmup(self) -> Dict[str, Any]:
+        """
+        启动预热：用轮询密钥预建立上游连接，同时同步密钥状态
+
+        认证失败（401/403）的密钥在接收流量前即被标记为失败，直到找到一个可用密钥为止。
+
+        Returns:
+            {"key": 脱敏密钥, "status": 上游状态码, "failed_keys": 本次标记失败的密钥数}
+        """
+        failed = 0
+        for _ in range(self.key_manager.total_keys):
+            api_key = self.key_manager.get_next_key()
+            status = await self.http_client.warmup(api_key)
+            if status in (401, 403):
+                self.key_manager.mark_key_failed(api_key)
+                logger.error("预热时密钥认证失败，已禁用: %s", mask_key(api_key))
+                failed += 1
+                continue
+            return {"key": mask_key(api_key), "status": status, "failed_keys": failed}
+
+        raise RuntimeError(f"预热失败，已尝试 {failed} 个密钥均认证失败")
+
     def get_stats(self) -> Dict[str, Any]:
         """
         获取服务统计信息
@@ -147,5 +189,6 @@ class ProxyService:
         """
         return {
             "key_stats": self.key_manager.get_stats(),
-            "max_key_retries": self.max_key_retries
+            "max_key_retries": self.max_key_retries,
+            "timeouts": self.http_client.get_timeout_stats()
         }
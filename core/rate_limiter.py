@@ -0,0 +1,317 @@
+"""
+客户端限流模块 - 按调用方凭证识别客户端，并按令牌桶限制请求数和 token 数
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitExceeded(Exception):
+    """客户端超出限流配额"""
+
+    def __init__(self, message: str, retry_after: int, limit_type: str):
+        """
+        Args:
+            message: 错误信息
+            retry_after: 建议客户端重试等待秒数
+            limit_type: 触发的限制类型（requests / tokens）
+        """
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.limit_type = limit_type
+
+
+class ClientAuthError(Exception):
+    """客户端凭证无效"""
+
+
+class TokenBucket:
+    """令牌桶，按时间差惰性补充，每次操作 O(1)"""
+
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, per_minute: float, now: float):
+        """
+        Args:
+            per_minute: 每分钟配额（同时作为桶容量）
+            now: 当前单调时钟时间
+        """
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = now
+
+    def consume(self, amount: float, now: float) -> float:
+        """
+        尝试消费令牌
+
+        超过桶容量的单次请求在桶满时允许通过并记为欠额，避免大请求永远无法执行。
+
+        Args:
+            amount: 消费数量
+            now: 当前单调时钟时间
+
+        Returns:
+            0 表示消费成功，否则为需要等待的秒数
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        required = min(amount, self.capacity)
+        if self.tokens >= required:
+            self.tokens -= amount
+            return 0.0
+
+        return (required - self.tokens) / self.rate
+
+    def charge(self, amount: float, now: float) -> None:
+        """
+        无条件扣除令牌（按实际用量事后计费，可产生欠额）
+
+        Args:
+            amount: 扣除数量
+            now: 当前单调时钟时间
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate) - amount
+        self.updated = now
+
+    def resize(self, per_minute: float, now: float) -> None:
+        """
+        调整每分钟配额，已累积的令牌不超过新容量
+
+        Args:
+            per_minute: 新的每分钟配额
+            now: 当前单调时钟时间
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = min(self.tokens, self.capacity)
+
+
+class ClientState:
+    """客户端配置与限流状态"""
+
+    __slots__ = ("client_id", "anonymous", "weight", "default_class", "max_class", "requests", "tokens")
+
+    def __init__(
+        self,
+        client_id: str,
+        requests_per_minute: int,
+        tokens_per_minute: int,
+        now: float,
+        anonymous: bool = False,
+        weight: float = 1.0,
+        default_class: Optional[str] = None,
+        max_class: Optional[str] = None
+    ):
+        """
+        Args:
+            client_id: 客户端ID
+            requests_per_minute: 每分钟请求数上限，<=0 表示不限制
+            tokens_per_minute: 每分钟估算 token 数上限，<=0 表示不限制
+            now: 当前单调时钟时间
+            anonymous: 是否为匿名客户端
+            weight: 调度权重
+            default_class: 请求未指定优先级分类时使用的分类，为空时使用全局默认分类
+            max_class: 允许请求的最高优先级分类，为空时不限制
+        """
+        self.client_id = client_id
+        self.anonymous = anonymous
+        self.weight = weight
+        self.default_class = default_class
+        self.max_class = max_class
+        self.requests = TokenBucket(requests_per_minute, now) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute, now) if tokens_per_minute > 0 else None
+
+
+class ClientRateLimiter:
+    """客户端识别与限流器"""
+
+    def __init__(
+        self,
+        config_path: Optional[str] = None,
+        auth_required: bool = False,
+        default_requests_per_minute: int = 0,
+        default_tokens_per_minute: int = 0,
+        max_tracked_clients: int = 10_000
+    ):
+        """
+        初始化客户端限流器
+
+        Args:
+            config_path: 客户端配置文件路径（JSON），不存在时仅使用默认限制
+            auth_required: 是否要求客户端携带已配置的凭证
+            default_requests_per_minute: 匿名客户端每分钟请求数上限
+            default_tokens_per_minute: 匿名客户端每分钟 token 数上限
+            max_tracked_clients: 最多跟踪的匿名客户端数量（LRU 淘汰）
+        """
+        self.config_path = Path(config_path) if config_path else None
+        self.auth_required = auth_required
+        self.default_requests_per_minute = default_requests_per_minute
+        self.default_tokens_per_minute = default_tokens_per_minute
+        self.max_tracked_clients = max_tracked_clients
+        self.default_class: Optional[str] = None
+        self.max_class: Optional[str] = None
+
+        self._lock = threading.Lock()
+        self._clients_by_token: Dict[str, ClientState] = {}
+        self._anonymous: "OrderedDict[str, ClientState]" = OrderedDict()
+        self._rejected = {"requests": 0, "tokens": 0, "auth": 0}
+
+        self._load_clients()
+
+    def _load_clients(self) -> None:
+        """从配置文件加载客户端"""
+        clients_by_token: Dict[str, ClientState] = {}
+
+        if self.config_path and self.config_path.exists():
+            with open(self.config_path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+
+            defaults = config.get("default", {})
+            self.default_requests_per_minute = defaults.get(
+                "requests_per_minute", self.default_requests_per_minute
+            )
+            self.default_tokens_per_minute = defaults.get(
+                "tokens_per_minute", self.default_tokens_per_minute
+            )
+            self.default_class = defaults.get("priority")
+            self.max_class = defaults.get("max_priority")
+
+            now = time.monotonic()
+            for client in config.get("clients", []):
+                state = ClientState(
+                    client_id=client["id"],
+                    requests_per_minute=client.get("requests_per_minute", self.default_requests_per_minute),
+                    tokens_per_minute=client.get("tokens_per_minute", self.default_tokens_per_minute),
+                    now=now,
+                    weight=client.get("weight", 1.0),
+                    default_class=client.get("priority", self.default_class),
+                    max_class=client.get("max_priority", self.max_class)
+                )
+                for token in client.get("api_keys", []):
+                    clients_by_token[token] = state
+
+            logger.info(f"成功加载 {len(config.get('clients', []))} 个客户端配置")
+        elif self.auth_required:
+            raise FileNotFoundError(f"客户端配置文件不存在: {self.config_path}")
+
+        self._clients_by_token = clients_by_token
+
+    def reload_clients(self) -> None:
+        """重新加载客户端配置（已有客户端的限流状态会被重置）"""
+        with self._lock:
+            self._load_clients()
+            self._anonymous.clear()
+            logger.info(f"客户端配置已重新加载: {self.total_clients} 个凭证")
+
+    def identify(self, token: Optional[str], remote_addr: Optional[str]) -> ClientState:
+        """
+        根据凭证或来源地址识别客户端
+
+        Args:
+            token: 请求携带的凭证（Bearer token 或 X-API-Key）
+            remote_addr: 客户端地址，匿名客户端按地址分别限流
+
+        Returns:
+            客户端状态
+
+        Raises:
+            ClientAuthError: 要求认证但凭证缺失或无效时
+        """
+        if token:
+            state = self._clients_by_token.get(token)
+            if state is not None:
+                return state
+
+        if self.auth_required:
+            self._rejected["auth"] += 1
+            raise ClientAuthError("缺少或无效的客户端凭证")
+
+        anonymous_id = f"anonymous:{remote_addr or 'unknown'}"
+        with self._lock:
+            state = self._anonymous.get(anonymous_id)
+            if state is not None:
+                self._anonymous.move_to_end(anonymous_id)
+                return state
+
+            state = ClientState(
+                client_id=anonymous_id,
+                requests_per_minute=self.default_requests_per_minute,
+                tokens_per_minute=self.default_tokens_per_minute,
+                now=time.monotonic(),
+                anonymous=True,
+                default_class=self.default_class,
+                max_class=self.max_class
+            )
+            self._anonymous[anonymous_id] = state
+            if len(self._anonymous) > self.max_tracked_clients:
+                self._anonymous.popitem(last=False)
+            return state
+
+    def check_request(self, client: ClientState) -> None:
+        """
+        消费一次请求配额
+
+        Args:
+            client: 客户端状态
+
+        Raises:
+            RateLimitExceeded: 超出每分钟请求数上限
+        """
+        if client.requests is None:
+            return
+
+        wait = client.requests.consume(1, time.monotonic())
+        if wait > 0:
+            self._rejected["requests"] += 1
+            raise RateLimitExceeded(
+                f"客户端 {client.client_id} 超出每分钟请求数限制",
+                retry_after=max(int(wait + 0.999), 1),
+                limit_type="requests"
+            )
+
+    def check_tokens(self, client: ClientState, tokens: int) -> None:
+        """
+        消费估算 token 配额
+
+        Args:
+            client: 客户端状态
+            tokens: 本次请求估算的 token 数（输入 + 输出）
+
+        Raises:
+            RateLimitExceeded: 超出每分钟 token 数上限
+        """
+        if client.tokens is None:
+            return
+
+        wait = client.tokens.consume(tokens, time.monotonic())
+        if wait > 0:
+            self._rejected["tokens"] += 1
+            raise RateLimitExceeded(
+                f"客户端 {client.client_id} 超出每分钟 token 数限制",
+                retry_after=max(int(wait + 0.999), 1),
+                limit_type="tokens"
+            )
+
+    @property
+    def total_clients(self) -> int:
+        """已配置的凭证数"""
+        return len(self._clients_by_token)
+
+    def get_stats(self) -> dict:
+        """获取统计信息"""
+        return {
+            "configured_tokens": self.total_clients,
+            "anonymous_tracked": len(self._anonymous),
+            "auth_required": self.auth_required,
+            "rejected": dict(self._rejected)
+        }
@@ -0,0 +1,114 @@
+"""
+调度模块 - 按租户/优先级分类的加权公平队列（WFQ）
+"""
+import heapq
+import itertools
+from typing import Any, Callable, Dict, List
+
+
+class FairQueue:
+    """
+    加权公平队列（自时钟公平排队，SCFQ）
+
+    每个流（优先级分类 + 租户）维护上一个请求的虚拟完成时间，新请求的完成标签为
+    max(系统虚拟时间, 流的上一个完成标签) + cost / weight，按完成标签从小到大出队。
+    高权重的流获得更大比例的出队机会，空闲流不会积累额度。
+    """
+
+    def __init__(self, max_tracked_flows: int = 10_000):
+        """
+        Args:
+            max_tracked_flows: 超过该数量时清理已落后于虚拟时间的流状态
+        """
+        self.max_tracked_flows = max_tracked_flows
+
+        self._heap: List[list] = []
+        self._counter = itertools.count()
+        self._last_finish: Dict[str, float] = {}
+        self._virtual_time = 0.0
+        self._live = 0
+
+    def _tag(self, flow: str, weight: float, cost: float) -> float:
+        """计算完成标签"""
+        start = max(self._virtual_time, self._last_finish.get(flow, 0.0))
+        finish = start + cost / max(weight, 1e-9)
+        self._last_finish[flow] = finish
+
+        if len(self._last_finish) > self.max_tracked_flows:
+            self._last_finish = {
+                name: tag for name, tag in self._last_finish.items() if tag > self._virtual_time
+            }
+        return finish
+
+    def push(self, payload: Any, flow: str, weight: float = 1.0, cost: float = 1.0) -> list:
+        """
+        入队
+
+        Args:
+            payload: 队列元素
+            flow: 流标识
+            weight: 流权重
+            cost: 请求代价
+
+        Returns:
+            队列条目，可用于 discard()
+        """
+        entry = [self._tag(flow, weight, cost), next(self._counter), payload, True]
+        heapq.heappush(self._heap, entry)
+        self._live += 1
+        return entry
+
+    def bypass(self, flow: str, weight: float = 1.0, cost: float = 1.0) -> None:
+        """记录一个无需排队直接执行的请求，保持流的虚拟时间推进"""
+        self._virtual_time = self._tag(flow, weight, cost)
+
+    def discard(self, entry: list) -> None:
+        """移除条目（惰性删除，失效条目过多时重建堆）"""
+        if entry[3]:
+            entry[3] = False
+            self._live -= 1
+
+        if len(self._heap) > 2 * self._live + 64:
+            self._heap = [item for item in self._heap if item[3]]
+            heapq.heapify(self._heap)
+
+    def dispatch(
+        self,
+        can_run: Callable[[Any], bool],
+        has_capacity: Callable[[], bool],
+        on_dispatch: Callable[[Any], None]
+    ) -> int:
+        """
+        按完成标签顺序出队所有当前可执行的元素
+
+        Args:
+            can_run: 判断单个元素是否可以执行（如单模型并发上限）
+            has_capacity: 判断是否还有全局容量，返回 False 时停止出队
+            on_dispatch: 出队回调，需在其中立即占用容量
+
+        Returns:
+            出队数量
+        """
+        dispatched = 0
+        blocked = []
+
+        while self._heap and has_capacity():
+            entry = heapq.heappop(self._heap)
+            if not entry[3]:
+                continue
+            if can_run(entry[2]):
+                entry[3] = False
+                self._live -= 1
+                self._virtual_time = entry[0]
+                on_dispatch(entry[2])
+                dispatched += 1
+            else:
+                blocked.append(entry)
+
+        for entry in blocked:
+            heapq.heappush(self._heap, entry)
+
+        return dispatched
+
+    def __len__(self) -> int:
+        return self._live
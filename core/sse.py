@@ -0,0 +1,134 @@
+"""
+SSE 工具模块 - 增量解析上游 Server-Sent Events 流并生成事件
+"""
+import json
+from typing import Any, AsyncIterator, Dict, Optional
+
+
+# 流结束标记
+DONE = "[DONE]"
+
+
+class SSEParser:
+    """
+    增量 SSE 解析器
+
+    上游分块边界与事件边界无关，解析器缓存不完整的行，只在遇到空行时产出完整事件的 data。
+    """
+
+    def __init__(self):
+        self._buffer = b""
+        self._data: list = []
+
+    def feed(self, chunk: bytes) -> list:
+        """
+        输入一个分块
+
+        Args:
+            chunk: 上游响应分块
+
+        Returns:
+            本分块中完成的事件 data 列表（多行 data 以换行连接）
+        """
+        self._buffer += chunk
+        events = []
+
+        while True:
+            newline = self._buffer.find(b"\n")
+            if newline < 0:
+                break
+            line = self._buffer[:newline].rstrip(b"\r")
+            self._buffer = self._buffer[newline + 1:]
+
+            if not line:
+                if self._data:
+                    events.append("\n".join(self._data))
+                    self._data = []
+            elif line.startswith(b"data:"):
+                value = line[5:]
+                if value.startswith(b" "):
+                    value = value[1:]
+                self._data.append(value.decode("utf-8"))
+            # 注释行（以 ":" 开头）及 event/id/retry 字段不需要转发语义，忽略
+
+        return events
+
+    def flush(self) -> Optional[str]:
+        """流结束时产出未以空行结尾的最后一个事件"""
+        if self._buffer.strip():
+            self.feed(b"\n")
+        if self._data:
+            data = "\n".join(self._data)
+            self._data = []
+            return data
+        return None
+
+
+class UsageTail:
+    """
+    记录流的末尾分块，流结束后从中提取 usage 事件
+
+    usage 只在流末尾出现一次，没有必要逐块解析 JSON：转发时只保留最后两个分块的引用（事件可能跨越分块边界），
+    结束后从后向前查找最后一个带 usage 的事件。
+    """
+
+    __slots__ = ("_previous", "_last")
+
+    def __init__(self):
+        self._previous = b""
+        self._last = b""
+
+    def feed(self, chunk: bytes) -> None:
+        """记录一个已转发的分块"""
+        self._previous, self._last = self._last, chunk
+
+    def usage(self) -> Optional[Dict[str, Any]]:
+        """
+        提取流末尾的 usage
+
+        Returns:
+            usage 字典，上游未返回时为 None
+        """
+        for line in reversed((self._previous + self._last).split(b"\n")):
+            line = line.strip()
+            if not line.startswith(b"data:") or b'"usage"' not in line:
+                continue
+            try:
+                event = json.loads(line[5:])
+            except ValueError:
+                continue
+            if isinstance(event, dict) and isinstance(event.get("usage"), dict):
+                return event["usage"]
+        return None
+
+
+async def iter_sse_data(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    从字节流中逐个产出 SSE 事件 data
+
+    Args:
+        chunks: 上游响应分块迭代器
+
+    Yields:
+        事件 data 字符串（包括 "[DONE]"）
+    """
+    parser = SSEParser()
+    async for chunk in chunks:
+        for data in parser.feed(chunk):
+            yield data
+    data = parser.flush()
+    if data is not None:
+        yield data
+
+
+def format_sse_data(data: str) -> bytes:
+    """
+    生成 SSE 事件
+
+    Args:
+        data: 事件 data（不含换行的 JSON 字符串）
+
+    Returns:
+        SSE 事件字节串
+    """
+    return f"data: {data}\n\n".encode("utf-8")
@@ -0,0 +1,107 @@
+"""
+启动模块 - 启动阶段计时、预热任务和就绪状态
+
+服务在组件初始化后即可接受请求（/health 可用），预热任务（上游连接预建立、密钥状态同步、
+上下文检查池启动）在后台执行，全部结束后 /ready 才返回 200，滚动发布时负载均衡器据此切流。
+"""
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class StartupState:
+    """启动阶段耗时与就绪状态"""
+
+    def __init__(self, started: Optional[float] = None):
+        """
+        初始化启动状态
+
+        Args:
+            started: 启动起点（time.perf_counter()），默认为当前时间
+        """
+        self.started = started if started is not None else time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.warmup: Dict[str, dict] = {}
+        self.ready = False
+        self.ready_at: Optional[float] = None
+
+    @contextmanager
+    def phase(self, name: str):
+        """记录一个启动阶段的耗时"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - started
+
+    def mark_ready(self) -> None:
+        """标记为就绪"""
+        if not self.ready:
+            self.ready = True
+            self.ready_at = time.perf_counter()
+
+    async def run_warmup(self, tasks: Dict[str, Callable[[], Awaitable]], timeout: float) -> None:
+        """
+        并发执行预热任务，结束（含失败和超时）后标记就绪并输出启动耗时报告
+
+        预热失败不阻止就绪：上游故障时所有实例都无法预热，继续挡住流量只会扩大影响。
+
+        Args:
+            tasks: 任务名称 -> 无参协程函数
+            timeout: 全部预热任务的最长等待时间（秒）
+        """
+        for name in tasks:
+            self.warmup[name] = {"status": "pending"}
+
+        async def run(name: str, func: Callable[[], Awaitable]) -> None:
+            started = time.perf_counter()
+            try:
+                result = await func()
+                self.warmup[name] = {"status": "ok"}
+                if result is not None:
+                    self.warmup[name]["result"] = result
+            except Exception as e:
+                logger.warning(f"预热任务失败 [{name}]: {e}")
+                self.warmup[name] = {"status": "failed", "error": str(e)}
+            finally:
+                self.warmup[name]["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+        with self.phase("warmup"):
+            pending = [asyncio.create_task(run(name, func)) for name, func in tasks.items()]
+            if pending:
+                _, not_done = await asyncio.wait(pending, timeout=timeout)
+                for task in not_done:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+                for name, state in self.warmup.items():
+                    if state["status"] == "pending":
+                        logger.warning(f"预热任务超时 [{name}]: 超过 {timeout}s")
+                        state.update(status="timeout")
+
+        self.mark_ready()
+        logger.info(f"服务已就绪: {self.summary()}")
+
+    def summary(self) -> str:
+        """单行启动耗时报告"""
+        parts = [f"{name}={seconds * 1000:.0f}ms" for name, seconds in self.phases.items()]
+        if self.warmup:
+            tasks = ", ".join(
+                f"{name}={state.get('duration_ms', 0):.0f}ms/{state['status']}" for name, state in self.warmup.items()
+            )
+            parts.append(f"({tasks})")
+        if self.ready_at is not None:
+            parts.append(f"total={(self.ready_at - self.started) * 1000:.0f}ms")
+        return " ".join(parts)
+
+    def report(self) -> dict:
+        """启动耗时报告（/ready 返回）"""
+        return {
+            "ready": self.ready,
+            "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in self.phases.items()},
+            "warmup": self.warmup,
+            "total_ms": round((self.ready_at - self.started) * 1000, 1) if self.ready_at is not None else None
+        }
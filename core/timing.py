@@ -0,0 +1,151 @@
+"""
+分阶段计时模块 - 基于 contextvar 的请求级阶段计时器，输出 Server-Timing 响应头
+
+计时器由中间件为每个请求创建并绑定到当前上下文，路由、代理服务和 HTTP 客户端通过
+phase() / record() 记录阶段耗时；未启用时这两个函数直接返回，不做任何计时。
+"""
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+_current: ContextVar[Optional["PhaseTimer"]] = ContextVar("phase_timer", default=None)
+
+_NULL_CONTEXT = nullcontext()
+
+
+class _Phase:
+    """阶段计时上下文管理器"""
+
+    __slots__ = ("_timer", "_name", "_started")
+
+    def __init__(self, timer: "PhaseTimer", name: str):
+        self._timer = timer
+        self._name = name
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._timer.add(self._name, time.perf_counter() - self._started)
+        return False
+
+
+class PhaseTimer:
+    """请求级阶段计时器（同名阶段累加，如多次密钥重试）"""
+
+    __slots__ = ("started", "phases")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        """
+        累加阶段耗时
+
+        Args:
+            name: 阶段名称（Server-Timing 指标名，不含空格和分号）
+            seconds: 耗时（秒）
+        """
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def phase(self, name: str) -> _Phase:
+        """返回计时上下文管理器"""
+        return _Phase(self, name)
+
+    def elapsed(self) -> float:
+        """从请求开始到现在的耗时（秒）"""
+        return time.perf_counter() - self.started
+
+    def header(self, **extra: float) -> str:
+        """
+        生成 Server-Timing 响应头
+
+        Args:
+            **extra: 追加的阶段（秒），如 total
+
+        Returns:
+            形如 tokens;dur=0.42, upstream;dur=812.3 的字符串（毫秒）
+        """
+        phases = {**self.phases, **extra}
+        return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in phases.items())
+
+
+def start_timer() -> tuple:
+    """
+    为当前上下文创建计时器
+
+    Returns:
+        (计时器, contextvar token)，请求结束后用 token 调用 reset_timer
+    """
+    timer = PhaseTimer()
+    return timer, _current.set(timer)
+
+
+def reset_timer(token) -> None:
+    """解除当前上下文的计时器"""
+    _current.reset(token)
+
+
+def current_timer() -> Optional[PhaseTimer]:
+    """获取当前请求的计时器，未启用时返回 None"""
+    return _current.get()
+
+
+def phase(name: str):
+    """
+    记录一个阶段的耗时，用法: with phase("tokens"): ...
+
+    Args:
+        name: 阶段名称
+
+    Returns:
+        上下文管理器（未启用计时时为空操作）
+    """
+    timer = _current.get()
+    if timer is None:
+        return _NULL_CONTEXT
+    return _Phase(timer, name)
+
+
+def record(name: str, seconds: float) -> None:
+    """累加一个已测量的阶段耗时（未启用计时时为空操作）"""
+    timer = _current.get()
+    if timer is not None:
+        timer.add(name, seconds)
+
+
+class UpstreamTrace:
+    """
+    httpx trace 扩展回调，拆分上游请求的 连接池等待 / 建立连接 / 首字节 耗时
+
+    httpcore 在各阶段开始和结束时回调 "连接类型.事件.started/complete"，复用连接时
+    第一个事件就是发送请求头，因此 发起请求 到 第一个事件 之间即为连接池等待。
+    """
+
+    __slots__ = ("_timer", "_sent", "_marks")
+
+    def __init__(self, timer: PhaseTimer):
+        self._timer = timer
+        self._sent = time.perf_counter()
+        self._marks: Dict[str, float] = {}
+
+    async def __call__(self, name: str, info: dict) -> None:
+        # name 形如 connection.connect_tcp.started / http2.send_request_headers.started
+        self._marks.setdefault(name.split(".", 1)[-1], time.perf_counter())
+
+    def finish(self) -> None:
+        """收到响应头后记录各阶段"""
+        now = time.perf_counter()
+        marks = self._marks
+        first_event = min(marks.values(), default=now)
+        self._timer.add("pool", first_event - self._sent)
+
+        connect_started = marks.get("connect_tcp.started")
+        if connect_started is not None:
+            connect_done = marks.get("start_tls.complete") or marks.get("connect_tcp.complete") or now
+            self._timer.add("connect", connect_done - connect_started)
+
+        self._timer.add("ttfb", now - marks.get("send_request_headers.started", first_event))
@@ -0,0 +1,397 @@
+"""
+请求追踪模块 - 进程内 span 记录，最近的请求保存在固定大小的环形缓冲区中
+
+中间件为每个请求创建 Trace（请求ID即 X-Request-ID）并绑定到当前上下文，代理服务和 HTTP 客户端通过
+span() 记录 选择密钥 / 每次上游调用 / 同一密钥上的重试 / 流式转发；请求结束后 Trace 进入环形缓冲区，
+可通过管理端点查询，或按 OTLP JSON 格式导出到文件（无需部署 collector）。未启用时 span() 返回空操作对象。
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import time
+from collections import deque
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 单个请求最多记录的 span 数（超出后不再记录，避免大扇出或异常重试导致单条记录过大）
+MAX_SPANS = 128
+
+# 接受客户端传入的请求ID（可打印 ASCII，不含空格，最长 128 字符），否则生成新的
+_REQUEST_ID_PATTERN = re.compile(r"^[\x21-\x7e]{1,128}$")
+_HEX32 = re.compile(r"^[0-9a-f]{32}$")
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("trace", default=None)
+_current_span: ContextVar[Optional["Span"]] = ContextVar("span", default=None)
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+def new_request_id() -> str:
+    """生成请求ID（32 位十六进制，可直接作为 OTLP traceId）"""
+    return _new_id(128)
+
+
+def normalize_request_id(value: Optional[str]) -> str:
+    """
+    校验客户端传入的请求ID
+
+    Args:
+        value: X-Request-ID 请求头
+
+    Returns:
+        合法时原样返回，否则生成新的请求ID
+    """
+    if value and _REQUEST_ID_PATTERN.match(value):
+        return value
+    return new_request_id()
+
+
+class Span:
+    """一个计时区间（可作为上下文管理器，进入时成为当前 span）"""
+
+    __slots__ = (
+        "name", "span_id", "parent_id", "start_ns", "_started", "duration",
+        "attributes", "events", "status", "_token"
+    )
+
+    def __init__(self, name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.span_id = _new_id(64)
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self._started = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.attributes = attributes
+        self.events: List[Dict[str, Any]] = []
+        self.status = "ok"
+        self._token = None
+
+    def set(self, **attributes: Any) -> None:
+        """设置属性"""
+        self.attributes.update(attributes)
+
+    def event(self, name: str, **attributes: Any) -> None:
+        """记录一个时间点事件（如重试）"""
+        self.events.append({"name": name, "time_ns": time.time_ns(), "attributes": attributes})
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        """结束 span（重复调用只记录第一次）"""
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._started
+        if error is not None:
+            self.status = "cancelled" if isinstance(error, asyncio.CancelledError) else "error"
+            self.attributes["error"] = f"{type(error).__name__}: {error}"
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _current_span.reset(self._token)
+        self.finish(exc_val)
+        return False
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典（时间为相对请求开始的毫秒数由 Trace.to_dict 计算）"""
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ns": self.start_ns,
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "status": self.status,
+            "attributes": self.attributes,
+            "events": self.events
+        }
+
+
+class _NullSpan:
+    """未启用追踪时的空操作 span"""
+
+    __slots__ = ()
+
+    def set(self, **attributes: Any) -> None:
+        pass
+
+    def event(self, name: str, **attributes: Any) -> None:
+        pass
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        pass
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Trace:
+    """一个请求的全部 span"""
+
+    __slots__ = ("request_id", "trace_id", "root", "spans", "dropped_spans")
+
+    def __init__(self, request_id: str, name: str, **attributes: Any):
+        self.request_id = request_id
+        # OTLP 要求 32 位十六进制 traceId，非该格式的请求ID取哈希
+        self.trace_id = request_id if _HEX32.match(request_id) else hashlib.md5(request_id.encode()).hexdigest()
+        self.root = Span(name, None, attributes)
+        self.spans: List[Span] = [self.root]
+        self.dropped_spans = 0
+
+    def start_span(self, name: str, parent: Optional[Span] = None, **attributes: Any):
+        """创建子 span（超过 MAX_SPANS 时返回空操作对象）"""
+        if len(self.spans) >= MAX_SPANS:
+            self.dropped_spans += 1
+            return NULL_SPAN
+        span = Span(name, (parent or self.root).span_id, attributes)
+        self.spans.append(span)
+        return span
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        return round(self.root.duration * 1000, 3) if self.root.duration is not None else None
+
+    def summary(self) -> Dict[str, Any]:
+        """摘要（列表展示用）"""
+        return {
+            "request_id": self.request_id,
+            "name": self.root.name,
+            "start_ns": self.root.start_ns,
+            "duration_ms": self.duration_ms,
+            "status": self.root.status,
+            "spans": len(self.spans),
+            "attributes": self.root.attributes
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        """完整记录（span 附带相对请求开始的偏移毫秒数）"""
+        spans = []
+        for span in self.spans:
+            item = span.to_dict()
+            item["offset_ms"] = round((span.start_ns - self.root.start_ns) / 1e6, 3)
+            spans.append(item)
+        return {**self.summary(), "trace_id": self.trace_id, "dropped_spans": self.dropped_spans, "span_list": spans}
+
+
+def start_trace(request_id: str, name: str, **attributes: Any) -> tuple:
+    """
+    为当前上下文创建 Trace
+
+    Returns:
+        (Trace, contextvar tokens)，请求结束后用 tokens 调用 reset_trace
+    """
+    trace = Trace(request_id, name, **attributes)
+    return trace, (_current_trace.set(trace), _current_span.set(trace.root))
+
+
+def reset_trace(tokens) -> None:
+    """解除当前上下文的 Trace"""
+    trace_token, span_token = tokens
+    _current_span.reset(span_token)
+    _current_trace.reset(trace_token)
+
+
+def current_trace() -> Optional[Trace]:
+    """获取当前请求的 Trace，未启用时返回 None"""
+    return _current_trace.get()
+
+
+def current_request_id() -> Optional[str]:
+    """获取当前请求ID，不在请求上下文中时返回 None"""
+    trace = _current_trace.get()
+    return trace.request_id if trace is not None else None
+
+
+def span(name: str, **attributes: Any):
+    """
+    记录一个子 span，用法: with span("upstream.attempt", key=...) as s: ...
+
+    使用 with 时进入即成为当前 span，其中创建的 span 以它为父节点，只能在同一个上下文中进入和退出；
+    跨越 async 生成器迭代的区间不使用 with，直接保存返回值并手动 finish()。
+
+    Returns:
+        Span（未启用追踪时为空操作对象）
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return NULL_SPAN
+    return trace.start_span(name, _current_span.get(), **attributes)
+
+
+def set_attributes(**attributes: Any) -> None:
+    """设置当前 span 的属性（未启用追踪时为空操作）"""
+    current = _current_span.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+
+def add_event(name: str, **attributes: Any) -> None:
+    """在当前 span 上记录事件（未启用追踪时为空操作）"""
+    current = _current_span.get()
+    if current is not None:
+        current.event(name, **attributes)
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+def to_otlp(traces: List[Trace], service_name: str = "megallm2api") -> Dict[str, Any]:
+    """
+    转换为 OTLP/JSON 格式（ExportTraceServiceRequest），可直接 POST 到任意 OTLP HTTP 接收端或由 collector 的 file receiver 读取
+
+    Args:
+        traces: Trace 列表
+        service_name: service.name 资源属性
+
+    Returns:
+        OTLP JSON 对象
+    """
+    spans = []
+    for trace in traces:
+        for item in trace.spans:
+            duration_ns = int((item.duration or 0) * 1e9)
+            otlp_span = {
+                "traceId": trace.trace_id,
+                "spanId": item.span_id,
+                "name": item.name,
+                "kind": 2 if item is trace.root else 1,  # SERVER / INTERNAL
+                "startTimeUnixNano": str(item.start_ns),
+                "endTimeUnixNano": str(item.start_ns + duration_ns),
+                "attributes": _otlp_attributes(item.attributes),
+                "events": [
+                    {"timeUnixNano": str(event["time_ns"]), "name": event["name"],
+                     "attributes": _otlp_attributes(event["attributes"])}
+                    for event in item.events
+                ],
+                "status": {"code": 2 if item.status == "error" else 1}
+            }
+            if item.parent_id:
+                otlp_span["parentSpanId"] = item.parent_id
+            if item is trace.root:
+                otlp_span["attributes"].append({"key": "request.id", "value": {"stringValue": trace.request_id}})
+            spans.append(otlp_span)
+
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({"service.name": service_name, "process.pid": os.getpid()})},
+            "scopeSpans": [{"scope": {"name": "megallm2api.tracing"}, "spans": spans}]
+        }]
+    }
+
+
+class TraceBuffer:
+    """最近请求的环形缓冲区（每个 worker 一份），可选定期导出为 OTLP JSON 行文件"""
+
+    def __init__(self, size: int = 1000, export_dir: str = "", export_interval: float = 5.0):
+        """
+        Args:
+            size: 保留的最近请求数
+            export_dir: OTLP JSON 导出目录，留空不导出
+            export_interval: 导出间隔（秒）
+        """
+        self._traces: deque = deque(maxlen=size)
+        self._index: Dict[str, Trace] = {}
+        self.export_dir = Path(export_dir) if export_dir else None
+        self.export_interval = export_interval
+        self._pending: List[Trace] = []
+        self.exported = 0
+
+    def add(self, trace: Trace) -> None:
+        """保存已结束的 Trace（缓冲区满时淘汰最早的）"""
+        if len(self._traces) == self._traces.maxlen:
+            evicted = self._traces[0]
+            if self._index.get(evicted.request_id) is evicted:
+                del self._index[evicted.request_id]
+        self._traces.append(trace)
+        self._index[trace.request_id] = trace
+        if self.export_dir is not None:
+            self._pending.append(trace)
+
+    def get(self, request_id: str) -> Optional[Trace]:
+        """按请求ID查询（同一请求ID出现多次时返回最近一次）"""
+        return self._index.get(request_id)
+
+    def recent(
+        self,
+        limit: int = 50,
+        min_duration_ms: float = 0.0,
+        status: Optional[str] = None,
+        path: Optional[str] = None
+    ) -> List[Trace]:
+        """
+        查询最近的请求（新的在前）
+
+        Args:
+            limit: 最多返回条数
+            min_duration_ms: 只返回耗时不小于该值的请求
+            status: 只返回该状态（ok / error / cancelled）的请求
+            path: 只返回该路径的请求
+        """
+        result = []
+        for trace in reversed(self._traces):
+            if (trace.duration_ms or 0) < min_duration_ms:
+                continue
+            if status is not None and trace.root.status != status:
+                continue
+            if path is not None and trace.root.attributes.get("http.path") != path:
+                continue
+            result.append(trace)
+            if len(result) >= limit:
+                break
+        return result
+
+    def __len__(self) -> int:
+        return len(self._traces)
+
+    def _write(self, traces: List[Trace]) -> None:
+        """追加一行 OTLP JSON（在线程中执行）"""
+        self.export_dir.mkdir(parents=True, exist_ok=True)
+        path = self.export_dir / f"traces-{time.strftime('%Y%m%d')}-{os.getpid()}.jsonl"
+        line = json.dumps(to_otlp(traces), ensure_ascii=False, default=str)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    async def flush(self) -> None:
+        """导出待导出的 Trace"""
+        if not self._pending:
+            return
+        traces, self._pending = self._pending, []
+        try:
+            await asyncio.to_thread(self._write, traces)
+            self.exported += len(traces)
+        except Exception as e:
+            logger.error(f"导出追踪数据失败，丢弃 {len(traces)} 条: {e}")
+
+    async def run_exporter(self) -> None:
+        """定期导出（后台任务，取消前导出剩余数据）"""
+        try:
+            while True:
+                await asyncio.sleep(self.export_interval)
+                await self.flush()
+        finally:
+            await self.flush()
@@ -2,7 +2,14 @@
 MegaLLM API代理服务 - 主应用入口
 支持多密钥轮询、自动重试、故障转移的高可用API代理
 """
-import uvicorn
+import sys
+import time
+
+# 启动计时起点（在导入应用模块之前）；spawn 启动的 worker 进程先以 __mp_main__ 导入本文件，沿用那次的起点
+IMPORT_STARTED = getattr(sys.modules.get("__mp_main__"), "IMPORT_STARTED", None) or time.perf_counter()
+
+import asyncio
+import signal
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -12,20 +19,122 @@ from config.settings import settings
 from core.key_manager import KeyManager
 from core.http_client import MegaLLMClient
 from core.proxy import ProxyService
+from core.context_checker import ContextChecker
+from core.admission import AdmissionController
+from core.rate_limiter import ClientRateLimiter
+from core.batch import BatchManager
+from core.chat_session import SessionStore
+from core.metrics import registry
+from core.drain import DrainController
+from core.startup import StartupState
+from core.tracing import TraceBuffer
+from api.middleware import (
+    AccessLogMiddleware,
+    CompressionMiddleware,
+    DrainMiddleware,
+    ServerTimingMiddleware,
+    TracingMiddleware
+)
 from api.routes import router
 from utils.logger import setup_logging
 
+IMPORT_FINISHED = time.perf_counter()
+
+
+def collect_component_metrics(
+    key_manager: KeyManager,
+    http_client: MegaLLMClient,
+    admission_controller: AdmissionController,
+    audit_sink=None,
+    session_store=None
+) -> list:
+    """
+    采集各组件当前状态作为指标
+
+    Returns:
+        指标族列表（格式见 MetricsRegistry.register_collector）
+    """
+    key_stats = key_manager.get_stats()
+    admission_stats = admission_controller.get_stats()
+    pool_stats = http_client.get_pool_stats()
+
+    families = [
+        {
+            "name": "megallm_keys", "type": "gauge", "help": "密钥数量",
+            "labelnames": ("state",), "mode": "min",
+            "values": [(("available",), key_stats["available"]), (("total",), key_stats["total"])]
+        },
+        {
+            "name": "megallm_keys_failed", "type": "gauge", "help": "已标记为失败的密钥数量",
+            "mode": "max", "values": [((), key_stats["failed"])]
+        },
+        {
+            "name": "megallm_admission_active", "type": "gauge", "help": "已准入正在处理的请求数",
+            "values": [((), admission_stats["active"])]
+        },
+        {
+            "name": "megallm_admission_queue_depth", "type": "gauge", "help": "准入队列中等待的请求数",
+            "labelnames": ("class",),
+            "values": [((name,), depth) for name, depth in admission_stats["queue_depth_by_class"].items()]
+        },
+        {
+            "name": "megallm_admission_rejected_total", "type": "counter", "help": "被准入控制拒绝的请求数",
+            "labelnames": ("reason",),
+            "values": [((reason,), count) for reason, count in admission_stats["rejected"].items()]
+        },
+        {
+            "name": "megallm_upstream_pool", "type": "gauge", "help": "上游连接池连接数和请求数",
+            "labelnames": ("state",),
+            "values": [((state,), count) for state, count in pool_stats.items()]
+        },
+        {
+            "name": "megallm_upstream_timeouts_total", "type": "counter", "help": "按阶段统计的上游超时次数",
+            "labelnames": ("kind",),
+            "values": [((kind,), count) for kind, count in http_client.get_timeout_stats().items()]
+        }
+    ]
+
+    if audit_sink is not None:
+        families.append({
+            "name": "megallm_audit_queue_depth", "type": "gauge", "help": "审计队列中等待写入的记录数",
+            "values": [((), audit_sink.get_stats()["queue_depth"])]
+        })
+
+    if session_store is not None:
+        session_stats = session_store.get_stats()
+        families.append({
+            "name": "megallm_ws_sessions", "type": "gauge", "help": "WebSocket 对话会话数",
+            "labelnames": ("state",),
+            "values": [
+                (("connected",), session_stats["connected"]),
+                (("detached",), session_stats["sessions"] - session_stats["connected"])
+            ]
+        })
+
+    return families
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """应用生命周期管理"""
 
     # 启动时初始化
+    startup = StartupState(started=IMPORT_STARTED)
+    startup.phases["import"] = IMPORT_FINISHED - IMPORT_STARTED
+    startup.phases["server"] = time.perf_counter() - IMPORT_FINISHED
+    app.state.startup = startup
+    init_started = time.perf_counter()
+
     setup_logging()
 
     from loguru import logger
     logger.info(f"启动 {settings.app_name} v{settings.app_version}")
 
+    # 实际生效的事件循环和 HTTP 解析器（uvicorn 只导入选中的协议实现）
+    loop = asyncio.get_running_loop()
+    http_impl = "httptools" if "uvicorn.protocols.http.httptools_impl" in sys.modules else "h11"
+    logger.info(f"事件循环: {type(loop).__module__}.{type(loop).__name__}, HTTP 解析器: {http_impl}")
+
     # 初始化密钥管理器
     try:
         key_manager = KeyManager(settings.key_file_path)
@@ -34,11 +143,28 @@ async def lifespan(app: FastAPI):
         logger.error(f"密钥管理器初始化失败: {e}")
         raise
 
+    # 初始化客户端限流器
+    try:
+        rate_limiter = ClientRateLimiter(
+            config_path=settings.client_config_path,
+            auth_required=settings.client_auth_required,
+            default_requests_per_minute=settings.client_default_rpm,
+            default_tokens_per_minute=settings.client_default_tpm,
+            max_tracked_clients=settings.client_max_tracked
+        )
+    except Exception as e:
+        logger.error(f"客户端限流器初始化失败: {e}")
+        raise
+
     # 初始化HTTP客户端
     http_client = MegaLLMClient(
         base_url=settings.megallm_base_url,
         timeout=settings.megallm_timeout,
-        max_retries=settings.megallm_max_retries
+        max_retries=settings.megallm_max_retries,
+        connect_timeout=settings.megallm_connect_timeout,
+        pool_timeout=settings.megallm_pool_timeout,
+        first_byte_timeout=settings.megallm_first_byte_timeout,
+        idle_timeout=settings.megallm_idle_timeout
     )
 
     async with http_client:
@@ -49,15 +175,167 @@ async def lifespan(app: FastAPI):
             max_key_retries=settings.max_key_retries
         )
 
+        # 初始化上下文检查器
+        context_checker = ContextChecker(
+            offload_threshold=settings.context_check_offload_threshold,
+            pool_size=settings.context_check_pool_size,
+            executor_type=settings.context_check_executor
+        )
+
+        # 初始化准入控制器
+        admission_controller = AdmissionController(
+            max_concurrency=settings.admission_max_concurrency,
+            model_concurrency=settings.admission_model_concurrency,
+            model_limits=settings.admission_model_limits,
+            max_queue_size=settings.admission_max_queue_size,
+            max_queue_time=settings.admission_max_queue_time,
+            retry_after=settings.admission_retry_after,
+            class_weights=settings.scheduler_class_weights,
+            capacity_provider=(
+                (lambda: key_manager.available_keys * settings.scheduler_per_key_concurrency)
+                if settings.scheduler_per_key_concurrency > 0 else None
+            )
+        )
+
         # 保存到应用状态
         app.state.proxy_service = proxy_service
+        app.state.context_checker = context_checker
+        app.state.admission_controller = admission_controller
+        app.state.rate_limiter = rate_limiter
 
-        logger.info("服务启动完成，所有组件已就绪")
+        # 初始化批处理任务管理器，并恢复重启前未完成的任务
+        batch_manager = BatchManager(
+            proxy_service=proxy_service,
+            storage_dir=settings.batch_storage_dir,
+            concurrency_per_key=settings.batch_concurrency_per_key,
+            max_concurrency=settings.batch_max_concurrency,
+            checkpoint_interval=settings.batch_checkpoint_interval,
+            admission_controller=admission_controller,
+            context_checker=context_checker
+        )
+        batch_manager.resume_all()
+        app.state.batch_manager = batch_manager
+
+        # 审计日志（后台批量写入压缩文件）
+        audit_sink = None
+        if settings.audit_enabled:
+            from core.audit import AuditSink
+
+            audit_sink = AuditSink(
+                directory=settings.audit_dir,
+                compression=settings.audit_compression,
+                queue_size=settings.audit_queue_size,
+                policy=settings.audit_queue_policy,
+                batch_size=settings.audit_batch_size,
+                flush_interval=settings.audit_flush_interval,
+                rotate_bytes=settings.audit_rotate_mb * 1024 * 1024,
+                rotate_interval=settings.audit_rotate_interval
+            )
+            audit_sink.start()
+        app.state.audit_sink = audit_sink
+
+        # WebSocket 对话会话（服务端保存历史，定期淘汰空闲会话）
+        session_store = None
+        session_evictor = None
+        if settings.ws_enabled:
+            session_store = SessionStore(
+                max_sessions=settings.ws_max_sessions,
+                max_sessions_per_client=settings.ws_max_sessions_per_client,
+                max_messages=settings.ws_session_max_messages,
+                max_chars=settings.ws_session_max_chars,
+                idle_timeout=settings.ws_session_idle_timeout
+            )
+            session_evictor = asyncio.create_task(session_store.run_evictor())
+        app.state.session_store = session_store
+
+        # 事件循环延迟监控（诊断模块按需导入）
+        loop_lag_monitor = None
+        if settings.loop_lag_monitor_enabled:
+            from core.profiler import LoopLagMonitor
+
+            loop_lag_monitor = LoopLagMonitor(
+                interval=settings.loop_lag_interval,
+                threshold=settings.loop_lag_threshold
+            )
+            loop_lag_monitor.start()
+        app.state.loop_lag_monitor = loop_lag_monitor
+
+        # 注册指标采集（密钥、准入队列、连接池、超时），多 worker 时定期写入快照
+        metrics_flusher = None
+        if settings.metrics_enabled:
+            registry.register_collector(
+                lambda: collect_component_metrics(
+                    key_manager, http_client, admission_controller, audit_sink, session_store
+                )
+            )
+            if settings.metrics_multiprocess_dir:
+                registry.enable_multiprocess(settings.metrics_multiprocess_dir, settings.metrics_flush_interval)
+                metrics_flusher = asyncio.create_task(registry.run_flusher())
+
+        # 追踪数据导出（OTLP JSON 行文件）
+        trace_exporter = None
+        trace_buffer = getattr(app.state, "trace_buffer", None)
+        if trace_buffer is not None and trace_buffer.export_dir is not None:
+            trace_exporter = asyncio.create_task(trace_buffer.run_exporter())
+
+        startup.phases["init"] = time.perf_counter() - init_started
+        logger.info("服务启动完成，所有组件已初始化")
+
+        # 预热在后台执行，期间 /health 正常返回、/ready 返回 503
+        warmup_task = None
+        if settings.warmup_enabled:
+            warmup_task = asyncio.create_task(startup.run_warmup(
+                {"upstream": proxy_service.warmup, "context_pool": context_checker.warmup},
+                timeout=settings.warmup_timeout
+            ))
+        else:
+            startup.mark_ready()
+            logger.info(f"服务已就绪（未启用预热）: {startup.summary()}")
+
+        # SIGTERM 时先排空再退出：接管 uvicorn 的 SIGTERM 处理，排空结束后以 SIGINT 通知 uvicorn 正常关闭
+        # （uvicorn 收到退出信号会立即停止监听，无法在关闭监听前让负载均衡器感知）
+        drain_task = None
+        drain_controller = app.state.drain_controller
+        if drain_controller is not None:
+            def on_sigterm():
+                nonlocal drain_task
+                if drain_task is None:
+                    logger.info("收到 SIGTERM，开始排空")
+                    drain_task = asyncio.create_task(drain_and_exit())
+
+            async def drain_and_exit():
+                await drain_controller.drain()
+                signal.raise_signal(signal.SIGINT)
+
+            try:
+                asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, on_sigterm)
+            except (NotImplementedError, RuntimeError):
+                # Windows 或非主线程运行时不支持，保持服务器默认的信号处理
+                pass
 
         yield
 
         # 关闭时清理
         logger.info("服务正在关闭...")
+        if warmup_task is not None:
+            warmup_task.cancel()
+            await asyncio.gather(warmup_task, return_exceptions=True)
+        await batch_manager.shutdown()
+        if session_evictor is not None:
+            session_evictor.cancel()
+            await asyncio.gather(session_evictor, return_exceptions=True)
+        if audit_sink is not None:
+            await audit_sink.close()
+        context_checker.shutdown()
+        if loop_lag_monitor is not None:
+            await loop_lag_monitor.stop()
+        if trace_exporter is not None:
+            trace_exporter.cancel()
+            await asyncio.gather(trace_exporter, return_exceptions=True)
+        if metrics_flusher is not None:
+            metrics_flusher.cancel()
+            await asyncio.gather(metrics_flusher, return_exceptions=True)
+        registry.clear_collectors()
 
 
 # 创建FastAPI应用
@@ -79,6 +357,44 @@ app.add_middleware(
     allow_headers=settings.cors_headers,
 )
 
+# 添加响应压缩中间件（在 Server-Timing 中间件内层，压缩耗时计入总耗时）
+if settings.compression_enabled:
+    app.add_middleware(
+        CompressionMiddleware,
+        encodings=settings.compression_encodings,
+        min_size=settings.compression_min_size,
+        offload_threshold=settings.compression_offload_threshold,
+        levels=settings.compression_levels,
+        sse=settings.compression_sse
+    )
+
+# 添加优雅排空中间件（在访问日志和追踪中间件内层，排空期间拒绝的请求同样有访问日志和请求ID）
+app.state.drain_controller = None
+if settings.drain_enabled:
+    app.state.drain_controller = DrainController(
+        grace_period=settings.drain_grace_period,
+        retry_after=settings.drain_retry_after
+    )
+    app.add_middleware(DrainMiddleware, controller=app.state.drain_controller)
+
+# 添加访问日志中间件（在 Server-Timing 中间件内层，可读取各阶段耗时）
+if settings.access_log_enabled:
+    app.add_middleware(AccessLogMiddleware)
+
+# 添加 Server-Timing 中间件
+if settings.server_timing_enabled:
+    app.add_middleware(ServerTimingMiddleware)
+
+# 添加请求追踪中间件（最外层，其他中间件和路由的日志都带有请求ID）
+app.state.trace_buffer = None
+if settings.tracing_enabled:
+    app.state.trace_buffer = TraceBuffer(
+        size=settings.tracing_buffer_size,
+        export_dir=settings.tracing_export_dir,
+        export_interval=settings.tracing_export_interval
+    )
+    app.add_middleware(TracingMiddleware, buffer=app.state.trace_buffer)
+
 # 注册路由
 app.include_router(router)
 
@@ -92,7 +408,8 @@ async def root():
         "version": settings.app_version,
         "status": "running",
         "docs": "/docs",
-        "health": "/health"
+        "health": "/health",
+        "ready": "/ready"
     }
 
 
@@ -116,11 +433,7 @@ async def global_exception_handler(request, exc):
 
 
 if __name__ == '__main__':
-    uvicorn.run(
-        "main:app",
-        host=settings.host,
-        port=settings.port,
-        workers=settings.workers,
-        reload=settings.reload,
-        log_level=settings.log_level.lower()
-    )
\ No newline at end of file
+    from server.engine import run_server
+
+    setup_logging()
+    run_server(settings)
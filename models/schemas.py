@@ -80,4 +80,6 @@ class HealthResponse(BaseModel):
     """健康检查响应"""
     status: str = Field(..., description="服务状态")
     key_stats: Dict[str, Any] = Field(..., description="密钥统计")
+    admission: Optional[Dict[str, Any]] = Field(None, description="准入控制统计（并发数、排队深度、排队时间）")
+    timeouts: Optional[Dict[str, int]] = Field(None, description="上游各阶段超时次数")
     version: str = Field(..., description="服务版本")
@@ -0,0 +1,559 @@
+#!/usr/bin/env python3
+"""
+负载生成工具 - 按固定到达速率回放对话语料，测量代理在真实负载下的延迟分布
+
+子命令:
+    smoke      冒烟测试: 健康检查、模型列表、一次非流式和一次流式请求（替代原 test_api.py / test_stream.py）
+    generate   生成合成对话语料（JSONL）: 单轮短对话、多轮对话，以及接近 MODEL_CONTEXT_LIMITS 的长上下文请求
+    run        开环回放语料: 请求按 --rate 的到达速率（泊松或均匀间隔）发出，不等待前一个请求完成；
+               测量首 token 延迟（TTFT）、token 间延迟（ITL）、总延迟和错误分类，输出 HDR 风格的百分位报告
+
+开环负载下延迟从计划发送时间开始计算（避免 coordinated omission：服务变慢时闭环脚本会自动降低发送速率，
+排队延迟被隐藏）；负载发生器落后于计划的时间单独报告，落后明显时结果不可信。
+
+语料每行一个请求体（OpenAI 格式），可选的 kind 字段用于分类统计，发送前移除。
+
+运行方式:
+    python scripts/loadgen.py smoke
+    python scripts/loadgen.py generate --output data/corpus.jsonl --count 500 --long-fraction 0.05
+    python scripts/loadgen.py run --corpus data/corpus.jsonl --rate 5 --duration 60
+    python scripts/loadgen.py run --corpus data/corpus.jsonl --rate 20 --arrival uniform --hgrm-dir results/
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from config.model_config import (  # noqa: E402
+    MODEL_CONTEXT_LIMITS, calculate_messages_tokens, get_prompt_budget
+)
+from core.sse import DONE, SSEParser  # noqa: E402
+
+DEFAULT_BASE_URL = "http://localhost:8000"
+DEFAULT_MODEL = "openai-gpt-oss-120b"
+
+# 报告中的百分位（HDR 风格，向尾部逐级加密）
+REPORT_PERCENTILES = (50, 75, 90, 95, 99, 99.9, 99.99)
+
+
+async def smoke(args) -> int:
+    """依次检查各端点，返回失败项数"""
+    failures = 0
+    payload = {
+        "model": args.model,
+        "messages": [{"role": "user", "content": "请用三句话介绍Python语言"}],
+        "max_tokens": 200
+    }
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout) as client:
+        async def check(name: str, call) -> None:
+            nonlocal failures
+            print(f"{name}...")
+            try:
+                detail = await call()
+                print(f"  ✅ {detail}")
+            except Exception as e:
+                failures += 1
+                print(f"  ❌ {type(e).__name__}: {e}")
+
+        async def health():
+            response = await client.get("/health")
+            response.raise_for_status()
+            return json.dumps(response.json(), ensure_ascii=False)
+
+        async def models():
+            response = await client.get("/v1/models")
+            response.raise_for_status()
+            return f"{len(response.json().get('data', []))} 个模型"
+
+        async def non_stream():
+            response = await client.post("/v1/chat/completions", json=payload)
+            response.raise_for_status()
+            result = response.json()
+            return f"回复: {result['choices'][0]['message']['content']!r}，用量: {result.get('usage')}"
+
+        async def stream():
+            parser = SSEParser()
+            content = []
+            async with client.stream("POST", "/v1/chat/completions", json={**payload, "stream": True}) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes():
+                    for data in parser.feed(chunk):
+                        if data == DONE:
+                            return f"回复: {''.join(content)!r}"
+                        event = json.loads(data)
+                        if "error" in event:
+                            raise RuntimeError(f"流中返回错误: {event['error']}")
+                        for choice in event.get("choices") or []:
+                            content.append((choice.get("delta") or {}).get("content") or "")
+            raise RuntimeError("流式响应未以 [DONE] 结束")
+
+        await check("健康检查 GET /health", health)
+        await check("模型列表 GET /v1/models", models)
+        await check("非流式请求", non_stream)
+        await check("流式请求", stream)
+
+    print(f"\n{'全部通过' if failures == 0 else f'{failures} 项失败'}")
+    return failures
+
+
+SENTENCES = (
+    "请帮我分析一下这段代码的性能瓶颈。",
+    "我们的服务在高峰期延迟明显上升，可能是什么原因？",
+    "Summarize the following meeting notes and list the action items.",
+    "Explain the difference between optimistic and pessimistic locking.",
+    "这个函数在处理大文件时内存占用过高，有什么优化思路？",
+    "Write a unit test for the retry logic described above.",
+    "用户反馈导出报表时经常超时，需要排查数据库查询。",
+    "Translate the previous paragraph into formal English.",
+    "What are the trade-offs of using a ring buffer here?",
+    "请把上面的方案整理成一份简短的设计文档。",
+)
+
+
+def _paragraph(rng: random.Random, sentences: int) -> str:
+    return "".join(rng.choice(SENTENCES) for _ in range(sentences))
+
+
+def _long_messages(rng: random.Random, model: str, max_tokens: int, ratio: float) -> List[Dict[str, str]]:
+    """生成输入 token 估算约为模型输入预算 ratio 倍的长上下文请求（文档 + 提问）"""
+    target = int(get_prompt_budget(model, max_tokens) * ratio)
+    question = {"role": "user", "content": "根据上面的文档回答：" + rng.choice(SENTENCES)}
+    overhead = calculate_messages_tokens([{"role": "system", "content": ""}, question])
+
+    # 以一段文本的估算值为单位按比例放大，最后逐段补足
+    unit = _paragraph(rng, 20)
+    unit_tokens = calculate_messages_tokens([{"role": "user", "content": unit}]) - 4
+    document = unit * max((target - overhead) // unit_tokens, 0)
+    while calculate_messages_tokens([{"role": "system", "content": document}, question]) < target - unit_tokens:
+        document += unit
+    return [{"role": "system", "content": document}, question]
+
+
+def generate_corpus(
+    count: int,
+    models: List[str],
+    long_fraction: float = 0.05,
+    chat_fraction: float = 0.45,
+    stream_fraction: float = 0.8,
+    long_ratio: float = 0.9,
+    seed: int = 42
+) -> Iterator[Dict[str, Any]]:
+    """
+    生成合成对话语料
+
+    Args:
+        count: 请求数
+        models: 模型列表（每个请求随机选择）
+        long_fraction: 长上下文请求比例
+        chat_fraction: 多轮对话比例（其余为单轮短对话）
+        stream_fraction: 流式请求比例
+        long_ratio: 长上下文请求的输入 token 占模型输入预算的比例
+        seed: 随机数种子
+
+    Yields:
+        请求体（含 kind 字段: short / chat / long）
+    """
+    rng = random.Random(seed)
+    for _ in range(count):
+        model = rng.choice(models)
+        draw = rng.random()
+        max_tokens = rng.choice((128, 256, 512, 1024))
+
+        if draw < long_fraction:
+            kind = "long"
+            messages = _long_messages(rng, model, max_tokens, long_ratio)
+        elif draw < long_fraction + chat_fraction:
+            kind = "chat"
+            messages = [{"role": "system", "content": "你是一个资深的后端工程师助手。"}]
+            for _ in range(rng.randint(2, 6)):
+                messages.append({"role": "user", "content": _paragraph(rng, rng.randint(1, 6))})
+                messages.append({"role": "assistant", "content": _paragraph(rng, rng.randint(3, 12))})
+            messages.append({"role": "user", "content": _paragraph(rng, rng.randint(1, 4))})
+        else:
+            kind = "short"
+            messages = [{"role": "user", "content": _paragraph(rng, rng.randint(1, 3))}]
+
+        yield {
+            "kind": kind,
+            "model": model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "stream": rng.random() < stream_fraction
+        }
+
+
+def generate(args) -> None:
+    models = args.models.split(",") if args.models else [DEFAULT_MODEL]
+    for model in models:
+        if model not in MODEL_CONTEXT_LIMITS:
+            print(f"警告: {model} 不在 MODEL_CONTEXT_LIMITS 中，按默认上下文长度生成", file=sys.stderr)
+
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    kinds: Dict[str, int] = {}
+    with open(output, "w", encoding="utf-8") as f:
+        for request in generate_corpus(
+            args.count, models, args.long_fraction, args.chat_fraction, args.stream_fraction, args.long_ratio, args.seed
+        ):
+            kinds[request["kind"]] = kinds.get(request["kind"], 0) + 1
+            f.write(json.dumps(request, ensure_ascii=False) + "\n")
+    print(f"已生成 {args.count} 个请求到 {output}（{output.stat().st_size / 1e6:.1f} MB）: {kinds}")
+
+
+class LatencyRecorder:
+    """
+    记录延迟样本并输出 HDR 风格的百分位报告
+
+    保留全部原始样本（毫秒）精确计算百分位；hgrm() 输出与 HdrHistogram 相同格式的百分位分布，
+    可直接用 HdrHistogram 的绘图工具对比多次运行的延迟曲线。
+    """
+
+    def __init__(self):
+        self.values: List[float] = []
+
+    def record(self, value_ms: float) -> None:
+        self.values.append(value_ms)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def percentile(self, pct: float) -> float:
+        """百分位数（最近秩法）"""
+        if not self.values:
+            return 0.0
+        ordered = sorted(self.values)
+        rank = max(math.ceil(len(ordered) * pct / 100), 1)
+        return ordered[min(rank, len(ordered)) - 1]
+
+    def summary(self) -> Dict[str, float]:
+        if not self.values:
+            return {}
+        result = {f"p{pct:g}": round(self.percentile(pct), 2) for pct in REPORT_PERCENTILES}
+        result["max"] = round(max(self.values), 2)
+        result["mean"] = round(sum(self.values) / len(self.values), 2)
+        result["count"] = len(self.values)
+        return result
+
+    def hgrm(self, ticks_per_half: int = 5) -> str:
+        """
+        HdrHistogram 格式的百分位分布（Value / Percentile / TotalCount / 1/(1-Percentile)）
+
+        与 HdrHistogram 一样，每次剩余比例减半时输出 ticks_per_half 个点，尾部越来越密。
+        """
+        lines = [f"{'Value':>12} {'Percentile':>14} {'TotalCount':>10} {'1/(1-Percentile)':>14}", ""]
+        if not self.values:
+            return "\n".join(lines)
+        ordered = sorted(self.values)
+        total = len(ordered)
+        percentile = 0.0
+        while True:
+            index = min(max(math.ceil(total * percentile) - 1, 0), total - 1)
+            if index >= total - 1:
+                break
+            lines.append(f"{ordered[index]:12.3f} {percentile:14.12f} {index + 1:10d} {1 / (1 - percentile):14.2f}")
+            # 剩余比例每减半一次，步长也减半
+            level = 2 ** math.floor(math.log2(1 / (1 - percentile)) + 1e-9)
+            percentile += 1 / (level * 2 * ticks_per_half)
+        lines.append(f"{ordered[-1]:12.3f} {1.0:14.12f} {total:10d}")
+        lines.append(f"#[Mean    = {sum(ordered) / total:12.3f}, StdDeviation   = {_stdev(ordered):12.3f}]")
+        lines.append(f"#[Max     = {ordered[-1]:12.3f}, Total count    = {total:12d}]")
+        return "\n".join(lines) + "\n"
+
+
+def _stdev(values: List[float]) -> float:
+    mean = sum(values) / len(values)
+    return math.sqrt(sum((value - mean) ** 2 for value in values) / len(values))
+
+
+class RunStats:
+    """一次回放的全部统计（按请求类型分别记录）"""
+
+    def __init__(self):
+        self.ttft = {"all": LatencyRecorder()}
+        self.itl = {"all": LatencyRecorder()}
+        self.total = {"all": LatencyRecorder()}
+        self.errors: Dict[str, int] = {}
+        self.sent = 0
+        self.succeeded = 0
+        self.skipped = 0
+        self.completion_tokens = 0
+        self.schedule_lag = LatencyRecorder()
+        self.max_inflight = 0
+
+    def _recorders(self, table: Dict[str, LatencyRecorder], kind: str) -> List[LatencyRecorder]:
+        return [table["all"], table.setdefault(kind, LatencyRecorder())]
+
+    def record_success(self, kind: str, total: float, ttft: Optional[float], gaps: List[float], tokens: int) -> None:
+        self.succeeded += 1
+        self.completion_tokens += tokens
+        for recorder in self._recorders(self.total, kind):
+            recorder.record(total)
+        if ttft is not None:
+            for recorder in self._recorders(self.ttft, kind):
+                recorder.record(ttft)
+        for recorder in self._recorders(self.itl, kind):
+            for gap in gaps:
+                recorder.record(gap)
+
+    def record_error(self, error: str) -> None:
+        self.errors[error] = self.errors.get(error, 0) + 1
+
+
+def load_corpus(path: str) -> List[Dict[str, Any]]:
+    """读取 JSONL 语料（跳过空行）"""
+    with open(path, encoding="utf-8") as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+    if not corpus:
+        raise ValueError(f"语料为空: {path}")
+    return corpus
+
+
+async def send_one(client: httpx.AsyncClient, body: Dict[str, Any], scheduled: float, stats: RunStats) -> None:
+    """
+    发送一个请求并记录结果（延迟从计划发送时间开始计算）
+
+    流式请求解析 SSE：首个非空 content/tool_calls 增量为首 token，之后相邻增量的间隔为 ITL；
+    未以 [DONE] 结束或流中出现错误事件均计为失败。非流式请求只记录总延迟。
+    """
+    kind = body.pop("kind", "default")
+    stream = bool(body.get("stream"))
+
+    def elapsed() -> float:
+        return (time.perf_counter() - scheduled) * 1000
+
+    try:
+        if not stream:
+            response = await client.post("/v1/chat/completions", json=body)
+            if response.status_code != 200:
+                stats.record_error(f"http_{response.status_code}")
+                return
+            usage = response.json().get("usage") or {}
+            stats.record_success(kind, elapsed(), None, [], usage.get("completion_tokens") or 0)
+            return
+
+        parser = SSEParser()
+        ttft = None
+        last_token = None
+        gaps: List[float] = []
+        tokens = 0
+        done = False
+        async with client.stream("POST", "/v1/chat/completions", json=body) as response:
+            if response.status_code != 200:
+                await response.aread()
+                stats.record_error(f"http_{response.status_code}")
+                return
+            async for chunk in response.aiter_bytes():
+                for data in parser.feed(chunk):
+                    if data == DONE:
+                        done = True
+                        continue
+                    try:
+                        event = json.loads(data)
+                    except ValueError:
+                        continue
+                    if "error" in event:
+                        error = event["error"]
+                        stats.record_error(f"sse_{error.get('type', 'error') if isinstance(error, dict) else 'error'}")
+                        return
+                    if event.get("usage"):
+                        tokens = event["usage"].get("completion_tokens") or tokens
+                    if any(
+                        (choice.get("delta") or {}).get("content") or (choice.get("delta") or {}).get("tool_calls")
+                        for choice in event.get("choices") or []
+                    ):
+                        now = elapsed()
+                        if ttft is None:
+                            ttft = now
+                        else:
+                            gaps.append(now - last_token)
+                        last_token = now
+        if not done:
+            stats.record_error("truncated")
+            return
+        stats.record_success(kind, elapsed(), ttft, gaps, tokens or len(gaps) + (ttft is not None))
+    except httpx.TimeoutException:
+        stats.record_error("timeout")
+    except httpx.HTTPError as e:
+        stats.record_error(type(e).__name__)
+
+
+def arrival_times(rate: float, duration: float, arrival: str, rng: random.Random) -> Iterator[float]:
+    """生成相对开始时间的计划发送时间（泊松过程或均匀间隔）"""
+    offset = 0.0
+    while True:
+        offset += rng.expovariate(rate) if arrival == "poisson" else 1 / rate
+        if offset >= duration:
+            return
+        yield offset
+
+
+async def replay(args) -> RunStats:
+    """开环回放语料"""
+    corpus = load_corpus(args.corpus)
+    rng = random.Random(args.seed)
+    if args.shuffle:
+        rng.shuffle(corpus)
+
+    stats = RunStats()
+    inflight: set = set()
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=args.max_inflight)
+    headers = {"Authorization": f"Bearer {args.api_key}"} if args.api_key else {}
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits, headers=headers) as client:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        perf_started = time.perf_counter()
+        next_report = args.report_interval
+
+        for i, offset in enumerate(arrival_times(args.rate, args.duration, args.arrival, rng)):
+            delay = started + offset - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            stats.schedule_lag.record(max(-delay, 0) * 1000)
+
+            if len(inflight) >= args.max_inflight:
+                stats.skipped += 1
+                continue
+
+            body = dict(corpus[i % len(corpus)])
+            if args.stream != "corpus":
+                body["stream"] = args.stream == "always"
+            if args.model:
+                body["model"] = args.model
+            stats.sent += 1
+            task = asyncio.create_task(send_one(client, body, perf_started + offset, stats))
+            inflight.add(task)
+            task.add_done_callback(inflight.discard)
+            stats.max_inflight = max(stats.max_inflight, len(inflight))
+
+            if args.report_interval and offset >= next_report:
+                next_report += args.report_interval
+                print(
+                    f"[{offset:6.1f}s] 已发送 {stats.sent}  成功 {stats.succeeded}  失败 {sum(stats.errors.values())}"
+                    f"  进行中 {len(inflight)}",
+                    flush=True
+                )
+
+        if inflight:
+            await asyncio.wait(set(inflight), timeout=args.timeout)
+            for task in list(inflight):
+                task.cancel()
+                stats.record_error("unfinished")
+
+    return stats
+
+
+def report(stats: RunStats, args) -> Dict[str, Any]:
+    """打印报告并返回 JSON 结果"""
+    failed = sum(stats.errors.values())
+    print(f"\n发送 {stats.sent}  成功 {stats.succeeded}  失败 {failed}  最大进行中 {stats.max_inflight}")
+    if stats.skipped:
+        print(f"跳过 {stats.skipped} 个到达（进行中请求达到 --max-inflight）")
+    lag = stats.schedule_lag.summary()
+    if lag:
+        print(f"负载发生器落后计划: p99={lag['p99']:.1f}ms  max={lag['max']:.1f}ms"
+              + ("  ⚠ 负载发生器跟不上到达速率，结果偏乐观" if lag["p99"] > 10 else ""))
+    if stats.errors:
+        print("错误分类: " + "  ".join(f"{name}={count}" for name, count in sorted(stats.errors.items())))
+
+    columns = [f"p{pct:g}" for pct in REPORT_PERCENTILES] + ["max"]
+    print(f"\n{'指标(ms)':<16}{'样本':>8}" + "".join(f"{column:>10}" for column in columns))
+    for name, table in (("TTFT", stats.ttft), ("ITL", stats.itl), ("总延迟", stats.total)):
+        for kind, recorder in sorted(table.items(), key=lambda item: item[0] != "all"):
+            if not len(recorder):
+                continue
+            summary = recorder.summary()
+            label = name if kind == "all" else f"  {kind}"
+            print(f"{label:<16}{len(recorder):>8}" + "".join(f"{summary[column]:>10.1f}" for column in columns))
+
+    if args.hgrm_dir:
+        directory = Path(args.hgrm_dir)
+        directory.mkdir(parents=True, exist_ok=True)
+        for name, table in (("ttft", stats.ttft), ("itl", stats.itl), ("total", stats.total)):
+            (directory / f"{name}.hgrm").write_text(table["all"].hgrm(), encoding="utf-8")
+        print(f"\nHDR 百分位分布已写入 {directory}/{{ttft,itl,total}}.hgrm")
+
+    return {
+        "args": {key: value for key, value in vars(args).items() if key != "func"},
+        "sent": stats.sent,
+        "succeeded": stats.succeeded,
+        "skipped": stats.skipped,
+        "errors": stats.errors,
+        "max_inflight": stats.max_inflight,
+        "completion_tokens": stats.completion_tokens,
+        "schedule_lag_ms": lag,
+        "ttft_ms": {kind: recorder.summary() for kind, recorder in stats.ttft.items()},
+        "itl_ms": {kind: recorder.summary() for kind, recorder in stats.itl.items()},
+        "total_ms": {kind: recorder.summary() for kind, recorder in stats.total.items()}
+    }
+
+
+def run(args) -> int:
+    stats = asyncio.run(replay(args))
+    result = report(stats, args)
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.output).write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"结果已写入 {args.output}")
+    return 0 if stats.sent and not stats.errors else 1
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="MegaLLM Proxy 负载生成工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    smoke_parser = subparsers.add_parser("smoke", help="冒烟测试")
+    smoke_parser.add_argument("--base-url", default=DEFAULT_BASE_URL)
+    smoke_parser.add_argument("--model", default=DEFAULT_MODEL)
+    smoke_parser.add_argument("--timeout", type=float, default=120.0)
+
+    generate_parser = subparsers.add_parser("generate", help="生成合成对话语料")
+    generate_parser.add_argument("--output", required=True, help="输出 JSONL 文件")
+    generate_parser.add_argument("--count", type=int, default=500, help="请求数")
+    generate_parser.add_argument("--models", help=f"模型列表，逗号分隔（默认 {DEFAULT_MODEL}）")
+    generate_parser.add_argument("--long-fraction", type=float, default=0.05, help="长上下文请求比例")
+    generate_parser.add_argument("--chat-fraction", type=float, default=0.45, help="多轮对话比例")
+    generate_parser.add_argument("--stream-fraction", type=float, default=0.8, help="流式请求比例")
+    generate_parser.add_argument("--long-ratio", type=float, default=0.9, help="长上下文输入占模型输入预算的比例")
+    generate_parser.add_argument("--seed", type=int, default=42)
+
+    run_parser = subparsers.add_parser("run", help="开环回放语料")
+    run_parser.add_argument("--corpus", required=True, help="JSONL 语料文件")
+    run_parser.add_argument("--base-url", default=DEFAULT_BASE_URL)
+    run_parser.add_argument("--api-key", help="客户端 API Key（启用客户端认证时）")
+    run_parser.add_argument("--rate", type=float, required=True, help="到达速率（请求/秒）")
+    run_parser.add_argument("--duration", type=float, default=60.0, help="发送时长（秒）")
+    run_parser.add_argument("--arrival", choices=("poisson", "uniform"), default="poisson", help="到达过程")
+    run_parser.add_argument("--stream", choices=("corpus", "always", "never"), default="corpus", help="是否流式")
+    run_parser.add_argument("--model", help="覆盖语料中的模型")
+    run_parser.add_argument("--shuffle", action="store_true", help="打乱语料顺序")
+    run_parser.add_argument("--seed", type=int, default=42)
+    run_parser.add_argument("--timeout", type=float, default=300.0, help="单个请求超时（秒）")
+    run_parser.add_argument("--max-inflight", type=int, default=10_000, help="进行中请求上限，超出的到达计为跳过")
+    run_parser.add_argument("--report-interval", type=float, default=10.0, help="进度输出间隔（秒），0 关闭")
+    run_parser.add_argument("--output", help="JSON 结果文件")
+    run_parser.add_argument("--hgrm-dir", help="写入 HdrHistogram 格式百分位分布的目录")
+
+    args = parser.parse_args()
+    if args.command == "smoke":
+        return 1 if asyncio.run(smoke(args)) else 0
+    if args.command == "generate":
+        generate(args)
+        return 0
+    if args.rate <= 0:
+        parser.error("--rate 必须大于 0")
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
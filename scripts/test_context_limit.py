@@ -27,8 +27,10 @@ def test_get_model_info():
 
             print(f"\n模型: {info['id']}")
             print(f"  上下文长度: {info['context_length_formatted']}")
+            if 'max_output_tokens' in info:
+                print(f"  最大输出: {info['max_output_tokens']:,} tokens")
             if 'usable_limit_formatted' in info:
-                print(f"  可用限制 (90%): {info['usable_limit_formatted']}")
+                print(f"  可用限制: {info['usable_limit_formatted']}")
             if 'note' in info:
                 print(f"  备注: {info['note']}")
 
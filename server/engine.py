@@ -0,0 +1,257 @@
+"""
+服务器引擎模块 - 性能档位、按 CPU 配额确定 worker 数、SO_REUSEPORT 多进程监听
+
+`python main.py` 通过 run_server() 启动 uvicorn。档位给出事件循环、HTTP 解析器、worker 数、
+SO_REUSEPORT、backlog 和 keep-alive 的默认值，SERVER_* 配置单独覆盖其中某一项。
+
+多 worker 时 uvicorn 默认由父进程监听一个套接字、各 worker 共享 accept，连接在 worker 之间分布
+不均；启用 SO_REUSEPORT 时每个 worker 各自绑定同一端口，由内核按连接哈希分发。
+"""
+import importlib.util
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+from pathlib import Path
+from typing import Optional
+
+import uvicorn
+
+from core.metrics import clear_multiprocess_dir
+
+logger = logging.getLogger(__name__)
+
+APP = "main:app"
+
+# 多 worker 且未配置 METRICS_MULTIPROCESS_DIR 时使用的指标快照目录
+DEFAULT_METRICS_DIR = "data/metrics"
+
+# 档位默认值；workers=0 表示按 CPU 配额自动确定
+PROFILES = {
+    "default": {
+        "loop": "auto", "http": "auto", "workers": 1, "reuse_port": False,
+        "backlog": 2048, "keepalive_timeout": 5
+    },
+    "performance": {
+        # keep-alive 长于常见负载均衡器的空闲超时（60 秒），避免代理先关闭连接导致 502
+        "loop": "uvloop", "http": "httptools", "workers": 0, "reuse_port": True,
+        "backlog": 4096, "keepalive_timeout": 75
+    },
+}
+
+# 实现名称 -> 需要的模块
+_OPTIONAL_IMPLEMENTATIONS = {
+    ("loop", "uvloop"): ("uvloop", "asyncio"),
+    ("http", "httptools"): ("httptools", "h11"),
+}
+
+
+def cpu_quota() -> Optional[float]:
+    """
+    读取 cgroup CPU 配额（容器 --cpus / Kubernetes limits.cpu）
+
+    Returns:
+        配额核数，未限制或无法读取时返回 None
+    """
+    # cgroup v2: <挂载点>/<cgroup 路径>/cpu.max，内容为 "<quota> <period>" 或 "max <period>"
+    candidates = []
+    try:
+        for line in Path("/proc/self/cgroup").read_text().splitlines():
+            if line.startswith("0::"):
+                candidates.append(Path("/sys/fs/cgroup") / line[3:].lstrip("/") / "cpu.max")
+    except OSError:
+        pass
+    candidates.append(Path("/sys/fs/cgroup/cpu.max"))
+
+    for path in candidates:
+        try:
+            quota, period = path.read_text().split()[:2]
+        except (OSError, ValueError):
+            continue
+        return None if quota == "max" else int(quota) / int(period)
+
+    # cgroup v1
+    try:
+        quota = int(Path("/sys/fs/cgroup/cpu/cpu.cfs_quota_us").read_text())
+        period = int(Path("/sys/fs/cgroup/cpu/cpu.cfs_period_us").read_text())
+    except (OSError, ValueError):
+        return None
+    return quota / period if quota > 0 and period > 0 else None
+
+
+def available_cpus() -> int:
+    """
+    当前进程可用的 CPU 数：CPU 亲和性（cpuset）与 cgroup 配额中较小者，配额向下取整且至少为 1
+
+    Returns:
+        CPU 数
+    """
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+
+    quota = cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, int(quota))
+    return max(cpus, 1)
+
+
+def resolve_profile(settings) -> dict:
+    """
+    合并档位默认值和单独配置，并检查可选实现是否已安装
+
+    Args:
+        settings: 应用配置
+
+    Returns:
+        {"profile", "loop", "http", "workers", "reuse_port", "backlog", "keepalive_timeout"}
+
+    Raises:
+        ValueError: 档位或实现名称不支持时
+    """
+    if settings.server_profile not in PROFILES:
+        raise ValueError(f"不支持的服务器档位: {settings.server_profile}，可选: {', '.join(PROFILES)}")
+
+    overrides = {
+        "loop": settings.server_loop,
+        "http": settings.server_http,
+        "workers": settings.workers,
+        "reuse_port": settings.server_reuse_port,
+        "backlog": settings.server_backlog,
+        "keepalive_timeout": settings.server_keepalive_timeout,
+    }
+    resolved = {"profile": settings.server_profile, **PROFILES[settings.server_profile]}
+    resolved.update({name: value for name, value in overrides.items() if value is not None})
+
+    if resolved["loop"] not in ("auto", "asyncio", "uvloop"):
+        raise ValueError(f"不支持的事件循环: {resolved['loop']}")
+    if resolved["http"] not in ("auto", "h11", "httptools"):
+        raise ValueError(f"不支持的 HTTP 解析器: {resolved['http']}")
+
+    # 档位指定的可选实现未安装时（如 Windows 不支持 uvloop）回退到纯 Python 实现
+    for (field, name), (module, fallback) in _OPTIONAL_IMPLEMENTATIONS.items():
+        if resolved[field] == name and importlib.util.find_spec(module) is None:
+            logger.warning(f"{module} 未安装，{field} 回退为 {fallback}")
+            resolved[field] = fallback
+
+    if resolved["workers"] <= 0:
+        resolved["workers"] = available_cpus()
+
+    if settings.reload:
+        resolved["workers"] = 1
+    if resolved["reuse_port"] and not hasattr(socket, "SO_REUSEPORT"):
+        logger.warning("当前平台不支持 SO_REUSEPORT，使用共享监听套接字")
+        resolved["reuse_port"] = False
+    return resolved
+
+
+def uvicorn_options(settings, engine: dict) -> dict:
+    """生成 uvicorn.run / uvicorn.Config 的公共参数"""
+    return {
+        "host": settings.host,
+        "port": settings.port,
+        "loop": engine["loop"],
+        "http": engine["http"],
+        "backlog": engine["backlog"],
+        "timeout_keep_alive": engine["keepalive_timeout"],
+        "log_level": settings.log_level.lower(),
+    }
+
+
+def reuse_port_socket(host: str, port: int) -> socket.socket:
+    """创建启用 SO_REUSEPORT 的监听套接字（由 asyncio 按 backlog 调用 listen）"""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    return sock
+
+
+def _serve_worker(engine: dict) -> None:
+    """worker 进程入口：各自绑定端口后运行 uvicorn"""
+    from config.settings import settings
+
+    config = uvicorn.Config(APP, **uvicorn_options(settings, engine))
+    sock = reuse_port_socket(settings.host, settings.port)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def run_reuse_port(engine: dict) -> None:
+    """
+    启动 SO_REUSEPORT 多进程服务
+
+    父进程只负责启动和停止 worker：收到 SIGINT/SIGTERM 时向各 worker 发送 SIGTERM（worker 各自排空后退出）。
+
+    Args:
+        engine: resolve_profile() 的结果
+    """
+    context = multiprocessing.get_context("spawn")
+    should_exit = threading.Event()
+
+    def handle_exit(sig, frame):
+        should_exit.set()
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, handle_exit)
+
+    processes = [context.Process(target=_serve_worker, args=(engine,)) for _ in range(engine["workers"])]
+    for process in processes:
+        process.start()
+    logger.info(f"已启动 {len(processes)} 个 worker（SO_REUSEPORT）: {[process.pid for process in processes]}")
+
+    while not should_exit.wait(0.5):
+        if not any(process.is_alive() for process in processes):
+            logger.error("所有 worker 均已退出")
+            break
+
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    for process in processes:
+        process.join()
+
+
+def prepare_metrics_dir(settings, engine: dict) -> None:
+    """
+    多 worker 时确保 /metrics 聚合全部 worker 的指标
+
+    各 worker 独立计数，未设置快照目录时抓取结果只反映恰好响应的那个 worker：此时使用默认目录，
+    并写入环境变量由 worker 进程继承。启动 worker 前清理旧快照，避免累计上次运行的计数。
+
+    Args:
+        settings: 应用配置
+        engine: resolve_profile() 的结果
+    """
+    if engine["workers"] > 1 and settings.metrics_enabled and not settings.metrics_multiprocess_dir:
+        settings.metrics_multiprocess_dir = DEFAULT_METRICS_DIR
+        os.environ["METRICS_MULTIPROCESS_DIR"] = DEFAULT_METRICS_DIR
+        logger.info(f"多 worker 部署未设置 METRICS_MULTIPROCESS_DIR，指标快照写入 {DEFAULT_METRICS_DIR}")
+
+    if settings.metrics_multiprocess_dir:
+        clear_multiprocess_dir(settings.metrics_multiprocess_dir)
+
+
+def run_server(settings) -> None:
+    """
+    按配置启动服务（python main.py 的入口）
+
+    Args:
+        settings: 应用配置
+    """
+    engine = resolve_profile(settings)
+    logger.info(
+        "服务器引擎: profile=%s loop=%s http=%s workers=%d reuse_port=%s backlog=%d keepalive=%ds",
+        engine["profile"], engine["loop"], engine["http"], engine["workers"], engine["reuse_port"],
+        engine["backlog"], engine["keepalive_timeout"]
+    )
+    prepare_metrics_dir(settings, engine)
+
+    if engine["reuse_port"] and engine["workers"] > 1:
+        run_reuse_port(engine)
+        return
+
+    uvicorn.run(APP, workers=engine["workers"], reload=settings.reload, **uvicorn_options(settings, engine))
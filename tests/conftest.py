@@ -0,0 +1,187 @@
+"""
+测试公共配置 - 热路径微基准测试
+
+微基准测试默认跳过，`pytest --bench` 时运行。每个用例测得的单次耗时先按机器校准比例换算，
+再与 `tests/microbench_baseline.json` 中提交的基线比较，超过基线 x 阈值即失败，
+用于在部署前发现单请求开销的退化。`--bench-save` 重新生成基线（不做阈值检查）。
+"""
+import gc
+import json
+import platform
+import statistics
+import time
+from pathlib import Path
+
+import pytest
+
+
+BASELINE_PATH = Path(__file__).parent / "microbench_baseline.json"
+
+# 单轮最短时长（纳秒），迭代次数据此自动校准
+MIN_ROUND_NS = 20_000_000
+ROUNDS = 7
+
+RESULTS_KEY = pytest.StashKey[dict]()
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("microbench", "热路径微基准测试")
+    group.addoption("--bench", action="store_true", default=False, help="运行微基准测试并与基线比较")
+    group.addoption("--bench-save", action="store_true", default=False, help="运行微基准测试并重写基线文件")
+    group.addoption(
+        "--bench-threshold", type=float, default=1.5,
+        help="允许的退化倍数（校准后耗时 / 基线耗时），默认 1.5"
+    )
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "bench: 热路径微基准测试，仅在 --bench / --bench-save 时运行")
+    config.stash[RESULTS_KEY] = {}
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--bench") or config.getoption("--bench-save"):
+        return
+    skip = pytest.mark.skip(reason="微基准测试需要 --bench")
+    for item in items:
+        if "bench" in item.keywords:
+            item.add_marker(skip)
+
+
+def measure(func, ops: int = 1) -> dict:
+    """
+    测量函数的单次操作耗时
+
+    先倍增迭代次数直到单轮不短于 MIN_ROUND_NS，再运行 ROUNDS 轮；计时期间关闭 GC。
+
+    Args:
+        func: 无参可调用对象
+        ops: 每次调用包含的操作数（如一次调用转发 N 个分块），结果按操作数折算
+
+    Returns:
+        {"min_ns", "median_ns", "iterations"}，耗时为单次操作的纳秒数
+    """
+    iterations = 1
+    while True:
+        started = time.perf_counter_ns()
+        for _ in range(iterations):
+            func()
+        elapsed = time.perf_counter_ns() - started
+        if elapsed >= MIN_ROUND_NS:
+            break
+        iterations *= 2
+
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        samples = []
+        for _ in range(ROUNDS):
+            started = time.perf_counter_ns()
+            for _ in range(iterations):
+                func()
+            samples.append((time.perf_counter_ns() - started) / iterations / ops)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    return {"min_ns": min(samples), "median_ns": statistics.median(samples), "iterations": iterations}
+
+
+def _calibration_workload():
+    """机器速度参考负载：字符串、字典和整数运算的混合"""
+    table = {}
+    for i in range(200):
+        table[str(i)] = i * i
+    return sum(table.values())
+
+
+def calibration_ns() -> float:
+    """当前机器上参考负载的单次耗时"""
+    return measure(_calibration_workload)["min_ns"]
+
+
+def load_baseline() -> dict:
+    if not BASELINE_PATH.exists():
+        return {}
+    return json.loads(BASELINE_PATH.read_text(encoding="utf-8"))
+
+
+class Benchmark:
+    """`benchmark` 夹具对象，调用方式与 pytest-benchmark 相同：benchmark(func, *args)"""
+
+    def __init__(self, request):
+        self.name = request.node.name
+        self.config = request.config
+        self.result = None
+
+    def __call__(self, func, *args, ops: int = 1):
+        """
+        测量 func(*args) 并检查是否超过基线
+
+        Args:
+            func: 被测函数
+            *args: 传给被测函数的参数
+            ops: 每次调用包含的操作数
+
+        Returns:
+            被测函数最后一次调用的返回值
+        """
+        value = func(*args)
+        self._measure(func, args, ops)
+
+        if not self.config.getoption("--bench-save"):
+            baseline = load_baseline().get("benchmarks", {}).get(self.name)
+            # 共享机器上的偶发抖动会让单次测量偏高，超限时重测一次再判定
+            if baseline is not None and not self._check(baseline):
+                self._measure(func, args, ops)
+                if not self._check(baseline):
+                    pytest.fail(
+                        f"{self.name}: 校准后耗时为基线的 {self.result['ratio']:.2f} 倍，超过阈值 "
+                        f"{self.config.getoption('--bench-threshold')}（实测 {self.result['min_ns']:.0f} ns/op，"
+                        f"基线 {baseline['ns']:.0f} ns/op）"
+                    )
+        return value
+
+    def _measure(self, func, args, ops: int) -> None:
+        # 紧挨着被测函数测量参考负载，抵消机器负载在会话中的变化
+        calibration = calibration_ns()
+        self.result = measure(lambda: func(*args), ops)
+        self.result["calibration_ns"] = calibration
+        self.config.stash[RESULTS_KEY][self.name] = self.result
+
+    def _check(self, baseline: dict) -> bool:
+        """按参考负载耗时换算到基线机器后与基线比较，未超过阈值返回 True"""
+        scale = self.result["calibration_ns"] / baseline["calibration_ns"]
+        self.result["ratio"] = self.result["min_ns"] / scale / baseline["ns"]
+        return self.result["ratio"] <= self.config.getoption("--bench-threshold")
+
+
+@pytest.fixture
+def benchmark(request):
+    """微基准测试夹具"""
+    return Benchmark(request)
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    results = config.stash[RESULTS_KEY]
+    if not results:
+        return
+
+    terminalreporter.section("microbench")
+    for name, result in sorted(results.items()):
+        line = f"{name:<48} {result['min_ns']:>12.0f} ns/op  (median {result['median_ns']:.0f})"
+        if "ratio" in result:
+            line += f"  x{result['ratio']:.2f} vs baseline"
+        terminalreporter.write_line(line)
+
+    if config.getoption("--bench-save"):
+        baseline = {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "benchmarks": {
+                name: {"ns": round(result["min_ns"], 1), "calibration_ns": round(result["calibration_ns"], 1)}
+                for name, result in sorted(results.items())
+            },
+        }
+        BASELINE_PATH.write_text(json.dumps(baseline, indent=2) + "\n", encoding="utf-8")
+        terminalreporter.write_line(f"基线已写入 {BASELINE_PATH}")
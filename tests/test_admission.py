@@ -0,0 +1,165 @@
+"""
+准入控制器单元测试
+"""
+import asyncio
+import pytest
+from core.admission import AdmissionController, AdmissionRejected
+from core.scheduler import FairQueue
+
+
+@pytest.mark.asyncio
+async def test_acquire_within_limit():
+    """测试并发未满时直接放行"""
+    controller = AdmissionController(max_concurrency=2)
+
+    ticket1 = await controller.acquire("m")
+    ticket2 = await controller.acquire("m")
+    assert controller.active == 2
+
+    ticket1.release()
+    ticket1.release()  # 重复释放无副作用
+    ticket2.release()
+    assert controller.active == 0
+
+
+@pytest.mark.asyncio
+async def test_queue_then_admit_on_release():
+    """测试排队请求在槽位释放后按顺序放行"""
+    controller = AdmissionController(max_concurrency=1, max_queue_time=1.0)
+    ticket = await controller.acquire("m")
+
+    waiter = asyncio.create_task(controller.acquire("m"))
+    await asyncio.sleep(0)
+    assert controller.queue_depth == 1
+
+    ticket.release()
+    second = await waiter
+    assert controller.active == 1
+    assert controller.queue_depth == 0
+    second.release()
+
+
+@pytest.mark.asyncio
+async def test_queue_full_rejected():
+    """测试队列满时立即返回 429"""
+    controller = AdmissionController(max_concurrency=1, max_queue_size=1, retry_after=3)
+    ticket = await controller.acquire("m")
+    waiter = asyncio.create_task(controller.acquire("m"))
+    await asyncio.sleep(0)
+
+    with pytest.raises(AdmissionRejected) as exc_info:
+        await controller.acquire("m")
+
+    assert exc_info.value.status_code == 429
+    assert exc_info.value.retry_after == 3
+    ticket.release()
+    (await waiter).release()
+
+
+@pytest.mark.asyncio
+async def test_queue_timeout_rejected():
+    """测试排队超时返回 503"""
+    controller = AdmissionController(max_concurrency=1, max_queue_time=0.01)
+    ticket = await controller.acquire("m")
+
+    with pytest.raises(AdmissionRejected) as exc_info:
+        await controller.acquire("m")
+
+    assert exc_info.value.status_code == 503
+    assert controller.queue_depth == 0
+    assert controller.get_stats()["rejected"]["queue_timeout"] == 1
+    ticket.release()
+
+
+@pytest.mark.asyncio
+async def test_per_model_limit():
+    """测试单模型并发上限不影响其他模型"""
+    controller = AdmissionController(max_concurrency=10, model_limits={"small": 1}, max_queue_time=0.01)
+    ticket = await controller.acquire("small")
+
+    other = await controller.acquire("large")
+    with pytest.raises(AdmissionRejected):
+        await controller.acquire("small")
+
+    ticket.release()
+    other.release()
+
+
+def test_fair_queue_weighted_order():
+    """测试加权公平队列按权重比例出队"""
+    queue = FairQueue()
+    for i in range(8):
+        queue.push(("batch", i), "batch:t", weight=1)
+    for i in range(8):
+        queue.push(("interactive", i), "interactive:t", weight=4)
+
+    order = []
+    queue.dispatch(lambda item: True, lambda: len(order) < 10, order.append)
+
+    # 前 10 个中交互式请求占 8 个（权重 4:1）
+    assert sum(1 for item in order if item[0] == "interactive") == 8
+    assert len(queue) == 6
+
+
+@pytest.mark.asyncio
+async def test_interactive_dispatched_before_batch_backlog():
+    """测试交互式请求不会排在批处理积压之后"""
+    controller = AdmissionController(
+        max_concurrency=1,
+        max_queue_time=1.0,
+        class_weights={"interactive": 8, "batch": 1}
+    )
+    ticket = await controller.acquire("m", request_class="batch", tenant="b")
+
+    batch_waiters = [
+        asyncio.create_task(controller.acquire("m", request_class="batch", tenant="b"))
+        for _ in range(5)
+    ]
+    await asyncio.sleep(0)
+    interactive = asyncio.create_task(controller.acquire("m", request_class="interactive", tenant="u"))
+    await asyncio.sleep(0)
+
+    ticket.release()
+    interactive_ticket = await interactive
+    assert not any(waiter.done() for waiter in batch_waiters)
+
+    interactive_ticket.release()
+    for waiter in batch_waiters:
+        (await waiter).release()
+
+
+@pytest.mark.asyncio
+async def test_invalid_class_rejected():
+    """测试未知优先级分类"""
+    controller = AdmissionController(class_weights={"interactive": 1})
+
+    with pytest.raises(AdmissionRejected) as exc_info:
+        await controller.acquire("m", request_class="vip")
+    assert exc_info.value.status_code == 400
+
+
+def test_cap_class_by_weight():
+    """测试优先级分类按权重截断到上限，上限为空或未配置时不限制"""
+    controller = AdmissionController(class_weights={"interactive": 8, "batch": 1})
+
+    assert controller.cap_class("interactive", "batch") == "batch"
+    assert controller.cap_class("batch", "interactive") == "batch"
+    assert controller.cap_class("interactive", None) == "interactive"
+    assert controller.cap_class("interactive", "vip") == "interactive"
+    assert controller.cap_class("vip", "batch") == "vip"
+
+
+@pytest.mark.asyncio
+async def test_key_capacity_limit():
+    """测试按密钥容量限制并发"""
+    capacity = {"value": 1}
+    controller = AdmissionController(max_queue_time=0.01, capacity_provider=lambda: capacity["value"])
+    ticket = await controller.acquire("m")
+
+    with pytest.raises(AdmissionRejected):
+        await controller.acquire("m")
+
+    capacity["value"] = 2
+    second = await controller.acquire("m")
+    ticket.release()
+    second.release()
@@ -0,0 +1,108 @@
+"""
+审计日志单元测试
+"""
+import asyncio
+import gzip
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from api.routes import build_audit_record
+from core.audit import AuditSink, reassemble_stream
+from core.tracing import normalize_request_id, reset_trace, start_trace
+
+
+def sse(event) -> bytes:
+    return f"data: {json.dumps(event)}\n\n".encode()
+
+
+def test_reassemble_stream_merges_deltas_and_tool_calls():
+    """按 choice 拼接 delta、合并 tool_calls，分块边界与事件边界无关"""
+    body = b"".join([
+        sse({"id": "c1", "model": "m", "choices": [{"index": 0, "delta": {"role": "assistant", "content": "Hel"}}]}),
+        sse({"id": "c1", "choices": [{"index": 1, "delta": {"tool_calls": [
+            {"index": 0, "id": "call_1", "function": {"name": "get_", "arguments": "{\"a\""}}
+        ]}}]}),
+        sse({"id": "c1", "choices": [{"index": 0, "delta": {"content": "lo"}, "finish_reason": "stop"}]}),
+        sse({"id": "c1", "choices": [{"index": 1, "delta": {"tool_calls": [
+            {"index": 0, "function": {"name": "weather", "arguments": ": 1}"}}
+        ]}, "finish_reason": "tool_calls"}]}),
+        sse({"id": "c1", "choices": [], "usage": {"total_tokens": 7}}),
+        b"data: [DONE]\n\n"
+    ])
+    chunks = [body[i:i + 7] for i in range(0, len(body), 7)]
+
+    result = reassemble_stream(chunks)
+
+    assert result["id"] == "c1"
+    assert result["usage"] == {"total_tokens": 7}
+    assert result["choices"][0] == {
+        "index": 0, "message": {"role": "assistant", "content": "Hello"}, "finish_reason": "stop"
+    }
+    call = result["choices"][1]["message"]["tool_calls"][0]
+    assert call["id"] == "call_1"
+    assert call["function"] == {"name": "get_weather", "arguments": "{\"a\": 1}"}
+
+
+@pytest.mark.asyncio
+async def test_sink_writes_compressed_batches_and_rotates(tmp_path):
+    """批量写入 gzip JSONL，流式记录在写入时重组，超过大小后轮转"""
+    sink = AuditSink(str(tmp_path), compression="gzip", batch_size=2, flush_interval=0.01, rotate_bytes=1)
+    sink.start()
+    for i in range(3):
+        await sink.submit({"id": i, "response": {"ok": True}})
+    await sink.submit({"id": 3, "_stream_chunks": [sse({"choices": [{"index": 0, "delta": {"content": "hi"}}]})]})
+    await sink.close()
+
+    files = sorted(tmp_path.glob("audit-*.jsonl.gz"))
+    assert len(files) == sink.get_stats()["batches"] >= 2
+    records = [json.loads(line) for path in files for line in gzip.open(path, "rt", encoding="utf-8")]
+    assert [record["id"] for record in records] == [0, 1, 2, 3]
+    assert records[3]["response"]["choices"][0]["message"]["content"] == "hi"
+    assert "_stream_chunks" not in records[3]
+    assert sink.get_stats()["written"] == 4
+
+
+@pytest.mark.asyncio
+async def test_drop_policy_never_waits(tmp_path):
+    """drop 策略下队列满时立即丢弃"""
+    sink = AuditSink(str(tmp_path), queue_size=1, policy="drop")
+    assert await sink.submit({"id": 1})
+    assert not await sink.submit({"id": 2})
+    assert sink.get_stats()["dropped"] == 1
+
+
+@pytest.mark.asyncio
+async def test_block_policy_waits_for_writer(tmp_path):
+    """block 策略下队列满时等待写入任务腾出空间，不丢记录"""
+    sink = AuditSink(str(tmp_path), compression="none", queue_size=1, policy="block", flush_interval=0.01)
+    sink.start()
+    await asyncio.wait_for(asyncio.gather(*(sink.submit({"id": i}) for i in range(20))), timeout=5)
+    await sink.close()
+
+    lines = [line for path in tmp_path.glob("audit-*.jsonl") for line in path.read_text(encoding="utf-8").splitlines()]
+    assert len(lines) == 20
+    assert sink.get_stats()["dropped"] == 0
+
+
+def test_invalid_configuration():
+    with pytest.raises(ValueError):
+        AuditSink("unused", compression="lz4")
+    with pytest.raises(ValueError):
+        AuditSink("unused", policy="spill")
+
+
+def test_audit_id_is_server_generated():
+    """客户端传入的 X-Request-ID 只记录为 request_id，审计记录 ID 由服务端生成"""
+    request = SimpleNamespace(state=SimpleNamespace(client_id="client"))
+    _, tokens = start_trace(normalize_request_id("spoofed-id"), "test")
+    try:
+        first = build_audit_record(request, None, "m", 200, time.monotonic(), False)
+        second = build_audit_record(request, None, "m", 200, time.monotonic(), False)
+    finally:
+        reset_trace(tokens)
+
+    assert first["request_id"] == second["request_id"] == "spoofed-id"
+    assert first["id"] != second["id"] and len(first["id"]) == 32
@@ -0,0 +1,255 @@
+"""
+批处理任务单元测试
+"""
+import asyncio
+import io
+import json
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.routes import router
+from core import batch
+from core.admission import AdmissionController
+from core.batch import BatchJob, BatchManager, parse_batch_line, process_batch_line
+from core.context_checker import ContextChecker
+from core.rate_limiter import ClientRateLimiter
+
+
+class FakeKeyManager:
+    """模拟密钥管理器"""
+    available_keys = 2
+
+
+class FakeProxyService:
+    """模拟代理服务，记录调用的消息内容"""
+
+    def __init__(self):
+        self.key_manager = FakeKeyManager()
+        self.calls = []
+
+    async def chat_completion(self, model, messages, **kwargs):
+        self.calls.append(messages[-1]["content"])
+        await asyncio.sleep(0)
+        return {"model": model, "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"}}]}
+
+
+class FakeUpload:
+    """模拟上传文件"""
+
+    def __init__(self, data: bytes):
+        self._buffer = io.BytesIO(data)
+
+    async def read(self, size: int) -> bytes:
+        return self._buffer.read(size)
+
+
+def make_input(count: int) -> bytes:
+    """生成 JSONL 输入"""
+    lines = [
+        json.dumps({
+            "custom_id": f"req-{i}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {"messages": [{"role": "user", "content": f"q{i}"}]}
+        })
+        for i in range(count)
+    ]
+    return ("\n".join(lines) + "\n").encode()
+
+
+async def wait_for_status(manager: BatchManager, job_id: str, status: str) -> dict:
+    """等待任务到达指定状态"""
+    for _ in range(200):
+        state = manager.get(job_id)
+        if state["status"] == status:
+            return state
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"任务未到达状态 {status}: {manager.get(job_id)}")
+
+
+def test_parse_batch_line():
+    """测试解析 OpenAI Batch 格式和纯请求体"""
+    parsed = parse_batch_line(json.dumps({
+        "custom_id": "a",
+        "body": {"model": "m", "messages": [{"role": "user", "content": "hi"}], "max_tokens": 5}
+    }))
+    assert parsed["custom_id"] == "a"
+    assert parsed["params"] == {"max_tokens": 5, "stream": False}
+
+    parsed = parse_batch_line(json.dumps({"messages": [{"role": "user", "content": "hi"}]}))
+    assert parsed["model"] == "openai-gpt-oss-120b"
+
+    with pytest.raises(ValueError):
+        parse_batch_line(json.dumps({"url": "/v1/embeddings", "body": {}}))
+
+
+@pytest.mark.asyncio
+async def test_process_batch_line_checks_context_through_checker():
+    """测试批处理行的上下文检查经由上下文检查器（大请求卸载到池中执行）"""
+    proxy = FakeProxyService()
+    checker = ContextChecker(offload_threshold=1000)
+    line = json.dumps({"custom_id": "big", "body": {"messages": [{"role": "user", "content": "字" * 200_000}]}})
+    try:
+        record = await process_batch_line(proxy, checker, "r", 0, line)
+        small = await process_batch_line(proxy, checker, "r", 1, json.dumps({"messages": [{"role": "user", "content": "hi"}]}))
+    finally:
+        checker.shutdown()
+
+    assert record["error"]["type"] == "context_length_exceeded" and proxy.calls == ["hi"]
+    assert small["error"] is None
+    assert checker.get_stats()["offloaded_checks"] == 1 and checker.get_stats()["inline_checks"] == 1
+
+
+@pytest.mark.asyncio
+async def test_batch_runs_to_completion(tmp_path):
+    """测试任务执行完成并写入全部结果"""
+    proxy = FakeProxyService()
+    manager = BatchManager(proxy, storage_dir=str(tmp_path), checkpoint_interval=3)
+
+    state = await manager.create(FakeUpload(make_input(10) + b"not json\n"))
+    state = await wait_for_status(manager, state["id"], "completed")
+
+    assert state["request_counts"] == {"total": 11, "completed": 10, "failed": 1}
+    records = [json.loads(line) for line in manager.output_path(state["id"]).read_text().splitlines()]
+    assert sorted(record["line"] for record in records) == list(range(11))
+    assert {record["custom_id"] for record in records if record["error"] is None} == {f"req-{i}" for i in range(10)}
+
+
+@pytest.mark.asyncio
+async def test_batch_resumes_from_checkpoint(tmp_path, monkeypatch):
+    """测试从结果文件断点续跑，跳过已完成的行、丢弃不完整的最后一行，计数以结果文件为准"""
+    monkeypatch.setattr(batch, "CHECKPOINT_TAIL_BLOCK", 8)  # 不完整的行跨越多个查找块
+    proxy = FakeProxyService()
+    manager = BatchManager(proxy, storage_dir=str(tmp_path))
+
+    job_dir = tmp_path / "batch_abc123"
+    job_dir.mkdir()
+    (job_dir / "input.jsonl").write_bytes(make_input(5))
+    (job_dir / "output.jsonl").write_text(
+        json.dumps({"id": "x", "custom_id": "req-0", "line": 0, "response": {}, "error": None}) + "\n"
+        + json.dumps({"id": "x", "custom_id": "req-2", "line": 2, "response": {}, "error": None}) + "\n"
+        + '{"id": "x", "custom_id": "req-3", "li'
+    )
+    BatchJob(job_dir, {
+        "id": "batch_abc123",
+        "object": "batch",
+        "status": "in_progress",
+        "created_at": 0,
+        "completed_at": None,
+        "request_counts": {"total": 5, "completed": 1, "failed": 0},
+        "error": None
+    }).save()
+
+    assert manager.resume_all() == 1
+    state = await wait_for_status(manager, "batch_abc123", "completed")
+
+    assert sorted(proxy.calls) == ["q1", "q3", "q4"]
+    assert state["request_counts"] == {"total": 5, "completed": 5, "failed": 0}
+    lines = (job_dir / "output.jsonl").read_text().splitlines()
+    assert sorted(json.loads(line)["line"] for line in lines) == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.asyncio
+async def test_batch_total_skips_blank_lines(tmp_path):
+    """测试总数只统计非空行（包括跨越上传分块的行和没有结尾换行的最后一行）"""
+    proxy = FakeProxyService()
+    manager = BatchManager(proxy, storage_dir=str(tmp_path))
+
+    data = make_input(3).replace(b"\n", b"\n\n  \n") + make_input(1).rstrip(b"\n")
+    upload = FakeUpload(data)
+    upload.read = lambda size, read=upload.read: read(7)
+
+    state = await manager.create(upload)
+    assert state["request_counts"]["total"] == 4
+    state = await wait_for_status(manager, state["id"], "completed")
+    assert state["request_counts"] == {"total": 4, "completed": 4, "failed": 0}
+
+
+@pytest.mark.asyncio
+async def test_batch_admits_lines_as_submitting_client(tmp_path):
+    """测试批处理行以提交任务的客户端作为准入租户，旧任务回退到 batch 租户"""
+    proxy = FakeProxyService()
+    controller = AdmissionController(max_concurrency=10, class_weights={"interactive": 8, "batch": 1})
+    tenants = []
+    acquire = controller.acquire
+
+    async def recording_acquire(model, **kwargs):
+        tenants.append((kwargs["tenant"], kwargs["tenant_weight"]))
+        return await acquire(model, **kwargs)
+
+    controller.acquire = recording_acquire
+    manager = BatchManager(proxy, storage_dir=str(tmp_path), admission_controller=controller)
+
+    state = await manager.create(FakeUpload(make_input(2)), client_id="team-a", client_weight=3.0)
+    await wait_for_status(manager, state["id"], "completed")
+    state = await manager.create(FakeUpload(make_input(1)))
+    await wait_for_status(manager, state["id"], "completed")
+
+    assert tenants == [("team-a", 3.0), ("team-a", 3.0), ("batch", 1.0)]
+
+
+@pytest.mark.asyncio
+async def test_cancel_batch(tmp_path):
+    """测试取消任务"""
+    proxy = FakeProxyService()
+    manager = BatchManager(proxy, storage_dir=str(tmp_path))
+
+    state = await manager.create(FakeUpload(make_input(1000)))
+    state = await manager.cancel(state["id"])
+
+    assert state["status"] == "cancelled"
+    assert manager.get(state["id"])["status"] == "cancelled"
+    assert manager.get("batch_missing") is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(batch.fcntl is None, reason="需要 fcntl 文件锁")
+async def test_checkpoint_does_not_overwrite_concurrent_cancel(tmp_path):
+    """测试检查点的读取与保存在状态锁内完成，不会覆盖其他 worker 同时写入的取消状态"""
+    manager = BatchManager(FakeProxyService(), storage_dir=str(tmp_path))
+    job = BatchJob(tmp_path, {"id": "batch_race", "status": "in_progress", "completed_at": None})
+    job.save()
+
+    with job.state_lock():
+        checkpoint = asyncio.create_task(manager._checkpoint(job, io.StringIO()))
+        await asyncio.sleep(0.05)  # 检查点阻塞在状态锁上
+        other_worker = BatchJob.load(tmp_path)
+        other_worker.state.update(status="cancelled", completed_at=1)
+        other_worker.save()
+
+    with pytest.raises(batch.BatchCancelled):
+        await checkpoint
+    assert BatchJob.load(tmp_path).state["status"] == "cancelled"
+    assert job.state == {"id": "batch_race", "status": "cancelled", "completed_at": 1}
+
+
+def test_batch_routes_scope_jobs_to_submitting_client(tmp_path):
+    """批处理接口要求与聊天补全相同的认证，任务只对提交它的客户端可见"""
+    config = tmp_path / "clients.json"
+    config.write_text(json.dumps({"clients": [
+        {"id": "team-a", "api_keys": ["sk-a"], "weight": 3},
+        {"id": "team-b", "api_keys": ["sk-b"]}
+    ]}))
+    app = FastAPI()
+    app.include_router(router)
+    app.state.rate_limiter = ClientRateLimiter(str(config), auth_required=True)
+    app.state.batch_manager = BatchManager(FakeProxyService(), storage_dir=str(tmp_path / "batches"))
+    team_a = {"Authorization": "Bearer sk-a"}
+    team_b = {"Authorization": "Bearer sk-b"}
+
+    with TestClient(app) as client:
+        files = {"file": ("requests.jsonl", make_input(2))}
+        assert client.post("/v1/batches", files=files).status_code == 401
+
+        created = client.post("/v1/batches", files=files, headers=team_a).json()
+        job_id = created["id"]
+        assert created["client_id"] == "team-a" and created["client_weight"] == 3
+
+        assert client.get("/v1/batches", headers=team_b).json()["data"] == []
+        for method, path in (("get", ""), ("get", "/output"), ("post", "/cancel")):
+            assert client.request(method, f"/v1/batches/{job_id}{path}", headers=team_b).status_code == 404
+
+        assert [job["id"] for job in client.get("/v1/batches", headers=team_a).json()["data"]] == [job_id]
+        assert client.get(f"/v1/batches/{job_id}", headers=team_a).status_code == 200
+        assert client.get("/v1/batches", headers={}).status_code == 401
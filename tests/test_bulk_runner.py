@@ -0,0 +1,93 @@
+"""
+离线批量执行器单元测试
+"""
+import asyncio
+import json
+import pytest
+from core.bulk_runner import BulkRunner, KeyAwareRateLimiter
+from core.rate_limiter import TokenBucket
+
+
+class FakeKeyManager:
+    """模拟密钥管理器"""
+
+    def __init__(self, available_keys: int = 2):
+        self.available_keys = available_keys
+
+
+class FakeProxyService:
+    """模拟代理服务，前面的请求耗时更长以打乱完成顺序"""
+
+    def __init__(self, count: int):
+        self.key_manager = FakeKeyManager()
+        self.count = count
+
+    async def chat_completion(self, model, messages, **kwargs):
+        index = int(messages[-1]["content"][1:])
+        await asyncio.sleep((self.count - index) * 0.002)
+        return {
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": f"a{index}"}}],
+            "usage": {"prompt_tokens": 3, "completion_tokens": 2, "total_tokens": 5}
+        }
+
+
+def write_input(path, count: int) -> None:
+    """生成 JSONL 输入（包含一个空行和一个格式错误的行）"""
+    lines = [json.dumps({"custom_id": f"req-{i}", "body": {"messages": [{"role": "user", "content": f"q{i}"}]}})
+             for i in range(count)]
+    lines.insert(3, "")
+    lines.append("not json")
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+@pytest.mark.asyncio
+async def test_bulk_runner_preserves_input_order(tmp_path):
+    """按输入顺序写出结果并统计吞吐"""
+    input_path, output_path = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    write_input(input_path, 20)
+
+    runner = BulkRunner(FakeProxyService(20), concurrency_per_key=2, reorder_window=2)
+    report = await runner.run(str(input_path), str(output_path))
+
+    records = [json.loads(line) for line in output_path.read_text(encoding="utf-8").splitlines()]
+    assert [record["custom_id"] for record in records[:-1]] == [f"req-{i}" for i in range(20)]
+    assert records[-1]["error"]["type"] == "invalid_request_error"
+    assert report["total"] == 21
+    assert report["completed"] == 20
+    assert report["failed"] == 1
+    assert report["total_tokens"] == 100
+    assert report["requests_per_second"] > 0
+
+
+@pytest.mark.asyncio
+async def test_bulk_runner_completed_order(tmp_path):
+    """完成即写模式下慢请求不阻塞后续结果"""
+    input_path, output_path = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    write_input(input_path, 8)
+
+    runner = BulkRunner(FakeProxyService(8), concurrency_per_key=4, order="completed")
+    await runner.run(str(input_path), str(output_path))
+
+    records = [json.loads(line) for line in output_path.read_text(encoding="utf-8").splitlines()]
+    assert len(records) == 9
+    assert [record["custom_id"] for record in records[:8]] != [f"req-{i}" for i in range(8)]
+
+
+def test_rate_limiter_scales_with_available_keys():
+    """可用密钥减少时总配额随之收紧"""
+    key_manager = FakeKeyManager(available_keys=4)
+    limiter = KeyAwareRateLimiter(key_manager, requests_per_minute_per_key=60)
+    assert limiter._requests.capacity == 240
+
+    key_manager.available_keys = 1
+    limiter._sync_capacity(0.0)
+    assert limiter._requests.capacity == 60
+    assert limiter._requests.tokens <= 60
+
+
+def test_token_bucket_charge_creates_debt():
+    """事后计费可产生欠额，欠额还清前 consume(0) 需要等待"""
+    bucket = TokenBucket(60, now=0.0)
+    bucket.charge(90, now=0.0)
+    assert bucket.consume(0, now=0.0) == pytest.approx(30.0)
+    assert bucket.consume(0, now=30.0) == 0.0
@@ -0,0 +1,363 @@
+"""
+WebSocket 对话会话单元测试
+"""
+import asyncio
+import json
+import logging
+
+import pytest
+import uvicorn
+import websockets
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from api.routes import router
+from core.admission import AdmissionController
+from core.chat_session import DeltaCollector, SessionStore, SessionUnavailable
+from core.context_checker import ContextChecker
+from core.metrics import TOKENS
+from core.rate_limiter import ClientRateLimiter
+from utils.logger import apply_redaction
+
+
+def sse(event: dict) -> bytes:
+    return f"data: {json.dumps(event)}\n\n".encode()
+
+
+class FakeStream:
+    """模拟上游流：回复 "reply-<收到的消息数>"，拆成两个增量，末尾带 usage 事件"""
+
+    def __init__(self, count: int, delay: float):
+        self.count = count
+        self.delay = delay
+        self.closed = False
+
+    async def aiter_bytes(self):
+        for text in ("reply-", str(self.count)):
+            await asyncio.sleep(self.delay)
+            yield sse({"choices": [{"index": 0, "delta": {"content": text}}]})
+        usage = sse({"choices": [], "usage": {"prompt_tokens": self.count, "completion_tokens": 2}})
+        yield sse({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}) + usage[:20]
+        yield usage[20:] + b"data: [DONE]\n\n"
+
+    async def aclose(self):
+        self.closed = True
+
+
+class FakeProxyService:
+    """模拟代理服务，记录每次收到的消息列表和参数"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = []
+
+    async def chat_completion(self, model, messages, **kwargs):
+        self.calls.append((model, [dict(message) for message in messages], kwargs))
+        return FakeStream(len(messages), self.delay)
+
+
+def create_app(proxy: FakeProxyService, store: SessionStore, rate_limiter: ClientRateLimiter = None) -> FastAPI:
+    app = FastAPI()
+    app.include_router(router)
+    app.state.proxy_service = proxy
+    app.state.session_store = store
+    app.state.rate_limiter = rate_limiter or ClientRateLimiter()
+    app.state.context_checker = ContextChecker()
+    app.state.admission_controller = AdmissionController(class_weights={"interactive": 8, "batch": 1})
+    app.state.drain_controller = None
+    return app
+
+
+def receive_turn(ws) -> list:
+    """读取帧直到本轮的 done 帧"""
+    frames = []
+    while True:
+        frames.append(ws.receive_json())
+        if frames[-1]["t"] == "done":
+            return frames
+
+
+def test_multi_turn_keeps_history_server_side_and_resumes():
+    """客户端每轮只发送新消息，历史在服务端累积；断开后凭会话 ID 恢复"""
+    proxy = FakeProxyService()
+    store = SessionStore()
+    client = TestClient(create_app(proxy, store))
+
+    with client.websocket_connect("/v1/chat/ws?model=test-model") as ws:
+        session = ws.receive_json()
+        assert session["t"] == "session" and not session["resumed"]
+
+        ws.send_json({"t": "cfg", "system": "be brief", "temperature": 0.2})
+        assert ws.receive_json()["params"] == {"temperature": 0.2}
+
+        ws.send_json({"t": "msg", "c": "hi"})
+        frames = receive_turn(ws)
+        assert [frame["c"] for frame in frames if frame["t"] == "d"] == ["reply-", "2"]
+        assert frames[-1]["finish"] == "stop"
+
+        ws.send_json({"t": "msg", "c": "again"})
+        receive_turn(ws)
+
+    model, messages, params = proxy.calls[-1]
+    assert model == "test-model" and params == {"stream": True, "temperature": 0.2}
+    assert [message["content"] for message in messages] == ["be brief", "hi", "reply-2", "again"]
+
+    with client.websocket_connect(f"/v1/chat/ws?session_id={session['id']}") as ws:
+        resumed = ws.receive_json()
+        assert resumed["resumed"] and resumed["messages"] == 4
+
+        ws.send_json({"t": "cfg", "temperature": 5})
+        assert ws.receive_json()["t"] == "error"
+        ws.send_json({"t": "nope"})
+        assert ws.receive_json()["t"] == "error"
+
+    # 会话不存在（已淘汰或保存在其他 worker 中）时明确报错，不静默开始新会话
+    with client.websocket_connect("/v1/chat/ws?session_id=missing") as ws:
+        error = ws.receive_json()
+        with pytest.raises(WebSocketDisconnect) as exc_info:
+            ws.receive_json()
+    assert error["t"] == "error" and error["code"] == "session_not_found"
+    assert exc_info.value.code == 1008
+    assert len(store) == 1 and store.get_stats()["not_found"] == 1
+
+
+def test_credentials_from_subprotocol_or_auth_frame(tmp_path):
+    """凭证通过子协议 bearer.<凭证> 或第一帧 auth 帧传递，查询参数中的凭证不被接受"""
+    config = tmp_path / "clients.json"
+    config.write_text(json.dumps({"clients": [{"id": "team-a", "api_keys": ["sk-a"]}]}))
+    store = SessionStore()
+    client = TestClient(create_app(FakeProxyService(), store, ClientRateLimiter(str(config), auth_required=True)))
+
+    with client.websocket_connect("/v1/chat/ws", subprotocols=["megallm.v1", "bearer.sk-a"]) as ws:
+        assert ws.accepted_subprotocol == "megallm.v1"
+        ws.receive_json()
+        assert ws.scope["state"]["client_id"] == "team-a"
+
+    with client.websocket_connect("/v1/chat/ws") as ws:
+        ws.send_json({"t": "auth", "key": "sk-a"})
+        assert ws.receive_json()["t"] == "session"
+        ws.send_json({"t": "msg", "c": "hi"})
+        assert receive_turn(ws)[-1]["finish"] == "stop"
+
+    with client.websocket_connect("/v1/chat/ws?api_key=sk-a") as ws:
+        ws.send_json({"t": "msg", "c": "hi"})
+        assert ws.receive_json()["code"] == 401
+
+    assert {session.client_id for session in store._sessions.values()} == {"team-a"}
+
+
+def test_priority_capped_by_client_config(tmp_path):
+    """X-Priority 与 cfg 帧的优先级分类不超过客户端配置的上限，未指定时使用客户端配置的默认分类"""
+    config = tmp_path / "clients.json"
+    config.write_text(json.dumps({
+        "default": {"max_priority": "batch"},
+        "clients": [
+            {"id": "chat-ui", "api_keys": ["sk-ui"], "max_priority": "interactive"},
+            {"id": "nightly", "api_keys": ["sk-batch"], "priority": "batch"}
+        ]
+    }))
+    app = create_app(FakeProxyService(), SessionStore(), ClientRateLimiter(str(config)))
+    controller = app.state.admission_controller
+    classes = []
+    acquire = controller.acquire
+
+    async def recording_acquire(model, **kwargs):
+        classes.append((kwargs["tenant"], kwargs["request_class"]))
+        return await acquire(model, **kwargs)
+
+    controller.acquire = recording_acquire
+    client = TestClient(app)
+    body = {"model": "test-model", "messages": [{"role": "user", "content": "hi"}], "stream": True}
+
+    for headers in (
+        {"X-Priority": "interactive"},
+        {"X-API-Key": "sk-ui"},
+        {"X-API-Key": "sk-batch"},
+        {"X-API-Key": "sk-batch", "X-Priority": "interactive"}
+    ):
+        assert client.post("/v1/chat/completions", json=body, headers=headers).status_code == 200
+
+    with client.websocket_connect("/v1/chat/ws") as ws:
+        ws.receive_json()
+        ws.send_json({"t": "cfg", "priority": "interactive"})
+        ws.receive_json()
+        ws.send_json({"t": "msg", "c": "hi"})
+        receive_turn(ws)
+
+    assert [request_class for _, request_class in classes] == ["batch", "interactive", "batch", "batch", "batch"]
+    assert [tenant for tenant, _ in classes][1:3] == ["chat-ui", "nightly"]
+
+
+def test_anonymous_connection_authenticates_with_first_frame(tmp_path):
+    """不要求认证时，匿名连接发送的第一帧 auth 帧将会话转给认证后的客户端"""
+    config = tmp_path / "clients.json"
+    config.write_text(json.dumps({"clients": [{"id": "team-a", "api_keys": ["sk-a"]}]}))
+    store = SessionStore()
+    client = TestClient(create_app(FakeProxyService(), store, ClientRateLimiter(str(config))))
+
+    with client.websocket_connect("/v1/chat/ws") as ws:
+        ws.receive_json()
+        ws.send_json({"t": "auth", "key": "sk-a"})
+        assert ws.receive_json()["t"] == "session"
+        ws.send_json({"t": "auth", "key": "sk-a"})
+        assert ws.receive_json()["t"] == "error"
+
+    (session,) = store._sessions.values()
+    assert session.client_id == "team-a"
+
+
+@pytest.mark.asyncio
+async def test_handshake_log_redacts_query_credentials():
+    """uvicorn 在 uvicorn.error 中记录的 WebSocket 握手行不包含查询参数中的凭证"""
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    uvicorn_logger = logging.getLogger("uvicorn.error")
+    uvicorn_logger.addHandler(handler)
+    apply_redaction()
+
+    config = uvicorn.Config(
+        create_app(FakeProxyService(), SessionStore()), host="127.0.0.1", port=0,
+        ws="websockets", log_config=None, log_level="info", lifespan="off"
+    )
+    server = uvicorn.Server(config)
+    serving = asyncio.create_task(server.serve())
+    try:
+        while not server.started:
+            await asyncio.sleep(0.01)
+        port = server.servers[0].sockets[0].getsockname()[1]
+        async with websockets.connect(f"ws://127.0.0.1:{port}/v1/chat/ws?model=m&api_key=sk-secret") as ws:
+            assert json.loads(await ws.recv())["t"] == "session"
+    finally:
+        server.should_exit = True
+        await serving
+        uvicorn_logger.removeHandler(handler)
+
+    handshake = [record.getMessage() for record in records if "WebSocket" in record.getMessage()]
+    assert handshake and "api_key=***" in handshake[0]
+    assert not any("sk-secret" in record.getMessage() for record in records)
+
+
+def test_http_and_websocket_share_request_checks():
+    """HTTP 接口与 WebSocket 对话经过同一套检查，拒绝时返回相同的错误"""
+    proxy = FakeProxyService()
+    client = TestClient(create_app(proxy, SessionStore()))
+
+    response = client.post("/v1/chat/completions", json={
+        "model": "test-model", "messages": [{"role": "user", "content": "hi"}], "max_tokens": 10_000_000
+    })
+    assert response.status_code == 400
+
+    with client.websocket_connect("/v1/chat/ws?model=test-model") as ws:
+        ws.receive_json()
+        ws.send_json({"t": "cfg", "max_tokens": 10_000_000})
+        ws.receive_json()
+        ws.send_json({"t": "msg", "c": "hi"})
+        error = ws.receive_json()
+        assert ws.receive_json()["t"] == "done"
+
+    assert error == {"t": "error", **response.json()["detail"]["error"]}
+    assert proxy.calls == []
+
+
+def test_streamed_usage_recorded_in_token_metrics():
+    """HTTP 流式响应与 WebSocket 对话都从流末尾的 usage 事件记录 token 用量"""
+    client = TestClient(create_app(FakeProxyService(), SessionStore()))
+    TOKENS.values.pop(("usage-model", "prompt"), None)
+    TOKENS.values.pop(("usage-model", "completion"), None)
+
+    response = client.post("/v1/chat/completions", json={
+        "model": "usage-model", "messages": [{"role": "user", "content": "hi"}], "stream": True
+    })
+    assert response.status_code == 200 and response.content.endswith(b"data: [DONE]\n\n")
+
+    with client.websocket_connect("/v1/chat/ws?model=usage-model") as ws:
+        ws.receive_json()
+        ws.send_json({"t": "msg", "c": "hi"})
+        assert receive_turn(ws)[-1]["usage"] == {"prompt_tokens": 1, "completion_tokens": 2}
+
+    assert TOKENS.values[("usage-model", "prompt")] == 2
+    assert TOKENS.values[("usage-model", "completion")] == 4
+
+
+def test_cancel_keeps_partial_reply():
+    """取消进行中的一轮：以 done(cancelled) 结束，已生成的部分回复保留在历史中"""
+    proxy = FakeProxyService(delay=0.2)
+    store = SessionStore()
+    client = TestClient(create_app(proxy, store))
+
+    with client.websocket_connect("/v1/chat/ws") as ws:
+        ws.receive_json()
+        ws.send_json({"t": "msg", "c": "hi"})
+        assert ws.receive_json() == {"t": "d", "c": "reply-"}
+        ws.send_json({"t": "msg", "c": "too early"})
+        assert ws.receive_json()["code"] == "busy"
+        ws.send_json({"t": "cancel"})
+        frames = receive_turn(ws)
+        assert frames[-1]["finish"] == "cancelled"
+
+    (session,) = store._sessions.values()
+    assert session.messages == [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "reply-"}]
+    assert not session.connected
+
+
+def test_session_store_bounds_and_eviction():
+    """超出消息数/字符数上限时丢弃最早的消息；会话数满时淘汰最久未活动的已断开会话"""
+    store = SessionStore(max_sessions=2, max_messages=3, max_chars=10, idle_timeout=60)
+    first, _ = store.open("client", "m")
+    for content in ("aaaa", "bbbb", "cc", "dd"):
+        store.append(first, "user", content)
+    assert [message["content"] for message in first.messages] == ["bbbb", "cc", "dd"]
+    store.append(first, "user", "x" * 20)
+    assert [message["content"] for message in first.messages] == ["x" * 20]
+
+    second, _ = store.open("client", "m")
+    store.release(first)
+    third, _ = store.open("client", "m")
+    assert first.id not in store._sessions and len(store) == 2
+    assert store.get_stats()["evicted_capacity"] == 1
+
+    store.release(second)
+    second.last_active -= 120
+    store._sessions.move_to_end(third.id)
+    assert store.evict_idle() == 1 and len(store) == 1
+
+
+def test_session_limit_per_client_evicts_own_sessions_first():
+    """单个客户端的会话数有上限；总数满时优先淘汰请求方自己的已断开会话，不影响其他客户端"""
+    store = SessionStore(max_sessions=4, max_sessions_per_client=2)
+    other, _ = store.open("other", "m")
+    store.release(other)
+
+    first, _ = store.open("greedy", "m")
+    second, _ = store.open("greedy", "m")
+    with pytest.raises(SessionUnavailable) as exc_info:
+        store.open("greedy", "m")
+    assert exc_info.value.reason == "too_many_client_sessions"
+
+    store.release(first)
+    third, _ = store.open("greedy", "m")
+    assert first.id not in store._sessions and other.id in store._sessions
+    assert store.get_stats()["evicted_client_limit"] == 1
+
+    store.max_sessions_per_client = 10
+    store.release(second)
+    store.open("greedy", "m")
+    store.open("greedy", "m")
+    assert second.id not in store._sessions and other.id in store._sessions
+    assert store.get_stats()["evicted_capacity"] == 1
+
+
+def test_delta_collector_merges_events_in_chunk():
+    """同一分块内的多个事件合并为一次增量，记录结束原因和用量"""
+    collector = DeltaCollector()
+    chunk = (
+        sse({"choices": [{"delta": {"content": "a"}}]})
+        + sse({"choices": [{"delta": {"content": "b"}, "finish_reason": "stop"}]})
+        + sse({"choices": [], "usage": {"total_tokens": 3}})
+    )
+    assert collector.feed(chunk[:10]) == ""
+    assert collector.feed(chunk[10:]) == "ab"
+    assert collector.content == "ab" and collector.finish_reason == "stop"
+    assert collector.usage == {"total_tokens": 3}
@@ -0,0 +1,102 @@
+"""
+响应压缩单元测试
+"""
+import asyncio
+import zlib
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+from api.middleware import CompressionMiddleware
+from core.compression import StreamCompressor, compress, decompress, negotiate
+
+
+def create_app(**options) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/small")
+    async def small():
+        return {"ok": True}
+
+    @app.get("/large")
+    async def large():
+        return {"data": [{"id": f"model-{i}", "object": "model", "context_length": 131072} for i in range(500)]}
+
+    @app.get("/stream")
+    async def stream():
+        async def generate():
+            for i in range(3):
+                yield f'data: {{"choices":[{{"delta":{{"content":"token-{i}"}}}}]}}\n\n'.encode()
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+    app.add_middleware(CompressionMiddleware, **options)
+    return app
+
+
+def test_negotiate_uses_quality_then_server_preference():
+    """按 q 值选择，q 相同按服务端偏好，q=0 和未列出的编码不可接受"""
+    assert negotiate("gzip, zstd", ("zstd", "gzip")) == "zstd"
+    assert negotiate("zstd;q=0.5, gzip", ("zstd", "gzip")) == "gzip"
+    assert negotiate("*;q=0.1, zstd;q=0", ("zstd", "gzip")) == "gzip"
+    assert negotiate("br", ("zstd", "gzip")) is None
+    assert negotiate("identity", ("gzip",)) is None
+
+
+@pytest.mark.asyncio
+async def test_middleware_compresses_large_json_only():
+    """超过阈值的 JSON 响应按协商结果压缩（线程池中压缩），小响应和未声明 Accept-Encoding 的请求原样返回"""
+    app = create_app(encodings=("gzip",), min_size=1024, offload_threshold=4096)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://proxy") as client:
+        large = await client.get("/large", headers={"Accept-Encoding": "gzip"})
+        small = await client.get("/small", headers={"Accept-Encoding": "gzip"})
+        plain = await client.get("/large", headers={"Accept-Encoding": "identity"})
+
+    assert large.headers["content-encoding"] == "gzip" and large.headers["vary"] == "Accept-Encoding"
+    assert int(large.headers["content-length"]) < len(plain.content) / 5
+    assert large.json() == plain.json()
+    assert "content-encoding" not in small.headers and small.json() == {"ok": True}
+    assert "content-encoding" not in plain.headers
+
+
+@pytest.mark.asyncio
+async def test_middleware_flushes_each_sse_chunk():
+    """SSE 压缩时每个输出分块都能立即解压出完整事件"""
+    app = create_app(encodings=("gzip",), sse=True)
+    messages = []
+    finished = asyncio.Event()
+
+    async def receive():
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        messages.append(message)
+        if message["type"] == "http.response.body" and not message.get("more_body", False):
+            finished.set()
+
+    scope = {
+        "type": "http", "http_version": "1.1", "method": "GET", "path": "/stream", "raw_path": b"/stream",
+        "query_string": b"", "root_path": "", "scheme": "http", "server": ("proxy", 80), "client": ("test", 1),
+        "headers": [(b"host", b"proxy"), (b"accept-encoding", b"gzip")]
+    }
+    await app(scope, receive, send)
+
+    headers = dict(messages[0]["headers"])
+    assert headers[b"content-encoding"] == b"gzip" and b"content-length" not in headers
+
+    decoder = zlib.decompressobj(31)
+    events = [decoder.decompress(message["body"]) for message in messages[1:] if message["body"]]
+    assert events[:3] == [
+        f'data: {{"choices":[{{"delta":{{"content":"token-{i}"}}}}]}}\n\n'.encode() for i in range(3)
+    ]
+
+
+def test_stream_compressor_round_trip():
+    """逐块压缩的输出拼接后是完整的压缩流"""
+    compressor = StreamCompressor("gzip")
+    chunks = [f"data: {i}\n\n".encode() for i in range(10)]
+    data = b"".join(compressor.compress(chunk) for chunk in chunks) + compressor.finish()
+    assert decompress(data, "gzip") == b"".join(chunks)
+    assert decompress(compress(b"x" * 1000, "gzip"), "gzip") == b"x" * 1000
@@ -0,0 +1,60 @@
+"""
+上下文检查器单元测试
+"""
+import pytest
+from config.model_config import check_context_limit
+from core.context_checker import ContextChecker
+
+
+@pytest.fixture
+def small_messages():
+    """小消息列表"""
+    return [{"role": "user", "content": "你好"}]
+
+
+@pytest.fixture
+def large_messages():
+    """大消息列表"""
+    return [{"role": "user", "content": "hello world " * 10_000}]
+
+
+@pytest.mark.asyncio
+async def test_small_payload_inline(small_messages):
+    """测试小请求内联执行"""
+    checker = ContextChecker(offload_threshold=1024)
+
+    result = await checker.check("openai-gpt-oss-120b", small_messages)
+
+    assert result == check_context_limit("openai-gpt-oss-120b", small_messages)
+    assert checker.get_stats()["inline_checks"] == 1
+    assert checker.get_stats()["offloaded_checks"] == 0
+
+
+@pytest.mark.asyncio
+async def test_large_payload_offloaded(large_messages):
+    """测试大请求卸载到线程池执行"""
+    checker = ContextChecker(offload_threshold=1024, pool_size=1)
+
+    try:
+        result = await checker.check("openai-gpt-oss-120b", large_messages)
+    finally:
+        checker.shutdown()
+
+    assert result == check_context_limit("openai-gpt-oss-120b", large_messages)
+    assert checker.get_stats()["offloaded_checks"] == 1
+
+
+@pytest.mark.asyncio
+async def test_threshold_disabled(large_messages):
+    """测试阈值<=0时始终内联"""
+    checker = ContextChecker(offload_threshold=0)
+
+    await checker.check("openai-gpt-oss-120b", large_messages)
+
+    assert checker.get_stats()["inline_checks"] == 1
+
+
+def test_invalid_executor_type():
+    """测试非法执行器类型"""
+    with pytest.raises(ValueError):
+        ContextChecker(executor_type="fiber")
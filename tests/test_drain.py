@@ -0,0 +1,83 @@
+"""
+优雅排空单元测试
+"""
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+from api.middleware import DrainMiddleware
+from core.drain import DrainController, current_request, guard_stream
+
+
+def create_app(controller: DrainController) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/health")
+    async def health():
+        return {"status": "healthy"}
+
+    @app.post("/sleep/{seconds}")
+    async def sleep(seconds: float):
+        await asyncio.sleep(seconds)
+        return {"slept": seconds}
+
+    @app.post("/stream")
+    async def stream():
+        async def upstream():
+            for i in range(100):
+                yield f"data: {i}\n\n".encode()
+                await asyncio.sleep(0.05)
+
+        async def generate():
+            async for chunk in guard_stream(upstream()):
+                yield chunk
+            if current_request().aborted:
+                yield b"data: aborted\n\n"
+
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+    app.add_middleware(DrainMiddleware, controller=controller)
+    return app
+
+
+@pytest.mark.asyncio
+async def test_drain_finishes_inflight_and_aborts_stragglers():
+    """宽限期内完成的请求正常返回；超时的非流式请求返回 503，流式响应以中止事件结束；新请求被拒绝"""
+    controller = DrainController(grace_period=0.6, retry_after=7)
+    app = create_app(controller)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://proxy") as client:
+        fast = asyncio.create_task(client.post("/sleep/0.2"))
+        slow = asyncio.create_task(client.post("/sleep/10"))
+        stream = asyncio.create_task(client.post("/stream"))
+        await asyncio.sleep(0.05)
+        assert controller.inflight == 3
+
+        drain = asyncio.create_task(controller.drain())
+        await asyncio.sleep(0)
+        rejected = await client.post("/sleep/0")
+        health = await client.get("/health")
+        fast, slow, stream = await asyncio.gather(fast, slow, stream)
+        stats = await drain
+
+    assert rejected.status_code == 503
+    assert rejected.headers["retry-after"] == "7" and rejected.headers["connection"] == "close"
+    assert health.status_code == 200
+
+    assert fast.json() == {"slept": 0.2}
+    assert slow.status_code == 503 and slow.json()["error"]["type"] == "server_shutdown"
+    assert stream.status_code == 200
+    assert stream.content.startswith(b"data: 0\n\n") and stream.content.endswith(b"data: aborted\n\n")
+
+    assert (stats["drained"], stats["aborted"], stats["rejected"], stats["inflight"]) == (1, 2, 1, 0)
+
+
+@pytest.mark.asyncio
+async def test_drain_without_inflight_returns_immediately():
+    """没有进行中的请求时立即完成"""
+    controller = DrainController(grace_period=5)
+    stats = await asyncio.wait_for(controller.drain(), timeout=1)
+    assert stats["draining"] and stats["drained"] == 0
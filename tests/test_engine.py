@@ -0,0 +1,71 @@
+"""
+服务器引擎档位单元测试
+"""
+import importlib.util
+
+import pytest
+
+from config.settings import Settings
+from server import engine
+
+
+def make_settings(**overrides) -> Settings:
+    return Settings(_env_file=None, **overrides)
+
+
+def test_resolve_profile_applies_overrides(monkeypatch):
+    """档位给出默认值，单独配置覆盖；workers=0 按可用 CPU 数确定"""
+    monkeypatch.setattr(engine, "available_cpus", lambda: 3)
+    monkeypatch.setattr(importlib.util, "find_spec", lambda name: object())
+
+    resolved = engine.resolve_profile(make_settings(server_profile="performance", server_keepalive_timeout=30))
+    assert resolved == {
+        "profile": "performance", "loop": "uvloop", "http": "httptools", "workers": 3,
+        "reuse_port": True, "backlog": 4096, "keepalive_timeout": 30
+    }
+
+    resolved = engine.resolve_profile(make_settings(server_profile="performance", workers=2, reload=True))
+    assert resolved["workers"] == 1
+
+    with pytest.raises(ValueError):
+        engine.resolve_profile(make_settings(server_profile="turbo"))
+
+
+def test_resolve_profile_falls_back_when_optional_modules_missing(monkeypatch):
+    """uvloop / httptools 未安装时回退为 asyncio / h11"""
+    monkeypatch.setattr(engine, "available_cpus", lambda: 1)
+    monkeypatch.setattr(importlib.util, "find_spec", lambda name: None)
+
+    resolved = engine.resolve_profile(make_settings(server_profile="performance"))
+    assert (resolved["loop"], resolved["http"], resolved["workers"]) == ("asyncio", "h11", 1)
+
+
+def test_available_cpus_respects_cgroup_quota(monkeypatch):
+    """配额向下取整后与 CPU 亲和性取较小值，且至少为 1"""
+    monkeypatch.setattr(engine.os, "sched_getaffinity", lambda pid: set(range(8)), raising=False)
+
+    monkeypatch.setattr(engine, "cpu_quota", lambda: 2.5)
+    assert engine.available_cpus() == 2
+    monkeypatch.setattr(engine, "cpu_quota", lambda: 0.5)
+    assert engine.available_cpus() == 1
+    monkeypatch.setattr(engine, "cpu_quota", lambda: None)
+    assert engine.available_cpus() == 8
+
+
+def test_prepare_metrics_dir_defaults_for_multiple_workers(monkeypatch, tmp_path):
+    """多 worker 未设置快照目录时使用默认目录并传给 worker 进程，启动前清理旧快照"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("METRICS_MULTIPROCESS_DIR", raising=False)
+    stale = tmp_path / engine.DEFAULT_METRICS_DIR / "metrics_1.json"
+    stale.parent.mkdir(parents=True)
+    stale.write_text("{}")
+
+    single = make_settings()
+    engine.prepare_metrics_dir(single, {"workers": 1})
+    assert single.metrics_multiprocess_dir == "" and stale.exists()
+
+    settings = make_settings()
+    engine.prepare_metrics_dir(settings, {"workers": 4})
+    assert settings.metrics_multiprocess_dir == engine.DEFAULT_METRICS_DIR
+    assert engine.os.environ["METRICS_MULTIPROCESS_DIR"] == engine.DEFAULT_METRICS_DIR
+    assert not stale.exists()
@@ -0,0 +1,124 @@
+"""
+扇出与 SSE 解析单元测试
+"""
+import asyncio
+import json
+import pytest
+from core.fanout import fanout_chat_completion, merge_completions
+from core.sse import SSEParser
+
+
+def completion(content: str) -> dict:
+    """构造 n=1 的非流式响应"""
+    return {
+        "id": f"chatcmpl-{content}",
+        "object": "chat.completion",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 2, "total_tokens": 12}
+    }
+
+
+class FakeStream:
+    """模拟上游流，按给定延迟逐个发送分块"""
+
+    def __init__(self, name: str, delay: float):
+        self.name = name
+        self.delay = delay
+        self.status_code = 200
+        self.headers = {}
+        self.closed = False
+
+    async def aiter_bytes(self):
+        for word in ("a", "b"):
+            await asyncio.sleep(self.delay)
+            chunk = {"id": f"id-{self.name}", "choices": [{"index": 0, "delta": {"content": f"{self.name}{word}"}}]}
+            data = f"data: {json.dumps(chunk)}\n\n".encode()
+            # 在事件中间切分，模拟任意分块边界
+            yield data[:7]
+            yield data[7:]
+        yield b"data: [DONE]\n\n"
+
+    async def aclose(self):
+        self.closed = True
+
+
+class FakeProxyService:
+    """模拟代理服务，记录每次调用的 n"""
+
+    def __init__(self, fail_on: int = -1):
+        self.calls = []
+        self.fail_on = fail_on
+        self.streams = []
+
+    async def chat_completion(self, model, messages, **kwargs):
+        call = len(self.calls)
+        self.calls.append(kwargs["n"])
+        await asyncio.sleep(0.01)
+        if call == self.fail_on:
+            raise RuntimeError("upstream failed")
+        if kwargs.get("stream"):
+            stream = FakeStream(str(call), delay=0.001 * (3 - call))
+            self.streams.append(stream)
+            return stream
+        return completion(f"c{call}")
+
+
+def test_merge_completions_reindexes_and_sums_usage():
+    """合并后 choice 重新编号，usage 求和"""
+    merged = merge_completions([completion("x"), completion("y"), completion("z")])
+
+    assert [choice["index"] for choice in merged["choices"]] == [0, 1, 2]
+    assert [choice["message"]["content"] for choice in merged["choices"]] == ["x", "y", "z"]
+    assert merged["usage"] == {"prompt_tokens": 30, "completion_tokens": 6, "total_tokens": 36}
+    assert merged["id"] == "chatcmpl-x"
+
+
+def test_sse_parser_handles_split_chunks():
+    """跨分块的事件在完整后才产出"""
+    parser = SSEParser()
+    assert parser.feed(b"data: {\"a\"") == []
+    assert parser.feed(b": 1}\n\n: comment\n\ndata: [DONE]\r\n\r\n") == ['{"a": 1}', "[DONE]"]
+    assert parser.flush() is None
+
+
+@pytest.mark.asyncio
+async def test_fanout_non_stream_runs_in_parallel():
+    """非流式扇出为 n 个并行的 n=1 请求"""
+    proxy = FakeProxyService()
+    started = asyncio.get_running_loop().time()
+    result = await fanout_chat_completion(proxy, model="m", messages=[], n=4, stream=False)
+    elapsed = asyncio.get_running_loop().time() - started
+
+    assert proxy.calls == [1, 1, 1, 1]
+    assert len(result["choices"]) == 4
+    assert elapsed < 0.04
+
+
+@pytest.mark.asyncio
+async def test_fanout_stream_interleaves_with_index():
+    """流式扇出交错转发，choice 索引对应子请求，仅发送一个 [DONE]"""
+    proxy = FakeProxyService()
+    stream = await fanout_chat_completion(proxy, model="m", messages=[], n=3, stream=True)
+
+    events = []
+    async for chunk in stream.aiter_bytes():
+        events.append(chunk.decode()[6:].strip())
+
+    assert events[-1] == "[DONE]"
+    chunks = [json.loads(event) for event in events[:-1]]
+    assert len(chunks) == 6
+    assert {chunk["id"] for chunk in chunks} == {chunks[0]["id"]}
+    for chunk in chunks:
+        choice = chunk["choices"][0]
+        assert choice["delta"]["content"].startswith(str(choice["index"]))
+    assert all(s.closed for s in proxy.streams)
+
+
+@pytest.mark.asyncio
+async def test_fanout_stream_failure_closes_opened_streams():
+    """任一子请求失败时关闭已建立的上游流"""
+    proxy = FakeProxyService(fail_on=1)
+    with pytest.raises(RuntimeError):
+        await fanout_chat_completion(proxy, model="m", messages=[], n=3, stream=True)
+    assert len(proxy.streams) == 2
+    assert all(s.closed for s in proxy.streams)
@@ -0,0 +1,206 @@
+"""
+HTTP客户端分阶段超时单元测试
+"""
+import asyncio
+import functools
+import httpx
+import pytest
+from tenacity import stop_after_attempt
+from core.http_client import MegaLLMClient, PhaseTimeout
+
+
+class SlowStream(httpx.AsyncByteStream):
+    """按固定间隔产生分块的响应体"""
+
+    def __init__(self, chunks: int, interval: float):
+        self.chunks = chunks
+        self.interval = interval
+
+    async def __aiter__(self):
+        for i in range(self.chunks):
+            await asyncio.sleep(self.interval)
+            yield f"data: {i}\n\n".encode()
+
+
+def make_client(handler, **timeouts) -> MegaLLMClient:
+    """创建使用模拟传输层的客户端"""
+    client = MegaLLMClient(base_url="http://mock/v1", **timeouts)
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client
+
+
+async def call_once(client: MegaLLMClient, model: str = "m", **kwargs):
+    """不重试地调用一次"""
+    client._send_chat_completion = functools.partial(
+        MegaLLMClient._send_chat_completion.retry_with(stop=stop_after_attempt(1)), client
+    )
+    return await client.chat_completion(
+        api_key="k", model=model, messages=[{"role": "user", "content": "hi"}], **kwargs
+    )
+
+
+@pytest.mark.asyncio
+async def test_first_byte_timeout():
+    """测试等待响应头超时"""
+    async def handler(request):
+        await asyncio.sleep(0.5)
+        return httpx.Response(200, json={})
+
+    client = make_client(handler, first_byte_timeout=0.05)
+
+    with pytest.raises(PhaseTimeout) as exc_info:
+        await call_once(client)
+
+    assert exc_info.value.kind == "first_byte"
+    assert client.get_timeout_stats()["first_byte"] == 1
+
+
+@pytest.mark.asyncio
+async def test_stream_total_deadline():
+    """测试流式响应超过总截止时间"""
+    async def handler(request):
+        return httpx.Response(200, stream=SlowStream(chunks=20, interval=0.02))
+
+    client = make_client(handler, timeout=0.1)
+    stream = await call_once(client, stream=True)
+
+    received = []
+    with pytest.raises(PhaseTimeout) as exc_info:
+        async for chunk in stream.aiter_bytes():
+            received.append(chunk)
+
+    assert exc_info.value.kind == "total"
+    assert 0 < len(received) < 20
+    assert client.get_timeout_stats()["total"] == 1
+
+
+@pytest.mark.asyncio
+async def test_stream_completes_within_deadline():
+    """测试正常流式响应"""
+    async def handler(request):
+        return httpx.Response(200, stream=SlowStream(chunks=3, interval=0))
+
+    client = make_client(handler)
+    stream = await call_once(client, stream=True)
+
+    chunks = [chunk async for chunk in stream.aiter_bytes()]
+    assert b"".join(chunks) == b"data: 0\n\ndata: 1\n\ndata: 2\n\n"
+
+
+@pytest.mark.asyncio
+async def test_stream_idle_timeout_between_chunks():
+    """测试分块间隔超过空闲超时；调用方处理分块的耗时不计入空闲时间"""
+    async def slow_upstream(request):
+        return httpx.Response(200, stream=SlowStream(chunks=3, interval=0.2))
+
+    client = make_client(slow_upstream, idle_timeout=0.05)
+    stream = await call_once(client, stream=True)
+    with pytest.raises(PhaseTimeout) as exc_info:
+        async for _ in stream.aiter_bytes():
+            pass
+    assert exc_info.value.kind == "idle"
+
+    async def fast_upstream(request):
+        return httpx.Response(200, stream=SlowStream(chunks=3, interval=0))
+
+    client = make_client(fast_upstream, idle_timeout=0.05)
+    stream = await call_once(client, stream=True)
+    received = []
+    async for chunk in stream.aiter_bytes():
+        received.append(chunk)
+        await asyncio.sleep(0.1)
+    assert len(received) == 3
+
+
+@pytest.mark.asyncio
+async def test_model_timeout_override(monkeypatch):
+    """测试按模型覆盖超时配置"""
+    from config import model_config
+    monkeypatch.setitem(model_config.MODEL_TIMEOUT_OVERRIDES, "slow-model", {"first_byte": 1.0})
+
+    async def handler(request):
+        await asyncio.sleep(0.1)
+        return httpx.Response(200, json={"usage": {}})
+
+    client = make_client(handler, first_byte_timeout=0.05)
+    result = await call_once(client, model="slow-model")
+    assert result == {"usage": {}}
+
+
+@pytest.mark.asyncio
+async def test_first_byte_timeout_longer_than_idle():
+    """首字节超时大于空闲超时时，等待响应头不受空闲超时限制；分块间隔仍按空闲超时检查"""
+    async def handle(reader, writer):
+        await reader.readuntil(b"\r\n\r\n")
+        await reader.read(1024)
+        await asyncio.sleep(0.3)
+        body = b'{"usage": {}}'
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nTransfer-Encoding: chunked\r\n\r\n")
+        writer.write(b"%x\r\n%s\r\n" % (len(body), body))
+        await writer.drain()
+        if stall_body.is_set():
+            await asyncio.sleep(0.3)
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        writer.close()
+
+    stall_body = asyncio.Event()
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    client = MegaLLMClient(base_url=f"http://127.0.0.1:{port}/v1", first_byte_timeout=2.0, idle_timeout=0.1)
+    try:
+        async with client:
+            assert await call_once(client) == {"usage": {}}
+
+            stall_body.set()
+            with pytest.raises(PhaseTimeout) as exc_info:
+                await call_once(client)
+            assert exc_info.value.kind == "idle"
+    finally:
+        server.close()
+        await server.wait_closed()
+    assert client.get_timeout_stats()["first_byte"] == 0
+
+
+@pytest.mark.asyncio
+async def test_total_deadline_shared_across_retries(monkeypatch):
+    """总截止时间在首次尝试前计算，重试不会重新计时：最后一次尝试只剩余下的时间"""
+    from core import http_client
+    monkeypatch.setattr(http_client, "_retry_wait", lambda retry_state: 0.01)
+    monkeypatch.setattr(MegaLLMClient._send_chat_completion.retry, "wait", lambda retry_state: 0.01)
+    attempts = []
+
+    async def handler(request):
+        attempts.append(request)
+        await asyncio.sleep(1)
+        return httpx.Response(200, json={})
+
+    client = make_client(handler, first_byte_timeout=0.1, timeout=0.25)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    with pytest.raises(PhaseTimeout) as exc_info:
+        await client.chat_completion(api_key="k", model="m", messages=[])
+
+    # 两次首字节超时（各 0.1 秒）后，第三次尝试只剩约 0.03 秒，以总超时结束
+    assert len(attempts) == 3
+    assert exc_info.value.kind == "total"
+    assert loop.time() - started < 0.35
+
+
+@pytest.mark.asyncio
+async def test_no_retry_sleep_past_deadline():
+    """重试等待会越过总截止时间时不再等待，立即抛出最后一次的错误"""
+    attempts = []
+
+    async def handler(request):
+        attempts.append(request)
+        raise httpx.ConnectError("connection refused", request=request)
+
+    client = make_client(handler, timeout=0.5)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    with pytest.raises(httpx.ConnectError):
+        await client.chat_completion(api_key="k", model="m", messages=[])
+
+    assert len(attempts) == 1
+    assert loop.time() - started < 0.5
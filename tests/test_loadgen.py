@@ -0,0 +1,68 @@
+"""
+负载生成工具单元测试
+"""
+import time
+
+import httpx
+import pytest
+
+from config.model_config import check_context_limit, get_prompt_budget
+from scripts.loadgen import LatencyRecorder, RunStats, generate_corpus, send_one
+
+
+def test_latency_recorder_percentiles_and_hgrm():
+    """百分位按最近秩计算；hgrm 输出以最大值和 1.0 百分位结束"""
+    recorder = LatencyRecorder()
+    for value in range(1, 1001):
+        recorder.record(float(value))
+
+    summary = recorder.summary()
+    assert (summary["p50"], summary["p99"], summary["p99.9"], summary["max"]) == (500, 990, 999, 1000)
+
+    rows = [line.split() for line in recorder.hgrm().splitlines()[2:] if line and not line.startswith("#")]
+    assert rows[0][:3] == ["1.000", "0.000000000000", "1"]
+    assert rows[-1] == ["1000.000", "1.000000000000", "1000"]
+    percentiles = [float(row[1]) for row in rows]
+    assert percentiles == sorted(percentiles)
+
+
+def test_generate_corpus_long_context_near_limit():
+    """长上下文请求接近但不超过模型输入预算"""
+    corpus = list(generate_corpus(200, ["llama3-8b-instruct"], long_fraction=0.1, long_ratio=0.9, seed=1))
+    long_requests = [r for r in corpus if r["kind"] == "long"]
+    assert long_requests and {r["kind"] for r in corpus} == {"short", "chat", "long"}
+
+    for request in long_requests:
+        exceeded, tokens, _ = check_context_limit(request["model"], request["messages"], request["max_tokens"])
+        assert not exceeded
+        assert tokens > 0.85 * get_prompt_budget(request["model"], request["max_tokens"])
+
+
+def sse(*events: str) -> bytes:
+    return "".join(f"data: {event}\n\n" for event in events).encode()
+
+
+@pytest.mark.asyncio
+async def test_send_one_stream_metrics_and_errors():
+    """流式请求记录 TTFT 和 token 间隔；未以 [DONE] 结束记为 truncated"""
+    delta = '{"choices":[{"index":0,"delta":{"content":"hi"}}]}'
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if b"truncate" in request.content:
+            return httpx.Response(200, content=sse(delta))
+        if b"fail" in request.content:
+            return httpx.Response(503, json={"error": {"message": "busy"}})
+        return httpx.Response(200, content=sse('{"choices":[{"index":0,"delta":{"role":"assistant"}}]}',
+                                               delta, delta, delta, "[DONE]"))
+
+    stats = RunStats()
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://proxy") as client:
+        for content in ("ok", "truncate", "fail"):
+            body = {"kind": "short", "stream": True, "messages": [{"role": "user", "content": content}]}
+            await send_one(client, body, time.perf_counter(), stats)
+
+    assert stats.succeeded == 1
+    assert stats.errors == {"truncated": 1, "http_503": 1}
+    assert len(stats.ttft["short"]) == 1
+    assert len(stats.itl["all"]) == 2
+    assert stats.completion_tokens == 3
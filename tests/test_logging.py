@@ -0,0 +1,101 @@
+"""
+日志系统（标准 logging 转发、采样、访问日志）单元测试
+"""
+import json
+import logging
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from loguru import logger as loguru_logger
+
+from api.middleware import AccessLogMiddleware
+from core.access_log import KeyValues, annotate
+from utils.logger import InterceptHandler, SamplingFilter, apply_sampling, json_formatter
+
+
+@pytest.fixture
+def captured():
+    """捕获转发到 loguru 的记录"""
+    records = []
+    handler_id = loguru_logger.add(lambda message: records.append(message.record), level="DEBUG", format="{message}")
+    yield records
+    loguru_logger.remove(handler_id)
+
+
+def test_intercept_handler_keeps_caller_location(captured):
+    """转发的记录使用调用方的位置和结构化字段，不是 logging 模块内部的帧"""
+    log = logging.getLogger("tests.intercept")
+    log.handlers = [InterceptHandler()]
+    log.propagate = False
+    log.setLevel(logging.DEBUG)
+
+    log.info("hello %s {braces}", "world", extra={"fields": {"status": 200}})
+
+    record = captured[-1]
+    assert record["message"] == "hello world {braces}"
+    assert record["name"] == "tests.intercept"
+    assert record["function"] == "test_intercept_handler_keeps_caller_location"
+    assert record["extra"]["status"] == 200
+    assert "_stdlib" not in record["extra"]
+
+    assert json_formatter(record) == "{extra[json]}\n"
+    payload = json.loads(record["extra"]["json"])
+    assert payload["status"] == 200
+    assert payload["logger"] == "tests.intercept"
+
+
+def test_sampling_filter_keeps_warnings_and_replaces_previous_filters():
+    """采样只作用于 WARNING 以下的日志，重复配置时替换之前的过滤器"""
+    sampler = SamplingFilter(0.0)
+    info = logging.LogRecord("x", logging.INFO, __file__, 1, "m", None, None)
+    warning = logging.LogRecord("x", logging.WARNING, __file__, 1, "m", None, None)
+    assert not sampler.filter(info)
+    assert sampler.filter(warning)
+
+    log = logging.getLogger("tests.sampled")
+    try:
+        apply_sampling({"tests.sampled": 0.5})
+        apply_sampling({"tests.sampled": 0.1})
+        filters = [f for f in log.filters if isinstance(f, SamplingFilter)]
+        assert [f.rate for f in filters] == [0.1]
+
+        apply_sampling({})
+        assert not log.filters
+        with pytest.raises(ValueError):
+            apply_sampling({"tests.sampled": 2})
+    finally:
+        apply_sampling({})
+
+
+def test_key_values_formats_lazily():
+    """key=value 格式：省略 None，含空格的值加引号，字典展开"""
+    line = KeyValues({"status": 200, "stream": False, "key": None, "error": "a b", "phases_ms": {"ttfb": 1.5}})
+    assert str(line) == 'status=200 stream=false error="a b" phases_ms=ttfb:1.5'
+
+
+@pytest.mark.asyncio
+async def test_access_log_middleware_emits_single_line(caplog):
+    """每个请求输出一行访问日志，包含路由补充的字段"""
+    app = FastAPI()
+
+    @app.get("/ping")
+    async def ping():
+        annotate(model="m", client="c")
+        return {"ok": True}
+
+    app.add_middleware(AccessLogMiddleware)
+
+    with caplog.at_level(logging.INFO, logger="megallm.access"):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            await client.get("/ping")
+
+    records = [record for record in caplog.records if record.name == "megallm.access"]
+    assert len(records) == 1
+    assert records[0].fields["status"] == 200
+    assert records[0].fields["model"] == "m"
+    assert records[0].getMessage().startswith("method=GET path=/ping status=200 duration_ms=")
+    assert "client=c" in records[0].getMessage()
+
+    # 未在请求上下文中时 annotate 为空操作
+    annotate(model="ignored")
@@ -0,0 +1,71 @@
+"""
+指标模块单元测试
+"""
+import json
+import os
+import time
+import pytest
+from core.metrics import MetricsRegistry, merge_snapshots, render_text
+
+
+def make_registry() -> MetricsRegistry:
+    """创建带一个计数器、一个直方图和一个仪表盘的注册表"""
+    registry = MetricsRegistry()
+    requests = registry.counter("test_requests_total", "请求数", ("model", "status"))
+    latency = registry.histogram("test_latency_seconds", "延迟", ("model",), buckets=(0.1, 1.0))
+    requests.inc("m", "200")
+    requests.inc("m", "200")
+    latency.observe(0.05, "m")
+    latency.observe(0.5, "m")
+    latency.observe(5.0, "m")
+    registry.register_collector(lambda: [{
+        "name": "test_queue_depth", "type": "gauge", "help": "队列深度", "mode": "max",
+        "values": [((), 3)]
+    }])
+    return registry
+
+
+def test_render_prometheus_text():
+    """直方图桶累计输出，标签按名称输出"""
+    text = render_text(make_registry().snapshot())
+
+    assert '# TYPE test_requests_total counter' in text
+    assert 'test_requests_total{model="m",status="200"} 2' in text
+    assert 'test_latency_seconds_bucket{model="m",le="0.1"} 1' in text
+    assert 'test_latency_seconds_bucket{model="m",le="1"} 2' in text
+    assert 'test_latency_seconds_bucket{model="m",le="+Inf"} 3' in text
+    assert 'test_latency_seconds_count{model="m"} 3' in text
+    assert 'test_queue_depth 3' in text
+
+
+def test_merge_snapshots_sums_counters_and_aggregates_gauges():
+    """计数器和直方图求和，仪表盘按 mode 聚合"""
+    snapshot = make_registry().snapshot()
+    other = json.loads(json.dumps(snapshot))
+    other["test_queue_depth"]["values"] = [[[], 7]]
+
+    merged = merge_snapshots([snapshot, other])
+
+    assert merged["test_requests_total"]["values"] == [[["m", "200"], 4]]
+    assert merged["test_latency_seconds"]["values"][0][1][-1] == 6
+    assert merged["test_queue_depth"]["values"] == [[[], 7]]
+
+
+@pytest.mark.asyncio
+async def test_multiprocess_collect_ignores_stale_gauges(tmp_path):
+    """多进程模式下合并其他 worker 的快照，过期快照只保留计数器"""
+    registry = make_registry()
+    registry.enable_multiprocess(str(tmp_path), flush_interval=1.0)
+
+    other = make_registry().snapshot()
+    for pid, written in ((os.getpid() + 1, time.time()), (os.getpid() + 2, time.time() - 60)):
+        with open(tmp_path / f"metrics_{pid}.json", 'w', encoding='utf-8') as f:
+            json.dump({"pid": pid, "time": written, "metrics": other}, f)
+
+    merged = await registry.collect()
+
+    assert merged["test_requests_total"]["values"] == [[["m", "200"], 6]]
+    assert merged["test_queue_depth"]["values"] == [[[], 3]]
+
+    registry.write_snapshot(registry.snapshot())
+    assert (tmp_path / f"metrics_{os.getpid()}.json").exists()
@@ -0,0 +1,149 @@
+"""
+热路径微基准测试
+
+覆盖每个请求都会经过的组件：token 估算、密钥轮询、请求体校验、JSON 编解码和流式分块转发。
+默认跳过，运行方式见 tests/conftest.py:
+
+    pytest tests/test_microbench.py --bench
+"""
+import asyncio
+import json
+import math
+import threading
+
+import httpx
+import pytest
+
+from config.model_config import calculate_messages_tokens, estimate_tokens
+from core.http_client import UpstreamStream
+from core.key_manager import KeyManager
+from core.sse import SSEParser
+from models.schemas import ChatCompletionRequest
+
+pytestmark = pytest.mark.bench
+
+CONTENTION_THREADS = 4
+CALLS_PER_THREAD = 2000
+STREAM_CHUNKS = 200
+
+
+def conversation(turns: int, chars: int) -> list:
+    """构造中英文混合的多轮对话"""
+    text = ("The quick brown fox jumps over the lazy dog. 敏捷的棕色狐狸跳过了懒狗。" * (chars // 40 + 1))[:chars]
+    messages = [{"role": "system", "content": "You are a helpful assistant."}]
+    for i in range(turns):
+        messages.append({"role": "user" if i % 2 == 0 else "assistant", "content": text})
+    return messages
+
+
+def sse_chunk(index: int) -> bytes:
+    delta = {
+        "id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 0, "model": "m",
+        "choices": [{"index": 0, "delta": {"content": f"token{index} "}, "finish_reason": None}]
+    }
+    return f"data: {json.dumps(delta)}\n\n".encode()
+
+
+@pytest.fixture
+def key_manager(tmp_path):
+    key_file = tmp_path / "keys.txt"
+    key_file.write_text("".join(f"sk-bench-{i:04d}\n" for i in range(8)))
+    return KeyManager(str(key_file))
+
+
+def test_estimate_tokens_10k_chars(benchmark):
+    text = conversation(1, 10_000)[1]["content"]
+    assert benchmark(estimate_tokens, text) > 0
+
+
+def test_calculate_messages_tokens_50_turns(benchmark):
+    messages = conversation(50, 500)
+    assert benchmark(calculate_messages_tokens, messages) > 0
+
+
+def test_get_next_key(benchmark, key_manager):
+    assert benchmark(key_manager.get_next_key).startswith("sk-bench-")
+
+
+def test_get_next_key_with_failed_keys(benchmark, key_manager):
+    """一半密钥失败时轮询需要跳过失败密钥"""
+    for i in range(0, 8, 2):
+        key_manager.mark_key_failed(f"sk-bench-{i:04d}")
+    benchmark(key_manager.get_next_key)
+
+
+def test_get_next_key_contention(benchmark, key_manager):
+    """多线程同时取密钥，按单次调用折算（含线程启动开销，CALLS_PER_THREAD 足够大以摊薄）"""
+    def contend():
+        barrier = threading.Barrier(CONTENTION_THREADS)
+
+        def worker():
+            barrier.wait()
+            for _ in range(CALLS_PER_THREAD):
+                key_manager.get_next_key()
+
+        threads = [threading.Thread(target=worker) for _ in range(CONTENTION_THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    benchmark(contend, ops=CONTENTION_THREADS * CALLS_PER_THREAD)
+
+
+def test_validate_large_request(benchmark):
+    """200 条消息、约 200KB 的请求体校验"""
+    body = {"model": "openai-gpt-oss-120b", "messages": conversation(200, 1000), "temperature": 0.7, "stream": True}
+    request = benchmark(lambda: ChatCompletionRequest(**body))
+    assert len(request.messages) == 201
+
+
+def test_request_to_upstream_json(benchmark):
+    """校验后的请求转为上游请求体并编码"""
+    request = ChatCompletionRequest(model="m", messages=conversation(20, 1000))
+    payload = benchmark(lambda: json.dumps(request.dict(exclude_none=True)))
+    assert payload.startswith("{")
+
+
+def test_decode_completion_json(benchmark):
+    """解码非流式响应体"""
+    response = json.dumps({
+        "id": "chatcmpl-bench", "object": "chat.completion", "created": 0, "model": "m",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": "x" * 4000}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 1000, "completion_tokens": 1000, "total_tokens": 2000}
+    })
+    assert benchmark(json.loads, response)["usage"]["total_tokens"] == 2000
+
+
+def test_sse_parser_per_chunk(benchmark):
+    """审计、扇出路径上逐块解析 SSE"""
+    chunks = [sse_chunk(i) for i in range(STREAM_CHUNKS)]
+
+    def parse():
+        parser = SSEParser()
+        for chunk in chunks:
+            parser.feed(chunk)
+
+    benchmark(parse, ops=STREAM_CHUNKS)
+
+
+def test_stream_passthrough_per_chunk(benchmark):
+    """UpstreamStream 逐块转发（截止时间检查 + httpx 分块迭代），按单个分块折算"""
+    chunks = [sse_chunk(i) for i in range(STREAM_CHUNKS)]
+    loop = asyncio.new_event_loop()
+
+    async def body():
+        for chunk in chunks:
+            yield chunk
+
+    async def passthrough():
+        stream = UpstreamStream(None, httpx.Response(200, content=body()), math.inf, "m")
+        count = 0
+        async for _ in stream.aiter_bytes():
+            count += 1
+        return count
+
+    try:
+        assert benchmark(lambda: loop.run_until_complete(passthrough()), ops=STREAM_CHUNKS) == STREAM_CHUNKS
+    finally:
+        loop.close()
@@ -0,0 +1,94 @@
+"""
+模拟上游服务单元测试
+"""
+import time
+
+import httpx
+import pytest
+
+from benchmarks.mock_upstream import FaultSchedule, create_app
+from core.audit import reassemble_stream
+
+
+@pytest.mark.asyncio
+async def test_stream_chunks_and_timing():
+    """流式响应按 chunk_tokens 分块，首 token 和生成速度符合配置，可被重组为完整响应"""
+    app = create_app(ttft=0.05, tokens_per_second=200, chunk_tokens=2, completion_tokens=6)
+    payload = {
+        "model": "m", "stream": True, "stream_options": {"include_usage": True},
+        "messages": [{"role": "user", "content": "hello"}]
+    }
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://mock") as client:
+        started = time.perf_counter()
+        response = await client.post("/v1/chat/completions", json=payload)
+        elapsed = time.perf_counter() - started
+
+    chunks = [line for line in response.content.split(b"\n\n") if line]
+    assert chunks[-1] == b"data: [DONE]"
+    assert len(chunks) == 1 + 3 + 1 + 1 + 1  # role、3 个内容分块、finish_reason、usage、[DONE]
+    assert 0.05 + 5 / 200 <= elapsed < 0.5
+
+    result = reassemble_stream([response.content])
+    assert result["choices"][0]["message"]["content"] == "token " * 6
+    assert result["choices"][0]["finish_reason"] == "stop"
+    assert result["usage"]["completion_tokens"] == 6
+
+
+@pytest.mark.asyncio
+async def test_non_stream_respects_max_tokens():
+    """非流式响应 token 数受 max_tokens 限制"""
+    app = create_app(ttft=0, tokens_per_second=0, completion_tokens=64)
+    payload = {"model": "m", "max_tokens": 3, "messages": [{"role": "user", "content": "hello"}]}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://mock") as client:
+        body = (await client.post("/v1/chat/completions", json=payload)).json()
+        models = (await client.get("/v1/models")).json()
+
+    assert body["choices"][0]["message"]["content"] == "token " * 3
+    assert body["usage"]["completion_tokens"] == 3
+    assert models["data"][0]["id"] == "openai-gpt-oss-120b"
+
+
+def test_fault_schedule_matching():
+    """规则按密钥、时间窗口和命中比例匹配，第一条命中的规则生效"""
+    schedule = FaultSchedule([
+        {"fault": 401, "keys": ["k1"]},
+        {"fault": 503, "start": 0, "end": 60, "rate": 0.5},
+        {"fault": "reset", "start": 60},
+    ], seed=1)
+
+    assert schedule.match("k1")["fault"] == 401
+    hits = [schedule.match("k2") for _ in range(1000)]
+    assert 400 < sum(1 for rule in hits if rule is not None) < 600
+
+    schedule.started -= 61
+    assert schedule.match("k2")["fault"] == "reset"
+
+    with pytest.raises(ValueError):
+        FaultSchedule([{"fault": "explode"}])
+
+
+@pytest.mark.asyncio
+async def test_fault_injector_errors_and_stats():
+    """注入的 HTTP 错误带 Retry-After，连接类故障在测试传输层中表现为连接错误；统计按密钥记录"""
+    app = create_app(ttft=0, tokens_per_second=0, completion_tokens=4)
+    payload = {"model": "m", "stream": True, "messages": [{"role": "user", "content": "hello"}]}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://mock") as client:
+        plan = {"faults": [{"fault": 429, "keys": ["k1"], "retry_after": 3}, {"fault": "drop", "keys": ["k2"]}]}
+        assert (await client.put("/mock/faults", json=plan)).status_code == 200
+
+        response = await client.post("/v1/chat/completions", json=payload, headers={"Authorization": "Bearer k1"})
+        assert response.status_code == 429
+        assert response.headers["retry-after"] == "3"
+
+        with pytest.raises(ConnectionResetError):
+            await client.post(
+                "/v1/chat/completions", json={**payload, "stream": False}, headers={"Authorization": "Bearer k2"}
+            )
+
+        response = await client.post("/v1/chat/completions", json=payload, headers={"Authorization": "Bearer k3"})
+        assert response.status_code == 200
+
+        stats = (await client.get("/mock/stats")).json()
+
+    assert stats["calls"] == 3
+    assert stats["by_key"] == {"k1": {"429": 1}, "k2": {"drop": 1}, "k3": {"ok": 1}}
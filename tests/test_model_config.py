@@ -0,0 +1,96 @@
+"""
+模型配置单元测试
+"""
+import pytest
+from config.model_config import (
+    TRUNCATION_MARKER,
+    check_context_limit,
+    check_max_tokens_limit,
+    get_prompt_budget,
+    trim_messages_to_fit
+)
+
+
+@pytest.fixture
+def long_conversation():
+    """超出 llama3-8b-instruct 上下文的多轮对话"""
+    return [
+        {"role": "system", "content": "你是一个有用的助手"},
+        {"role": "user", "content": "a" * 12_000},
+        {"role": "assistant", "content": "b" * 12_000},
+        {"role": "user", "content": "c" * 8_000},
+        {"role": "user", "content": "最后的问题"}
+    ]
+
+
+def test_max_tokens_counted_in_budget():
+    """测试 max_tokens 计入上下文预算"""
+    messages = [{"role": "user", "content": "x" * 20_000}]
+
+    assert not check_context_limit("llama3-8b-instruct", messages)[0]
+    assert check_context_limit("llama3-8b-instruct", messages, max_tokens=4_000)[0]
+
+
+def test_small_output_not_rejected_on_large_model():
+    """测试小输出请求在大模型上不会被提前拒绝"""
+    # 约 120,000 tokens，超过原先 90% 的可用限制，但加上输出仍在 128k 以内
+    messages = [{"role": "user", "content": "x" * 480_000}]
+
+    assert not check_context_limit("openai-gpt-oss-120b", messages, max_tokens=1_000)[0]
+    assert get_prompt_budget("openai-gpt-oss-120b", 1_000) == 127_000
+
+
+def test_max_tokens_over_model_output_limit():
+    """测试 max_tokens 超出模型最大输出长度"""
+    assert check_max_tokens_limit("llama3-8b-instruct", 32_000) == (True, 4_096)
+    assert check_max_tokens_limit("llama3-8b-instruct", 1_000) == (False, 4_096)
+    assert check_max_tokens_limit("llama3-8b-instruct", None) == (False, 4_096)
+
+
+def test_drop_oldest_keeps_system_and_last(long_conversation):
+    """测试丢弃最早消息时保留 system 和最后一条消息"""
+    assert check_context_limit("llama3-8b-instruct", long_conversation)[0]
+
+    trimmed, info = trim_messages_to_fit("llama3-8b-instruct", long_conversation, policy="drop_oldest")
+
+    assert info["fits"]
+    assert info["dropped_messages"] == 1
+    assert trimmed[0]["role"] == "system"
+    assert trimmed[-1]["content"] == "最后的问题"
+    assert not check_context_limit("llama3-8b-instruct", trimmed)[0]
+
+
+def test_truncate_oldest_keeps_messages(long_conversation):
+    """测试截断策略只截断最早的消息内容"""
+    trimmed, info = trim_messages_to_fit("llama3-8b-instruct", long_conversation, policy="truncate_oldest")
+
+    assert info["fits"]
+    assert info["dropped_messages"] == 0
+    assert info["truncated_messages"] == 1
+    assert trimmed[1]["content"].endswith(TRUNCATION_MARKER)
+    assert len(trimmed) == len(long_conversation)
+
+
+def test_max_tokens_reserved(long_conversation):
+    """测试裁剪预算扣除 max_tokens"""
+    _, without_output = trim_messages_to_fit("llama3-8b-instruct", long_conversation)
+    _, with_output = trim_messages_to_fit("llama3-8b-instruct", long_conversation, max_tokens=4_000)
+
+    assert with_output["budget"] == 8_000 - 4_000
+    assert with_output["trimmed_tokens"] > without_output["trimmed_tokens"]
+
+
+def test_cannot_fit_single_message():
+    """测试最后一条消息本身超限时无法裁剪"""
+    messages = [{"role": "user", "content": "x" * 100_000}]
+
+    trimmed, info = trim_messages_to_fit("llama3-8b-instruct", messages, policy="drop_oldest")
+
+    assert not info["fits"]
+    assert trimmed == messages
+
+
+def test_invalid_policy():
+    """测试非法裁剪策略"""
+    with pytest.raises(ValueError):
+        trim_messages_to_fit("llama3-8b-instruct", [], policy="none")
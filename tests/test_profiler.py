@@ -0,0 +1,111 @@
+"""
+诊断模块（栈采样、任务快照、事件循环延迟监控）单元测试
+"""
+import asyncio
+import logging
+import threading
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.routes import router
+from config.settings import settings
+from core.profiler import LoopLagMonitor, Profiler, StackSampler, dump_tasks
+
+
+def busy_wait(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def test_stack_sampler_captures_target_thread():
+    """采样器读取目标线程的栈并输出 collapsed 格式"""
+    worker = threading.Thread(target=busy_wait, args=(0.3,))
+    worker.start()
+    sampler = StackSampler(worker.ident, interval=0.002)
+    sampler.run(0.1)
+    worker.join()
+
+    assert sampler.sample_count > 0
+    lines = sampler.collapsed().splitlines()
+    stack, count = lines[0].rsplit(" ", 1)
+    assert stack.split(";")[-1].endswith(":busy_wait")
+    assert int(count) > 0
+
+
+@pytest.mark.asyncio
+async def test_loop_lag_monitor_detects_blocking(caplog):
+    """阻塞事件循环超过阈值时记录告警和阻塞位置的栈"""
+    monitor = LoopLagMonitor(interval=0.02, threshold=0.1)
+    monitor.start()
+    try:
+        with caplog.at_level(logging.WARNING, logger="core.profiler"):
+            await asyncio.sleep(0.05)
+            time.sleep(0.3)
+            await asyncio.sleep(0.05)
+    finally:
+        await monitor.stop()
+
+    stats = monitor.get_stats()
+    assert stats["blocked"] == 1
+    assert stats["max_lag_ms"] >= 200
+    assert any("test_loop_lag_monitor_detects_blocking" in record.message for record in caplog.records)
+
+
+@pytest.mark.asyncio
+async def test_profiler_profiles_loop_and_rejects_concurrent_runs():
+    """采样期间阻塞的协程出现在结果中，同一时间只允许一个采样"""
+    profiler = Profiler(max_duration=1.0)
+
+    async def blocker():
+        await asyncio.sleep(0.02)
+        busy_wait(0.1)
+
+    task = asyncio.create_task(blocker(), name="blocker")
+    profiling = asyncio.create_task(profiler.profile(0.2, interval=0.002))
+    await asyncio.sleep(0)
+    assert profiler.running
+    with pytest.raises(RuntimeError):
+        await profiler.profile(0.1)
+
+    result = await profiling
+    await task
+    assert not profiler.running
+    assert result["samples"] > 0
+    assert ":busy_wait" in result["collapsed"]
+
+
+@pytest.mark.asyncio
+async def test_dump_tasks_lists_pending_tasks():
+    """任务快照包含任务名称和挂起位置"""
+    async def idle():
+        await asyncio.sleep(10)
+
+    task = asyncio.create_task(idle(), name="idle-task")
+    await asyncio.sleep(0)
+    try:
+        tasks = {item["name"]: item for item in dump_tasks()}
+        assert tasks["idle-task"]["coro"].endswith("idle")
+        assert any("idle" in frame for frame in tasks["idle-task"]["stack"])
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+def test_profiler_endpoints_disabled_by_default(monkeypatch):
+    """采样分析和任务快照端点默认关闭，PROFILER_ENABLED 开启后可用"""
+    app = FastAPI()
+    app.include_router(router)
+    client = TestClient(app)
+
+    monkeypatch.setattr(settings, "profiler_enabled", False)
+    assert client.post("/admin/profile?duration=0.01").status_code == 404
+    assert client.get("/admin/tasks").status_code == 404
+
+    monkeypatch.setattr(settings, "profiler_enabled", True)
+    assert client.get("/admin/tasks").json()["count"] > 0
+    response = client.post("/admin/profile?duration=0.05&format=json")
+    assert response.status_code == 200 and "samples" in response.json()
@@ -0,0 +1,94 @@
+"""
+客户端限流器单元测试
+"""
+import json
+import pytest
+from core.rate_limiter import (
+    ClientAuthError,
+    ClientRateLimiter,
+    RateLimitExceeded,
+    TokenBucket
+)
+
+
+@pytest.fixture
+def client_config(tmp_path):
+    """创建临时客户端配置文件"""
+    config_file = tmp_path / "clients.json"
+    config_file.write_text(json.dumps({
+        "default": {"requests_per_minute": 2},
+        "clients": [
+            {"id": "team-a", "api_keys": ["token-a"], "requests_per_minute": 3, "tokens_per_minute": 1000}
+        ]
+    }))
+    return str(config_file)
+
+
+def test_token_bucket_refill():
+    """测试令牌桶按时间补充"""
+    bucket = TokenBucket(60, now=0.0)
+
+    assert bucket.consume(60, now=0.0) == 0
+    assert bucket.consume(1, now=0.0) > 0
+    assert bucket.consume(1, now=1.0) == 0  # 每秒补充 1 个
+
+
+def test_token_bucket_oversized_request():
+    """测试超过容量的请求在桶满时允许通过并记为欠额"""
+    bucket = TokenBucket(100, now=0.0)
+
+    assert bucket.consume(250, now=0.0) == 0
+    assert bucket.consume(1, now=0.0) > 0
+
+
+def test_identify_configured_client(client_config):
+    """测试按凭证识别已配置客户端"""
+    limiter = ClientRateLimiter(client_config)
+
+    client = limiter.identify("token-a", "10.0.0.1")
+    assert client.client_id == "team-a"
+    assert not client.anonymous
+
+
+def test_anonymous_clients_limited_by_address(client_config):
+    """测试匿名客户端按地址分别限流"""
+    limiter = ClientRateLimiter(client_config)
+
+    first = limiter.identify(None, "10.0.0.1")
+    limiter.check_request(first)
+    limiter.check_request(first)
+    with pytest.raises(RateLimitExceeded) as exc_info:
+        limiter.check_request(first)
+    assert exc_info.value.retry_after >= 1
+
+    other = limiter.identify("unknown-token", "10.0.0.2")
+    limiter.check_request(other)
+
+
+def test_token_limit(client_config):
+    """测试 token 配额"""
+    limiter = ClientRateLimiter(client_config)
+    client = limiter.identify("token-a", None)
+
+    limiter.check_tokens(client, 900)
+    with pytest.raises(RateLimitExceeded) as exc_info:
+        limiter.check_tokens(client, 500)
+    assert exc_info.value.limit_type == "tokens"
+
+
+def test_auth_required(client_config):
+    """测试要求认证时拒绝未知凭证"""
+    limiter = ClientRateLimiter(client_config, auth_required=True)
+
+    with pytest.raises(ClientAuthError):
+        limiter.identify("bad-token", "10.0.0.1")
+
+
+def test_anonymous_lru_bounded():
+    """测试匿名客户端数量有上限"""
+    limiter = ClientRateLimiter(None, default_requests_per_minute=10, max_tracked_clients=3)
+
+    for i in range(10):
+        limiter.identify(None, f"10.0.0.{i}")
+
+    assert limiter.get_stats()["anonymous_tracked"] == 3
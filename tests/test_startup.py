@@ -0,0 +1,77 @@
+"""
+启动预热与就绪状态单元测试
+"""
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from api.routes import router
+from core.http_client import MegaLLMClient
+from core.key_manager import KeyManager
+from core.proxy import ProxyService
+from core.startup import StartupState
+
+
+@pytest.mark.asyncio
+async def test_run_warmup_records_failures_and_timeouts():
+    """预热失败或超时不阻止就绪，各任务状态和耗时写入报告"""
+    async def ok():
+        return {"pool_size": 2}
+
+    async def fail():
+        raise RuntimeError("upstream down")
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    startup = StartupState()
+    await startup.run_warmup({"ok": ok, "fail": fail, "hang": hang}, timeout=0.05)
+
+    report = startup.report()
+    assert report["ready"] and report["total_ms"] is not None
+    assert report["warmup"]["ok"]["result"] == {"pool_size": 2}
+    assert (report["warmup"]["fail"]["status"], report["warmup"]["fail"]["error"]) == ("failed", "upstream down")
+    assert report["warmup"]["hang"]["status"] == "timeout"
+    assert "warmup" in report["phases_ms"]
+
+
+@pytest.mark.asyncio
+async def test_proxy_warmup_marks_unauthorized_keys(tmp_path):
+    """预热时认证失败的密钥被标记为失败，直到找到可用密钥"""
+    key_file = tmp_path / "keys.txt"
+    key_file.write_text("bad-key-1\nbad-key-2\ngood-key\n")
+    key_manager = KeyManager(str(key_file))
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert request.url.path == "/v1/models"
+        if request.headers["authorization"].startswith("Bearer bad"):
+            return httpx.Response(401)
+        return httpx.Response(200, json={"data": []})
+
+    client = MegaLLMClient(base_url="http://mock/v1")
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    result = await ProxyService(key_manager, client).warmup()
+
+    assert result["status"] == 200 and result["failed_keys"] == 2
+    assert key_manager.available_keys == 1
+
+
+@pytest.mark.asyncio
+async def test_ready_endpoint():
+    """预热完成前 /ready 返回 503，之后返回 200 和启动报告"""
+    app = FastAPI()
+    app.include_router(router)
+    app.state.startup = StartupState()
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://proxy") as client:
+        response = await client.get("/ready")
+        assert response.status_code == 503
+        assert response.json()["status"] == "starting"
+
+        await app.state.startup.run_warmup({}, timeout=1)
+        response = await client.get("/ready")
+
+    assert response.status_code == 200
+    assert response.json()["ready"] is True
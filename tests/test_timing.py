@@ -0,0 +1,83 @@
+"""
+分阶段计时与 Server-Timing 中间件单元测试
+"""
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+from api.middleware import ServerTimingMiddleware
+from core.timing import PhaseTimer, UpstreamTrace, current_timer, phase, record, reset_timer, start_timer
+
+
+def test_phase_is_noop_without_timer():
+    """未启用计时时 phase() / record() 为空操作"""
+    assert current_timer() is None
+    with phase("tokens"):
+        pass
+    record("body", 1.0)
+    assert current_timer() is None
+
+
+def test_phase_timer_accumulates_and_formats_header():
+    """同名阶段累加，输出毫秒"""
+    timer, token = start_timer()
+    try:
+        record("key", 0.001)
+        record("key", 0.002)
+        with phase("tokens"):
+            pass
+    finally:
+        reset_timer(token)
+
+    assert timer.phases["key"] == pytest.approx(0.003)
+    header = timer.header(total=0.5)
+    assert header.startswith("key;dur=3.00, tokens;dur=")
+    assert header.endswith("total;dur=500.00")
+
+
+@pytest.mark.asyncio
+async def test_upstream_trace_splits_pool_connect_and_ttfb(monkeypatch):
+    """根据 httpcore trace 事件拆分连接池等待、建立连接和首字节耗时"""
+    timer = PhaseTimer()
+    clock = iter([0.0, 0.010, 0.015, 0.030, 0.031, 0.131])
+    monkeypatch.setattr("core.timing.time.perf_counter", lambda: next(clock))
+
+    trace = UpstreamTrace(timer)
+    await trace("connection.connect_tcp.started", {})
+    await trace("connection.connect_tcp.complete", {})
+    await trace("connection.start_tls.complete", {})
+    await trace("http11.send_request_headers.started", {})
+    trace.finish()
+
+    assert timer.phases["pool"] == pytest.approx(0.010)
+    assert timer.phases["connect"] == pytest.approx(0.020)
+    assert timer.phases["ttfb"] == pytest.approx(0.100)
+
+
+@pytest.mark.asyncio
+async def test_middleware_adds_server_timing_header():
+    """中间件在普通响应和流式响应头中附加 Server-Timing"""
+    app = FastAPI()
+
+    @app.get("/plain")
+    async def plain():
+        with phase("tokens"):
+            pass
+        return {"ok": True}
+
+    @app.get("/stream")
+    async def stream():
+        async def generate():
+            yield b"data: 1\n\n"
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+    app.add_middleware(ServerTimingMiddleware)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get("/plain")
+        assert "tokens;dur=" in response.headers["server-timing"]
+        assert "total;dur=" in response.headers["server-timing"]
+
+        response = await client.get("/stream")
+        assert "total;dur=" in response.headers["server-timing"]
@@ -0,0 +1,107 @@
+"""
+请求追踪模块单元测试
+"""
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from api.middleware import TracingMiddleware
+from core.tracing import (
+    NULL_SPAN, Trace, TraceBuffer, current_request_id, reset_trace, span, start_trace, to_otlp
+)
+
+
+def make_trace(request_id, duration=0.01, path="/v1/chat/completions"):
+    trace = Trace(request_id, "http.request", **{"http.path": path})
+    trace.root.finish()
+    trace.root.duration = duration
+    return trace
+
+
+def test_spans_nest_under_current_span():
+    """with span() 进入后成为当前 span，其中创建的 span 以它为父节点"""
+    trace, tokens = start_trace("req-1", "http.request")
+    try:
+        with span("upstream.attempt", attempt=1) as attempt:
+            with span("retry.sleep") as inner:
+                pass
+        sibling = span("stream")
+        sibling.finish()
+    finally:
+        reset_trace(tokens)
+
+    assert attempt.parent_id == trace.root.span_id
+    assert inner.parent_id == attempt.span_id
+    assert sibling.parent_id == trace.root.span_id
+    assert attempt.duration is not None and attempt.attributes == {"attempt": 1}
+    assert current_request_id() is None
+
+
+def test_span_without_trace_is_noop():
+    """不在请求上下文中时 span() 返回空操作对象"""
+    with span("key.select") as s:
+        s.set(key="x")
+        s.event("retry")
+    assert s is NULL_SPAN
+
+
+def test_buffer_evicts_oldest_and_filters():
+    """环形缓冲区淘汰最早的请求，索引同步移除；按耗时和路径过滤"""
+    buffer = TraceBuffer(size=2)
+    buffer.add(make_trace("a", duration=0.5))
+    buffer.add(make_trace("b", duration=0.001, path="/health"))
+    buffer.add(make_trace("c", duration=0.2))
+
+    assert len(buffer) == 2
+    assert buffer.get("a") is None
+    assert [t.request_id for t in buffer.recent()] == ["c", "b"]
+    assert [t.request_id for t in buffer.recent(min_duration_ms=100)] == ["c"]
+    assert [t.request_id for t in buffer.recent(path="/health")] == ["b"]
+
+
+def test_to_otlp_structure():
+    """OTLP 导出: 非十六进制请求ID取哈希作为 traceId，子 span 带 parentSpanId"""
+    trace, tokens = start_trace("my-request", "http.request")
+    try:
+        with span("upstream.attempt") as s:
+            s.event("retry", status_code=503)
+    finally:
+        reset_trace(tokens)
+    trace.root.finish()
+
+    spans = to_otlp([trace])["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    root, child = spans
+    assert len(root["traceId"]) == 32 and root["traceId"] == child["traceId"]
+    assert "parentSpanId" not in root and child["parentSpanId"] == root["spanId"]
+    assert {"key": "request.id", "value": {"stringValue": "my-request"}} in root["attributes"]
+    assert child["events"][0]["attributes"] == [{"key": "status_code", "value": {"intValue": "503"}}]
+
+
+@pytest.mark.asyncio
+async def test_middleware_propagates_request_id():
+    """合法的 X-Request-ID 原样返回，不合法时生成新的；请求结束后进入缓冲区"""
+    seen = []
+    app = FastAPI()
+
+    @app.get("/ping")
+    async def ping():
+        seen.append(current_request_id())
+        with span("work"):
+            pass
+        return {"ok": True}
+
+    buffer = TraceBuffer(size=10)
+    app.add_middleware(TracingMiddleware, buffer=buffer)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get("/ping", headers={"X-Request-ID": "client-id-42"})
+        assert response.headers["x-request-id"] == "client-id-42"
+
+        response = await client.get("/ping", headers={"X-Request-ID": "bad id with spaces"})
+        generated = response.headers["x-request-id"]
+        assert generated != "bad id with spaces" and len(generated) == 32
+
+    assert seen == ["client-id-42", generated]
+    trace = buffer.get("client-id-42")
+    assert trace.root.attributes["http.status_code"] == 200
+    assert [s.name for s in trace.spans] == ["http.request", "work"]
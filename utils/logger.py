@@ -1,11 +1,55 @@
 """
 日志配置模块
 """
+import re
 import sys
+import json
+import random
 import logging
+import traceback
 from pathlib import Path
+from typing import Dict
 from loguru import logger as loguru_logger
 from config.settings import settings
+from core.tracing import current_request_id
+
+# 标准 logging 与 loguru 同名的级别，其他级别按数值转发
+_LEVEL_NAMES = frozenset({"TRACE", "DEBUG", "INFO", "SUCCESS", "WARNING", "ERROR", "CRITICAL"})
+
+TEXT_FORMAT = "{extra[asctime]} | {level: <8} | {extra[request_tag]}{name}:{function}:{line} - {message}\n{exception}"
+CONSOLE_FORMAT = (
+    "<green>{extra[asctime]}</green> | <level>{level: <8}</level> | {extra[request_tag]}"
+    "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>\n{exception}"
+)
+LOG_FORMATS = ("text", "json")
+
+# 按秒缓存格式化后的时间（(秒, 文本) 元组整体替换，多个 sink 线程并发读写也是一致的）
+_time_cache = (None, "")
+
+
+def _apply_stdlib_record(record: dict) -> None:
+    """
+    用标准 logging 记录中的位置信息和结构化字段覆盖 loguru 记录
+
+    LogRecord 已经包含调用位置（name/funcName/lineno），直接使用，无需逐帧回溯调用栈；
+    通过 extra={"fields": {...}} 传入的结构化字段合并到 loguru 的 extra 中；请求上下文中记录的日志带上请求ID。
+    """
+    source = record["extra"].pop("_stdlib", None)
+    if source is None:
+        return
+    request_id = current_request_id()
+    if request_id is not None:
+        record["extra"]["request_id"] = request_id
+    record["name"] = source.name
+    record["function"] = source.funcName
+    record["line"] = source.lineno
+    record["module"] = source.module
+    fields = getattr(source, "fields", None)
+    if fields:
+        record["extra"].update(fields)
+
+
+_stdlib_logger = loguru_logger.patch(_apply_stdlib_record)
 
 
 class InterceptHandler(logging.Handler):
@@ -14,23 +58,134 @@ class InterceptHandler(logging.Handler):
     """
 
     def emit(self, record: logging.LogRecord) -> None:
-        try:
-            level = loguru_logger.level(record.levelname).name
-        except ValueError:
-            level = record.levelno
-
-        frame, depth = logging.currentframe(), 2
-        while frame.f_code.co_filename == logging.__file__:
-            frame = frame.f_back
-            depth += 1
-
-        loguru_logger.opt(depth=depth, exception=record.exc_info).log(
-            level, record.getMessage()
-        )
+        level = record.levelname if record.levelname in _LEVEL_NAMES else record.levelno
+        logger = _stdlib_logger.bind(_stdlib=record)
+        if record.exc_info:
+            logger = logger.opt(exception=record.exc_info)
+        logger.log(level, record.getMessage())
+
+
+class SamplingFilter(logging.Filter):
+    """按比例采样低于 WARNING 的日志，WARNING 及以上全部保留"""
+
+    def __init__(self, rate: float):
+        """
+        Args:
+            rate: 保留比例（0-1）
+        """
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+# 查询字符串中的凭证参数（uvicorn 的握手/访问日志包含完整的查询字符串）
+_CREDENTIAL_QUERY = re.compile(r"([?&](?:api_key|apikey|key|token|access_token)=)[^&\s\"']*", re.IGNORECASE)
+
+
+class RedactCredentialsFilter(logging.Filter):
+    """将日志消息中查询字符串的凭证参数替换为 ***（只在消息包含 = 时格式化消息）"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        message = record.getMessage()
+        if "=" in message:
+            redacted = _CREDENTIAL_QUERY.sub(r"\1***", message)
+            if redacted != message:
+                record.msg = redacted
+                record.args = None
+        return True
+
+
+def apply_redaction(names=("uvicorn.error", "uvicorn.access")) -> None:
+    """
+    为记录请求路径的 logger 添加凭证过滤器
+
+    uvicorn 在 uvicorn.error 中以 INFO 级别记录 WebSocket 握手（'"WebSocket /path?query" [accepted]'），
+    在 uvicorn.access 中记录 HTTP 请求行，两者都包含完整的查询字符串。
+
+    Args:
+        names: logger 名称
+    """
+    for name in names:
+        named_logger = logging.getLogger(name)
+        if not any(isinstance(f, RedactCredentialsFilter) for f in named_logger.filters):
+            named_logger.addFilter(RedactCredentialsFilter())
+
+
+def apply_sampling(rates: Dict[str, float]) -> None:
+    """
+    按类别设置日志采样率
+
+    类别即 logger 名称（如 megallm.access、core.proxy、core.http_client），只作用于该 logger
+    直接记录的日志；过滤发生在消息格式化和转发到 loguru 之前。
+
+    Args:
+        rates: 类别 -> 保留比例，1 表示全部保留，0 表示只保留 WARNING 及以上
+
+    Raises:
+        ValueError: 采样率不在 0-1 之间时
+    """
+    for name, rate in rates.items():
+        if not 0 <= float(rate) <= 1:
+            raise ValueError(f"日志采样率必须在 0-1 之间: {name}={rate}")
+
+    # 重复调用时先移除之前添加的采样过滤器
+    for existing in [logging.getLogger()] + list(logging.Logger.manager.loggerDict.values()):
+        if isinstance(existing, logging.Logger):
+            for log_filter in [f for f in existing.filters if isinstance(f, SamplingFilter)]:
+                existing.removeFilter(log_filter)
+
+    for name, rate in rates.items():
+        if float(rate) < 1:
+            logging.getLogger(name).addFilter(SamplingFilter(float(rate)))
+
+
+def _asctime(record: dict) -> str:
+    """格式化记录时间，同一秒内复用上次的结果（loguru 的 {time:...} 每条日志约占格式化耗时的一半以上）"""
+    global _time_cache
+    second = int(record["time"].timestamp())
+    if _time_cache[0] != second:
+        _time_cache = (second, record["time"].strftime("%Y-%m-%d %H:%M:%S"))
+    return _time_cache[1]
+
+
+def text_formatter(template: str):
+    """生成文本格式函数（返回格式模板，时间从缓存中读取）"""
+    def formatter(record: dict) -> str:
+        record["extra"]["asctime"] = _asctime(record)
+        request_id = record["extra"].get("request_id")
+        record["extra"]["request_tag"] = f"[{request_id}] " if request_id else ""
+        return template
+    return formatter
+
+
+def json_formatter(record: dict) -> str:
+    """
+    JSON 行格式（每条日志一行 JSON，结构化字段为顶层字段）
+
+    loguru 的 format 函数返回格式模板，这里先把序列化结果写入 extra 再引用，避免 JSON 中的花括号被当作模板解析。
+    """
+    payload = {
+        "time": record["time"].isoformat(),
+        "level": record["level"].name,
+        "logger": record["name"],
+        "function": record["function"],
+        "line": record["line"],
+        "message": record["message"],
+        **{key: value for key, value in record["extra"].items() if key not in ("json", "asctime", "request_tag")}
+    }
+    if record["exception"] is not None:
+        payload["exception"] = "".join(traceback.format_exception(*record["exception"]))
+    record["extra"]["json"] = json.dumps(payload, ensure_ascii=False, default=str)
+    return "{extra[json]}\n"
 
 
 def setup_logging():
     """配置日志系统"""
+    if settings.log_format not in LOG_FORMATS:
+        raise ValueError(f"不支持的日志格式: {settings.log_format}，可选值: {', '.join(LOG_FORMATS)}")
+    structured = settings.log_format == "json"
 
     # 移除默认处理器
     loguru_logger.remove()
@@ -38,9 +193,9 @@ def setup_logging():
     # 添加控制台输出
     loguru_logger.add(
         sys.stdout,
-        format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>",
+        format=json_formatter if structured else text_formatter(CONSOLE_FORMAT),
         level=settings.log_level,
-        colorize=True
+        colorize=not structured
     )
 
     # 添加文件输出
@@ -53,12 +208,13 @@ def setup_logging():
             rotation=settings.log_rotation,
             retention=settings.log_retention,
             level=settings.log_level,
-            format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} - {message}",
+            format=json_formatter if structured else text_formatter(TEXT_FORMAT),
             enqueue=True  # 异步写入
         )
 
-    # 拦截标准logging
-    logging.basicConfig(handlers=[InterceptHandler()], level=0, force=True)
+    # 拦截标准logging；根 logger 使用与输出相同的级别，低于该级别的日志在创建记录前即被丢弃，
+    # %-style 参数不会被格式化
+    logging.basicConfig(handlers=[InterceptHandler()], level=settings.log_level.upper(), force=True)
 
     # 设置第三方库日志级别
     logging.getLogger("uvicorn").handlers = [InterceptHandler()]
@@ -66,4 +222,12 @@ def setup_logging():
     logging.getLogger("fastapi").handlers = [InterceptHandler()]
     logging.getLogger("httpx").setLevel(logging.WARNING)
 
-    loguru_logger.info(f"日志系统已初始化: level={settings.log_level}, file={settings.log_file}")
+    # 启用访问日志中间件时由它输出每个请求的汇总行，关闭 uvicorn 自带的访问日志
+    logging.getLogger("uvicorn.access").disabled = settings.access_log_enabled
+
+    apply_redaction()
+    apply_sampling(settings.log_sampling)
+
+    loguru_logger.info(
+        f"日志系统已初始化: level={settings.log_level}, file={settings.log_file}, format={settings.log_format}"
+    )